@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, Optional, TextIO, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.fake_servers import FakeOpenAIServer, FakeZoteroServer
+from benchmarks.synthetic_corpus import SyntheticCorpus
+from config.constants import BenchmarkConstants, ModelsConstants, PipelineConstants
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class BenchmarkConfig(BaseModel):
+    """
+    The configuration of a benchmark run.
+
+    Attributes
+    ----------
+    corpus_sizes : List[int]
+        The number of papers in each benchmarked library.
+    num_queries : int
+        The number of questions asked of each library.
+    pages_per_paper : int
+        The number of pages in each synthetic paper.
+    llm_model : str
+        The LLM name passed to `paperqa`. Completions are served by the fake OpenAI server whatever the model.
+    zotero_latency_seconds : float
+        The latency of every fake Zotero API request.
+    zotero_requests_per_second : float
+        The rate limit of the fake Zotero API, or 0 for none.
+    openai_latency_seconds : float
+        The latency of every fake OpenAI API request.
+    openai_requests_per_minute : int
+        The requests-per-minute limit of the fake OpenAI API, also given to the client-side rate limiters.
+    openai_tokens_per_minute : int
+        The tokens-per-minute limit of the fake OpenAI API, also given to the client-side rate limiters.
+    embedding_dimensions : int
+        The number of dimensions of the fake embeddings.
+    """
+    corpus_sizes: List[int] = BenchmarkConstants.CORPUS_SIZES
+    num_queries: int = BenchmarkConstants.NUM_QUERIES
+    pages_per_paper: int = BenchmarkConstants.PAGES_PER_PAPER
+    llm_model: str = ModelsConstants.GPT_4o_MINI_LLM_MODEL
+    zotero_latency_seconds: float = BenchmarkConstants.ZOTERO_LATENCY_SECONDS
+    zotero_requests_per_second: float = BenchmarkConstants.ZOTERO_REQUESTS_PER_SECOND
+    openai_latency_seconds: float = BenchmarkConstants.OPENAI_LATENCY_SECONDS
+    openai_requests_per_minute: int = BenchmarkConstants.OPENAI_REQUESTS_PER_MINUTE
+    openai_tokens_per_minute: int = BenchmarkConstants.OPENAI_TOKENS_PER_MINUTE
+    embedding_dimensions: int = BenchmarkConstants.EMBEDDING_DIMENSIONS
+
+
+class BenchmarkResult(BaseModel):
+    """
+    The measurements of one benchmarked library.
+
+    Attributes
+    ----------
+    num_papers : int
+        The number of papers in the library.
+    download_papers_per_second : float
+        The throughput of paging through the library and downloading every PDF with `ZoteroPaperEmbedder.iterate()`.
+    ingest_papers_per_second : float
+        The end-to-end throughput of embedding the whole library with `ZoteroPaperEmbedder.embed_library()`.
+    num_embedded_papers : int
+        The number of papers embedded.
+    num_failed_papers : int
+        The number of papers that failed to embed. The benchmark carries on with the other papers.
+    cold_load_seconds : float
+        The time taken to load the embedding store from its checkpoint in a new embedder.
+    query_p50_seconds : float
+        The median latency of answering a question with `DocsSession.query()`.
+    query_p95_seconds : float
+        The 95th percentile latency of answering a question.
+    peak_rss_bytes : int
+        The peak resident set size of the process that ran the benchmark, or 0 where it cannot be measured.
+    checkpoint_bytes : int
+        The number of bytes written to the checkpoint journal and snapshots while embedding the library.
+    snapshot_bytes : int
+        The size of the final snapshot, including its ANN index and chunk store.
+    vector_dtype : str
+        The data type of the snapshot's memory-mapped embedding matrix, or 'pickled' if it has no chunk store.
+    retrieval_recall : float
+        The mean recall@k of exact search over the loaded snapshot's (possibly quantized) vectors, against exact
+        search over the float32 embeddings returned by the API, for each question.
+    min_quantized_cosine : float
+        The lowest cosine similarity between an embedding and its quantized vector in the chunk store.
+    openai_requests : int
+        The number of requests made to the fake OpenAI API, including throttled ones.
+    openai_rate_limited : int
+        The number of requests throttled by the fake OpenAI API.
+    """
+    num_papers: int
+    download_papers_per_second: float
+    ingest_papers_per_second: float
+    num_embedded_papers: int
+    num_failed_papers: int = 0
+    cold_load_seconds: float
+    query_p50_seconds: float
+    query_p95_seconds: float
+    peak_rss_bytes: int
+    checkpoint_bytes: int
+    snapshot_bytes: int
+    vector_dtype: str = 'pickled'
+    retrieval_recall: float = 1.0
+    min_quantized_cosine: float = 1.0
+    openai_requests: int = 0
+    openai_rate_limited: int = 0
+
+
+class BenchmarkRunner:
+    """
+    Benchmarks ingestion and querying offline, against a synthetic library served by fake Zotero and OpenAI servers.
+
+    Each library size is benchmarked in a fresh process, so that its peak RSS is measured in isolation, with a cold
+    PDF storage, parsed PDF cache and embedding store in a temporary directory. The fake servers run in the benchmark
+    process, and the OpenAI client of the child process is pointed at them with the `OPENAI_BASE_URL` environment
+    variable. No network access or API keys are needed, and the results are reproducible from run to run, once the
+    `tiktoken` encoding used to count tokens has been cached (it is downloaded the first time it is used).
+
+    Attributes
+    ----------
+    config : BenchmarkConfig
+        The configuration of the benchmark.
+    log_stream : TextIO
+        The stream to which progress and the results table are written.
+
+    Methods
+    -------
+    run() -> List[BenchmarkResult]
+        Benchmarks every library size.
+    run_size(num_papers: int) -> BenchmarkResult
+        Benchmarks a library of a given size.
+    report(results: List[BenchmarkResult]) -> str
+        Formats results as a table.
+    save(results: List[BenchmarkResult], output_path: Union[str, Path])
+        Writes results to a JSON file.
+    compare(results: List[BenchmarkResult], baseline_path: Union[str, Path], max_regression: float) -> List[str]
+        Returns the regressions of results against a baseline JSON file.
+    """
+    HIGHER_IS_BETTER: List[str] = ['download_papers_per_second', 'ingest_papers_per_second', 'retrieval_recall']
+    LOWER_IS_BETTER: List[str] = [
+        'cold_load_seconds', 'query_p50_seconds', 'query_p95_seconds', 'peak_rss_bytes', 'checkpoint_bytes'
+    ]
+
+    def __init__(self, config: Optional[BenchmarkConfig] = None, log_stream: TextIO = sys.stderr):
+        self.config: BenchmarkConfig = config if config is not None else BenchmarkConfig()
+        self.log_stream: TextIO = log_stream
+
+    def run(self) -> List[BenchmarkResult]:
+        """
+        Benchmarks every library size in the configuration.
+
+        Returns
+        -------
+        List[BenchmarkResult]
+            The results of each library size.
+        """
+        results: List[BenchmarkResult] = []
+        for num_papers in self.config.corpus_sizes:
+            print(f"Benchmarking a library of {num_papers} papers...", file=self.log_stream, flush=True)
+            results.append(self.run_size(num_papers))
+
+        return results
+
+    def run_size(self, num_papers: int) -> BenchmarkResult:
+        """
+        Benchmarks a library of a given size in a fresh process.
+
+        Parameters
+        ----------
+        num_papers : int
+            The number of papers in the library.
+
+        Returns
+        -------
+        BenchmarkResult
+            The measurements of the library.
+
+        Raises
+        ------
+        RuntimeError
+            If the `tiktoken` encoding used to count tokens is neither cached nor downloadable.
+        """
+        self._check_tokenizer()
+        corpus: SyntheticCorpus = SyntheticCorpus(num_papers, pages_per_paper=self.config.pages_per_paper)
+        zotero_server: FakeZoteroServer = FakeZoteroServer(
+            corpus,
+            latency_seconds=self.config.zotero_latency_seconds,
+            requests_per_second=self.config.zotero_requests_per_second
+        )
+        openai_server: FakeOpenAIServer = FakeOpenAIServer(
+            latency_seconds=self.config.openai_latency_seconds,
+            requests_per_minute=self.config.openai_requests_per_minute,
+            tokens_per_minute=self.config.openai_tokens_per_minute,
+            embedding_dimensions=self.config.embedding_dimensions
+        )
+        with zotero_server, openai_server:
+            environment: Dict[str, str] = {
+                'OPENAI_BASE_URL': openai_server.base_url,
+                'OPENAI_API_KEY': 'benchmark',
+                'OPENAI_LLM_RPM': str(self.config.openai_requests_per_minute),
+                'OPENAI_LLM_TPM': str(self.config.openai_tokens_per_minute),
+                'OPENAI_EMBEDDING_RPM': str(self.config.openai_requests_per_minute),
+                'OPENAI_EMBEDDING_TPM': str(self.config.openai_tokens_per_minute),
+            }
+            previous_environment: Dict[str, Optional[str]] = {name: os.getenv(name) for name in environment}
+            os.environ.update(environment)
+            try:
+                # A spawned process starts from a clean interpreter, inheriting the environment set above
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result: BenchmarkResult = executor.submit(
+                        _benchmark_library, self.config, num_papers, zotero_server.base_url, zotero_server.library_id
+                    ).result()
+            finally:
+                for name, value in previous_environment.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+
+            result.openai_requests = openai_server.num_requests
+            result.openai_rate_limited = openai_server.num_rate_limited
+
+        return result
+
+    @staticmethod
+    def _check_tokenizer():
+        """Loads the `tiktoken` encoding used to count tokens, so that a machine without it fails before measuring."""
+        from utils.llm_utils import get_encoding
+
+        try:
+            get_encoding(PipelineConstants.TOKENIZER_MODEL)
+        except Exception as e:
+            raise RuntimeError(
+                f"The tiktoken encoding of {PipelineConstants.TOKENIZER_MODEL} is not cached and could not be "
+                f"downloaded ({e}). Run the benchmark once with network access, or copy a tiktoken cache into the "
+                f"directory named by the TIKTOKEN_CACHE_DIR environment variable."
+            ) from e
+
+    @staticmethod
+    def report(results: List[BenchmarkResult]) -> str:
+        """
+        Formats results as a table, with one row per library size.
+
+        Parameters
+        ----------
+        results : List[BenchmarkResult]
+            The results to format.
+
+        Returns
+        -------
+        str
+            The table.
+        """
+        rows: List[str] = [
+            f"{'Papers':>8} {'Failed':>7} {'Download/s':>11} {'Ingest/s':>9} {'Load (s)':>9} {'Query p50':>10} "
+            f"{'Query p95':>10} {'Peak RSS':>10} {'Checkpoint':>11} {'Recall':>7} {'429s':>6}"
+        ]
+        for result in results:
+            rows.append(
+                f"{result.num_papers:>8} {result.num_failed_papers:>7} {result.download_papers_per_second:>11.2f} "
+                f"{result.ingest_papers_per_second:>9.2f} {result.cold_load_seconds:>9.3f} "
+                f"{result.query_p50_seconds:>10.3f} {result.query_p95_seconds:>10.3f} "
+                f"{result.peak_rss_bytes / 2 ** 20:>8.1f}MB {result.checkpoint_bytes / 2 ** 20:>9.1f}MB "
+                f"{result.retrieval_recall:>7.3f} {result.openai_rate_limited:>6}"
+            )
+
+        return '\n'.join(rows)
+
+    @staticmethod
+    def save(results: List[BenchmarkResult], output_path: Union[str, Path]):
+        """
+        Writes results to a JSON file, for use as a baseline by later runs.
+
+        Parameters
+        ----------
+        results : List[BenchmarkResult]
+            The results to save.
+        output_path : Union[str, Path]
+            The path to the JSON file.
+        """
+        with open(output_path, 'w', encoding='utf-8') as file:
+            json.dump([result.model_dump() for result in results], file, indent=2)
+
+    def compare(self, results: List[BenchmarkResult], baseline_path: Union[str, Path],
+                max_regression: float = BenchmarkConstants.MAX_REGRESSION) -> List[str]:
+        """
+        Compares results against a baseline JSON file written by `save()`.
+
+        Parameters
+        ----------
+        results : List[BenchmarkResult]
+            The results to compare.
+        baseline_path : Union[str, Path]
+            The path to the baseline JSON file.
+        max_regression : float
+            The largest tolerated relative regression of any metric, e.g. 0.2 for 20%.
+
+        Returns
+        -------
+        List[str]
+            A description of every metric that regressed by more than `max_regression`, for library sizes present in
+            both the results and the baseline.
+        """
+        with open(baseline_path, 'r', encoding='utf-8') as file:
+            baseline: Dict[int, BenchmarkResult] = {
+                result.num_papers: result for result in (BenchmarkResult(**entry) for entry in json.load(file))
+            }
+
+        regressions: List[str] = []
+        for result in results:
+            baseline_result: Optional[BenchmarkResult] = baseline.get(result.num_papers)
+            if baseline_result is None:
+                continue
+
+            for metric in self.HIGHER_IS_BETTER + self.LOWER_IS_BETTER:
+                value: float = getattr(result, metric)
+                baseline_value: float = getattr(baseline_result, metric)
+                if not baseline_value:
+                    continue
+                change: float = (value - baseline_value) / baseline_value
+                if metric in self.HIGHER_IS_BETTER:
+                    change = -change
+                if change > max_regression:
+                    regressions.append(f"{result.num_papers} papers: {metric} regressed by {change:.0%} "
+                                       f"({baseline_value:g} -> {value:g})")
+
+        return regressions
+
+
+def _benchmark_library(config: BenchmarkConfig, num_papers: int, zotero_url: str, library_id: str) -> BenchmarkResult:
+    """
+    Benchmarks a library in the current process, which must have the OpenAI environment variables of the fake server.
+
+    This is a module-level function so that it can be run in a spawned process.
+    """
+    from paperqa.utils import get_loop
+    from models.answer_cache import AnswerCache
+    from models.docs_session import DocsSession
+    from models.mapped_chunk_store import MappedChunkStore
+    from models.zotero_paper_embedder import ZoteroPaperEmbedder
+
+    with tempfile.TemporaryDirectory(prefix='paper_qa_benchmark_') as temp_dir:
+        temp_path: Path = Path(temp_dir)
+
+        def make_embedder(name: str) -> ZoteroPaperEmbedder:
+            return ZoteroPaperEmbedder(
+                library_id=library_id,
+                library_type='user',
+                api_key='benchmark',
+                storage=temp_path / name / 'zotero',
+                endpoint=zotero_url,
+                processed_data_dir=temp_path / 'processed',
+                parsed_pdf_cache_dir=temp_path / name / 'parsed_pdf_cache'
+            )
+
+        # Paging through the library and downloading every PDF, with nothing embedded
+        download_embedder: ZoteroPaperEmbedder = make_embedder('download')
+        start: float = time.perf_counter()
+        num_downloaded: int = sum(1 for _ in download_embedder.iterate(limit=num_papers))
+        download_seconds: float = time.perf_counter() - start
+
+        # Embedding the whole library from a cold PDF storage and parsed PDF cache
+        # A paper that fails is counted, rather than stopping the run
+        ingest_embedder: ZoteroPaperEmbedder = make_embedder('ingest')
+        ingest_embedder.stop_on_error = False
+        docs = ingest_embedder.load_paperqa_doc(llm_model=config.llm_model)
+        start = time.perf_counter()
+        num_failed_papers: int = len(ingest_embedder.embed_library(docs))
+        ingest_seconds: float = time.perf_counter() - start
+        num_embedded_papers: int = len(docs.docs)
+        checkpoint_bytes: int = ingest_embedder.embedding_store.checkpoint_store.bytes_written
+        exact_texts = list(docs.texts_index.texts)
+        exact_matrix: np.ndarray = np.asarray([text.embedding for text in exact_texts], dtype=np.float32).reshape(
+            len(exact_texts), config.embedding_dimensions
+        )
+        exact_matrix /= np.maximum(np.linalg.norm(exact_matrix, axis=1, keepdims=True), 1e-12)
+        chunk_store: Optional[MappedChunkStore] = ingest_embedder.embedding_store.checkpoint_store.chunk_store
+        snapshot_bytes: int = sum(
+            os.path.getsize(path) for path in (
+                ingest_embedder.embedding_store.pkl_file_path, ingest_embedder.embedding_store.index_path
+            ) if os.path.exists(path)
+        )
+        if chunk_store is not None:
+            snapshot_bytes += sum(
+                os.path.getsize(path) for path in chunk_store.base_path.parent.glob(f"{chunk_store.base_path.name}.*")
+            )
+
+        # Loading the embedding store from its checkpoint, then answering questions
+        query_embedder: ZoteroPaperEmbedder = make_embedder('query')
+        start = time.perf_counter()
+        docs = query_embedder.load_paperqa_doc(llm_model=config.llm_model)
+        cold_load_seconds: float = time.perf_counter() - start
+
+        docs_session: DocsSession = DocsSession(query_embedder, AnswerCache(temp_path / 'answer_cache.pkl'))
+        corpus: SyntheticCorpus = SyntheticCorpus(num_papers, pages_per_paper=config.pages_per_paper)
+        questions: List[str] = corpus.questions(config.num_queries) if num_embedded_papers else []
+        latencies: List[float] = []
+        for question in questions:
+            start = time.perf_counter()
+            docs_session.query(config.llm_model, question)
+            latencies.append(time.perf_counter() - start)
+
+        # Recall of the loaded (possibly quantized) vectors against the float32 embeddings, for the same questions
+        recalls: List[float] = []
+        if questions and len(exact_texts):
+            question_embeddings: List[List[float]] = get_loop().run_until_complete(
+                docs.texts_index.embedding_model.embed_documents(docs._embedding_client, questions)
+            )
+            names: List[str] = [text.name for text in docs.texts_index.texts]
+            k: int = min(BenchmarkConstants.RECALL_K, len(exact_texts))
+            for question_embedding in question_embeddings:
+                query: np.ndarray = np.asarray(question_embedding, dtype=np.float32)
+                exact_rows: np.ndarray = np.argsort(-(exact_matrix @ query), kind='stable')[:k]
+                rows, _ = docs.texts_index.search_embedding(question_embedding, k, exact=True)
+                recalls.append(len({exact_texts[row].name for row in exact_rows} & {names[row] for row in rows}) / k)
+
+        return BenchmarkResult(
+            num_papers=num_papers,
+            download_papers_per_second=num_downloaded / download_seconds if download_seconds else 0.0,
+            ingest_papers_per_second=num_embedded_papers / ingest_seconds if ingest_seconds else 0.0,
+            num_embedded_papers=num_embedded_papers,
+            num_failed_papers=num_failed_papers,
+            cold_load_seconds=cold_load_seconds,
+            query_p50_seconds=float(np.percentile(latencies, 50)) if latencies else 0.0,
+            query_p95_seconds=float(np.percentile(latencies, 95)) if latencies else 0.0,
+            peak_rss_bytes=_peak_rss_bytes(),
+            checkpoint_bytes=checkpoint_bytes,
+            snapshot_bytes=snapshot_bytes,
+            vector_dtype=chunk_store.dtype if chunk_store is not None else 'pickled',
+            retrieval_recall=float(np.mean(recalls)) if recalls else 1.0,
+            min_quantized_cosine=chunk_store.metadata['min_cosine'] if chunk_store is not None else 1.0
+        )
+
+
+def _peak_rss_bytes() -> int:
+    """Returns the peak resident set size of the current process, or 0 where it cannot be measured (e.g. Windows)."""
+    if resource is None:
+        return 0
+
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
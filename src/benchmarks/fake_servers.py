@@ -0,0 +1,417 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.synthetic_corpus import SyntheticCorpus
+from config.constants import BenchmarkConstants
+
+
+class FakeHttpServer:
+    """
+    The base class of the local stand-ins for the Zotero web API and the OpenAI API used by the benchmarks.
+
+    The server runs on a background thread, handling each request on its own thread. Every request is delayed by a
+    fixed latency, and requests exceeding the configured rate limit are rejected with HTTP 429 and a retry-after
+    header, like the real APIs.
+
+    Attributes
+    ----------
+    latency_seconds : float
+        The delay added to every request.
+    requests_per_minute : float
+        The maximum number of requests per minute, or 0 for no limit.
+    tokens_per_minute : float
+        The maximum number of tokens per minute, or 0 for no limit. Only used by servers that count tokens.
+    num_requests : int
+        The number of requests handled, including rejected ones.
+    num_rate_limited : int
+        The number of requests rejected by the rate limit.
+
+    Methods
+    -------
+    start() -> FakeHttpServer
+        Starts the server on a free local port.
+    stop()
+        Stops the server.
+    base_url -> str
+        The base URL of the server.
+    handle(method: str, path: str, query: Dict[str, List[str]], body: bytes) -> Tuple[int, Dict[str, str], bytes]
+        Handles a request. Implemented by subclasses.
+    """
+    def __init__(self, latency_seconds: float = 0.0, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.latency_seconds: float = latency_seconds
+        self.requests_per_minute: float = requests_per_minute
+        self.tokens_per_minute: float = tokens_per_minute
+        self.num_requests: int = 0
+        self.num_rate_limited: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._window: List[Tuple[float, int]] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'FakeHttpServer':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        """Return the base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeHttpServer':
+        """Starts the server on a free local port, returning the server."""
+        fake_server: FakeHttpServer = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, method: str):
+                url = urlparse(self.path)
+                body: bytes = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                status, headers, content = fake_server.dispatch(method, url.path, parse_qs(url.query), body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if 'Transfer-Encoding' not in headers:
+                    self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def dispatch(self, method: str, path: str, query: Dict[str, List[str]],
+                 body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Applies the latency and rate limit to a request, then handles it."""
+        time.sleep(self.latency_seconds)
+        retry_after: Optional[float] = self._admit(self.count_tokens(path, body))
+        if retry_after is not None:
+            return self.rate_limited(retry_after)
+
+        return self.handle(method, path, query, body)
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]],
+               body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Handles a request, returning its status, headers and content."""
+        raise NotImplementedError
+
+    def count_tokens(self, path: str, body: bytes) -> int:
+        """Returns the number of tokens counted against the tokens-per-minute limit by a request."""
+        return 0
+
+    def rate_limited(self, retry_after: float) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns the response to a request rejected by the rate limit."""
+        return 429, {'Retry-After': f"{retry_after:.3f}", 'Content-Type': 'text/plain'}, b'Rate limit exceeded'
+
+    def _admit(self, num_tokens: int) -> Optional[float]:
+        """Records a request in the sliding one-minute window, returning the retry delay if it exceeds a limit."""
+        now: float = time.monotonic()
+        with self._lock:
+            self.num_requests += 1
+            self._window = [(t, tokens) for t, tokens in self._window if now - t < 60]
+            over_requests: bool = 0 < self.requests_per_minute <= len(self._window)
+            over_tokens: bool = 0 < self.tokens_per_minute < sum(tokens for _, tokens in self._window) + num_tokens
+            if over_requests or over_tokens:
+                self.num_rate_limited += 1
+                return max(0.001, 60 - (now - self._window[0][0])) if self._window else 1.0
+
+            self._window.append((now, num_tokens))
+            return None
+
+
+class FakeZoteroServer(FakeHttpServer):
+    """
+    A local stand-in for the read-only parts of the Zotero web API used by `ZoteroPaperEmbedder`, serving the items
+    and PDFs of a `SyntheticCorpus`.
+
+    Supports `/items/top` (with `start`, `limit`, `sort`, `direction` and `tag`), `/items` (with `itemKey`, `since` and
+    `format=versions`), `/items/<key>/file`, `/deleted`, `/collections` and `/collections/<key>/items`.
+
+    Attributes
+    ----------
+    corpus : SyntheticCorpus
+        The corpus served.
+    library_id : str
+        The ID of the user library served.
+    library_version : int
+        The version of the library. Every item has the version at which it was added.
+    bytes_served : int
+        The number of PDF bytes served.
+    """
+    COLLECTION_KEY: str = 'BENCHCOL'
+    COLLECTION_NAME: str = 'Benchmark'
+
+    def __init__(self, corpus: SyntheticCorpus, library_id: str = BenchmarkConstants.LIBRARY_ID,
+                 latency_seconds: float = BenchmarkConstants.ZOTERO_LATENCY_SECONDS,
+                 requests_per_second: float = BenchmarkConstants.ZOTERO_REQUESTS_PER_SECOND):
+        super().__init__(latency_seconds=latency_seconds, requests_per_minute=requests_per_second * 60)
+        self.corpus: SyntheticCorpus = corpus
+        self.library_id: str = library_id
+        self.library_version: int = corpus.num_papers
+        self.bytes_served: int = 0
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]],
+               body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        prefix: str = f"/users/{self.library_id}"
+        if not path.startswith(prefix):
+            return 404, {}, b'Not found'
+        route: str = path[len(prefix):]
+
+        file_match: Optional[re.Match] = re.fullmatch(r'/items/(\w+)/file', route)
+        if file_match:
+            index: Optional[int] = self.corpus.index_of(file_match.group(1))
+            if index is None:
+                return 404, {}, b'Not found'
+            pdf: bytes = self.corpus.pdf(index)
+            with self._lock:
+                self.bytes_served += len(pdf)
+            return 200, {'Content-Type': 'application/pdf'}, pdf
+
+        if route == '/deleted':
+            return self._json({'collections': [], 'searches': [], 'items': [], 'tags': [], 'settings': []})
+        if route == '/collections':
+            return self._json([{'key': self.COLLECTION_KEY, 'version': 1,
+                                'data': {'key': self.COLLECTION_KEY, 'name': self.COLLECTION_NAME}}])
+
+        indices: List[int]
+        if route == '/items/top' or route == f"/collections/{self.COLLECTION_KEY}/items":
+            indices = list(range(self.corpus.num_papers))
+        elif route == '/items':
+            if 'itemKey' in query:
+                keys: List[str] = query['itemKey'][0].split(',')
+                return self._json([
+                    self._item(index, attachment=key.startswith('A'))
+                    for key, index in ((key, self.corpus.index_of(key)) for key in keys) if index is not None
+                ])
+            if query.get('format', ['json'])[0] == 'versions':
+                since: int = int(query.get('since', ['0'])[0])
+                return self._json({
+                    key: index + 1 for index in range(since, self.corpus.num_papers)
+                    for key in (self.corpus.item_key(index), self.corpus.attachment_key(index))
+                })
+            indices = list(range(self.corpus.num_papers))
+        else:
+            return 404, {}, b'Not found'
+
+        if 'tag' in query:
+            tag: str = query['tag'][0]
+            indices = [index for index in indices if self.corpus.metadata(index)['topic']['topic'] == tag]
+        if query.get('direction', ['asc'])[0] == 'desc':
+            indices.reverse()
+        start: int = int(query.get('start', ['0'])[0])
+        limit: int = int(query.get('limit', ['100'])[0])
+
+        return self._json([self._item(index) for index in indices[start:start + limit]], total_results=len(indices))
+
+    def _item(self, index: int, attachment: bool = False) -> Dict:
+        """Returns the Zotero JSON of a paper, or of its PDF attachment."""
+        item_key: str = self.corpus.item_key(index)
+        attachment_key: str = self.corpus.attachment_key(index)
+        if attachment:
+            return {'key': attachment_key, 'version': index + 1, 'data': {
+                'key': attachment_key, 'version': index + 1, 'itemType': 'attachment', 'parentItem': item_key,
+                'contentType': 'application/pdf', 'linkMode': 'imported_file'
+            }}
+
+        metadata: Dict = self.corpus.metadata(index)
+        return {
+            'key': item_key,
+            'version': index + 1,
+            'links': {'attachment': {
+                'href': f"{self.base_url}/users/{self.library_id}/items/{attachment_key}",
+                'type': 'application/json',
+                'attachmentType': 'application/pdf'
+            }},
+            'meta': {'creatorSummary': metadata['authors'][0], 'parsedDate': metadata['year'], 'numChildren': 1},
+            'data': {
+                'key': item_key,
+                'version': index + 1,
+                'itemType': 'journalArticle',
+                'title': metadata['title'],
+                'creators': [{'creatorType': 'author', 'firstName': 'A.', 'lastName': last_name}
+                             for last_name in metadata['authors']],
+                'date': metadata['year'],
+                'publicationTitle': metadata['journal'],
+                'tags': [{'tag': metadata['topic']['topic']}],
+                'collections': [self.COLLECTION_KEY],
+                'dateAdded': f"2024-01-01T00:00:{index % 60:02d}Z"
+            }
+        }
+
+    def _json(self, content, total_results: Optional[int] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns a JSON response with the headers set by the Zotero web API."""
+        headers: Dict[str, str] = {
+            'Content-Type': 'application/json',
+            'Last-Modified-Version': str(self.library_version),
+            'Total-Results': str(total_results if total_results is not None else len(content))
+        }
+        return 200, headers, json.dumps(content).encode('utf-8')
+
+
+class FakeOpenAIServer(FakeHttpServer):
+    """
+    A local stand-in for the OpenAI embeddings and chat completions APIs.
+
+    Embeddings are deterministic, normalised sums of a random vector per word, so texts sharing words have similar
+    embeddings. Chat completions recognise the citation, evidence summary and answer prompts of `paperqa`, and can be
+    streamed. Tokens are counted as one per four characters of input, against the tokens-per-minute limit.
+
+    Attributes
+    ----------
+    embedding_dimensions : int
+        The number of dimensions of each embedding.
+    prompt_tokens : int
+        The number of input tokens processed.
+    completion_tokens : int
+        The number of output tokens generated.
+    """
+    def __init__(self, latency_seconds: float = BenchmarkConstants.OPENAI_LATENCY_SECONDS,
+                 requests_per_minute: float = BenchmarkConstants.OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = BenchmarkConstants.OPENAI_TOKENS_PER_MINUTE,
+                 embedding_dimensions: int = BenchmarkConstants.EMBEDDING_DIMENSIONS):
+        super().__init__(latency_seconds=latency_seconds, requests_per_minute=requests_per_minute,
+                         tokens_per_minute=tokens_per_minute)
+        self.embedding_dimensions: int = embedding_dimensions
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+
+    @property
+    def base_url(self) -> str:
+        """Return the base URL of the API, as used for `OPENAI_BASE_URL`."""
+        return f"{super().base_url}/v1"
+
+    def count_tokens(self, path: str, body: bytes) -> int:
+        return len(body) // 4
+
+    def rate_limited(self, retry_after: float) -> Tuple[int, Dict[str, str], bytes]:
+        error: Dict = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+        return 429, {'Content-Type': 'application/json', 'retry-after-ms': str(int(retry_after * 1000))}, \
+            json.dumps(error).encode('utf-8')
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]],
+               body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        request: Dict = json.loads(body or b'{}')
+        if path == '/v1/embeddings':
+            return self._embeddings(request)
+        if path == '/v1/chat/completions':
+            return self._chat_completion(request)
+        return 404, {}, b'Not found'
+
+    def _embeddings(self, request: Dict) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns the embeddings of the input texts."""
+        texts: List[str] = request['input'] if isinstance(request['input'], list) else [request['input']]
+        num_tokens: int = sum(len(text) for text in texts) // 4
+        with self._lock:
+            self.prompt_tokens += num_tokens
+        content: Dict = {
+            'object': 'list',
+            'model': request.get('model', ''),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': self._embed(text)} for i, text in enumerate(texts)
+            ],
+            'usage': {'prompt_tokens': num_tokens, 'total_tokens': num_tokens}
+        }
+        return 200, {'Content-Type': 'application/json'}, json.dumps(content).encode('utf-8')
+
+    def _chat_completion(self, request: Dict) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns a completion for the recognised `paperqa` prompt, streamed as server-sent events if requested."""
+        prompt: str = '\n'.join(str(message.get('content', '')) for message in request.get('messages', []))
+        reply: str = self._reply(prompt)
+        prompt_tokens: int = len(prompt) // 4
+        completion_tokens: int = len(reply) // 4
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        usage: Dict = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                       'total_tokens': prompt_tokens + completion_tokens}
+        response_id: str = f"chatcmpl-{hashlib.md5(prompt.encode('utf-8')).hexdigest()[:12]}"
+        model: str = request.get('model', '')
+
+        if not request.get('stream'):
+            content: Dict = {
+                'id': response_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                'usage': usage
+            }
+            return 200, {'Content-Type': 'application/json'}, json.dumps(content).encode('utf-8')
+
+        events: List[str] = []
+        words: List[str] = reply.split(' ')
+        for i, word in enumerate(words):
+            delta: Dict = {'role': 'assistant', 'content': word if i == 0 else f" {word}"}
+            events.append(json.dumps({
+                'id': response_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]
+            }))
+        events.append(json.dumps({
+            'id': response_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage
+        }))
+        stream: bytes = ''.join(f"data: {event}\n\n" for event in events + ['[DONE]']).encode('utf-8')
+        return 200, {'Content-Type': 'text/event-stream'}, stream
+
+    @staticmethod
+    def _reply(prompt: str) -> str:
+        """Returns a plausible reply to a citation, evidence summary or answer prompt."""
+        if 'Provide the citation' in prompt:
+            first_line: str = prompt.split('\n\n')[1] if '\n\n' in prompt else prompt
+            return first_line.split('. ')[0][:200]
+        if 'Summarize the excerpt' in prompt:
+            excerpt: str = prompt.split('----')[1] if '----' in prompt else prompt
+            question: str = prompt.rsplit('Question:', 1)[-1].split('\n')[0].lower()
+            excerpt_words = set(excerpt.lower().split())
+            score: int = min(10, 1 + sum(word in excerpt_words for word in question.split()))
+            return f"{' '.join(excerpt.split()[:60])}\n\nRelevance score: {score}"
+        if 'Answer the question' in prompt:
+            keys: List[str] = sorted(set(re.findall(r'^(\S+): ', prompt, flags=re.MULTILINE)))[:3]
+            return (f"The retrieved excerpts describe the reported catalysts, conditions and yields "
+                    f"({', '.join(keys) or 'no sources'}).")
+        return 'OK'
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _word_vector(word: str, dimensions: int) -> np.ndarray:
+        """Returns the deterministic random vector of a word."""
+        seed: int = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:8], 'little')
+        return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+    def _embed(self, text: str) -> List[float]:
+        """Returns the deterministic embedding of a text."""
+        embedding: np.ndarray = np.zeros(self.embedding_dimensions, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            embedding += self._word_vector(word, self.embedding_dimensions)
+        norm: float = float(np.linalg.norm(embedding))
+        return (embedding / norm if norm else embedding).round(6).tolist()
@@ -0,0 +1,261 @@
+import os
+import sys
+import random
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import BenchmarkConstants
+
+# Topics with a representative compound (name, SMILES, CAS number), so that generated papers and questions share a
+# realistic chemistry vocabulary
+TOPICS: List[Dict[str, str]] = [
+    {'topic': 'Suzuki-Miyaura cross-coupling', 'compound': 'tetrakis(triphenylphosphine)palladium',
+     'smiles': 'c1ccc(cc1)P(c2ccccc2)c3ccccc3', 'cas': '14221-01-3'},
+    {'topic': 'retrosynthetic analysis', 'compound': 'aspirin', 'smiles': 'CC(=O)OC1=CC=CC=C1C(=O)O',
+     'cas': '50-78-2'},
+    {'topic': 'asymmetric organocatalysis', 'compound': 'L-proline', 'smiles': 'C1C[C@H](NC1)C(=O)O',
+     'cas': '147-85-3'},
+    {'topic': 'reaction yield prediction', 'compound': 'benzaldehyde', 'smiles': 'C1=CC=C(C=C1)C=O',
+     'cas': '100-52-7'},
+    {'topic': 'kinase inhibitor design', 'compound': 'imatinib',
+     'smiles': 'CC1=C(C=C(C=C1)NC(=O)C2=CC=C(C=C2)CN3CCN(CC3)C)NC4=NC=CC(=N4)C5=CN=CC=C5', 'cas': '152459-95-5'},
+    {'topic': 'graph neural networks for molecular property prediction', 'compound': 'caffeine',
+     'smiles': 'CN1C=NC2=C1C(=O)N(C(=O)N2C)C', 'cas': '58-08-2'},
+    {'topic': 'flow chemistry scale-up', 'compound': 'ibuprofen', 'smiles': 'CC(C)CC1=CC=C(C=C1)C(C)C(=O)O',
+     'cas': '15687-27-1'},
+    {'topic': 'photoredox catalysis', 'compound': 'tris(bipyridine)ruthenium(II) chloride',
+     'smiles': 'C1=CC=NC(=C1)C2=CC=CC=N2.[Ru+2].[Cl-].[Cl-]', 'cas': '14323-06-9'},
+    {'topic': 'Bayesian reaction optimisation', 'compound': 'paracetamol', 'smiles': 'CC(=O)NC1=CC=C(C=C1)O',
+     'cas': '103-90-2'},
+    {'topic': 'solid-phase peptide synthesis', 'compound': 'Fmoc-glycine',
+     'smiles': 'C1=CC=C2C(=C1)C(C3=CC=CC=C32)COC(=O)NCC(=O)O', 'cas': '29022-11-5'},
+]
+
+FILLER_WORDS: List[str] = [
+    'catalyst', 'ligand', 'solvent', 'temperature', 'selectivity', 'conversion', 'substrate', 'scope', 'mechanism',
+    'intermediate', 'transition', 'state', 'kinetics', 'enantiomeric', 'excess', 'dataset', 'model', 'descriptor',
+    'fingerprint', 'training', 'validation', 'accuracy', 'throughput', 'screening', 'assay', 'potency', 'binding',
+    'affinity', 'synthesis', 'route', 'protecting', 'group', 'oxidation', 'reduction', 'coupling', 'hydrogenation',
+    'crystallisation', 'purification', 'chromatography', 'spectroscopy', 'NMR', 'mass', 'spectrometry', 'yield',
+]
+
+LAST_NAMES: List[str] = [
+    'Smith', 'Chen', 'Garcia', 'Müller', 'Tanaka', 'Okafor', 'Rossi', 'Kowalski', 'Singh', 'Brown'
+]
+
+JOURNALS: List[str] = ['J. Am. Chem. Soc.', 'Angew. Chem. Int. Ed.', 'Chem. Sci.', 'J. Med. Chem.', 'Org. Lett.']
+
+
+class SyntheticCorpus:
+    """
+    A deterministic corpus of synthetic chemistry papers, with Zotero item metadata and generated PDFs.
+
+    Every paper is derived from its index and the corpus seed alone, so the same corpus can be regenerated in any
+    process, and PDFs are generated on demand rather than held in memory.
+
+    Attributes
+    ----------
+    num_papers : int
+        The number of papers in the corpus.
+    pages_per_paper : int
+        The number of pages in each paper's PDF.
+    words_per_page : int
+        The approximate number of words on each page.
+    seed : int
+        The seed from which the corpus is generated.
+
+    Methods
+    -------
+    item_key(index: int) -> str
+        Returns the Zotero key of a paper.
+    attachment_key(index: int) -> str
+        Returns the Zotero key of a paper's PDF attachment.
+    index_of(key: str) -> Optional[int]
+        Returns the index of the paper with a given Zotero item or attachment key.
+    metadata(index: int) -> Dict
+        Returns the bibliographic metadata of a paper.
+    pages(index: int) -> List[str]
+        Returns the text of each page of a paper.
+    pdf(index: int) -> bytes
+        Returns a paper as a PDF.
+    questions(num_questions: int) -> List[str]
+        Returns distinct questions about the topics of the corpus.
+    make_pdf(pages: List[str]) -> bytes
+        Renders pages of text as a minimal PDF.
+    """
+    def __init__(self, num_papers: int, pages_per_paper: int = BenchmarkConstants.PAGES_PER_PAPER,
+                 words_per_page: int = BenchmarkConstants.WORDS_PER_PAGE, seed: int = BenchmarkConstants.CORPUS_SEED):
+        self.num_papers: int = num_papers
+        self.pages_per_paper: int = pages_per_paper
+        self.words_per_page: int = words_per_page
+        self.seed: int = seed
+
+    @staticmethod
+    def item_key(index: int) -> str:
+        """Return the Zotero key of a paper."""
+        return f"P{index:07d}"
+
+    @staticmethod
+    def attachment_key(index: int) -> str:
+        """Return the Zotero key of a paper's PDF attachment."""
+        return f"A{index:07d}"
+
+    def index_of(self, key: str) -> Optional[int]:
+        """Return the index of the paper with a given Zotero item or attachment key, or None if there is none."""
+        if len(key) != 8 or key[0] not in 'PA' or not key[1:].isdigit():
+            return None
+
+        index: int = int(key[1:])
+        return index if index < self.num_papers else None
+
+    def metadata(self, index: int) -> Dict:
+        """
+        Returns the bibliographic metadata of a paper.
+
+        Parameters
+        ----------
+        index : int
+            The index of the paper.
+
+        Returns
+        -------
+        Dict
+            The title, authors, year, journal and topic of the paper.
+        """
+        rng: random.Random = self._rng(index)
+        topic: Dict[str, str] = TOPICS[index % len(TOPICS)]
+        return {
+            'title': f"{topic['topic'].capitalize()} of {topic['compound']}: study {index}",
+            'authors': rng.sample(LAST_NAMES, 3),
+            'year': str(1990 + index % 35),
+            'journal': rng.choice(JOURNALS),
+            'topic': topic
+        }
+
+    def pages(self, index: int) -> List[str]:
+        """
+        Returns the text of each page of a paper.
+
+        Parameters
+        ----------
+        index : int
+            The index of the paper.
+
+        Returns
+        -------
+        List[str]
+            The text of each page.
+        """
+        rng: random.Random = self._rng(index)
+        metadata: Dict = self.metadata(index)
+        topic: Dict[str, str] = metadata['topic']
+        pages: List[str] = []
+        for page_number in range(self.pages_per_paper):
+            sentences: List[str] = []
+            if page_number == 0:
+                sentences.append(f"{metadata['title']}. {', '.join(metadata['authors'])}. {metadata['journal']}, "
+                                 f"{metadata['year']}.")
+            num_words: int = 0
+            while num_words < self.words_per_page:
+                words: List[str] = rng.choices(FILLER_WORDS, k=rng.randint(8, 16))
+                if rng.random() < 0.2:
+                    words += [topic['compound'], f"({topic['smiles']},", f"CAS {topic['cas']})"]
+                if rng.random() < 0.2:
+                    words += ['for'] + topic['topic'].split()
+                sentences.append(' '.join(words).capitalize() + '.')
+                num_words += len(words)
+            pages.append(' '.join(sentences))
+
+        return pages
+
+    def pdf(self, index: int) -> bytes:
+        """Return a paper as a PDF."""
+        return self.make_pdf(self.pages(index))
+
+    def questions(self, num_questions: int) -> List[str]:
+        """
+        Returns distinct questions about the topics of the corpus.
+
+        Parameters
+        ----------
+        num_questions : int
+            The number of questions.
+
+        Returns
+        -------
+        List[str]
+            The questions.
+        """
+        templates: List[str] = [
+            "What catalysts and conditions are reported for {topic}?",
+            "How is {compound} used in {topic}?",
+            "What yields and selectivities are reported for {compound}?",
+            "Which machine learning models have been applied to {topic}?",
+        ]
+        questions: List[str] = []
+        for i in range(num_questions):
+            topic: Dict[str, str] = TOPICS[i % len(TOPICS)]
+            question: str = templates[(i // len(TOPICS)) % len(templates)].format(**topic)
+            repeat: int = i // (len(TOPICS) * len(templates))
+            questions.append(question if repeat == 0 else f"{question} (variant {repeat})")
+
+        return questions
+
+    @staticmethod
+    def make_pdf(pages: List[str]) -> bytes:
+        """
+        Renders pages of text as a minimal PDF, with one line of up to 90 characters per text line.
+
+        Parameters
+        ----------
+        pages : List[str]
+            The text of each page.
+
+        Returns
+        -------
+        bytes
+            The PDF.
+        """
+        objects: List[str] = [
+            '<< /Type /Catalog /Pages 2 0 R >>',
+            f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] "
+            f"/Count {len(pages)} >>"
+        ]
+        font_object: int = 3 + 2 * len(pages)
+        for i, page in enumerate(pages):
+            lines: List[str] = []
+            line: str = ''
+            for word in page.split():
+                if line and len(line) + len(word) + 1 > 90:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            lines.append(line)
+
+            escaped_lines: List[str] = [
+                line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in lines
+            ]
+            stream: str = 'BT /F1 9 Tf 11 TL 40 760 Td ' + ' '.join(f"({line}) Tj T*" for line in escaped_lines) + ' ET'
+            objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                           f"/Resources << /Font << /F1 {font_object} 0 R >> >> >>")
+            objects.append(f"<< /Length {len(stream.encode('latin-1', 'replace'))} >>\nstream\n{stream}\nendstream")
+        objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+        pdf: bytearray = bytearray(b'%PDF-1.4\n')
+        offsets: List[int] = []
+        for number, obj in enumerate(objects, start=1):
+            offsets.append(len(pdf))
+            pdf += f"{number} 0 obj\n{obj}\nendobj\n".encode('latin-1', 'replace')
+        xref_offset: int = len(pdf)
+        pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+        pdf += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+        pdf += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+                .encode('latin-1'))
+
+        return bytes(pdf)
+
+    def _rng(self, index: int) -> random.Random:
+        """Returns the random number generator of a paper."""
+        return random.Random(self.seed * 1_000_003 + index)
@@ -0,0 +1,655 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional, TextIO
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import (
+    BatchQueryConstants, BenchmarkConstants, CliConstants, DataConstants, ModelsConstants, RateLimitConstants
+)
+from models.telemetry import Telemetry, set_telemetry
+
+load_dotenv()
+
+ZOTERO_LIBRARY_ID = os.getenv('ZOTERO_USER_ID')
+ZOTERO_API_KEY = os.getenv('ZOTERO_API_KEY')
+ZOTERO_DATA_DIR = os.getenv('ZOTERO_DATA_DIR')
+
+
+class PaperQACLI:
+    """
+    A headless command-line interface for ingesting papers from Zotero and answering batches of questions, for use on
+    servers and from schedulers such as cron.
+
+    The CLI shares the `ZoteroPaperEmbedder` machinery of the GUI, so papers embedded by either are available to both.
+    Human-readable logs are written to standard error, and progress is written to standard output as JSON lines, one
+    object per event:
+
+        - `{"event": "start", ...}` once the embedding store has been loaded.
+        - `{"event": "paper", "status": "embedded" | "skipped" | "queued" | "failed", ...}` for every paper.
+        - `{"event": "summary", ...}` with the number of papers of each status and the exit code.
+        - `{"event": "merge", ...}` with the number of papers added and deduplicated when shards are merged.
+        - `{"event": "answer", ...}` for every question of a batch query, as soon as it has been answered.
+        - `{"event": "error", ...}` if the run is aborted.
+
+    The exit code is one of the `CliConstants` exit codes: 0 if every paper was embedded or skipped, 1 if any paper
+    failed or was queued to be retried, 2 for invalid arguments, 3 if the run was aborted by an error, and 130 if it
+    was interrupted (by Ctrl+C or SIGTERM).
+
+    `paperqa`, `openai` and `pyzotero` are only imported by the commands that use them, so parsing the arguments (and
+    `--help`) is fast.
+
+    Attributes
+    ----------
+    progress_stream : TextIO, optional
+        The stream to which JSON progress events are written, or None to disable them.
+
+    Methods
+    -------
+    run(argv: Optional[List[str]] = None) -> int
+        Parses the command-line arguments and runs the requested command, returning its exit code.
+    ingest(args: argparse.Namespace) -> int
+        Ingests the whole library, a collection or a tag, or one shard of them, or delta-syncs the library.
+    merge(args: argparse.Namespace) -> int
+        Merges independently embedded shards into the main embedding store.
+    query(args: argparse.Namespace) -> int
+        Answers a file of questions concurrently, writing each answer as soon as it is ready.
+    benchmark(args: argparse.Namespace) -> int
+        Benchmarks ingestion and querying offline, against fake Zotero and OpenAI servers.
+    build_parser() -> argparse.ArgumentParser
+        Builds the command-line argument parser.
+    """
+    def __init__(self, progress_stream: Optional[TextIO] = sys.stdout):
+        self.progress_stream: Optional[TextIO] = progress_stream
+
+    def run(self, argv: Optional[List[str]] = None) -> int:
+        """
+        Parses the command-line arguments and runs the requested command.
+
+        Parameters
+        ----------
+        argv : List[str], optional
+            The command-line arguments, excluding the program name. Defaults to `sys.argv[1:]`.
+
+        Returns
+        -------
+        int
+            The exit code.
+        """
+        try:
+            args: argparse.Namespace = self.build_parser().parse_args(argv)
+        except SystemExit as error:
+            return CliConstants.EXIT_USAGE_ERROR if error.code else CliConstants.EXIT_SUCCESS
+
+        if args.progress == 'none':
+            self.progress_stream = None
+
+        return args.command(args)
+
+    def ingest(self, args: argparse.Namespace) -> int:
+        """
+        Ingests the whole library, a collection or a tag, or one shard of them, or delta-syncs the library.
+
+        Parameters
+        ----------
+        args : argparse.Namespace
+            The parsed arguments of the `ingest` command.
+
+        Returns
+        -------
+        int
+            The exit code.
+
+        Notes
+        -----
+        SIGTERM is handled like Ctrl+C, so a scheduler stopping the run does not lose any work: every paper is
+        checkpointed as soon as it has been embedded, and the next run resumes from the checkpoint.
+
+        A paper that fails with an error that cannot be retried (e.g. an unreadable PDF) is reported as failed, and
+        the run carries on with the other papers, so one bad paper cannot stop every scheduled run at the same place.
+        With `--stop-on-error`, the run stops at the first such paper instead.
+
+        With `--shard`, only the papers in that shard are embedded, into the shard's own store, so separate processes
+        or machines can embed the shards of a library concurrently before they are combined with the `merge` command.
+        With `--processes`, the shards are embedded by that many local processes and merged automatically.
+        """
+        if args.sync and (args.shard is not None or args.processes is not None):
+            print("--sync cannot be combined with --shard or --processes", file=sys.stderr)
+            return CliConstants.EXIT_USAGE_ERROR
+
+        if args.processes is not None:
+            return self._ingest_shards(args)
+
+        import paperqa
+        from models.ingestion_pipeline import PipelineWorkItem
+        from models.zotero_paper_embedder import ZoteroPaperEmbedder
+
+        statuses: Dict[str, int] = {'embedded': 0, 'skipped': 0, 'queued': 0, 'failed': 0}
+        start: float = time.perf_counter()
+
+        def on_progress(work: PipelineWorkItem, status: str):
+            statuses[status] += 1
+            self._emit(
+                'paper',
+                index=work.index,
+                zotero_key=work.item['key'],
+                title=work.title,
+                status=status,
+                reason=work.skip_reason if work.error is None else repr(work.error),
+                num_tokens=work.num_tokens
+            )
+
+        if args.telemetry_dir is not None:
+            set_telemetry(Telemetry(args.telemetry_dir))
+
+        previous_sigterm_handler = signal.signal(signal.SIGTERM, self._raise_keyboard_interrupt)
+        try:
+            zotero_paper_embedder: ZoteroPaperEmbedder = ZoteroPaperEmbedder(
+                library_id=ZOTERO_LIBRARY_ID,
+                library_type='user',
+                api_key=ZOTERO_API_KEY,
+                processed_data_dir=(
+                    args.shard.directory(args.processed_data_dir) if args.shard is not None else args.processed_data_dir
+                ),
+                zotero_data_dir=args.zotero_data_dir
+            )
+            zotero_paper_embedder.skip_near_duplicates = not args.keep_near_duplicates
+            zotero_paper_embedder.stop_on_error = args.stop_on_error
+            docs: paperqa.Docs = zotero_paper_embedder.load_paperqa_doc(llm_model=args.llm_model)
+            self._emit('start', mode=self._mode(args), collection=args.collection, tag=args.tag, limit=args.limit,
+                       shard=self._format_shard(args.shard), llm_model=args.llm_model, embedded_papers=len(docs.docs))
+
+            if args.sync:
+                zotero_paper_embedder.sync_docs(docs, on_progress=on_progress)
+            else:
+                zotero_paper_embedder.embed_library(
+                    docs,
+                    collection_name=args.collection,
+                    tag=args.tag,
+                    limit=args.limit,
+                    on_progress=on_progress,
+                    shard=args.shard
+                )
+        except KeyboardInterrupt:
+            self._emit('error', message='Interrupted', **statuses)
+            return CliConstants.EXIT_INTERRUPTED
+        except Exception as error:
+            self._emit('error', message=repr(error), **statuses)
+            print(f"Ingestion aborted: {error!r}", file=sys.stderr)
+            return CliConstants.EXIT_FATAL_ERROR
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm_handler)
+
+        exit_code: int = (
+            CliConstants.EXIT_PAPERS_FAILED if statuses['queued'] or statuses['failed'] else CliConstants.EXIT_SUCCESS
+        )
+        self._emit('summary', elapsed_seconds=round(time.perf_counter() - start, 3), embedded_papers=len(docs.docs),
+                   shard=self._format_shard(args.shard), exit_code=exit_code, **statuses)
+
+        return exit_code
+
+    def merge(self, args: argparse.Namespace) -> int:
+        """
+        Merges independently embedded shards into the main embedding store, deduplicating papers by Zotero key and PDF
+        content hash.
+
+        Parameters
+        ----------
+        args : argparse.Namespace
+            The parsed arguments of the `merge` command.
+
+        Returns
+        -------
+        int
+            The exit code.
+
+        Notes
+        -----
+        Merging is idempotent, so it is safe to re-run after a shard has been re-embedded or more shards have been
+        copied in from other machines.
+        """
+        try:
+            report: 'ShardMergeReport' = self._merge_shards(args.processed_data_dir, args.shard_dirs or None)
+        except KeyboardInterrupt:
+            return CliConstants.EXIT_INTERRUPTED
+        except Exception as error:
+            self._emit('error', message=repr(error))
+            print(f"Merge aborted: {error!r}", file=sys.stderr)
+            return CliConstants.EXIT_FATAL_ERROR
+
+        return CliConstants.EXIT_SUCCESS if report.shard_dirs else CliConstants.EXIT_USAGE_ERROR
+
+    def query(self, args: argparse.Namespace) -> int:
+        """
+        Answers a file of questions concurrently, writing each answer as soon as it is ready.
+
+        Parameters
+        ----------
+        args : argparse.Namespace
+            The parsed arguments of the `query` command.
+
+        Returns
+        -------
+        int
+            The exit code: 1 if any question could not be answered, 2 if no embedded paper is in the given
+            collections and tags, or 3 if Zotero is not set up (e.g. neither `ZOTERO_USER_ID` nor `--zotero-data-dir`
+            is given).
+
+        Notes
+        -----
+        The questions share a single embedding request, the answer cache and the evidence cache, so overlapping
+        questions only summarise each retrieved text chunk once. With `--output`, every answer is written to a JSONL
+        file as soon as it is ready, so a long batch can be followed, and its answers kept, while it runs.
+
+        With `--collection` or `--tag`, only the papers in any of the given Zotero collections or with any of the
+        given tags are searched.
+        """
+        try:
+            with open(args.questions, 'r', encoding='utf-8') as file:
+                questions: List[str] = [line.strip() for line in file if line.strip()]
+        except OSError as error:
+            print(f"Cannot read the questions: {error}", file=sys.stderr)
+            return CliConstants.EXIT_USAGE_ERROR
+
+        from models.docs_session import DocsSession
+        from models.partition_index import PartitionScope
+        from models.zotero_paper_embedder import ZoteroPaperEmbedder
+
+        scope: PartitionScope = PartitionScope(collections=args.collection or [], tags=args.tag or [])
+        if args.telemetry_dir is not None:
+            set_telemetry(Telemetry(args.telemetry_dir))
+
+        start: float = time.perf_counter()
+        num_cached: List[int] = [0]
+        output: Optional[TextIO] = None
+
+        def on_answer(index: int, question: str, answer: 'paperqa.Answer', cached: bool):
+            num_cached[0] += cached
+            record: Dict[str, Any] = {
+                'index': index,
+                'question': question,
+                'answer': answer.answer,
+                'references': answer.references,
+                'contexts': [context.text.name for context in answer.contexts],
+                'cached': cached,
+                'cost': answer.cost
+            }
+            self._emit('answer', **record)
+            if output is not None:
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+
+        try:
+            zotero_paper_embedder: ZoteroPaperEmbedder = ZoteroPaperEmbedder(
+                library_id=ZOTERO_LIBRARY_ID,
+                library_type='user',
+                api_key=ZOTERO_API_KEY,
+                processed_data_dir=args.processed_data_dir,
+                zotero_data_dir=args.zotero_data_dir
+            )
+        except Exception as error:
+            self._emit('error', message=repr(error))
+            print(f"Query aborted: {error!r}", file=sys.stderr)
+            return CliConstants.EXIT_FATAL_ERROR
+
+        previous_sigterm_handler = signal.signal(signal.SIGTERM, self._raise_keyboard_interrupt)
+        try:
+            if args.output is not None:
+                output = open(args.output, 'w', encoding='utf-8')
+            docs_session: DocsSession = DocsSession(zotero_paper_embedder)
+            self._emit('start', mode='query', llm_model=args.llm_model, num_questions=len(questions),
+                       concurrency=args.concurrency, scope=scope.describe())
+            docs_session.query_batch(args.llm_model, questions, on_answer=on_answer, max_concurrency=args.concurrency,
+                                     scope=scope)
+        except KeyboardInterrupt:
+            self._emit('error', message='Interrupted')
+            return CliConstants.EXIT_INTERRUPTED
+        except ValueError as error:
+            self._emit('error', message=str(error))
+            print(f"Invalid query: {error}", file=sys.stderr)
+            return CliConstants.EXIT_USAGE_ERROR
+        except Exception as error:
+            self._emit('error', message=repr(error))
+            print(f"Query aborted: {error!r}", file=sys.stderr)
+            return CliConstants.EXIT_PAPERS_FAILED
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm_handler)
+            if output is not None:
+                output.close()
+
+        print(f"Evidence cache: {docs_session.evidence_cache.stats.report()}", file=sys.stderr)
+        self._emit('summary', elapsed_seconds=round(time.perf_counter() - start, 3), num_questions=len(questions),
+                   cached=num_cached[0], exit_code=CliConstants.EXIT_SUCCESS)
+
+        return CliConstants.EXIT_SUCCESS
+
+    def benchmark(self, args: argparse.Namespace) -> int:
+        """
+        Benchmarks ingestion and querying offline, against a synthetic library served by fake Zotero and OpenAI servers.
+
+        Parameters
+        ----------
+        args : argparse.Namespace
+            The parsed arguments of the `benchmark` command.
+
+        Returns
+        -------
+        int
+            The exit code: 1 if any metric regressed against the baseline by more than `--max-regression`.
+        """
+        from benchmarks.benchmark_runner import BenchmarkConfig, BenchmarkResult, BenchmarkRunner
+
+        benchmark_runner: BenchmarkRunner = BenchmarkRunner(BenchmarkConfig(
+            corpus_sizes=args.sizes,
+            num_queries=args.queries,
+            zotero_latency_seconds=args.zotero_latency,
+            zotero_requests_per_second=args.zotero_rps,
+            openai_latency_seconds=args.openai_latency,
+            openai_requests_per_minute=args.openai_rpm,
+            openai_tokens_per_minute=args.openai_tpm,
+            embedding_dimensions=args.embedding_dimensions
+        ))
+        try:
+            results: List[BenchmarkResult] = benchmark_runner.run()
+        except KeyboardInterrupt:
+            return CliConstants.EXIT_INTERRUPTED
+        except RuntimeError as error:
+            self._emit('error', message=str(error))
+            print(f"Benchmark aborted: {error}", file=sys.stderr)
+            return CliConstants.EXIT_FATAL_ERROR
+
+        print(benchmark_runner.report(results), file=sys.stderr)
+        for result in results:
+            self._emit('benchmark', **result.model_dump())
+        if args.output is not None:
+            benchmark_runner.save(results, args.output)
+
+        if args.baseline is not None:
+            regressions: List[str] = benchmark_runner.compare(results, args.baseline, args.max_regression)
+            for regression in regressions:
+                print(f"Regression: {regression}", file=sys.stderr)
+            if regressions:
+                return CliConstants.EXIT_PAPERS_FAILED
+
+        return CliConstants.EXIT_SUCCESS
+
+    def build_parser(self) -> argparse.ArgumentParser:
+        """
+        Builds the command-line argument parser.
+
+        Returns
+        -------
+        argparse.ArgumentParser
+            The parser, with one sub-parser per command.
+        """
+        parser: argparse.ArgumentParser = argparse.ArgumentParser(
+            prog='paper-qa',
+            description='Headless Paper QA Chemistry commands. Run without a command to start the GUI.'
+        )
+        subparsers = parser.add_subparsers(dest='command_name', required=True)
+
+        ingest_parser: argparse.ArgumentParser = subparsers.add_parser(
+            'ingest',
+            help='Embed papers from Zotero without a GUI.',
+            description='Embed every paper in the Zotero library, a collection or a tag that is not yet embedded, '
+                        'or delta-sync the library. Interrupted runs resume from their last checkpoint.'
+        )
+        ingest_parser.add_argument('--llm-model', default=ModelsConstants.GPT_4o_MINI_LLM_MODEL,
+                                   help='The LLM used to generate citations (default: %(default)s).')
+        scope = ingest_parser.add_mutually_exclusive_group()
+        scope.add_argument('--collection', help='Only embed the papers in this Zotero collection.')
+        scope.add_argument('--tag', help='Only embed the papers with this Zotero tag.')
+        scope.add_argument('--sync', action='store_true',
+                           help='Delta-sync the whole library: embed new and modified papers, and remove deleted ones.')
+        ingest_parser.add_argument('--limit', type=self._positive_integer,
+                                   help='The maximum number of papers to page through, ignored with --sync '
+                                        '(default: no limit).')
+        ingest_parser.add_argument('--progress', choices=['jsonl', 'none'], default='jsonl',
+                                   help='The format of the progress written to standard output (default: %(default)s).')
+        ingest_parser.add_argument('--processed-data-dir', default=DataConstants.PROCESSED_DATA_DIR,
+                                   help='The directory of the embedding store (default: %(default)s).')
+        sharding = ingest_parser.add_mutually_exclusive_group()
+        sharding.add_argument('--shard', type=self._shard,
+                              help='Only embed the papers in this shard, written as INDEX/COUNT with INDEX counted '
+                                   'from 0, into the shard\'s own store. Run one process per shard, on any number of '
+                                   'machines, then combine the shards with the merge command.')
+        sharding.add_argument('--processes', type=self._positive_integer,
+                              help='Embed the library in this many shards, each in its own local process, sharing the '
+                                   'OpenAI rate limits between them, then merge the shards.')
+        ingest_parser.add_argument('--zotero-data-dir', default=ZOTERO_DATA_DIR,
+                                   help='Read the library and its PDFs from this local Zotero data directory, which '
+                                        'contains zotero.sqlite and storage/, instead of the Zotero web API. Safe '
+                                        'while Zotero is running (default: the ZOTERO_DATA_DIR environment variable, '
+                                        'or the web API).')
+        ingest_parser.add_argument('--keep-near-duplicates', action='store_true',
+                                   help='Embed papers whose text is a near duplicate of an embedded paper, e.g. the '
+                                        'preprint of a published paper, and only flag them. Papers with an identical '
+                                        'PDF are always skipped.')
+        ingest_parser.add_argument('--stop-on-error', action='store_true',
+                                   help='Stop at the first paper that fails with an error that cannot be retried, '
+                                        'rather than reporting it as failed and carrying on with the other papers.')
+        ingest_parser.add_argument('--telemetry-dir',
+                                   help='Write a JSONL trace of timing spans and a Prometheus metrics snapshot to this '
+                                        'directory (default: the PAPER_QA_TELEMETRY_DIR environment variable, or '
+                                        'disabled).')
+        ingest_parser.set_defaults(command=self.ingest)
+
+        merge_parser: argparse.ArgumentParser = subparsers.add_parser(
+            'merge',
+            help='Merge embedded shards into the main embedding store.',
+            description='Merge the stores of shards embedded with ingest --shard into the main embedding store, '
+                        'deduplicating papers by Zotero key and PDF content hash. Merging is idempotent.'
+        )
+        merge_parser.add_argument('shard_dirs', nargs='*',
+                                  help='The shard directories to merge (default: every directory under the shards '
+                                       'directory of the embedding store).')
+        merge_parser.add_argument('--processed-data-dir', default=DataConstants.PROCESSED_DATA_DIR,
+                                  help='The directory of the main embedding store (default: %(default)s).')
+        merge_parser.add_argument('--progress', choices=['jsonl', 'none'], default='jsonl',
+                                  help='The format of the progress written to standard output (default: %(default)s).')
+        merge_parser.set_defaults(command=self.merge)
+
+        query_parser: argparse.ArgumentParser = subparsers.add_parser(
+            'query',
+            help='Answer a file of questions concurrently.',
+            description='Answer every question in a file, one per line, concurrently, sharing evidence summaries '
+                        'between overlapping questions and writing each answer as soon as it is ready.'
+        )
+        query_parser.add_argument('questions', help='The file of questions, one per line. Blank lines are ignored.')
+        query_parser.add_argument('--llm-model', default=ModelsConstants.GPT_4o_MINI_LLM_MODEL,
+                                  help='The LLM used to answer the questions (default: %(default)s).')
+        query_parser.add_argument('--concurrency', type=self._positive_integer,
+                                  default=BatchQueryConstants.MAX_CONCURRENCY,
+                                  help='The maximum number of questions answered, and of evidence summaries written, '
+                                       'at once (default: %(default)s).')
+        query_parser.add_argument('--collection', action='append',
+                                  help='Only search the papers in this Zotero collection, by name or key. Can be '
+                                       'repeated, and combined with --tag, to search several partitions.')
+        query_parser.add_argument('--tag', action='append',
+                                  help='Only search the papers with this Zotero tag. Can be repeated.')
+        query_parser.add_argument('--output', help='Write each answer to this JSONL file as soon as it is ready.')
+        query_parser.add_argument('--processed-data-dir', default=DataConstants.PROCESSED_DATA_DIR,
+                                  help='The directory of the embedding store (default: %(default)s).')
+        query_parser.add_argument('--zotero-data-dir', default=ZOTERO_DATA_DIR,
+                                  help='The local Zotero data directory the papers were ingested from with ingest '
+                                       '--zotero-data-dir, so that no Zotero web API credentials are needed (default: '
+                                       'the ZOTERO_DATA_DIR environment variable, or the web API).')
+        query_parser.add_argument('--progress', choices=['jsonl', 'none'], default='jsonl',
+                                  help='The format of the progress written to standard output (default: %(default)s).')
+        query_parser.add_argument('--telemetry-dir',
+                                  help='Write a JSONL trace of timing spans and a Prometheus metrics snapshot to this '
+                                       'directory (default: the PAPER_QA_TELEMETRY_DIR environment variable, or '
+                                       'disabled).')
+        query_parser.set_defaults(command=self.query)
+
+        benchmark_parser: argparse.ArgumentParser = subparsers.add_parser(
+            'benchmark',
+            help='Benchmark ingestion and querying offline.',
+            description='Benchmark ingestion throughput, query latency, peak memory and checkpoint size against a '
+                        'synthetic library served by local fake Zotero and OpenAI servers. No network access or API '
+                        'keys are needed.'
+        )
+        benchmark_parser.add_argument('--sizes', type=self._positive_integer, nargs='+',
+                                      default=BenchmarkConstants.CORPUS_SIZES,
+                                      help='The number of papers in each benchmarked library (default: %(default)s).')
+        benchmark_parser.add_argument('--queries', type=self._positive_integer, default=BenchmarkConstants.NUM_QUERIES,
+                                      help='The number of questions asked of each library (default: %(default)s).')
+        benchmark_parser.add_argument('--zotero-latency', type=float, default=BenchmarkConstants.ZOTERO_LATENCY_SECONDS,
+                                      help='The latency of each Zotero request, in seconds (default: %(default)s).')
+        benchmark_parser.add_argument('--zotero-rps', type=float, default=BenchmarkConstants.ZOTERO_REQUESTS_PER_SECOND,
+                                      help='The Zotero rate limit in requests per second, or 0 for none '
+                                           '(default: %(default)s).')
+        benchmark_parser.add_argument('--openai-latency', type=float, default=BenchmarkConstants.OPENAI_LATENCY_SECONDS,
+                                      help='The latency of each OpenAI request, in seconds (default: %(default)s).')
+        benchmark_parser.add_argument('--openai-rpm', type=self._positive_integer,
+                                      default=BenchmarkConstants.OPENAI_REQUESTS_PER_MINUTE,
+                                      help='The OpenAI requests-per-minute limit (default: %(default)s).')
+        benchmark_parser.add_argument('--openai-tpm', type=self._positive_integer,
+                                      default=BenchmarkConstants.OPENAI_TOKENS_PER_MINUTE,
+                                      help='The OpenAI tokens-per-minute limit (default: %(default)s).')
+        benchmark_parser.add_argument('--embedding-dimensions', type=self._positive_integer,
+                                      default=BenchmarkConstants.EMBEDDING_DIMENSIONS,
+                                      help='The number of dimensions of each embedding (default: %(default)s).')
+        benchmark_parser.add_argument('--output', help='Write the results to this JSON file.')
+        benchmark_parser.add_argument('--baseline',
+                                      help='Compare the results against this JSON file written by --output, exiting '
+                                           'with 1 on a regression.')
+        benchmark_parser.add_argument('--max-regression', type=float, default=BenchmarkConstants.MAX_REGRESSION,
+                                      help='The largest tolerated relative regression of any metric '
+                                           '(default: %(default)s).')
+        benchmark_parser.add_argument('--progress', choices=['jsonl', 'none'], default='jsonl',
+                                      help='The format of the results written to standard output '
+                                           '(default: %(default)s).')
+        benchmark_parser.set_defaults(command=self.benchmark)
+
+        return parser
+
+    def _ingest_shards(self, args: argparse.Namespace) -> int:
+        """
+        Embeds every shard of the library in its own spawned process, then merges the shards into the main store.
+
+        Each process runs the `ingest` command for its shard, writing its own progress events, and is given an equal
+        share of the OpenAI rate limits. The shards are only merged if no process was aborted or interrupted.
+        """
+        from models.embedding_shards import EmbeddingShard
+
+        start: float = time.perf_counter()
+        shards: List[EmbeddingShard] = [EmbeddingShard(index=index, count=args.processes)
+                                        for index in range(args.processes)]
+        fields: Dict[str, Any] = {name: value for name, value in vars(args).items() if name != 'command'}
+        try:
+            with ProcessPoolExecutor(max_workers=args.processes,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                exit_codes: List[int] = list(executor.map(
+                    _ingest_shard, [{**fields, 'shard': shard, 'processes': None} for shard in shards]
+                ))
+        except KeyboardInterrupt:
+            self._emit('error', message='Interrupted')
+            return CliConstants.EXIT_INTERRUPTED
+
+        exit_code: int = max(exit_codes)
+        if exit_code in (CliConstants.EXIT_SUCCESS, CliConstants.EXIT_PAPERS_FAILED):
+            try:
+                self._merge_shards(args.processed_data_dir,
+                                   [shard.directory(args.processed_data_dir) for shard in shards])
+            except KeyboardInterrupt:
+                return CliConstants.EXIT_INTERRUPTED
+            except Exception as error:
+                self._emit('error', message=repr(error))
+                print(f"Merge aborted: {error!r}", file=sys.stderr)
+                return CliConstants.EXIT_FATAL_ERROR
+
+        self._emit('summary', elapsed_seconds=round(time.perf_counter() - start, 3), shards=args.processes,
+                   exit_code=exit_code)
+
+        return exit_code
+
+    def _merge_shards(self, processed_data_dir: str, shard_dirs: Optional[List[str]]) -> 'ShardMergeReport':
+        """Merges shards into the main embedding store, logging and emitting the outcome."""
+        from models.embedding_shards import EmbeddingShardMerger, ShardMergeReport
+        from models.embedding_store import EmbeddingStore
+
+        embedding_store: EmbeddingStore = EmbeddingStore(processed_data_dir)
+        report: ShardMergeReport = EmbeddingShardMerger(embedding_store).merge(shard_dirs)
+        print(f"Merged {len(report.shard_dirs)} shards: {report.num_added} papers added, "
+              f"{report.num_already_merged} already merged, {report.num_duplicate_keys} duplicate Zotero keys and "
+              f"{report.num_duplicate_contents} duplicate PDFs skipped.", file=sys.stderr)
+        for shard_dir in report.missing_shard_dirs:
+            print(f"No embedding store found in {shard_dir}", file=sys.stderr)
+        self._emit('merge', embedded_papers=len(embedding_store.load().docs), **report.model_dump())
+
+        return report
+
+    def _emit(self, event: str, **fields):
+        """Writes a JSON progress event to the progress stream."""
+        if self.progress_stream is None:
+            return
+
+        self.progress_stream.write(json.dumps({'event': event, 'time': time.time(), **fields}) + '\n')
+        self.progress_stream.flush()
+
+    @staticmethod
+    def _mode(args: argparse.Namespace) -> str:
+        """Returns the ingestion mode selected by the arguments."""
+        if args.sync:
+            return 'sync'
+        if args.collection is not None:
+            return 'collection'
+        if args.tag is not None:
+            return 'tag'
+        return 'library'
+
+    @staticmethod
+    def _format_shard(shard: Optional['EmbeddingShard']) -> Optional[str]:
+        """Formats a shard as INDEX/COUNT for progress events."""
+        return f"{shard.index}/{shard.count}" if shard is not None else None
+
+    @staticmethod
+    def _shard(value: str) -> 'EmbeddingShard':
+        """Parses a shard argument."""
+        from models.embedding_shards import EmbeddingShard
+
+        try:
+            return EmbeddingShard.parse(value)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(str(error))
+
+    @staticmethod
+    def _positive_integer(value: str) -> int:
+        """Parses a positive integer argument."""
+        if not value.isdigit() or int(value) == 0:
+            raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+        return int(value)
+
+    @staticmethod
+    def _raise_keyboard_interrupt(signum, frame):
+        """Handles SIGTERM like Ctrl+C."""
+        raise KeyboardInterrupt
+
+
+def _ingest_shard(fields: Dict[str, Any]) -> int:
+    """
+    Runs the `ingest` command for a single shard in a spawned process, with an equal share of the OpenAI rate limits.
+
+    This is a module-level function so that it can be run in a spawned process.
+    """
+    count: int = fields['shard'].count
+    rate_limits: Dict[str, int] = {
+        'OPENAI_LLM_RPM': RateLimitConstants.LLM_REQUESTS_PER_MINUTE,
+        'OPENAI_LLM_TPM': RateLimitConstants.LLM_TOKENS_PER_MINUTE,
+        'OPENAI_EMBEDDING_RPM': RateLimitConstants.EMBEDDING_REQUESTS_PER_MINUTE,
+        'OPENAI_EMBEDDING_TPM': RateLimitConstants.EMBEDDING_TOKENS_PER_MINUTE,
+    }
+    for name, default in rate_limits.items():
+        os.environ[name] = str(max(1, int(os.getenv(name, default)) // count))
+
+    cli: PaperQACLI = PaperQACLI(progress_stream=sys.stdout if fields['progress'] != 'none' else None)
+
+    return cli.ingest(argparse.Namespace(**fields))
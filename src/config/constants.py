@@ -1,2 +1,194 @@
 class ModelsConstants:
     GPT_4o_MINI_LLM_MODEL = 'gpt-4o-mini'
+    TEXT_EMBEDDING_ADA_002_MODEL = 'text-embedding-ada-002'
+
+
+class CheckpointConstants:
+    JOURNAL_FILE_SUFFIX = '.journal'
+    SNAPSHOT_TEMP_FILE_SUFFIX = '.tmp'
+    LOCK_FILE_SUFFIX = '.lock'
+    COMPACTION_INTERVAL = 50
+
+
+class PipelineConstants:
+    DOWNLOAD_CONCURRENCY = 8
+    PARSE_CONCURRENCY = 4
+    EMBED_CONCURRENCY = 4
+    QUEUE_SIZE = 16
+    CHUNK_CHARS = 3000
+    CHUNK_OVERLAP = 100
+    TOKENIZER_MODEL = 'gpt-4o-mini'
+    CITATION_PROMPT_TOKENS = 400
+
+
+class RateLimitConstants:
+    EMBEDDING_REQUESTS_PER_MINUTE = 3000
+    EMBEDDING_TOKENS_PER_MINUTE = 1000000
+    LLM_REQUESTS_PER_MINUTE = 500
+    LLM_TOKENS_PER_MINUTE = 200000
+    TARGET_UTILISATION = 0.9
+    BURST_SECONDS = 1
+    MAX_RETRIES = 6
+    MIN_BACKOFF_SECONDS = 1
+    MAX_BACKOFF_SECONDS = 60
+    RETRY_AFTER_JITTER = 0.2
+    RATE_DECREASE_FACTOR = 0.7
+    RATE_RECOVERY_STEP = 0.02
+    MIN_RATE_SCALE = 0.1
+
+
+class AnnIndexConstants:
+    EXACT_SEARCH_THRESHOLD = 10000
+    N_PROBE = 16
+    RETRAIN_GROWTH_FACTOR = 4
+    KMEANS_ITERATIONS = 10
+    KMEANS_SEED = 0
+    TRAINING_SAMPLES_PER_LIST = 64
+    ASSIGNMENT_BLOCK_SIZE = 4096
+    INDEX_FILE_SUFFIX = '.ann.npz'
+
+
+class LexicalIndexConstants:
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    VECTOR_WEIGHT = 0.7
+    IDENTIFIER_BOOST = 0.2
+    MAX_LEXICAL_CANDIDATES = 50
+    MIN_SMILES_LENGTH = 4
+    TOKENIZER_VERSION = 2
+    FORMULA_GROUPS = frozenset(['Ac', 'Ar', 'Bn', 'Boc', 'Bu', 'Bz', 'Cy', 'Et', 'Me', 'Ms', 'Ph', 'Pr', 'Tf', 'Ts'])
+    HYBRID_SEARCH_ENV_VAR = 'PAPER_QA_HYBRID_SEARCH'
+    INDEX_FILE_SUFFIX = '.bm25.npz'
+    STOP_WORDS = frozenset([
+        'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does', 'for', 'from', 'had', 'has',
+        'have', 'how', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were',
+        'what', 'when', 'where', 'which', 'who', 'why', 'with'
+    ])
+
+
+class MappedStoreConstants:
+    VECTOR_DTYPE = 'float16'
+    VECTOR_DTYPES = ['float32', 'float16', 'int8']
+    VECTOR_DTYPE_ENV_VAR = 'PAPER_QA_VECTOR_DTYPE'
+    CHUNK_STORE_INFIX = '.chunks.'
+    SCORE_BLOCK_ROWS = 8192
+
+
+class DuplicateConstants:
+    NUM_PERMUTATIONS = 128
+    NUM_BANDS = 16
+    SHINGLE_WORDS = 5
+    SHINGLE_BLOCK_SIZE = 4096
+    MINHASH_SEED = 0
+    NEAR_DUPLICATE_THRESHOLD = 0.8
+    SKIP_NEAR_DUPLICATES = True
+
+
+class AnswerCacheConstants:
+    SIMILARITY_THRESHOLD = 0.95
+    MAX_ENTRIES = 1000
+    MAX_PENDING_QUESTION_EMBEDDINGS = 64
+
+
+class BatchQueryConstants:
+    MAX_CONCURRENCY = 8
+    EVIDENCE_SIMILARITY_THRESHOLD = 0.95
+    MAX_EVIDENCE_ENTRIES = 20000
+    MAX_QUERY_EMBEDDINGS = 1024
+
+
+class ZoteroConstants:
+    MAX_PAGE_SIZE = 100
+    PREFETCH_WORKERS = 8
+    HTTP_POOL_SIZE = 16
+    MAX_ITEM_KEYS_PER_REQUEST = 50
+
+
+class LocalZoteroConstants:
+    DATABASE_FILE_NAME = 'zotero.sqlite'
+    STORAGE_DIR_NAME = 'storage'
+    STORAGE_PATH_PREFIX = 'storage:'
+    ATTACHMENTS_PATH_PREFIX = 'attachments:'
+    PDF_CONTENT_TYPE = 'application/pdf'
+    LINK_MODE_IMPORTED_FILE = 0
+    LINK_MODE_IMPORTED_URL = 1
+    LINK_MODE_LINKED_FILE = 2
+    PAGE_SIZE = 500
+    LOCK_TIMEOUT_SECONDS = 0.1
+    LIBRARY_ID = '0'
+
+
+class BenchmarkConstants:
+    CORPUS_SIZES = [100, 1000, 10000]
+    PAGES_PER_PAPER = 4
+    WORDS_PER_PAGE = 400
+    EMBEDDING_DIMENSIONS = 1536
+    NUM_QUERIES = 20
+    ZOTERO_LATENCY_SECONDS = 0.05
+    ZOTERO_REQUESTS_PER_SECOND = 0
+    OPENAI_LATENCY_SECONDS = 0.2
+    OPENAI_REQUESTS_PER_MINUTE = 3000
+    OPENAI_TOKENS_PER_MINUTE = 1000000
+    MAX_REGRESSION = 0.2
+    LIBRARY_ID = '0'
+    CORPUS_SEED = 0
+    RECALL_K = 10
+
+
+class TelemetryConstants:
+    TELEMETRY_DIR_ENV_VAR = 'PAPER_QA_TELEMETRY_DIR'
+    TRACE_FILE_NAME = 'trace.jsonl'
+    METRICS_FILE_NAME = 'metrics.prom'
+    METRIC_PREFIX = 'paper_qa'
+
+
+class CliConstants:
+    EXIT_SUCCESS = 0
+    EXIT_PAPERS_FAILED = 1
+    EXIT_USAGE_ERROR = 2
+    EXIT_FATAL_ERROR = 3
+    EXIT_INTERRUPTED = 130
+
+
+class PartitionConstants:
+    COLLECTION_PREFIX = 'collection:'
+    TAG_PREFIX = 'tag:'
+    SEPARATOR = ','
+    MAX_CACHED_SCOPES = 16
+
+
+class PageHashConstants:
+    HASH_CHARS = 32
+
+
+class ShardConstants:
+    SHARDS_DIR_NAME = 'shards'
+
+
+class GuiConstants:
+    LOG_FLUSH_INTERVAL_MS = 100
+    TASK_DONE_EVENT = '-TASK-DONE-'
+    LIBRARY_METADATA_EVENT = '-LIBRARY-METADATA-'
+    WORKER_THREAD_NAME = 'paper-qa-worker'
+    SHUTDOWN_THREAD_NAME = 'paper-qa-shutdown'
+
+
+class LibraryMetadataConstants:
+    MAX_AGE_SECONDS = 300
+    REFRESH_THREAD_NAME = 'library-metadata-refresh'
+
+
+class DataConstants:
+    PROCESSED_DATA_DIR = '../data/processed'
+    EMBEDDING_STORE_FILE_PREFIX = 'paper_qa_embeddings_'
+    LEGACY_DOCS_FILE_PREFIX = 'paper_qa_'
+    PARSED_PDF_CACHE_DIR = '../data/cache/parsed_pdfs'
+    PARSED_PDF_CACHE_MEMORY_ENTRIES = 64
+    ANSWER_CACHE_PATH = '../data/cache/answer_cache.pkl'
+    EVIDENCE_CACHE_PATH = '../data/cache/evidence_cache.pkl'
+    SYNC_STATE_FILE_SUFFIX = '.sync.json'
+    RETRY_QUEUE_FILE_SUFFIX = '.retry.json'
+    DUPLICATE_INDEX_FILE_SUFFIX = '.duplicates.json'
+    PARTITION_INDEX_FILE_SUFFIX = '.partitions.json'
+    PAGE_HASH_INDEX_FILE_SUFFIX = '.pages.json'
+    LIBRARY_METADATA_CACHE_PATH = '../data/cache/zotero_library_metadata.json'
@@ -1,19 +1,26 @@
 import os
 import sys
+import queue
+import threading
 import PySimpleGUI as sg
-import paperqa
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from paperqa.contrib import ZoteroDB
+from typing import Callable, Dict, List, Optional
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from models.zotero_paper_embedder import ZoteroPaperEmbedder
-from config.constants import ModelsConstants
+from models.library_metadata import LibraryMetadata, LibraryMetadataCache
+from models.partition_index import PartitionScope
+from models.task_control import TaskControl
+from config.constants import DataConstants, GuiConstants, ModelsConstants
 
 load_dotenv()
 
 ZOTERO_LIBRARY_ID = os.getenv('ZOTERO_USER_ID')
 ZOTERO_API_KEY = os.getenv('ZOTERO_API_KEY')
+ZOTERO_DATA_DIR = os.getenv('ZOTERO_DATA_DIR')
+
+ACTION_BUTTONS = ('Embed Additional Papers', 'Sync Library', 'Estimate Tokens', 'Submit Query')
 
 
 class PaperQAGUI:
@@ -24,21 +31,63 @@ class PaperQAGUI:
     database. It allows users to embed additional papers into a document set and submit queries against the
     document set, with the option to specify the language model to use for processing the documents.
 
+    Embedding, syncing, estimating and querying run on a single background worker thread, so the window stays
+    responsive while they run. The worker never touches the window: it posts log messages, errors and progress to a
+    queue, which the event loop drains in one batch every `GuiConstants.LOG_FLUSH_INTERVAL_MS` milliseconds, and
+    reports its result with a window event. A running embedding batch or sync can be paused, resumed or cancelled.
+    Queries are streamed into the answer pane: the retrieved passages are counted as they are found, their summaries
+    are shown as soon as they have been scored, and the answer is shown token by token as the LLM generates it.
+
+    The window opens without importing `paperqa`, `openai` or `pyzotero`, and without any network calls. The size of
+    the Zotero library is shown from a local cache, which is refreshed from the Zotero API in the background, and the
+    embedder and the embedding store are loaded by the worker thread as soon as the window is open.
+
     Attributes
     ----------
-    zotero : ZoteroDB
-        An instance of ZoteroDB used to interact with the Zotero database.
+    library_metadata : LibraryMetadataCache
+        The locally cached item count and version of the Zotero library.
     layout : list
         The layout of the PySimpleGUI window, including input fields, buttons, and text outputs.
     window : sg.Window
         The main window of the GUI.
+    zotero_paper_embedder : ZoteroPaperEmbedder, optional
+        The embedder used to embed papers from the Zotero database, once it has been loaded by the worker thread.
+    docs_session : DocsSession, optional
+        The session keeping each LLM's document set in memory between queries, once it has been loaded.
+    log_queue : queue.Queue
+        The queue of `(kind, message)` tuples posted by the worker, where `kind` is 'log', 'error', 'progress' or
+        'query', the latter with a `QueryEvent` as its message.
+    executor : ThreadPoolExecutor
+        The single worker thread, which is reused for every task so the asyncio event loop and the OpenAI clients
+        bound to it are never shared between threads.
+    task_control : TaskControl, optional
+        The control of the running task, if it can be paused and cancelled.
+    progress_counts : Dict[str, int]
+        The number of papers processed by the running task, by status.
+    query_counts : Dict[str, int]
+        The number of events of the running query, by kind: passages retrieved, summaries scored and answer tokens.
 
     Methods
     -------
     embed_papers(llm_model: str, num_papers: str, start_position: str)
         Embeds additional papers into the document set using the specified language model.
-    submit_query(llm_model: str, query: str)
-        Submits a query to the document set and displays the response in a popup window.
+    sync_library(llm_model: str)
+        Brings the document set up to date with the changes made to the Zotero library since it was last synced.
+    estimate_tokens(num_papers: str, start_position: str)
+        Estimates the number of input tokens in a batch of papers without embedding them.
+    submit_query(llm_model: str, query: str, scope: str = '')
+        Submits a query to the document set, or to some of its collections and tags, and streams the evidence and the
+        answer into the answer pane.
+    start_task(name: str, task: Callable, *args, task_control: Optional[TaskControl] = None)
+        Runs a task on the worker thread, disabling the action buttons until it has finished.
+    flush_log()
+        Displays the messages posted by the worker since the last flush.
+    finish_task(name: str, result, error: Optional[BaseException])
+        Re-enables the action buttons and reports the result of a finished task.
+    toggle_pause()
+        Pauses or resumes the running task.
+    cancel_task()
+        Cancels the running task once the paper being committed has been saved.
     run()
         Runs the main event loop for the GUI, handling user interactions.
     validate_positive_integer(value, field_name)
@@ -52,13 +101,15 @@ class PaperQAGUI:
         and the starting position for embedding, as well as buttons for embedding papers, submitting queries,
         and exiting the application.
         """
-        self.zotero = ZoteroDB(library_type='user')
+        self.library_metadata: LibraryMetadataCache = LibraryMetadataCache(
+            DataConstants.LIBRARY_METADATA_CACHE_PATH, library_id=ZOTERO_LIBRARY_ID, library_type='user',
+            api_key=ZOTERO_API_KEY
+        )
         self.layout = [
             [sg.Text('Paper QA Interface')],
             [sg.Text('Enter the language model to use: ')],
             [sg.InputText(default_text='gpt-4o-mini', key='llm_model_input', size=(40, 1), expand_x=True)],
-            [sg.Text(f"Enter the number of papers to embed (Max batch size = 100. "
-                     f"Total Zotero database papers = {self.zotero.num_items()}): ")],
+            [sg.Text(self._num_papers_label(self.library_metadata.metadata), key='num_papers_label')],
             [sg.InputText(key='num_papers_input', size=(40, 1), enable_events=True, expand_x=True)],
             [sg.Text('Enter the database starting point for embedding: ')],
             [sg.InputText(key='start_position_input', size=(40, 1), enable_events=True, expand_x=True)],
@@ -66,25 +117,42 @@ class PaperQAGUI:
             [sg.Multiline(size=(80, 20), key='console_multiline', autoscroll=True, disabled=True, expand_x=True)],
             [sg.Text('Paper QA Query: ')],
             [sg.InputText(key='query_input', size=(40, 1), expand_x=True)],
+            [sg.Text('Limit the query to collections/tags (e.g. collection:Catalysis, tag:review): ')],
+            [sg.InputText(key='scope_input', size=(40, 1), expand_x=True)],
+            [sg.Text('Answer: ')],
+            [sg.Multiline(size=(80, 15), key='answer_multiline', autoscroll=True, disabled=True, expand_x=True)],
             [sg.Button('Embed Additional Papers')],
+            [sg.Button('Sync Library')],
+            [sg.Button('Estimate Tokens')],
             [sg.Button('Submit Query')],
+            [sg.Text('', key='status_text', size=(80, 1), expand_x=True)],
+            [sg.Button('Pause', key='pause_button', disabled=True), sg.Button('Cancel', disabled=True)],
             [sg.Button('Exit')],
         ]
         self.window = sg.Window('Paper QA', self.layout, resizable=True, finalize=True)
-        self.zotero_paper_embedder = ZoteroPaperEmbedder(
-            library_id=ZOTERO_LIBRARY_ID,
-            library_type='user',
-            api_key=ZOTERO_API_KEY,
-            console_multiline=self.window['console_multiline'],
-            window=self.window
+        self.log_queue: queue.Queue = queue.Queue()
+        self.zotero_paper_embedder: Optional['ZoteroPaperEmbedder'] = None
+        self.docs_session: Optional['DocsSession'] = None
+        self._backend_lock: threading.Lock = threading.Lock()
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=GuiConstants.WORKER_THREAD_NAME
+        )
+        self.task_control: Optional[TaskControl] = None
+        self.progress_counts: Dict[str, int] = {}
+        self.query_counts: Dict[str, int] = {}
+
+        self.library_metadata.refresh_in_background(
+            on_refresh=lambda metadata: self.window.write_event_value(GuiConstants.LIBRARY_METADATA_EVENT, metadata),
+            on_error=lambda error: self.log_queue.put(('log', f"Could not refresh the Zotero library size: {error}"))
         )
+        self.executor.submit(self._preload, ModelsConstants.GPT_4o_MINI_LLM_MODEL)
 
     def embed_papers(self, llm_model: str, num_papers: str, start_position: str):
         """
         Embeds additional papers into a set of vectors using the specified language model.
 
-        Based on the specified LLM, this method loads a document set from a pickle file or creates a new one if the
-        file does not exist. It then embeds a specified number of papers from the Zotero database, starting at a given
+        Based on the specified LLM, this method loads a document set as a view over the shared embedding store, which
+        is created if it does not exist. It then embeds a specified number of papers from the Zotero database, starting at a given
         position.
 
         Parameters
@@ -99,40 +167,86 @@ class PaperQAGUI:
         Notes
         -----
         If the input values for `num_papers` or `start_position` are invalid, an error message is displayed.
-        The method updates the GUI to output progress messages to the console.
+        The papers are embedded on the worker thread, which posts progress messages to the console, and the batch can
+        be paused or cancelled.
         """
         if not llm_model.strip():
             llm_model = ModelsConstants.GPT_4o_MINI_LLM_MODEL
 
-        try:
-            docs: paperqa.Docs = self.zotero_paper_embedder.load_paperqa_doc(
-                pkl_file_path=f"../data/processed/paper_qa_"
-                              f"{llm_model.lower().replace(' ', '_').replace('-', '_')}.pkl",
-                llm_model=llm_model
-            )
-        except ValueError:
-            sg.popup_error(f"{llm_model} is not a valid LLM model")
+        if not num_papers or not start_position:
+            sg.popup_error("Invalid input. Please enter valid numbers.")
             return
 
+        def embed(task_control: TaskControl):
+            self._load_backend()
+            self.zotero_paper_embedder.embed_docs(
+                embedded_docs=self._get_docs(llm_model),
+                query_limit=int(num_papers),
+                query_start=int(start_position),
+                on_progress=self._post_progress,
+                task_control=task_control
+            )
+
+        self.start_task('Embedding', embed, task_control=TaskControl())
+
+    def sync_library(self, llm_model: str):
+        """
+        Brings the document set up to date with the Zotero library, embedding papers added or modified since the last
+        sync and removing papers that have been deleted.
+
+        Parameters
+        ----------
+        llm_model : str
+            The language model to use for processing the documents.
+        """
+        if not llm_model.strip():
+            llm_model = ModelsConstants.GPT_4o_MINI_LLM_MODEL
+
+        def sync(task_control: TaskControl):
+            self._load_backend()
+            self.zotero_paper_embedder.sync_docs(
+                embedded_docs=self._get_docs(llm_model),
+                on_progress=self._post_progress,
+                task_control=task_control
+            )
+
+        self.start_task('Library sync', sync, task_control=TaskControl())
+
+    def estimate_tokens(self, num_papers: str, start_position: str):
+        """
+        Estimates the number of input tokens in a batch of papers without embedding them, giving a crude measure of how
+        expensive the batch will be to embed.
+
+        Parameters
+        ----------
+        num_papers : str
+            The number of papers to estimate.
+        start_position : str
+            The starting position in the Zotero database from which to begin the estimate.
+        """
         if not num_papers or not start_position:
             sg.popup_error("Invalid input. Please enter valid numbers.")
             return
 
-        self.zotero_paper_embedder.embed_docs(
-            embedded_docs=docs,
-            query_limit=int(num_papers),
-            query_start=int(start_position)
-        )
+        def estimate() -> str:
+            self._load_backend()
+            tokens_per_paper, total_tokens = self.zotero_paper_embedder.estimate_tokens(
+                query_limit=int(num_papers),
+                query_start=int(start_position)
+            )
+            return f"{len(tokens_per_paper)} papers with PDFs contain {total_tokens} input tokens in total."
 
-        sg.popup('Embedding completed and saved.')
+        self.start_task('Token estimate', estimate)
 
-    def submit_query(self, llm_model: str, query: str):
+    def submit_query(self, llm_model: str, query: str, scope: str = ''):
         """
         Submits a query which is then embedded into a vector. This vector is then used to search and summarise the top
-        passages in the embedded papers, and the LLM is used to score and select the relevant summaries. The response
-        and references are then displayed in a popup window.
+        passages in the embedded papers, and the LLM is used to score and select the relevant summaries. Each summary
+        is shown in the answer pane as soon as it has been scored, and the answer is streamed into the pane as the
+        LLM generates it, followed by its references.
 
-        This method loads a document set from a pickle file or creates a new one if the file does not exist.
+        The document set is kept in memory by the `DocsSession` between queries, and is only updated with any papers
+        embedded since the previous query, rather than being reloaded for every query.
 
         Parameters
         ----------
@@ -140,6 +254,9 @@ class PaperQAGUI:
             The language model to use for processing the documents.
         query : str
             The query to submit to the document set.
+        scope : str, optional
+            A comma-separated list of `collection:<name>` and `tag:<tag>` partitions. Only the papers in any of them
+            are searched. Defaults to the whole library.
 
         Notes
         -----
@@ -149,40 +266,268 @@ class PaperQAGUI:
             sg.popup_error("Query cannot be empty. Please enter a valid query.")
             return
 
+        if query.lower() == 'exit':
+            self.window.write_event_value('Exit', None)
+            return
+
+        try:
+            partition_scope: PartitionScope = PartitionScope.parse(scope)
+        except ValueError as error:
+            sg.popup_error(f"Invalid collections/tags: {error}")
+            return
+
         if not llm_model.strip():
             llm_model: str = ModelsConstants.GPT_4o_MINI_LLM_MODEL
 
-        try:
-            docs: paperqa.Docs = self.zotero_paper_embedder.load_paperqa_doc(
-                pkl_file_path=f"../data/processed/paper_qa_"
-                              f"{llm_model.lower().replace(' ', '_').replace('-', '_')}.pkl",
-                llm_model=llm_model
+        self.query_counts = {'retrieved': 0, 'evidence': 0, 'token': 0}
+        self.window['answer_multiline'].update(f"Question: {query}\n")
+        if not partition_scope.is_empty():
+            self.window['answer_multiline'].print(f"Limited to: {partition_scope.describe()}")
+
+        def answer():
+            self._get_docs(llm_model)
+            response = self.docs_session.query(
+                llm_model, query, on_event=lambda event: self.log_queue.put(('query', event)), scope=partition_scope
             )
-        except ValueError:
-            sg.popup_error(f"{llm_model} is not a valid LLM model")
+            self.zotero_paper_embedder.console_output(
+                f"Answer cache: {self.docs_session.answer_cache.stats.report()}"
+            )
+            return response
+
+        self.start_task('Query', answer)
+
+    def start_task(self, name: str, task: Callable, *args, task_control: Optional[TaskControl] = None):
+        """
+        Runs a task on the worker thread, disabling the action buttons until it has finished.
+
+        Parameters
+        ----------
+        name : str
+            The name of the task, used in status and error messages.
+        task : Callable
+            The task, which must not touch the window.
+        *args
+            The arguments of the task.
+        task_control : TaskControl, optional
+            If given, it is passed to the task as its last argument, and the Pause and Cancel buttons are enabled
+            while the task runs.
+        """
+        self.task_control = task_control
+        self.progress_counts = {}
+        self._set_busy(True)
+        self.window['status_text'].update(f"{name} running...")
+        if task_control is not None:
+            args += (task_control,)
+
+        def run_task():
+            try:
+                result = task(*args)
+            except Exception as error:
+                self.window.write_event_value(GuiConstants.TASK_DONE_EVENT, (name, None, error))
+            else:
+                self.window.write_event_value(GuiConstants.TASK_DONE_EVENT, (name, result, None))
+
+        self.executor.submit(run_task)
+
+    def flush_log(self):
+        """
+        Displays the messages posted by the worker since the last flush, printing the log messages to the console and
+        the query's evidence and answer tokens to the answer pane in a single update each, and reporting any errors in
+        popup windows.
+        """
+        lines: List[str] = []
+        answer_parts: List[str] = []
+        errors: List[str] = []
+        while True:
+            try:
+                kind, message = self.log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                self.progress_counts[message] = self.progress_counts.get(message, 0) + 1
+            elif kind == 'query':
+                answer_parts.append(self._format_query_event(message))
+            elif kind == 'error':
+                errors.append(message)
+            else:
+                lines.append(message)
+
+        if lines:
+            self.window['console_multiline'].print('\n'.join(lines))
+        if answer_parts:
+            self.window['answer_multiline'].print(''.join(answer_parts), end='')
+            self.window['status_text'].update(
+                f"Query: {self.query_counts['retrieved']} passages retrieved, {self.query_counts['evidence']} scored"
+                + (", answering..." if self.query_counts['token'] else "...")
+            )
+        if self.progress_counts:
+            counts: str = ', '.join(f"{count} {status}" for status, count in self.progress_counts.items())
+            paused: str = ' (paused)' if self.task_control is not None and self.task_control.is_paused else ''
+            self.window['status_text'].update(f"Papers: {counts}{paused}")
+        for error in errors:
+            sg.popup_error(error)
+
+    def finish_task(self, name: str, result, error: Optional[BaseException]):
+        """
+        Re-enables the action buttons and reports the result of a finished task.
+
+        Parameters
+        ----------
+        name : str
+            The name of the task.
+        result
+            The value returned by the task: the answer of a query, or the message of a token estimate.
+        error : BaseException, optional
+            The exception raised by the task, if it failed.
+        """
+        self.flush_log()
+        cancelled: bool = self.task_control is not None and self.task_control.is_cancelled
+        self.task_control = None
+        self._set_busy(False)
+        if error is not None:
+            self.window['status_text'].update(f"{name} failed.")
+            sg.popup_error(f"{name} failed: {error}")
+        elif cancelled:
+            self.window['status_text'].update(f"{name} cancelled.")
+            sg.popup(f"{name} cancelled. The papers processed so far have been saved.")
+        elif hasattr(result, 'formatted_answer'):
+            self.window['status_text'].update(f"{name} completed.")
+            if self.query_counts.get('token'):
+                self.window['answer_multiline'].print(
+                    f"\n\nReferences\n\n{result.references}" if result.references else ''
+                )
+            else:
+                # Answered from the answer cache, so nothing was streamed
+                self.window['answer_multiline'].update(result.formatted_answer)
+        else:
+            self.window['status_text'].update(f"{name} completed.")
+            sg.popup(result if result is not None else f"{name} completed and saved.")
+
+    def toggle_pause(self):
+        """Pauses the running task before its next paper, or resumes it if it is paused."""
+        if self.task_control is None:
             return
 
-        if query.lower() == 'exit':
-            self.window.close()
+        if self.task_control.is_paused:
+            self.task_control.resume()
+            self.window['pause_button'].update('Pause')
+        else:
+            self.task_control.pause()
+            self.window['pause_button'].update('Resume')
+
+    def cancel_task(self):
+        """Cancels the running task once the paper being committed has been saved."""
+        if self.task_control is None:
             return
 
-        response: paperqa.Answer = docs.query(query)
-        sg.popup_scrolled(f"Response: {response.formatted_answer}", title="Query Result", size=(50, 20))
+        self.task_control.cancel()
+        self.window['pause_button'].update('Pause', disabled=True)
+        self.window['Cancel'].update(disabled=True)
+        self.window['status_text'].update("Cancelling...")
+
+    def _load_backend(self):
+        """
+        Imports and creates the embedder and the query session, on the worker thread, if they have not been yet.
+
+        `paperqa`, `openai` and `pyzotero` are only imported here, so that the window opens without waiting for them.
+        """
+        with self._backend_lock:
+            if self.docs_session is not None:
+                return
+
+            from models.zotero_paper_embedder import ZoteroPaperEmbedder
+            from models.docs_session import DocsSession
+            self.zotero_paper_embedder = ZoteroPaperEmbedder(
+                library_id=ZOTERO_LIBRARY_ID,
+                library_type='user',
+                api_key=ZOTERO_API_KEY,
+                log_queue=self.log_queue,
+                zotero_data_dir=ZOTERO_DATA_DIR
+            )
+            self.zotero_paper_embedder.library_metadata = self.library_metadata
+            self.docs_session = DocsSession(self.zotero_paper_embedder)
+
+    def _preload(self, llm_model: str):
+        """
+        Loads the embedder and the default LLM's document set on the worker thread while the window is idle, so that
+        the first query does not wait for them. Failures are only logged, and raised again by the first task.
+        """
+        try:
+            self._get_docs(llm_model)
+        except Exception as error:
+            self.log_queue.put(('log', f"Could not preload the embedded papers: {error}"))
+
+    @staticmethod
+    def _num_papers_label(metadata: LibraryMetadata) -> str:
+        """Returns the label of the number of papers input, with the cached size of the Zotero library."""
+        num_items: str = str(metadata.num_items) if metadata.num_items is not None else 'unknown'
+        return f"Enter the number of papers to embed (Total Zotero database papers = {num_items}): "
+
+    def _get_docs(self, llm_model: str) -> 'paperqa.Docs':
+        """Returns the document set of an LLM, raising a ValueError with a readable message if it is not valid."""
+        self._load_backend()
+        try:
+            return self.docs_session.get_docs(llm_model)
+        except ValueError:
+            raise ValueError(f"{llm_model} is not a valid LLM model") from None
+
+    def _format_query_event(self, event: 'QueryEvent') -> str:
+        """Counts a query event, and returns the text it adds to the answer pane."""
+        self.query_counts[event.kind] += 1
+        if event.kind == 'evidence':
+            header: str = "\nEvidence:\n" if self.query_counts['evidence'] == 1 else ""
+            return f"{header}[{event.score}/10] {event.name}: {event.text}\n"
+        if event.kind == 'token':
+            header = "\nAnswer:\n" if self.query_counts['token'] == 1 else ""
+            return f"{header}{event.text}"
+        return ""
+
+    def _post_progress(self, work: 'PipelineWorkItem', status: str):
+        """Posts the status of a processed paper to the log queue, from the worker thread."""
+        self.log_queue.put(('progress', status))
+
+    def _set_busy(self, busy: bool):
+        """Disables the action buttons while a task runs, and enables the Pause and Cancel buttons if it may be."""
+        for button in ACTION_BUTTONS:
+            self.window[button].update(disabled=busy)
+        controllable: bool = busy and self.task_control is not None
+        self.window['pause_button'].update('Pause', disabled=not controllable)
+        self.window['Cancel'].update(disabled=not controllable)
 
     def run(self):
         """
        Runs the main event loop for the GUI, handling user interactions.
 
        This method starts the GUI event loop, allowing the user to interact with the interface. It handles
-       events such as embedding papers, submitting queries, and validating input fields.
+       events such as embedding papers, submitting queries, and validating input fields, and flushes the messages
+       posted by the worker thread at least every `GuiConstants.LOG_FLUSH_INTERVAL_MS` milliseconds. On exit, a
+       running embedding batch or sync is cancelled once its current paper has been saved. The window closes at once,
+       even while a query is running, and the process exits once the worker has finished and the answer cache has
+       been saved.
        """
         while True:
-            event, values = self.window.read()
+            event, values = self.window.read(timeout=GuiConstants.LOG_FLUSH_INTERVAL_MS)
             sg.theme('DarkBlue3')
 
             if event == sg.WIN_CLOSED or event == 'Exit':
                 break
 
+            self.flush_log()
+
+            if event == GuiConstants.TASK_DONE_EVENT:
+                self.finish_task(*values[GuiConstants.TASK_DONE_EVENT])
+
+            if event == GuiConstants.LIBRARY_METADATA_EVENT:
+                self.window['num_papers_label'].update(
+                    self._num_papers_label(values[GuiConstants.LIBRARY_METADATA_EVENT])
+                )
+
+            if event == 'pause_button':
+                self.toggle_pause()
+
+            if event == 'Cancel':
+                self.cancel_task()
+
             if event == 'num_papers_input':
                 if not self.validate_positive_integer(values['num_papers_input'],
                                                       "the number of papers to embed"):
@@ -196,11 +541,29 @@ class PaperQAGUI:
             if event == 'Embed Additional Papers':
                 self.embed_papers(values['llm_model_input'], values['num_papers_input'], values['start_position_input'])
 
-            if event == 'Submit Query':
-                self.submit_query(values['llm_model_input'], values['query_input'])
+            if event == 'Sync Library':
+                self.sync_library(values['llm_model_input'])
+
+            if event == 'Estimate Tokens':
+                self.estimate_tokens(values['num_papers_input'], values['start_position_input'])
 
+            if event == 'Submit Query':
+                self.submit_query(values['llm_model_input'], values['query_input'], values['scope_input'])
+
+        if self.task_control is not None:
+            self.task_control.cancel()
+        # A running query cannot be cancelled, so it is left to finish on the worker thread rather than freezing the
+        # window, and the non-daemon shutdown thread keeps the process alive until the answer cache is saved
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        threading.Thread(target=self._save_on_exit, name=GuiConstants.SHUTDOWN_THREAD_NAME).start()
         self.window.close()
 
+    def _save_on_exit(self):
+        """Waits for the task running on the worker thread to finish, then saves the answer cache."""
+        self.executor.shutdown(wait=True)
+        if self.docs_session is not None:
+            self.docs_session.answer_cache.save()
+
     @staticmethod
     def validate_positive_integer(value, field_name):
         """
@@ -1,7 +1,12 @@
-from gui.paper_qa_gui import PaperQAGUI
+import sys
 
 
 def main():
+    if len(sys.argv) > 1:
+        from cli.paper_qa_cli import PaperQACLI
+        sys.exit(PaperQACLI().run(sys.argv[1:]))
+
+    from gui.paper_qa_gui import PaperQAGUI
     gui: PaperQAGUI = PaperQAGUI()
     gui.run()
 
@@ -0,0 +1,702 @@
+import os
+import sys
+import hashlib
+import contextvars
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from paperqa.llms import EmbeddingModes, NumpyVectorStore
+from paperqa.types import Embeddable, Text
+from pathlib import Path
+from pydantic import Field
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import AnnIndexConstants, BatchQueryConstants, LexicalIndexConstants, PartitionConstants
+from models.lexical_index import LexicalIndex, is_identifier, tokenize
+from models.mapped_chunk_store import MappedChunkStore, MappedText
+from models.telemetry import Telemetry, get_telemetry
+
+_search_scope: contextvars.ContextVar[Optional[FrozenSet[str]]] = contextvars.ContextVar('search_scope', default=None)
+
+
+class AnnVectorStore(NumpyVectorStore):
+    """
+    A `paperqa` vector store with an inverted-file (IVF) approximate-nearest-neighbour index, built with NumPy.
+
+    The vectors are k-means clustered into `n_lists` inverted lists. A query is only scored against the vectors in
+    its `n_probe` nearest lists, rather than against every vector in the library. Libraries smaller than
+    `exact_search_threshold` vectors are searched exactly.
+
+    Unlike `paperqa.llms.NumpyVectorStore`, which rebuilds its whole embedding matrix every time texts are added,
+    the index is built incrementally: vectors are appended to a pre-allocated, normalised float32 matrix and assigned
+    to their nearest list. The lists are only re-clustered once the library has grown by `RETRAIN_GROWTH_FACTOR`
+    since they were last trained.
+
+    When the leading texts of the store are backed by a `MappedChunkStore` (as they are once a snapshot has been
+    loaded), their vectors are scored straight from the chunk store's memory-mapped, quantized matrix, and only the
+    vectors of texts added since are copied into the float32 matrix.
+
+    Text chunks are also indexed in a BM25 `LexicalIndex` as they are added, whose tokenizer keeps SMILES strings and
+    CAS numbers intact. Its scores are fused with the cosine similarities of the vector search, and when a query names
+    an identifier found in the library, the chunks that contain it are ranked higher.
+
+    Searches run inside `search_scope()` only score the texts of the given documents, e.g. the papers in a Zotero
+    collection. The rows of the most recently used scopes are cached until texts are added or removed.
+
+    Attributes
+    ----------
+    n_probe : int
+        The number of inverted lists searched per query. Higher values trade latency for recall.
+    n_lists : int, optional
+        The number of inverted lists. Defaults to the square root of the number of vectors.
+    exact_search_threshold : int
+        The number of vectors below which every query is answered by exact search.
+
+    Methods
+    -------
+    add_texts_and_embeddings(texts: Sequence[Embeddable])
+        Adds embedded texts to the store and the index.
+    similarity_search(client: Any, query: str, k: int) -> Tuple[Sequence[Embeddable], List[float]]
+        Returns the `k` texts most relevant to the query, and their fused lexical and vector scores.
+    search_embedding(query_embedding: Sequence[float], k: int, exact: bool, rows: Optional[np.ndarray])
+        Returns the positions of the `k` texts most similar to a query vector, and their cosine similarities.
+    search_scope(dockeys: Iterable[str])
+        A context manager limiting the searches run inside it to the texts of the given documents.
+    remember_query_embeddings(query_embeddings: Dict[str, Sequence[float]])
+        Remembers the embeddings of queries about to be searched, so that `similarity_search()` does not embed them.
+    remove_texts(removed_ids: Set[int])
+        Removes texts from the store and the index, without re-clustering the inverted lists.
+    clear()
+        Removes every text from the store and the index.
+    clear_index()
+        Discards the index arrays, so that the index is rebuilt from the texts when it is next used.
+    use_chunk_store(chunk_store: MappedChunkStore)
+        Scores the leading texts of the store from a chunk store written from them, freeing their float32 vectors.
+    save_index(index_path: Union[str, Path], lexical_index_path: Optional[Union[str, Path]] = None)
+        Saves the index, and optionally the lexical index, next to the `Docs` state.
+    load_index(index_path: Union[str, Path], lexical_index_path: Optional[Union[str, Path]] = None) -> bool
+        Loads a saved index, and optionally the lexical index, if it matches the texts in the store.
+
+    Notes
+    -----
+    The index arrays are not pickled with the `Docs` object, as every text already carries its embedding. They are
+    saved separately by `save_index()`, and rebuilt from the texts if no matching saved index is found. Hybrid
+    search can be turned off by setting the `PAPER_QA_HYBRID_SEARCH` environment variable to `0`, in which case no
+    lexical index is built.
+    """
+    n_probe: int = Field(default=AnnIndexConstants.N_PROBE)
+    n_lists: Optional[int] = Field(default=None)
+    exact_search_threshold: int = Field(default=AnnIndexConstants.EXACT_SEARCH_THRESHOLD)
+
+    _num_rows: int = 0
+    _assignments: Optional[np.ndarray] = None
+    _centroids: Optional[np.ndarray] = None
+    _num_trained_rows: int = 0
+    _deferred: bool = False
+    _chunk_store: Optional[MappedChunkStore] = None
+    _num_mapped_rows: int = 0
+    _query_embeddings: Optional[OrderedDict] = None
+    _lexical_index: Optional[LexicalIndex] = None
+    _texts_version: int = 0
+    _scope_rows: Optional[OrderedDict] = None
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['__pydantic_private__'] = {
+            **state['__pydantic_private__'],
+            '_embeddings_matrix': None,
+            '_num_rows': 0,
+            '_assignments': None,
+            '_centroids': None,
+            '_num_trained_rows': 0,
+            '_deferred': True,
+            '_chunk_store': None,
+            '_num_mapped_rows': 0,
+            '_query_embeddings': None,
+            '_lexical_index': None,
+            '_scope_rows': None
+        }
+        return state
+
+    def clear(self) -> None:
+        """Removes every text from the store and the index."""
+        super().clear()
+        self.clear_index()
+        self._lexical_index = None
+        self._texts_version += 1
+
+    def add_texts_and_embeddings(self, texts: Sequence[Embeddable]) -> None:
+        """
+        Adds embedded texts to the store, and appends their vectors to the index.
+
+        When the store has just been unpickled, the index is not rebuilt until it is loaded or first searched, so that
+        replaying a checkpoint journal does not rebuild it for every record.
+
+        Parameters
+        ----------
+        texts : Sequence[Embeddable]
+            The texts to add. Each must already have its embedding set.
+        """
+        self.texts.extend(texts)
+        self._texts_version += 1
+        if not self._deferred:
+            self._sync_index()
+
+    def remove_texts(self, removed_ids: Set[int]):
+        """
+        Removes texts from the store, compacting the index rows that remain rather than rebuilding the index.
+
+        Removing a text scored from the chunk store rebuilds the index from the remaining texts' embeddings instead,
+        as the chunk store's rows would no longer line up with the texts. This lasts until the next compaction.
+
+        Parameters
+        ----------
+        removed_ids : Set[int]
+            The `id()` of each text to remove.
+        """
+        keep: np.ndarray = np.fromiter((id(text) not in removed_ids for text in self.texts), dtype=bool,
+                                       count=len(self.texts))
+        if keep.all():
+            return
+
+        if self._lexical_index is not None:
+            if self._lexical_index.num_rows == len(self.texts):
+                self._lexical_index.remove_rows(keep)
+            else:
+                self._lexical_index = None
+
+        num_mapped_rows: int = self._num_mapped_rows
+        if self._num_rows == len(self.texts) and self._assignments is not None and keep[:num_mapped_rows].all():
+            # Only rows after the chunk store's are removed, so the chunk store still lines up with the texts
+            kept_rows: np.ndarray = keep[num_mapped_rows:]
+            num_kept: int = int(kept_rows.sum())
+            if self._embeddings_matrix is not None:
+                self._embeddings_matrix[:num_kept] = (
+                    self._embeddings_matrix[:self._num_rows - num_mapped_rows][kept_rows]
+                )
+            self._assignments[num_mapped_rows:num_mapped_rows + num_kept] = (
+                self._assignments[num_mapped_rows:self._num_rows][kept_rows]
+            )
+            self._num_rows = num_mapped_rows + num_kept
+        else:
+            self.clear_index()
+        self.texts[:] = [text for text, kept in zip(self.texts, keep) if kept]
+        self._texts_version += 1
+
+    async def similarity_search(self, client: Any, query: str, k: int) -> Tuple[Sequence[Embeddable], List[float]]:
+        """
+        Returns the `k` texts most relevant to the query.
+
+        The texts most similar to the query's embedding and those with the highest BM25 scores for its terms are
+        ranked by a weighted sum of their cosine similarity and normalised BM25 score. If the query names a SMILES
+        string or CAS number that occurs in the library, the texts containing one of its identifiers are also ranked,
+        and their scores boosted. Inside `search_scope()`, only the texts of the scope's documents are ranked.
+
+        Parameters
+        ----------
+        client : Any
+            The embedding client.
+        query : str
+            The query text, which is embedded with the store's embedding model.
+        k : int
+            The number of texts to return.
+
+        Returns
+        -------
+        Tuple[Sequence[Embeddable], List[float]]
+            The texts, most relevant first, and their scores: fused scores when hybrid search is used, and cosine
+            similarities to the query otherwise.
+        """
+        scope_rows: Optional[np.ndarray] = self._rows_in_scope(_search_scope.get())
+        k = min(k, len(self.texts) if scope_rows is None else len(scope_rows))
+        if k == 0:
+            return [], []
+
+        telemetry: Telemetry = get_telemetry()
+
+        query_embedding: Optional[Sequence[float]] = (
+            self._query_embeddings.get(query) if self._query_embeddings is not None else None
+        )
+        if query_embedding is None:
+            # This will only affect models that embed prompts
+            self.embedding_model.set_mode(EmbeddingModes.QUERY)
+            with telemetry.span('query.embed', model=self.embedding_model.name):
+                query_embedding = (await self.embedding_model.embed_documents(client, [query]))[0]
+            self.embedding_model.set_mode(EmbeddingModes.DOCUMENT)
+
+        with telemetry.span('query.search', k=k, num_chunks=len(self.texts) if scope_rows is None else len(scope_rows),
+                            scoped=scope_rows is not None) as span:
+            rows, scores = self.search_embedding(query_embedding, k, rows=scope_rows)
+            if self._lexical_index is not None:
+                rows, scores = self._fuse_lexical_scores(query, query_embedding, rows, scores, k, scope_rows)
+                span.set(num_results=len(rows))
+        return [self.texts[row] for row in rows], scores
+
+    def search_embedding(self, query_embedding: Sequence[float], k: int, exact: bool = False,
+                         rows: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """
+        Returns the positions of the `k` texts most similar to a query vector.
+
+        Parameters
+        ----------
+        query_embedding : Sequence[float]
+            The query vector.
+        k : int
+            The number of texts to return.
+        exact : bool, optional
+            Whether to score every vector rather than only those in the nearest inverted lists.
+        rows : np.ndarray, optional
+            The sorted positions of the texts to search. If the nearest inverted lists hold fewer than `k` of them,
+            every one of them is scored. Defaults to every text.
+
+        Returns
+        -------
+        Tuple[List[int], List[float]]
+            The positions of the texts in `texts`, most similar first, and their cosine similarities to the query.
+        """
+        self._deferred = False
+        self._sync_index()
+        k = min(k, self._num_rows if rows is None else len(rows))
+        if k == 0:
+            return [], []
+
+        query: np.ndarray = self._normalise(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        candidate_rows: Optional[np.ndarray] = None
+        if not exact and self._centroids is not None and self._num_rows >= self.exact_search_threshold:
+            n_probe: int = min(self.n_probe, len(self._centroids))
+            probed_lists: np.ndarray = np.zeros(len(self._centroids), dtype=bool)
+            probed_lists[np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]] = True
+            if rows is None:
+                candidate_rows = np.flatnonzero(probed_lists[self._assignments[:self._num_rows]])
+            else:
+                candidate_rows = rows[probed_lists[self._assignments[rows]]]
+            if len(candidate_rows) < k:
+                candidate_rows = None
+
+        if candidate_rows is None:
+            candidate_rows = np.arange(self._num_rows) if rows is None else rows
+        scores: np.ndarray = np.nan_to_num(self._scores(query, candidate_rows), nan=-np.inf)
+
+        top: np.ndarray = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        return candidate_rows[top].tolist(), scores[top].tolist()
+
+    @staticmethod
+    @contextmanager
+    def search_scope(dockeys: Iterable[str]) -> Iterator[None]:
+        """
+        Limits the searches run inside the context, including those of tasks it starts, to the texts of the given
+        documents.
+
+        Parameters
+        ----------
+        dockeys : Iterable[str]
+            The keys of the documents to search. If empty, searches return nothing.
+        """
+        token: contextvars.Token = _search_scope.set(frozenset(dockeys))
+        try:
+            yield
+        finally:
+            _search_scope.reset(token)
+
+    def remember_query_embeddings(self, query_embeddings: Dict[str, Sequence[float]]):
+        """
+        Remembers the embeddings of queries about to be searched, e.g. a batch of questions embedded in a single API
+        request, so that `similarity_search()` does not embed them again.
+
+        Parameters
+        ----------
+        query_embeddings : Dict[str, Sequence[float]]
+            The embedding of each query text, computed with the store's embedding model in query mode. Only the
+            `BatchQueryConstants.MAX_QUERY_EMBEDDINGS` most recently remembered embeddings are kept.
+        """
+        if self._query_embeddings is None:
+            self._query_embeddings = OrderedDict()
+        for query, query_embedding in query_embeddings.items():
+            self._query_embeddings[query] = query_embedding
+            self._query_embeddings.move_to_end(query)
+        while len(self._query_embeddings) > BatchQueryConstants.MAX_QUERY_EMBEDDINGS:
+            self._query_embeddings.popitem(last=False)
+
+    def save_index(self, index_path: Union[str, Path], lexical_index_path: Optional[Union[str, Path]] = None):
+        """
+        Atomically saves the index, so that it does not need to be rebuilt when the `Docs` state is next loaded.
+
+        The vectors scored from a chunk store are not saved again, only their inverted list assignments.
+
+        Parameters
+        ----------
+        index_path : Union[str, Path]
+            The path of the index file, usually next to the `Docs` pickle file.
+        lexical_index_path : Union[str, Path], optional
+            The path of the lexical index file. The lexical index is not saved if it is not given.
+        """
+        self._sync_index()
+        if self._num_rows == 0:
+            return
+
+        if lexical_index_path is not None and self._lexical_index is not None:
+            self._lexical_index.save(lexical_index_path, self._fingerprint(self._lexical_index.num_rows))
+
+        num_unmapped_rows: int = self._num_rows - self._num_mapped_rows
+        index_temp_path: str = f"{index_path}.{os.getpid()}.tmp"
+        with open(index_temp_path, 'wb') as file:
+            np.savez(
+                file,
+                fingerprint=np.array(self._fingerprint(self._num_rows)),
+                embeddings_matrix=(
+                    self._embeddings_matrix[:num_unmapped_rows] if self._embeddings_matrix is not None
+                    else np.zeros((0, 0), dtype=np.float32)
+                ),
+                assignments=self._assignments[:self._num_rows],
+                centroids=self._centroids if self._centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                num_trained_rows=np.array(self._num_trained_rows),
+                num_mapped_rows=np.array(self._num_mapped_rows),
+                chunk_store=np.array(self._chunk_store.generation if self._chunk_store is not None else '')
+            )
+        os.replace(index_temp_path, index_path)
+
+    def load_index(self, index_path: Union[str, Path], lexical_index_path: Optional[Union[str, Path]] = None) -> bool:
+        """
+        Loads a saved index, if it was saved for (a prefix of) the texts currently in the store, and for the chunk
+        store backing their leading texts.
+
+        Any texts added since the index was saved are then appended to it. If the index is missing or stale, it is
+        rebuilt from the texts instead. The same applies to the lexical index, which is saved again if it had to be
+        rebuilt, as tokenizing every text is much slower than re-clustering their vectors.
+
+        Parameters
+        ----------
+        index_path : Union[str, Path]
+            The path of the index file.
+        lexical_index_path : Union[str, Path], optional
+            The path of the lexical index file. The lexical index is rebuilt from the texts if it is not given.
+
+        Returns
+        -------
+        bool
+            True if the saved index was loaded, False if it was missing or stale and has been rebuilt.
+        """
+        self.clear_index()
+        chunk_store, num_mapped_rows = self._find_chunk_store()
+        loaded: bool = False
+        try:
+            with np.load(index_path) as index:
+                embeddings_matrix: np.ndarray = index['embeddings_matrix']
+                saved_num_mapped_rows: int = int(index['num_mapped_rows']) if 'num_mapped_rows' in index else 0
+                saved_chunk_store: str = str(index['chunk_store']) if 'chunk_store' in index else ''
+                num_rows: int = saved_num_mapped_rows + len(embeddings_matrix)
+                if (
+                        num_rows <= len(self.texts)
+                        and saved_num_mapped_rows == num_mapped_rows
+                        and saved_chunk_store == (chunk_store.generation if chunk_store is not None else '')
+                        and str(index['fingerprint']) == self._fingerprint(num_rows)
+                ):
+                    self._chunk_store = chunk_store
+                    self._num_mapped_rows = num_mapped_rows
+                    self._embeddings_matrix = embeddings_matrix if len(embeddings_matrix) else None
+                    self._assignments = index['assignments']
+                    self._centroids = index['centroids'] if index['centroids'].size else None
+                    self._num_trained_rows = int(index['num_trained_rows'])
+                    self._num_rows = num_rows
+                    loaded = True
+        except (OSError, KeyError, ValueError):
+            pass
+
+        self._lexical_index = None
+        lexical_index_loaded: bool = False
+        if lexical_index_path is not None and self._hybrid_search_enabled():
+            saved_lexical_index: Optional[Tuple[LexicalIndex, str]] = LexicalIndex.load(lexical_index_path)
+            if saved_lexical_index is not None:
+                lexical_index, fingerprint = saved_lexical_index
+                if (lexical_index.num_rows <= len(self.texts)
+                        and fingerprint == self._fingerprint(lexical_index.num_rows)):
+                    self._lexical_index = lexical_index
+                    lexical_index_loaded = True
+
+        self._deferred = False
+        self._sync_index()
+        if lexical_index_path is not None and not lexical_index_loaded and self._lexical_index is not None:
+            self._lexical_index.save(lexical_index_path, self._fingerprint(self._lexical_index.num_rows))
+        return loaded
+
+    def _sync_index(self):
+        """Appends any texts not yet in the index to it, re-clustering the inverted lists if required."""
+        if self._num_rows > len(self.texts):
+            # Texts have been removed, so the index no longer lines up with them
+            self.clear_index()
+        if self._num_rows == 0:
+            # Texts loaded from a snapshot are scored from its chunk store, without copying their vectors
+            self._chunk_store, self._num_mapped_rows = self._find_chunk_store()
+            if self._num_mapped_rows:
+                self._reserve_assignments(self._num_mapped_rows)
+                self._num_rows = self._num_mapped_rows
+        if self._num_rows < len(self.texts):
+            new_rows: np.ndarray = self._normalise(
+                np.asarray([text.embedding for text in self.texts[self._num_rows:]], dtype=np.float32)
+            )
+            self._reserve(self._num_rows + len(new_rows), new_rows.shape[1])
+            start: int = self._num_rows - self._num_mapped_rows
+            self._embeddings_matrix[start:start + len(new_rows)] = new_rows
+            if self._centroids is not None:
+                self._assignments[self._num_rows:self._num_rows + len(new_rows)] = self._assign(new_rows)
+            self._num_rows += len(new_rows)
+
+        if self._num_rows >= self.exact_search_threshold and (
+                self._centroids is None
+                or self._num_rows >= self._num_trained_rows * AnnIndexConstants.RETRAIN_GROWTH_FACTOR
+        ):
+            self._train()
+
+        self._sync_lexical_index()
+
+    def clear_index(self):
+        """Discards the index arrays, so that the index is rebuilt from the texts when it is next used."""
+        self._embeddings_matrix = None
+        self._num_rows = 0
+        self._assignments = None
+        self._centroids = None
+        self._num_trained_rows = 0
+        self._chunk_store = None
+        self._num_mapped_rows = 0
+
+    def use_chunk_store(self, chunk_store: MappedChunkStore):
+        """
+        Scores the leading texts of the store from a chunk store written from them in the same order, e.g. the one
+        just written with a snapshot, and frees their float32 vectors.
+
+        Parameters
+        ----------
+        chunk_store : MappedChunkStore
+            The chunk store.
+        """
+        self._deferred = False
+        self._sync_index()
+        num_mapped_rows: int = len(chunk_store)
+        if not self._num_mapped_rows <= num_mapped_rows <= self._num_rows:
+            return
+
+        if self._embeddings_matrix is not None:
+            unmapped_rows: np.ndarray = self._embeddings_matrix[
+                num_mapped_rows - self._num_mapped_rows:self._num_rows - self._num_mapped_rows
+            ]
+            self._embeddings_matrix = unmapped_rows.copy() if len(unmapped_rows) else None
+        self._chunk_store = chunk_store
+        self._num_mapped_rows = num_mapped_rows
+
+    def _sync_lexical_index(self):
+        """Tokenizes any text chunks not yet in the lexical index into it."""
+        if not self._hybrid_search_enabled() or not self.texts or not isinstance(self.texts[0], Text):
+            self._lexical_index = None
+            return
+
+        if self._lexical_index is None or self._lexical_index.num_rows > len(self.texts):
+            self._lexical_index = LexicalIndex()
+        if self._lexical_index.num_rows < len(self.texts):
+            with get_telemetry().span('index.lexical', num_chunks=len(self.texts) - self._lexical_index.num_rows):
+                self._lexical_index.add(text.text for text in self.texts[self._lexical_index.num_rows:])
+
+    def _rows_in_scope(self, scope: Optional[FrozenSet[str]]) -> Optional[np.ndarray]:
+        """Returns the sorted positions of the texts of the documents in a search scope, or None if unscoped."""
+        if scope is None:
+            return None
+
+        if self._scope_rows is None:
+            self._scope_rows = OrderedDict()
+        key: Tuple[FrozenSet[str], int, int] = (scope, self._texts_version, len(self.texts))
+        rows: Optional[np.ndarray] = self._scope_rows.get(key)
+        if rows is None:
+            # Text chunks belong to a document, while the documents index holds the documents themselves
+            rows = np.fromiter(
+                (row for row, text in enumerate(self.texts) if getattr(text, 'doc', text).dockey in scope),
+                dtype=np.int64
+            )
+            self._scope_rows = OrderedDict(
+                (cached_key, cached_rows) for cached_key, cached_rows in self._scope_rows.items()
+                if cached_key[1:] == key[1:]
+            )
+            self._scope_rows[key] = rows
+        self._scope_rows.move_to_end(key)
+        while len(self._scope_rows) > PartitionConstants.MAX_CACHED_SCOPES:
+            self._scope_rows.popitem(last=False)
+
+        return rows
+
+    def _fuse_lexical_scores(self, query: str, query_embedding: Sequence[float], vector_rows: List[int],
+                             vector_row_scores: List[float], k: int,
+                             scope_rows: Optional[np.ndarray] = None) -> Tuple[List[int], List[float]]:
+        """
+        Re-ranks the rows found by the vector search together with the rows that best match the query's terms, by a
+        weighted sum of their cosine similarity and normalised BM25 score. If the query names identifiers that occur
+        in the library, or in the search scope's rows when given, the best matching rows containing one of them are
+        ranked as well, and the score of every row containing one is boosted.
+        """
+        terms: List[str] = tokenize(query)
+        matched_rows, matched_scores = self._lexical_index.scores(terms)
+        if scope_rows is not None:
+            in_scope: np.ndarray = np.isin(matched_rows, scope_rows, assume_unique=True)
+            matched_rows, matched_scores = matched_rows[in_scope], matched_scores[in_scope]
+        if len(matched_rows) == 0:
+            return vector_rows, vector_row_scores
+
+        identifiers: List[str] = [
+            term for term in terms if is_identifier(term) and self._lexical_index.document_frequency(term)
+        ]
+        identifier_rows: np.ndarray = np.zeros(0, dtype=np.int32)
+        if identifiers:
+            identifier_rows = self._lexical_index.rows_containing(identifiers)
+            if scope_rows is not None:
+                identifier_rows = np.intersect1d(identifier_rows, scope_rows, assume_unique=True)
+        # Rows containing an identifier also contain a query term, so they are among the matched rows
+        identifier_scores: np.ndarray = matched_scores[np.searchsorted(matched_rows, identifier_rows)]
+        candidate_rows: np.ndarray = np.union1d(
+            np.asarray(vector_rows, dtype=np.int32),
+            np.union1d(self._best_lexical_rows(matched_rows, matched_scores),
+                       self._best_lexical_rows(identifier_rows, identifier_scores))
+        )
+
+        query_vector: np.ndarray = self._normalise(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        vector_scores: np.ndarray = np.nan_to_num(self._scores(query_vector, candidate_rows), nan=-1.0)
+        lexical_scores: np.ndarray = np.zeros(len(candidate_rows), dtype=np.float32)
+        matched: np.ndarray = np.isin(candidate_rows, matched_rows)
+        lexical_scores[matched] = matched_scores[np.searchsorted(matched_rows, candidate_rows[matched])]
+        if lexical_scores.max(initial=0.0) > 0:
+            lexical_scores /= lexical_scores.max()
+
+        scores: np.ndarray = (LexicalIndexConstants.VECTOR_WEIGHT * vector_scores
+                              + (1 - LexicalIndexConstants.VECTOR_WEIGHT) * lexical_scores
+                              + LexicalIndexConstants.IDENTIFIER_BOOST * np.isin(candidate_rows, identifier_rows))
+        top: np.ndarray = np.argsort(-scores, kind='stable')[:k]
+        get_telemetry().increment('hybrid_searches', identifier_boosted=len(identifier_rows) > 0)
+
+        return candidate_rows[top].tolist(), scores[top].tolist()
+
+    @staticmethod
+    def _best_lexical_rows(rows: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Returns the `MAX_LEXICAL_CANDIDATES` rows with the highest BM25 scores."""
+        if len(rows) <= LexicalIndexConstants.MAX_LEXICAL_CANDIDATES:
+            return rows
+
+        return rows[np.argpartition(-scores, LexicalIndexConstants.MAX_LEXICAL_CANDIDATES - 1)[
+            :LexicalIndexConstants.MAX_LEXICAL_CANDIDATES
+        ]]
+
+    @staticmethod
+    def _hybrid_search_enabled() -> bool:
+        """Returns whether text chunks are indexed lexically, and searched by both their text and their vectors."""
+        return os.getenv(LexicalIndexConstants.HYBRID_SEARCH_ENV_VAR, '1') != '0'
+
+    def _find_chunk_store(self) -> Tuple[Optional[MappedChunkStore], int]:
+        """Returns the chunk store backing the leading texts of the store in row order, and how many texts it backs."""
+        if not self.texts or not isinstance(self.texts[0], MappedText):
+            return None, 0
+
+        chunk_store: MappedChunkStore = self.texts[0].chunk_store
+        num_mapped_rows: int = 0
+        for text in self.texts[:len(chunk_store)]:
+            if not isinstance(text, MappedText) or text.chunk_store is not chunk_store or text.row != num_mapped_rows:
+                break
+            num_mapped_rows += 1
+
+        return chunk_store, num_mapped_rows
+
+    def _reserve(self, num_rows: int, dimensions: int):
+        """Grows the embedding matrix and list assignments geometrically, so that appends are amortised O(1)."""
+        self._reserve_assignments(num_rows)
+        num_unmapped_rows: int = num_rows - self._num_mapped_rows
+        if self._embeddings_matrix is not None and len(self._embeddings_matrix) >= num_unmapped_rows:
+            return
+
+        capacity: int = max(num_unmapped_rows,
+                            2 * (len(self._embeddings_matrix) if self._embeddings_matrix is not None else 0))
+        embeddings_matrix: np.ndarray = np.zeros((capacity, dimensions), dtype=np.float32)
+        if self._embeddings_matrix is not None:
+            num_filled_rows: int = self._num_rows - self._num_mapped_rows
+            embeddings_matrix[:num_filled_rows] = self._embeddings_matrix[:num_filled_rows]
+        self._embeddings_matrix = embeddings_matrix
+
+    def _reserve_assignments(self, num_rows: int):
+        """Grows the list assignments geometrically, so that they can hold `num_rows` rows."""
+        if self._assignments is not None and len(self._assignments) >= num_rows:
+            return
+
+        capacity: int = max(num_rows, 2 * (len(self._assignments) if self._assignments is not None else 0))
+        assignments: np.ndarray = np.zeros(capacity, dtype=np.int32)
+        if self._assignments is not None:
+            assignments[:self._num_rows] = self._assignments[:self._num_rows]
+        self._assignments = assignments
+
+    def _vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Returns the unit-length float32 vectors of the given rows, from the chunk store or the float32 matrix."""
+        mapped: np.ndarray = rows < self._num_mapped_rows
+        if not mapped.any():
+            return self._embeddings_matrix[rows - self._num_mapped_rows]
+        if mapped.all():
+            return self._chunk_store.vectors(rows)
+
+        vectors: np.ndarray = np.empty((len(rows), self._embeddings_matrix.shape[1]), dtype=np.float32)
+        vectors[mapped] = self._chunk_store.vectors(rows[mapped])
+        vectors[~mapped] = self._embeddings_matrix[rows[~mapped] - self._num_mapped_rows]
+        return vectors
+
+    def _scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Returns the cosine similarities of a unit-length query vector to the vectors of the given rows."""
+        mapped: np.ndarray = rows < self._num_mapped_rows
+        scores: np.ndarray = np.empty(len(rows), dtype=np.float32)
+        if mapped.any():
+            mapped_rows: np.ndarray = rows[mapped]
+            every_row: bool = len(mapped_rows) == self._num_mapped_rows == len(self._chunk_store)
+            scores[mapped] = self._chunk_store.scores(query, None if every_row else mapped_rows)
+        if not mapped.all():
+            scores[~mapped] = self._embeddings_matrix[rows[~mapped] - self._num_mapped_rows] @ query
+        return scores
+
+    def _train(self):
+        """Clusters the vectors into inverted lists with spherical k-means, and assigns every vector to a list."""
+        n_lists: int = max(1, min(self.n_lists or int(np.sqrt(self._num_rows)), self._num_rows))
+        rng: np.random.Generator = np.random.default_rng(AnnIndexConstants.KMEANS_SEED)
+
+        num_samples: int = min(self._num_rows, n_lists * AnnIndexConstants.TRAINING_SAMPLES_PER_LIST)
+        samples: np.ndarray = self._vectors(rng.choice(self._num_rows, num_samples, replace=False))
+        centroids: np.ndarray = samples[rng.choice(num_samples, n_lists, replace=False)]
+        for _ in range(AnnIndexConstants.KMEANS_ITERATIONS):
+            sample_assignments: np.ndarray = np.argmax(samples @ centroids.T, axis=1)
+            sums: np.ndarray = np.zeros_like(centroids)
+            np.add.at(sums, sample_assignments, samples)
+            empty_lists: np.ndarray = ~np.any(sums, axis=1)
+            sums[empty_lists] = centroids[empty_lists]
+            centroids = self._normalise(sums)
+
+        self._centroids = centroids
+        for start in range(0, self._num_rows, AnnIndexConstants.ASSIGNMENT_BLOCK_SIZE):
+            rows: np.ndarray = np.arange(start, min(start + AnnIndexConstants.ASSIGNMENT_BLOCK_SIZE, self._num_rows))
+            self._assignments[rows] = self._assign(self._vectors(rows))
+        self._num_trained_rows = self._num_rows
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Returns the nearest inverted list of each vector, computed in blocks to bound memory use."""
+        assignments: np.ndarray = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), AnnIndexConstants.ASSIGNMENT_BLOCK_SIZE):
+            block: np.ndarray = vectors[start:start + AnnIndexConstants.ASSIGNMENT_BLOCK_SIZE]
+            assignments[start:start + len(block)] = np.argmax(block @ self._centroids.T, axis=1)
+
+        return assignments
+
+    def _fingerprint(self, num_rows: int) -> str:
+        """Returns a hash identifying the first `num_rows` texts in the store."""
+        digest = hashlib.sha256()
+        for text in self.texts[:num_rows]:
+            digest.update((getattr(text, 'name', None) or getattr(text, 'docname', '')).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _normalise(vectors: np.ndarray) -> np.ndarray:
+        """Returns the vectors scaled to unit length, so that dot products are cosine similarities."""
+        norms: np.ndarray = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32, copy=False)
@@ -0,0 +1,359 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import threading
+import numpy as np
+import paperqa
+from collections import OrderedDict
+from pathlib import Path
+from pydantic import BaseModel, ConfigDict
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import AnswerCacheConstants, DataConstants
+
+
+class AnswerCacheEntry(BaseModel):
+    """
+    A cached answer to a question.
+
+    Attributes
+    ----------
+    question : str
+        The question as it was asked.
+    llm_model : str
+        The language model that generated the answer.
+    docs_version : str
+        The version of the `Docs` object the answer was computed from, as returned by `AnswerCache.docs_version()`.
+    scope : str
+        Identifies the Zotero collections and tags the question was limited to, and the papers in them, or is empty
+        if the whole library was searched.
+    question_embedding : List[float]
+        The normalised embedding of the question.
+    answer : paperqa.Answer
+        The answer, with the embeddings of its contexts removed.
+    created_at : float
+        When the answer was cached, as a Unix timestamp.
+    hits : int
+        The number of times the answer has been returned from the cache.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    question: str
+    llm_model: str
+    docs_version: str
+    scope: str = ''
+    question_embedding: List[float]
+    answer: paperqa.Answer
+    created_at: float
+    hits: int = 0
+
+
+class AnswerCacheStats(BaseModel):
+    """
+    Hit and miss statistics of an `AnswerCache`.
+
+    Attributes
+    ----------
+    exact_hits : int
+        Lookups answered by an identically worded question.
+    semantic_hits : int
+        Lookups answered by a differently worded question whose embedding is within the similarity threshold.
+    misses : int
+        Lookups that found no cached answer.
+    evictions : int
+        Entries evicted because the cache was full.
+    invalidations : int
+        Entries discarded because papers have since been added to (or removed from) the `Docs` object.
+    """
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hits(self) -> int:
+        """Return the total number of cache hits."""
+        return self.exact_hits + self.semantic_hits
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups answered from the cache."""
+        lookups: int = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        """Return a one-line human-readable summary of the statistics."""
+        return (f"{self.hits} hits ({self.exact_hits} exact, {self.semantic_hits} semantic), {self.misses} misses, "
+                f"{self.hit_rate:.0%} hit rate, {self.evictions} evictions, {self.invalidations} invalidations")
+
+
+class AnswerCache:
+    """
+    A persistent cache of answers, keyed by the embedding of the question they answer.
+
+    A question is answered from the cache if the same LLM has already answered a question whose embedding has a
+    cosine similarity of at least `similarity_threshold` with it, over the same set of papers and limited to the same
+    scope. Identically worded questions are answered without even embedding the question, and no cache hit makes any
+    LLM calls.
+
+    Attributes
+    ----------
+    cache_path : Path
+        The path to the pickle file in which the cache is persisted.
+    similarity_threshold : float
+        The minimum cosine similarity between two questions' embeddings for one to be answered with the other's answer.
+    max_entries : int
+        The maximum number of cached answers. The least recently used answer is evicted when the cache is full.
+    stats : AnswerCacheStats
+        The hit and miss statistics, persisted with the cache.
+
+    Methods
+    -------
+    lookup(question: str, llm_model: str, docs_version: str, embed_question: Callable[[str], Sequence[float]],
+           scope: str = '') -> Optional[paperqa.Answer]
+        Returns the cached answer to a question, or None if there is none.
+    add(question: str, llm_model: str, docs_version: str, embed_question: Callable[[str], Sequence[float]],
+        answer: paperqa.Answer, scope: str = '')
+        Caches the answer to a question.
+    invalidate(docs_version: str) -> int
+        Discards every answer computed from a different version of the `Docs` object.
+    clear()
+        Discards every cached answer.
+    save()
+        Atomically persists the cache, including its statistics and LRU order.
+    docs_version(docs: paperqa.Docs) -> str
+        Returns a version identifying the set of papers in a `Docs` object.
+    """
+    def __init__(self, cache_path: Union[str, Path] = DataConstants.ANSWER_CACHE_PATH,
+                 similarity_threshold: float = AnswerCacheConstants.SIMILARITY_THRESHOLD,
+                 max_entries: int = AnswerCacheConstants.MAX_ENTRIES):
+        self.cache_path: Path = Path(cache_path)
+        self.similarity_threshold: float = similarity_threshold
+        self.max_entries: int = max_entries
+        self.stats: AnswerCacheStats = AnswerCacheStats()
+        self._entries: OrderedDict[str, AnswerCacheEntry] = OrderedDict()
+        self._question_embeddings: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    def lookup(self, question: str, llm_model: str, docs_version: str,
+               embed_question: Callable[[str], Sequence[float]], scope: str = '') -> Optional[paperqa.Answer]:
+        """
+        Returns the cached answer to a question, or None if there is none.
+
+        Parameters
+        ----------
+        question : str
+            The question.
+        llm_model : str
+            The language model that would answer the question.
+        docs_version : str
+            The version of the `Docs` object that would answer the question.
+        embed_question : Callable[[str], Sequence[float]]
+            Embeds the question. Only called if no identically worded question has been cached.
+        scope : str, optional
+            Identifies the Zotero collections and tags the question is limited to, and the papers in them. Defaults to
+            the whole library.
+
+        Returns
+        -------
+        Optional[paperqa.Answer]
+            The cached answer, or None on a cache miss.
+
+        Notes
+        -----
+        Answers computed from any other version of the `Docs` object are invalidated first. To keep hits fast, the
+        statistics and LRU order are not written to disk by a lookup, only by the next change to the cache or by
+        `save()`.
+        """
+        with self._lock:
+            self.invalidate(docs_version)
+            candidates: List[AnswerCacheEntry] = [
+                entry for entry in self._entries.values() if entry.llm_model == llm_model and entry.scope == scope
+            ]
+            normalised_question: str = self._normalise_question(question)
+            for entry in candidates:
+                if self._normalise_question(entry.question) == normalised_question:
+                    self.stats.exact_hits += 1
+                    return self._hit(entry)
+
+        # The question is embedded without holding the lock, so concurrent lookups are not serialised
+        if candidates:
+            question_embedding: np.ndarray = np.asarray(self._embed(question, embed_question), dtype=np.float32)
+            similarities: np.ndarray = np.asarray(
+                [entry.question_embedding for entry in candidates], dtype=np.float32
+            ) @ question_embedding
+            best: int = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                with self._lock:
+                    self.stats.semantic_hits += 1
+                    return self._hit(candidates[best])
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def add(self, question: str, llm_model: str, docs_version: str,
+            embed_question: Callable[[str], Sequence[float]], answer: paperqa.Answer, scope: str = ''):
+        """
+        Caches the answer to a question, evicting the least recently used answers if the cache is full.
+
+        Parameters
+        ----------
+        question : str
+            The question.
+        llm_model : str
+            The language model that answered the question.
+        docs_version : str
+            The version of the `Docs` object that answered the question.
+        embed_question : Callable[[str], Sequence[float]]
+            Embeds the question, if it was not already embedded by `lookup()`.
+        answer : paperqa.Answer
+            The answer.
+        scope : str, optional
+            Identifies the Zotero collections and tags the question was limited to, and the papers in them. Defaults to
+            the whole library.
+        """
+        cached_answer: paperqa.Answer = answer.model_copy(deep=True)
+        for context in cached_answer.contexts:
+            context.text.embedding = None
+            context.text.doc.embedding = None
+
+        entry: AnswerCacheEntry = AnswerCacheEntry(
+            question=question,
+            llm_model=llm_model,
+            docs_version=docs_version,
+            question_embedding=self._embed(question, embed_question),
+            scope=scope,
+            answer=cached_answer,
+            created_at=time.time()
+        )
+        with self._lock:
+            self._entries[self._entry_key(question, llm_model, docs_version, scope)] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+            self.save()
+
+    def invalidate(self, docs_version: str) -> int:
+        """
+        Discards every answer computed from a different version of the `Docs` object.
+
+        Parameters
+        ----------
+        docs_version : str
+            The current version of the `Docs` object.
+
+        Returns
+        -------
+        int
+            The number of discarded answers.
+        """
+        with self._lock:
+            stale_keys: List[str] = [
+                key for key, entry in self._entries.items() if entry.docs_version != docs_version
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+            if stale_keys:
+                self.stats.invalidations += len(stale_keys)
+                self.save()
+
+        return len(stale_keys)
+
+    def clear(self):
+        """Discards every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            self.save()
+
+    def save(self):
+        """Atomically persists the cache, including its statistics and LRU order."""
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_temp_path: str = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(cache_temp_path, 'wb') as file:
+            pickle.dump({'entries': list(self._entries.items()), 'stats': self.stats}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_temp_path, self.cache_path)
+
+    @staticmethod
+    def docs_version(docs: paperqa.Docs) -> str:
+        """
+        Returns a version identifying the set of papers in a `Docs` object, which changes whenever a paper is added or
+        removed.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object.
+
+        Returns
+        -------
+        str
+            The hexadecimal SHA-256 hash of the sorted document keys.
+        """
+        digest = hashlib.sha256()
+        for dockey in sorted(str(dockey) for dockey in docs.docs):
+            digest.update(dockey.encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def _hit(self, entry: AnswerCacheEntry) -> paperqa.Answer:
+        """Records a cache hit, marking the entry as the most recently used."""
+        entry.hits += 1
+        entry_key: str = self._entry_key(entry.question, entry.llm_model, entry.docs_version, entry.scope)
+        if entry_key in self._entries:
+            self._entries.move_to_end(entry_key)
+        return entry.answer.model_copy(deep=True)
+
+    def _embed(self, question: str, embed_question: Callable[[str], Sequence[float]]) -> List[float]:
+        """Returns the normalised embedding of a question, embedding it at most once between a lookup and an add."""
+        with self._lock:
+            if question in self._question_embeddings:
+                self._question_embeddings.move_to_end(question)
+                return self._question_embeddings[question]
+
+        embedding: np.ndarray = np.asarray(embed_question(question), dtype=np.float32)
+        norm: float = float(np.linalg.norm(embedding))
+        question_embedding: List[float] = (embedding / norm if norm else embedding).tolist()
+
+        with self._lock:
+            self._question_embeddings[question] = question_embedding
+            while len(self._question_embeddings) > AnswerCacheConstants.MAX_PENDING_QUESTION_EMBEDDINGS:
+                self._question_embeddings.popitem(last=False)
+
+        return question_embedding
+
+    def _load(self):
+        """Loads the persisted cache, starting empty if it does not exist or cannot be read."""
+        try:
+            with open(self.cache_path, 'rb') as file:
+                state: Dict = pickle.load(file)
+            # Entries cached before queries could be scoped were answered over the whole library
+            entries: List[AnswerCacheEntry] = [
+                entry if 'scope' in entry.__dict__ else entry.model_copy(update={'scope': ''})
+                for _, entry in state['entries']
+            ]
+            self._entries = OrderedDict(
+                (self._entry_key(entry.question, entry.llm_model, entry.docs_version, entry.scope), entry)
+                for entry in entries
+            )
+            self.stats = state['stats']
+        except (FileNotFoundError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    @staticmethod
+    def _entry_key(question: str, llm_model: str, docs_version: str, scope: str = '') -> str:
+        """Returns the key of a cache entry."""
+        return f"{llm_model}\0{docs_version}\0{scope}\0{question}"
+
+    @staticmethod
+    def _normalise_question(question: str) -> str:
+        """Returns a question with case and whitespace differences removed, for exact matching."""
+        return ' '.join(question.lower().split())
@@ -0,0 +1,634 @@
+import os
+import sys
+import pickle
+import struct
+import threading
+import zlib
+import paperqa
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import CheckpointConstants, MappedStoreConstants
+from models.mapped_chunk_store import MappedChunkStore, MappedText
+
+# Each journal record is framed as <payload length (8 bytes)><payload CRC32 (4 bytes)><pickled payload>
+JOURNAL_RECORD_HEADER: struct.Struct = struct.Struct('<QI')
+# The lock file holds the last sequence number assigned by any process, as it outlives journal truncation
+LOCK_FILE_SEQ: struct.Struct = struct.Struct('<Q')
+
+
+class DocsCheckpointStore:
+    """
+    An append-only checkpoint store for a `paperqa.Docs` object, made up of a snapshot file and a journal file.
+
+    Rather than re-pickling the entire `paperqa.Docs` object after every embedded paper, only the newly added
+    `paperqa.Doc`, its text chunks and their embeddings are appended to the journal. The journal is periodically
+    compacted into a new snapshot, so the number of bytes written per paper no longer grows with the library size.
+
+    Attributes
+    ----------
+    snapshot_path : str
+        The path to the pickled snapshot of the `Docs` object.
+    journal_path : str
+        The path to the journal of records added since the last snapshot.
+    lock_path : str
+        The path to the lock file serialising journal appends and compactions across processes.
+    compaction_interval : int
+        The number of journal records after which the journal is compacted into a new snapshot.
+    bytes_written : int
+        The total number of bytes written to the journal and snapshots by this store.
+    vector_dtype : str, optional
+        The data type of the memory-mapped embedding matrix written with each snapshot ('float32', 'float16' or
+        'int8'), or None to pickle the text chunks and their embeddings into the snapshot itself.
+    chunk_store : MappedChunkStore, optional
+        The chunk store of the snapshot that was last read or written, if it has one.
+
+    Methods
+    -------
+    load() -> Optional[paperqa.Docs]
+        Rebuilds the `Docs` object from the snapshot and the journal.
+    append(docs: paperqa.Docs, doc: paperqa.Doc, texts: List[paperqa.Text])
+        Appends a newly embedded paper to the journal, compacting the journal if required.
+    append_removal(docs: paperqa.Docs, dockey: str)
+        Appends the removal of a paper to the journal, compacting the journal if required.
+    compact(docs: paperqa.Docs)
+        Writes a new snapshot of the `Docs` object and truncates the journal.
+    has_changed() -> bool
+        Returns whether the snapshot or journal has been changed by another process since it was last read.
+    refresh(docs: paperqa.Docs) -> int
+        Applies any papers added or removed by another process since the snapshot or journal was last read.
+    missing_records(source_docs: paperqa.Docs, docs: paperqa.Docs) -> List[dict]
+        Returns a record for every paper in one `Docs` object that is missing from another.
+    apply_records(docs: paperqa.Docs, records: List[dict])
+        Applies journal records to a `Docs` object without making any embedding API calls.
+
+    Notes
+    -----
+    A crash can never corrupt the existing state. Snapshots are written to a temporary file and atomically moved
+    over the previous snapshot, and a record torn by a crash mid-append fails its length or CRC32 check, so it is
+    discarded when the journal is next read. Every record carries a sequence number, and the snapshot stores the
+    sequence number of the last record it contains, so records are never applied twice.
+
+    Unless `vector_dtype` is None, the text and embedding of every chunk are written to a `MappedChunkStore` next to
+    the snapshot, and the snapshot only refers to them by row. Loading the snapshot then memory-maps the chunk store
+    rather than unpickling every chunk's text and vector into Python objects. Journal records always hold the full
+    chunks, until they are compacted.
+
+    Several processes (e.g. the GUI worker, the CLI and sharded embedding processes) may write to the same store.
+    Appends and compactions hold an exclusive OS-level lock on `lock_path`, and each new record takes the next
+    sequence number after every record in the journal, so sequence numbers stay unique and increase in file order.
+    A compaction first applies the records other processes have appended, so that the new snapshot keeps them.
+
+    Snapshots written by earlier versions of this program (a plain pickled `Docs` object, or a snapshot without a
+    chunk store) are still readable.
+    """
+    def __init__(self, pkl_file_path: str, compaction_interval: int = CheckpointConstants.COMPACTION_INTERVAL,
+                 vector_dtype: Optional[str] = MappedStoreConstants.VECTOR_DTYPE):
+        self.snapshot_path: str = pkl_file_path
+        self.journal_path: str = f"{pkl_file_path}{CheckpointConstants.JOURNAL_FILE_SUFFIX}"
+        self.lock_path: str = f"{pkl_file_path}{CheckpointConstants.LOCK_FILE_SUFFIX}"
+        self.compaction_interval: int = compaction_interval
+        self.bytes_written: int = 0
+        self.vector_dtype: Optional[str] = vector_dtype
+        self.chunk_store: Optional[MappedChunkStore] = None
+        self._last_seq: int = 0
+        self._num_journal_records: int = 0
+        self._loaded: bool = False
+        self._snapshot_version: Optional[Tuple[int, int]] = None
+        self._journal_offset: int = 0
+        self._thread_lock: threading.RLock = threading.RLock()
+        self._lock_fd: Optional[int] = None
+        self._lock_depth: int = 0
+        # The papers known to be in the snapshot and journal, as `docs` may also hold papers never checkpointed
+        self._dockeys: Set[str] = set()
+
+    @property
+    def num_journal_records(self) -> int:
+        """The number of records appended to the journal since the last snapshot."""
+        return self._num_journal_records
+
+    def load(self) -> Optional[paperqa.Docs]:
+        """
+        Rebuilds the `Docs` object from the snapshot and any journal records written after it.
+
+        Returns
+        -------
+        Optional[paperqa.Docs]
+            The rebuilt `Docs` object, or None if no snapshot exists.
+
+        Notes
+        -----
+        Any torn record at the end of the journal (e.g. from a crash mid-write) is truncated away.
+        """
+        self._loaded = True
+        self._snapshot_version = self._file_version(self.snapshot_path)
+        snapshot: Optional[Tuple[paperqa.Docs, int]] = self._read_snapshot()
+        if snapshot is None:
+            self._last_seq = 0
+            self._num_journal_records = 0
+            self._journal_offset = 0
+            self._dockeys = set()
+            return None
+
+        docs, snapshot_seq = snapshot
+        with self._locked():
+            journal_records, self._journal_offset = self._read_journal()
+        records: List[dict] = [record for record in journal_records if record['seq'] > snapshot_seq]
+        self.apply_records(docs, records)
+
+        self._last_seq = records[-1]['seq'] if records else snapshot_seq
+        self._num_journal_records = len(records)
+        self._dockeys = set(docs.docs)
+
+        return docs
+
+    def append(self, docs: paperqa.Docs, doc: paperqa.Doc, texts: List[paperqa.Text]):
+        """
+        Appends a newly embedded paper to the journal.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object the paper has already been added to.
+        doc : paperqa.Doc
+            The newly added document.
+        texts : List[paperqa.Text]
+            The text chunks (including their embeddings) of the newly added document.
+
+        Raises
+        ------
+        RuntimeError
+            If `load()` has not been called first, as the journal sequence numbers would be unknown.
+
+        Notes
+        -----
+        If no snapshot exists yet, a snapshot is written instead so that the journal always has a base to be
+        replayed onto. Once `compaction_interval` records have accumulated the journal is compacted.
+        """
+        if not self._loaded:
+            raise RuntimeError("`DocsCheckpointStore.load()` must be called before appending to the journal")
+
+        with self._locked():
+            if not os.path.exists(self.snapshot_path):
+                self.compact(docs)
+                return
+
+            self._append_record({'op': 'add', 'doc': doc, 'texts': texts})
+            self._dockeys.add(doc.dockey)
+
+            if self._num_journal_records >= self.compaction_interval:
+                self.compact(docs)
+
+    def append_removal(self, docs: paperqa.Docs, dockey: str):
+        """
+        Appends the removal of a paper to the journal.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object the paper has already been removed from.
+        dockey : str
+            The document key of the removed paper.
+
+        Raises
+        ------
+        RuntimeError
+            If `load()` has not been called first, as the journal sequence numbers would be unknown.
+        """
+        if not self._loaded:
+            raise RuntimeError("`DocsCheckpointStore.load()` must be called before appending to the journal")
+
+        with self._locked():
+            if not os.path.exists(self.snapshot_path):
+                self.compact(docs)
+                return
+
+            self._append_record({'op': 'delete', 'dockey': dockey})
+            self._dockeys.discard(dockey)
+
+            if self._num_journal_records >= self.compaction_interval:
+                self.compact(docs)
+
+    def compact(self, docs: paperqa.Docs):
+        """
+        Writes a new snapshot of the `Docs` object and truncates the journal.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object to snapshot. It must contain every record appended to the journal.
+
+        Notes
+        -----
+        With a `vector_dtype`, the chunk store is written first, in the order of the texts in the `Docs` object's
+        text index (followed by any texts missing from it), so that the store's rows line up with the index. The
+        chunk stores of previous snapshots are deleted once the new snapshot is in place. A `Docs` object without
+        texts, or with texts that have not been embedded, is pickled whole.
+
+        Papers checkpointed or removed by other processes since the store was last read are applied to `docs` first,
+        so that the new snapshot keeps their changes. Papers in `docs` that were never checkpointed (e.g. merged
+        from a shard) are kept.
+        """
+        with self._locked():
+            self._apply_changes(docs)
+            self._write_snapshot(docs)
+
+    def _write_snapshot(self, docs: paperqa.Docs):
+        """Writes a new snapshot of the `Docs` object and truncates the journal, with the store lock held."""
+        chunk_store: Optional[MappedChunkStore] = None
+        texts: List[paperqa.Text] = []
+        if self.vector_dtype is not None:
+            texts = list(docs.texts_index.texts)
+            indexed_ids: Set[int] = {id(text) for text in texts}
+            texts += [text for text in docs.texts if id(text) not in indexed_ids]
+        if texts and all(isinstance(text, MappedText) or text.embedding is not None for text in texts):
+            chunk_store = MappedChunkStore.write(MappedChunkStore.new_base_path(self.snapshot_path), texts,
+                                                 self.vector_dtype)
+            self.bytes_written += sum(
+                os.path.getsize(path) for path in chunk_store.base_path.parent.glob(f"{chunk_store.base_path.name}.*")
+            )
+
+        snapshot_temp_path: str = f"{self.snapshot_path}{CheckpointConstants.SNAPSHOT_TEMP_FILE_SUFFIX}"
+        with open(snapshot_temp_path, 'wb') as file:
+            snapshot: dict = {'seq': self._last_seq, 'docs': docs}
+            if chunk_store is not None:
+                snapshot['chunk_store'] = chunk_store
+                chunk_store.dump_snapshot(snapshot, file, texts)
+            else:
+                pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+            self.bytes_written += file.tell()
+        os.replace(snapshot_temp_path, self.snapshot_path)
+        self._snapshot_version = self._file_version(self.snapshot_path)
+        self.chunk_store = chunk_store
+        MappedChunkStore.delete_generations(self.snapshot_path, keep=chunk_store)
+
+        # The new snapshot supersedes every journal record, so a crash before truncation is harmless
+        with open(self.journal_path, 'wb'):
+            pass
+        self._num_journal_records = 0
+        self._journal_offset = 0
+        self._dockeys = set(docs.docs)
+
+    def has_changed(self) -> bool:
+        """
+        Returns whether the snapshot or journal has been changed by another process since it was last read.
+
+        Returns
+        -------
+        bool
+            True if another process has compacted the journal or appended records to it.
+
+        Notes
+        -----
+        Only the files' modification times and sizes are checked, so this is cheap enough to call before every
+        query.
+        """
+        journal_version: Optional[Tuple[int, int]] = self._file_version(self.journal_path)
+        journal_size: int = journal_version[1] if journal_version is not None else 0
+
+        return self._file_version(self.snapshot_path) != self._snapshot_version or journal_size != self._journal_offset
+
+    def refresh(self, docs: paperqa.Docs) -> int:
+        """
+        Applies any papers checkpointed by another process since the snapshot or journal was last read.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object previously returned by `load()`.
+
+        Returns
+        -------
+        int
+            The number of papers added or removed.
+
+        Notes
+        -----
+        If only the journal has grown, just the new records at its end are read. If another process has compacted
+        the journal into a new snapshot, the snapshot is read, but only the papers missing from `docs` are added to
+        it, and the checkpointed papers missing from the snapshot (e.g. deleted by a sync, or replaced by a
+        re-embedded version) are removed from it, so its vector indexes are updated rather than rebuilt. A record
+        that is still being written by another process cannot be seen, as appends hold the store lock.
+        """
+        if not self._loaded:
+            raise RuntimeError("`DocsCheckpointStore.load()` must be called before refreshing")
+
+        dockeys: Set[str] = set(docs.docs)
+        with self._locked():
+            self._apply_changes(docs)
+
+        return len(dockeys.symmetric_difference(docs.docs))
+
+    def _apply_changes(self, docs: paperqa.Docs):
+        """
+        Applies the snapshot and journal records written by other processes since they were last read.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object to apply the changes to.
+
+        Notes
+        -----
+        Of the papers missing from a snapshot written by another process, only those that had been checkpointed are
+        removed from `docs`.
+
+        Records this store appended after records of other processes it had not yet read are read back here too.
+        Applying them again is harmless, as adding a paper that is present or removing one that is absent is a no-op.
+        """
+        records: List[dict] = []
+        snapshot_version: Optional[Tuple[int, int]] = self._file_version(self.snapshot_path)
+        if snapshot_version != self._snapshot_version:
+            self._snapshot_version = snapshot_version
+            snapshot: Optional[Tuple[paperqa.Docs, int]] = self._read_snapshot()
+            if snapshot is not None:
+                snapshot_docs, self._last_seq = snapshot
+                records = [
+                    {'op': 'delete', 'dockey': dockey} for dockey in docs.docs
+                    if dockey in self._dockeys and dockey not in snapshot_docs.docs
+                ] + self.missing_records(snapshot_docs, docs)
+                self._dockeys = set(snapshot_docs.docs)
+            self._journal_offset = 0
+
+        journal_records, self._journal_offset = self._read_journal(self._journal_offset, truncate=False)
+        journal_records = [record for record in journal_records if record['seq'] > self._last_seq]
+        if journal_records:
+            self._last_seq = journal_records[-1]['seq']
+        for record in journal_records:
+            if record['op'] == 'delete':
+                self._dockeys.discard(record['dockey'])
+            else:
+                self._dockeys.add(record['doc'].dockey)
+        self.apply_records(docs, records + journal_records)
+
+    @staticmethod
+    def missing_records(source_docs: paperqa.Docs, docs: paperqa.Docs) -> List[dict]:
+        """
+        Returns a record for every paper in one `Docs` object that is missing from another.
+
+        Parameters
+        ----------
+        source_docs : paperqa.Docs
+            The `Docs` object to take the papers from.
+        docs : paperqa.Docs
+            The `Docs` object the records will be applied to.
+
+        Returns
+        -------
+        List[dict]
+            An 'add' record for each missing paper, which can be passed to `apply_records()`.
+        """
+        texts_by_dockey: Dict[str, List[paperqa.Text]] = defaultdict(list)
+        for text in source_docs.texts:
+            if text.doc.dockey not in docs.docs:
+                texts_by_dockey[text.doc.dockey].append(text)
+
+        return [
+            {'op': 'add', 'doc': doc, 'texts': texts_by_dockey[dockey]}
+            for dockey, doc in source_docs.docs.items() if dockey not in docs.docs
+        ]
+
+    @staticmethod
+    def apply_records(docs: paperqa.Docs, records: List[dict]):
+        """
+        Applies journal records to a `Docs` object without making any embedding API calls.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object to apply the records to.
+        records : List[dict]
+            The journal records to apply, in the order in which they were written. An 'add' record adds a paper,
+            and a 'delete' record removes the paper with the record's `dockey`.
+
+        Notes
+        -----
+        The vector indexes are updated once for all records rather than once per record, as
+        `NumpyVectorStore.add_texts_and_embeddings()` rebuilds its whole embedding matrix on every call.
+
+        Every container of the `Docs` object is modified in place, so views sharing them with the `Docs` object (see
+        `EmbeddingStore`) see the changes.
+        """
+        new_docs: List[paperqa.Doc] = []
+        new_texts: List[paperqa.Text] = []
+        removed_ids: Set[int] = set()
+        for record in records:
+            if record['op'] == 'delete':
+                removed_doc: Optional[paperqa.Doc] = docs.docs.pop(record['dockey'], None)
+                if removed_doc is None:
+                    continue
+                docs.docnames.discard(removed_doc.docname)
+                removed_ids.add(id(removed_doc))
+                removed_ids.update(id(text) for text in docs.texts if text.doc.dockey == record['dockey'])
+                docs.texts[:] = [text for text in docs.texts if text.doc.dockey != record['dockey']]
+                new_docs = [doc for doc in new_docs if doc.dockey != record['dockey']]
+                new_texts = [text for text in new_texts if text.doc.dockey != record['dockey']]
+                continue
+
+            doc: paperqa.Doc = record['doc']
+            if record['op'] != 'add' or doc.dockey in docs.docs:
+                continue
+            docs.docs[doc.dockey] = doc
+            docs.docnames.add(doc.docname)
+            docs.texts += record['texts']
+            new_docs.append(doc)
+            new_texts += record['texts']
+
+        if removed_ids:
+            for vector_store in (docs.texts_index, docs.docs_index):
+                DocsCheckpointStore._remove_from_vector_store(vector_store, removed_ids)
+        if new_texts and not docs.jit_texts_index:
+            docs.texts_index.add_texts_and_embeddings(new_texts)
+        if new_docs:
+            docs.docs_index.add_texts_and_embeddings(new_docs)
+
+    @staticmethod
+    def _remove_from_vector_store(vector_store, removed_ids: Set[int]):
+        """Removes the given objects (by identity) from a vector store, keeping its index consistent."""
+        if hasattr(vector_store, 'remove_texts'):
+            vector_store.remove_texts(removed_ids)
+            return
+
+        kept_texts: List = [text for text in vector_store.texts if id(text) not in removed_ids]
+        if len(kept_texts) < len(vector_store.texts):
+            vector_store.clear()
+            if kept_texts:
+                vector_store.add_texts_and_embeddings(kept_texts)
+
+    def _read_snapshot(self) -> Optional[Tuple[paperqa.Docs, int]]:
+        """
+        Reads the snapshot file.
+
+        Returns
+        -------
+        Optional[Tuple[paperqa.Docs, int]]
+            The snapshot `Docs` object and the sequence number of the last journal record it contains, or None if
+            no snapshot exists.
+        """
+        try:
+            with open(self.snapshot_path, 'rb') as file:
+                snapshot = MappedChunkStore.load_snapshot(file, os.path.dirname(os.path.abspath(self.snapshot_path)))
+        except FileNotFoundError:
+            return None
+
+        if isinstance(snapshot, paperqa.Docs):
+            self.chunk_store = None
+            return snapshot, 0
+
+        self.chunk_store = snapshot.get('chunk_store')
+        return snapshot['docs'], snapshot['seq']
+
+    def _read_journal(self, start_offset: int = 0, truncate: bool = True) -> Tuple[List[dict], int]:
+        """
+        Reads every intact record from the journal, truncating any torn record at the end of the file.
+
+        Parameters
+        ----------
+        start_offset : int, optional
+            The byte offset of the first record to read.
+        truncate : bool, optional
+            Whether to truncate a torn record at the end of the journal. Readers that do not own the journal must
+            not truncate it, as the record may still be being written.
+
+        Returns
+        -------
+        Tuple[List[dict], int]
+            The journal records, in the order in which they were written, and the byte offset just after the last
+            intact record.
+        """
+        records: List[dict] = []
+        try:
+            with open(self.journal_path, 'rb') as file:
+                file.seek(start_offset)
+                journal: bytes = file.read()
+        except FileNotFoundError:
+            return records, 0
+
+        offset: int = 0
+        while offset + JOURNAL_RECORD_HEADER.size <= len(journal):
+            length, checksum = JOURNAL_RECORD_HEADER.unpack_from(journal, offset)
+            payload_start: int = offset + JOURNAL_RECORD_HEADER.size
+            payload: bytes = journal[payload_start:payload_start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append(pickle.loads(payload))
+            offset = payload_start + length
+
+        if truncate and offset < len(journal):
+            with open(self.journal_path, 'r+b') as file:
+                file.truncate(start_offset + offset)
+
+        return records, start_offset + offset
+
+    def _append_record(self, record: dict):
+        """
+        Appends a single framed record to the journal and flushes it to disk.
+
+        Parameters
+        ----------
+        record : dict
+            The record to append. A sequence number is assigned to it.
+
+        Notes
+        -----
+        Must be called with the store lock held. If other processes have written to the store since it was last
+        read, the records at the end of the journal are read to take the next sequence number, but not applied, so
+        the store's offset and sequence number stay put and the next refresh or compaction applies them.
+        """
+        journal_version: Optional[Tuple[int, int]] = self._file_version(self.journal_path)
+        journal_size: int = journal_version[1] if journal_version is not None else 0
+        is_compacted: bool = self._file_version(self.snapshot_path) != self._snapshot_version
+        is_stale: bool = is_compacted or journal_size != self._journal_offset
+
+        seqs: List[int] = [self._last_seq, self._read_lock_seq()]
+        if is_stale:
+            # With the lock held no record is being written, so a torn record can only be left by a crash
+            tail_offset: int = 0 if is_compacted or journal_size < self._journal_offset else self._journal_offset
+            seqs += [tail_record['seq'] for tail_record in self._read_journal(tail_offset)[0]]
+        record['seq'] = max(seqs) + 1
+
+        payload: bytes = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        frame: bytes = JOURNAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with open(self.journal_path, 'ab') as file:
+            file.write(frame)
+            file.flush()
+            os.fsync(file.fileno())
+        self._write_lock_seq(record['seq'])
+        self._num_journal_records += 1
+        self.bytes_written += len(frame)
+        if not is_stale:
+            self._last_seq = record['seq']
+            self._journal_offset += len(frame)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Holds an exclusive lock on the store across threads and processes. The lock is re-entrant.
+
+        Notes
+        -----
+        `fcntl.flock` is used where available, and `msvcrt.locking` on Windows. If neither is available only
+        threads of this process are excluded.
+        """
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                    elif msvcrt is not None:
+                        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+                        msvcrt.locking(self._lock_fd, msvcrt.LK_LOCK, 1)
+                except BaseException:
+                    os.close(self._lock_fd)
+                    self._lock_fd = None
+                    raise
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    elif msvcrt is not None:
+                        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+                        msvcrt.locking(self._lock_fd, msvcrt.LK_UNLCK, 1)
+                    os.close(self._lock_fd)
+                    self._lock_fd = None
+
+    def _read_lock_seq(self) -> int:
+        """Returns the last sequence number recorded in the lock file, with the store lock held."""
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        data: bytes = os.read(self._lock_fd, LOCK_FILE_SEQ.size)
+
+        return LOCK_FILE_SEQ.unpack(data)[0] if len(data) == LOCK_FILE_SEQ.size else 0
+
+    def _write_lock_seq(self, seq: int):
+        """Records the last sequence number in the lock file, with the store lock held."""
+        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+        os.write(self._lock_fd, LOCK_FILE_SEQ.pack(seq))
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[Tuple[int, int]]:
+        """Returns the modification time and size of a file, or None if it does not exist."""
+        try:
+            stat: os.stat_result = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,427 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import hashlib
+import numpy as np
+import paperqa
+from contextlib import nullcontext
+from paperqa.llms import EmbeddingModes, get_score
+from paperqa.types import LLMResult
+from paperqa.utils import get_loop
+from pydantic import BaseModel
+from typing import Callable, ContextManager, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import BatchQueryConstants
+from models.ann_vector_store import AnnVectorStore
+from models.answer_cache import AnswerCache
+from models.evidence_cache import CachedSummaryLLMModel, EvidenceCache
+from models.partition_index import PartitionScope
+from models.telemetry import Telemetry
+from models.zotero_paper_embedder import ZoteroPaperEmbedder
+
+
+class QueryEvent(BaseModel):
+    """
+    A step of a query, reported as soon as it happens so that a GUI can show the query's progress.
+
+    Attributes
+    ----------
+    kind : str
+        'retrieved' when a text chunk has been retrieved and is about to be summarised, 'evidence' once its summary
+        has been scored, and 'token' for each chunk of the answer streamed by the LLM.
+    name : str, optional
+        The name of the text chunk, e.g. `Smith2020 pages 3-4`, for 'retrieved' and 'evidence' events.
+    text : str
+        The summary of the text chunk for 'evidence' events, or the answer chunk for 'token' events.
+    score : int, optional
+        The relevance score of the summary, from 0 to 10, for 'evidence' events.
+    """
+    kind: str
+    name: Optional[str] = None
+    text: str = ''
+    score: Optional[int] = None
+
+
+class DocsSession:
+    """
+    A long-lived session that keeps the `paperqa.Docs` object of each LLM in memory between queries.
+
+    Rather than loading the `Docs` object, resetting its prompts and setting up its client for every query, each
+    LLM's `Docs` object is created once and reused. Before it is handed out, the embedding store's snapshot and journal
+    are checked for changes (by modification time and size), and only the papers checkpointed since they were last
+    read are added.
+
+    Attributes
+    ----------
+    zotero_paper_embedder : ZoteroPaperEmbedder
+        The embedder whose embedding store backs every `Docs` object.
+    docs_by_llm : Dict[str, paperqa.Docs]
+        The `Docs` object of each LLM used so far in the session.
+    answer_cache : AnswerCache
+        The persistent semantic cache of answers to previous queries.
+    evidence_cache : EvidenceCache
+        The persistent cache of evidence summaries, shared by the questions of batch queries.
+
+    Methods
+    -------
+    get_docs(llm_model: str) -> paperqa.Docs
+        Returns the up-to-date `Docs` object for a given LLM.
+    query(llm_model: str, question: str, on_event: Optional[Callable[[QueryEvent], None]] = None,
+          scope: Optional[PartitionScope] = None) -> paperqa.Answer
+        Answers a question, from the answer cache if a sufficiently similar question has already been answered,
+        optionally streaming the retrieved evidence and the answer as they are generated.
+    query_batch(llm_model: str, questions: Sequence[str],
+                on_answer: Optional[Callable[[int, str, paperqa.Answer, bool], None]] = None,
+                max_concurrency: int = BatchQueryConstants.MAX_CONCURRENCY,
+                scope: Optional[PartitionScope] = None) -> List[paperqa.Answer]
+        Answers many questions concurrently, sharing their retrieval and evidence summaries.
+    """
+    def __init__(self, zotero_paper_embedder: ZoteroPaperEmbedder, answer_cache: Optional[AnswerCache] = None,
+                 evidence_cache: Optional[EvidenceCache] = None):
+        self.zotero_paper_embedder: ZoteroPaperEmbedder = zotero_paper_embedder
+        self.docs_by_llm: Dict[str, paperqa.Docs] = {}
+        self.answer_cache: AnswerCache = answer_cache if answer_cache is not None else AnswerCache()
+        self.evidence_cache: EvidenceCache = evidence_cache if evidence_cache is not None else EvidenceCache()
+
+    def get_docs(self, llm_model: str) -> paperqa.Docs:
+        """
+        Returns the `Docs` object for a given LLM, applying any papers embedded or removed by another process since it
+        was last used.
+
+        Parameters
+        ----------
+        llm_model : str
+            The language model to be used for the Docs object.
+
+        Returns
+        -------
+        paperqa.Docs
+            The up-to-date Docs object.
+
+        Raises
+        ------
+        ValueError
+            If `llm_model` is not a valid LLM model.
+        """
+        embedding_store = self.zotero_paper_embedder.embedding_store
+        if embedding_store.docs is not None and embedding_store.has_changed():
+            num_changed_docs: int = embedding_store.refresh()
+            self.zotero_paper_embedder.console_output(f"Loaded {num_changed_docs} newly embedded or removed papers")
+
+        if llm_model not in self.docs_by_llm:
+            docs: paperqa.Docs = self.zotero_paper_embedder.load_paperqa_doc(llm_model=llm_model)
+            if self.zotero_paper_embedder.telemetry.enabled:
+                docs.llm_result_callback = self._record_llm_result
+            self.docs_by_llm[llm_model] = docs
+
+        return self.docs_by_llm[llm_model]
+
+    def query(self, llm_model: str, question: str, on_event: Optional[Callable[[QueryEvent], None]] = None,
+              scope: Optional[PartitionScope] = None) -> paperqa.Answer:
+        """
+        Answers a question, from the answer cache if the same LLM has already answered a sufficiently similar
+        question over the same set of papers.
+
+        Parameters
+        ----------
+        llm_model : str
+            The language model used to answer the question.
+        question : str
+            The question.
+        on_event : Callable[[QueryEvent], None], optional
+            Called, on the thread running the query, with every text chunk as it is retrieved, with its summary once
+            it has been scored, and with every chunk of the answer as the LLM streams it. Not called for a cache hit.
+        scope : PartitionScope, optional
+            The Zotero collections and tags the question is limited to. Defaults to the whole library.
+
+        Returns
+        -------
+        paperqa.Answer
+            The answer.
+
+        Raises
+        ------
+        ValueError
+            If `llm_model` is not a valid LLM model, or if no embedded paper is in the scope.
+
+        Notes
+        -----
+        A cache hit makes no LLM calls, and at most one embedding call. Cached answers are invalidated automatically
+        once papers have been added to the `Docs` object.
+
+        With `on_event`, the answer is requested from the LLM as a stream, so the answer starts to appear as soon as
+        its first token arrives rather than once it is complete. The evidence summaries are not streamed, as each is
+        only useful once it has been scored.
+
+        With a `scope`, only the text chunks of the papers in the scope's collections or with its tags are scored
+        during retrieval. Papers are mapped to their partitions by the embedder's `PartitionIndex`, which is reloaded
+        first if another process has updated it.
+
+        If telemetry is enabled, the query is recorded as a span, with child spans for the cache lookup, the retrieval
+        and every LLM call, and the metrics snapshot is rewritten. A streamed query also records the time to the first
+        token of its answer.
+        """
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        with telemetry.span('query', llm_model=llm_model, scope=scope.describe() if scope is not None else '') as span:
+            answer: paperqa.Answer = self._query(llm_model, question, span, on_event, scope)
+        telemetry.write_metrics()
+
+        return answer
+
+    def query_batch(self, llm_model: str, questions: Sequence[str],
+                    on_answer: Optional[Callable[[int, str, paperqa.Answer, bool], None]] = None,
+                    max_concurrency: int = BatchQueryConstants.MAX_CONCURRENCY,
+                    scope: Optional[PartitionScope] = None) -> List[paperqa.Answer]:
+        """
+        Answers many questions concurrently, sharing their retrieval and evidence summaries.
+
+        Parameters
+        ----------
+        llm_model : str
+            The language model used to answer the questions.
+        questions : Sequence[str]
+            The questions. Repeated questions are only answered once.
+        on_answer : Callable[[int, str, paperqa.Answer, bool], None], optional
+            Called with the index of each question, the question, its answer and whether the answer came from the
+            answer cache, as soon as the answer is ready, so answers are reported in the order they complete.
+        max_concurrency : int
+            The maximum number of questions answered at once, which is also the maximum number of evidence summaries
+            written at once across all of them.
+        scope : PartitionScope, optional
+            The Zotero collections and tags every question is limited to. Defaults to the whole library.
+
+        Returns
+        -------
+        List[paperqa.Answer]
+            The answer to each question, in the order of the questions.
+
+        Raises
+        ------
+        ValueError
+            If `llm_model` is not a valid LLM model, or if no embedded paper is in the scope.
+        Exception
+            The first error raised while answering a question, once every other question has been answered.
+
+        Notes
+        -----
+        Every question is embedded in a single embedding request, and the embeddings are reused for the answer cache
+        lookups and for the retrieval of each question's text chunks. Evidence summaries are reused from the evidence
+        cache when the same chunk has been summarised for a sufficiently similar question, by this batch or an earlier
+        one, and a summary being written for one question is awaited by the others rather than requested again.
+        """
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        with telemetry.span('query.batch', llm_model=llm_model, num_questions=len(questions),
+                            scope=scope.describe() if scope is not None else ''):
+            answers: List[paperqa.Answer] = get_loop().run_until_complete(
+                self._aquery_batch(llm_model, questions, on_answer, max_concurrency, scope)
+            )
+        telemetry.write_metrics()
+
+        return answers
+
+    async def _aquery_batch(self, llm_model: str, questions: Sequence[str],
+                            on_answer: Optional[Callable[[int, str, paperqa.Answer, bool], None]],
+                            max_concurrency: int, scope: Optional[PartitionScope] = None) -> List[paperqa.Answer]:
+        """Answers a batch of questions concurrently on the running event loop."""
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        docs: paperqa.Docs = self.get_docs(llm_model)
+        docs_version: str = AnswerCache.docs_version(docs)
+        scope_dockeys, scope_key = self._resolve_scope(docs, scope)
+        unique_questions: List[str] = list(dict.fromkeys(questions))
+        if not unique_questions:
+            return []
+
+        embedding_model = docs.texts_index.embedding_model
+        embedding_model.set_mode(EmbeddingModes.QUERY)
+        try:
+            with telemetry.span('query.embed', model=embedding_model.name, num_questions=len(unique_questions)):
+                embeddings: List[List[float]] = await embedding_model.embed_documents(
+                    docs._embedding_client, unique_questions
+                )
+        finally:
+            embedding_model.set_mode(EmbeddingModes.DOCUMENT)
+
+        question_embeddings: Dict[str, List[float]] = dict(zip(unique_questions, embeddings))
+        for index in (docs.texts_index, docs.docs_index):
+            if isinstance(index, AnnVectorStore):
+                index.remember_query_embeddings(question_embeddings)
+        normalised_embeddings: Dict[str, List[float]] = {}
+        for question, embedding in question_embeddings.items():
+            vector: np.ndarray = np.asarray(embedding, dtype=np.float32)
+            norm: float = float(np.linalg.norm(vector))
+            normalised_embeddings[question] = (vector / norm if norm else vector).tolist()
+
+        indices_by_question: Dict[str, List[int]] = {question: [] for question in unique_questions}
+        for index, question in enumerate(questions):
+            indices_by_question[question].append(index)
+        answers: List[Optional[paperqa.Answer]] = [None] * len(questions)
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer_question(question: str) -> Tuple[paperqa.Answer, bool]:
+            async with semaphore:
+                with telemetry.span('query', llm_model=llm_model) as span:
+                    answer: Optional[paperqa.Answer] = self.answer_cache.lookup(
+                        question, docs.llm, docs_version, lambda _: question_embeddings[question], scope_key
+                    )
+                    telemetry.increment('cache_hits' if answer is not None else 'cache_misses', cache='answer')
+                    span.set(cache_hit=answer is not None)
+                    cached: bool = answer is not None
+                    if answer is None:
+                        answer = await docs.aquery(question)
+                        self.answer_cache.add(
+                            question, docs.llm, docs_version, lambda _: question_embeddings[question], answer,
+                            scope_key
+                        )
+                        span.set(num_contexts=len(answer.contexts))
+
+            for position, index in enumerate(indices_by_question[question]):
+                answers[index] = answer if position == 0 else answer.model_copy(deep=True)
+                if on_answer is not None:
+                    on_answer(index, question, answers[index], cached)
+
+            return answer, cached
+
+        summary_llm_model = docs.summary_llm_model
+        docs.summary_llm_model = CachedSummaryLLMModel(
+            name=summary_llm_model.name,
+            llm_type=summary_llm_model.llm_type,
+            summary_llm_model=summary_llm_model,
+            evidence_cache=self.evidence_cache,
+            question_embeddings=normalised_embeddings,
+            # Questions hold their own semaphore while their summaries are written, so summaries need another
+            semaphore=asyncio.Semaphore(max_concurrency)
+        )
+        try:
+            with self._search_scope(scope_dockeys):
+                results: List = await asyncio.gather(
+                    *[answer_question(question) for question in unique_questions], return_exceptions=True
+                )
+        finally:
+            docs.summary_llm_model = summary_llm_model
+            self.evidence_cache.save()
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return answers
+
+    def _query(self, llm_model: str, question: str, span,
+               on_event: Optional[Callable[[QueryEvent], None]] = None,
+               scope: Optional[PartitionScope] = None) -> paperqa.Answer:
+        """Answers a question, from the answer cache if possible, recording whether it was a cache hit in a span."""
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        docs: paperqa.Docs = self.get_docs(llm_model)
+        docs_version: str = AnswerCache.docs_version(docs)
+        scope_dockeys, scope_key = self._resolve_scope(docs, scope)
+
+        def embed_question(text: str) -> List[float]:
+            embedding_model = docs.texts_index.embedding_model
+            embedding_model.set_mode(EmbeddingModes.QUERY)
+            try:
+                return get_loop().run_until_complete(
+                    embedding_model.embed_documents(docs._embedding_client, [text])
+                )[0]
+            finally:
+                embedding_model.set_mode(EmbeddingModes.DOCUMENT)
+
+        with telemetry.span('query.answer_cache'):
+            answer: Optional[paperqa.Answer] = self.answer_cache.lookup(
+                question, docs.llm, docs_version, embed_question, scope_key
+            )
+        telemetry.increment('cache_hits' if answer is not None else 'cache_misses', cache='answer')
+        span.set(cache_hit=answer is not None)
+        if answer is None:
+            with self._search_scope(scope_dockeys):
+                answer = self._answer(docs, question, span, on_event) if on_event is not None else docs.query(question)
+            self.answer_cache.add(question, docs.llm, docs_version, embed_question, answer, scope_key)
+            span.set(num_contexts=len(answer.contexts))
+
+        return answer
+
+    def _resolve_scope(self, docs: paperqa.Docs,
+                       scope: Optional[PartitionScope]) -> Tuple[Optional[FrozenSet[str]], str]:
+        """
+        Returns the keys of the embedded papers in a scope, or None for the whole library, and the answer cache key
+        of the scope, which changes whenever a paper is moved into or out of it.
+        """
+        if scope is None or scope.is_empty():
+            return None, ''
+
+        partition_index = self.zotero_paper_embedder.partition_index
+        partition_index.refresh()
+        docnames = partition_index.docnames(scope)
+        dockeys: FrozenSet[str] = frozenset(dockey for dockey, doc in docs.docs.items() if doc.docname in docnames)
+        if not dockeys:
+            raise ValueError(f"No embedded papers are in {scope.describe()}")
+
+        digest = hashlib.sha256()
+        for dockey in sorted(str(dockey) for dockey in dockeys):
+            digest.update(dockey.encode('utf-8'))
+            digest.update(b'\0')
+
+        return dockeys, f"{scope.describe()}\0{digest.hexdigest()}"
+
+    @staticmethod
+    def _search_scope(dockeys: Optional[FrozenSet[str]]) -> ContextManager:
+        """Returns a context limiting the searches of the `Docs` objects to the given papers, if any."""
+        return AnnVectorStore.search_scope(dockeys) if dockeys is not None else nullcontext()
+
+    def _answer(self, docs: paperqa.Docs, question: str, span,
+                on_event: Callable[[QueryEvent], None]) -> paperqa.Answer:
+        """
+        Answers a question with `paperqa`, reporting each retrieved chunk, scored summary and answer token to
+        `on_event`.
+
+        `paperqa` asks its callback factory for the callbacks of every evidence chunk as it starts summarising it,
+        which reports the chunk as retrieved, and passes every completed LLM call to the `Docs` object's result
+        callback, which reports the scored summaries. Only the answer is given a streaming callback.
+        """
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        start: float = time.perf_counter()
+        first_token_seconds: List[float] = []
+        previous_llm_result_callback = docs.llm_result_callback
+
+        def on_token(token: str):
+            if not first_token_seconds:
+                first_token_seconds.append(time.perf_counter() - start)
+                telemetry.observe('query.first_token', first_token_seconds[0], model=docs.llm)
+                span.set(seconds_to_first_token=round(first_token_seconds[0], 3))
+            on_event(QueryEvent(kind='token', text=token))
+
+        def get_callbacks(name: str) -> Optional[List[Callable[[str], None]]]:
+            if name.startswith('evidence:'):
+                on_event(QueryEvent(kind='retrieved', name=name[len('evidence:'):]))
+            elif name == 'answer':
+                return [on_token]
+            return None
+
+        async def on_llm_result(result: LLMResult):
+            await previous_llm_result_callback(result)
+            if (result.name or '').startswith('evidence:'):
+                # The summary prompt asks for the relevance score on the last line, which is not shown
+                lines: List[str] = result.text.strip().split('\n')
+                if len(lines) > 1 and re.search(r'\d', lines[-1]):
+                    lines = lines[:-1]
+                summary: str = '\n'.join(lines).strip()
+                on_event(QueryEvent(kind='evidence', name=result.name[len('evidence:'):], text=summary,
+                                    score=get_score(result.text)))
+
+        docs.llm_result_callback = on_llm_result
+        try:
+            return docs.query(question, get_callbacks=get_callbacks)
+        finally:
+            docs.llm_result_callback = previous_llm_result_callback
+
+    async def _record_llm_result(self, result: LLMResult):
+        """Records an LLM call made while answering a question as a telemetry span, with its token counts."""
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        call: str = (result.name or 'llm').split(':')[0]
+        telemetry.observe(f"llm.{call}", result.seconds_to_last_token, model=result.model,
+                          tokens_in=result.prompt_count, tokens_out=result.completion_count)
+        telemetry.increment('llm_tokens', result.prompt_count, model=result.model, direction='in')
+        telemetry.increment('llm_tokens', result.completion_count, model=result.model, direction='out')
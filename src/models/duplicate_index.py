@@ -0,0 +1,420 @@
+import os
+import re
+import sys
+import json
+import zlib
+import threading
+import numpy as np
+from collections import defaultdict
+from pathlib import Path
+from pydantic import BaseModel
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import DuplicateConstants
+
+if TYPE_CHECKING:
+    import paperqa
+
+
+class DuplicateMatch(BaseModel):
+    """
+    An embedded paper found to be a duplicate of another paper.
+
+    Attributes
+    ----------
+    docname : str
+        The Zotero key of the embedded paper.
+    dockey : str
+        The document key of the embedded paper, i.e. the MD5 hash of its PDF.
+    similarity : float
+        The estimated Jaccard similarity of the two papers' texts, or 1.0 for identical PDFs.
+    exact : bool
+        Whether the two PDFs are byte-for-byte identical.
+    """
+    docname: str
+    dockey: str
+    similarity: float
+    exact: bool
+
+
+class DuplicateIndexEntry(BaseModel):
+    """
+    The fingerprints of a paper in the `DuplicateIndex`.
+
+    Attributes
+    ----------
+    docname : str
+        The Zotero key of the paper.
+    dockey : str
+        The document key of the paper, i.e. the MD5 hash of its PDF.
+    sha256 : str, optional
+        The SHA-256 hash of the paper's PDF, or None if the entry was rebuilt from the embedding store, which only
+        keeps the MD5 hash.
+    signature : str
+        The MinHash signature of the paper's text, as hexadecimal `uint32` values.
+    """
+    docname: str
+    dockey: str
+    sha256: Optional[str] = None
+    signature: str
+
+
+class DuplicateIndex:
+    """
+    An index of the PDF hashes and text fingerprints of every embedded paper, used to find duplicates before paying to
+    embed them.
+
+    Exact duplicates are found by the SHA-256 and MD5 hashes of the PDF's bytes. Near duplicates, such as the preprint
+    and published versions of a paper or the same paper attached to two Zotero items with different PDFs, are found by
+    the MinHash signatures of their texts' word shingles, using locality-sensitive hashing (LSH) to find candidates.
+
+    Attributes
+    ----------
+    index_path : Path
+        The JSON file in which the index is persisted.
+    num_permutations : int
+        The number of hash functions in each MinHash signature.
+    num_bands : int
+        The number of LSH bands each signature is split into. Papers sharing every value of at least one band are
+        compared.
+    shingle_words : int
+        The number of consecutive words in each shingle.
+    threshold : float
+        The estimated Jaccard similarity from which two papers are near duplicates.
+
+    Methods
+    -------
+    signature(text: str) -> np.ndarray
+        Returns the MinHash signature of a text.
+    find(sha256: str, dockey: str, signature: Optional[np.ndarray] = None,
+         exclude_docname: Optional[str] = None) -> Optional[DuplicateMatch]
+        Returns the embedded paper a PDF duplicates, if any.
+    claim(docname: str, dockey: str, sha256: Optional[str], signature: np.ndarray,
+          skip_near_duplicates: bool = True) -> Optional[DuplicateMatch]
+        Atomically looks for a duplicate of a paper and, unless it is to be skipped, adds the paper to the index.
+    release(docname: str, dockey: str)
+        Removes a claimed paper that was not embedded after all.
+    remove(dockeys: Iterable[str])
+        Removes papers from the index.
+    add_alias(docname: str, dockey: str)
+        Records a Zotero item that was skipped as a duplicate of an embedded paper.
+    alias_of(docname: str) -> Optional[str]
+        Returns the Zotero key of the embedded paper a skipped Zotero item duplicates.
+    sync(docs: paperqa.Docs) -> int
+        Drops the papers no longer in a `Docs` object, and adds the ones missing from the index.
+    save()
+        Atomically persists the index.
+
+    Notes
+    -----
+    Every lookup is a dictionary access per hash or LSH band, so checking a paper takes constant time however large the
+    library grows. Signatures are computed from the paper's text chunks, so the index can be rebuilt from the
+    embedding store without any PDF, e.g. for papers embedded before the index existed or merged from shards. The
+    index is only saved by `save()`: papers added since the last save are restored by the next `sync()`.
+    """
+    def __init__(self, index_path: Union[str, Path],
+                 num_permutations: int = DuplicateConstants.NUM_PERMUTATIONS,
+                 num_bands: int = DuplicateConstants.NUM_BANDS,
+                 shingle_words: int = DuplicateConstants.SHINGLE_WORDS,
+                 threshold: float = DuplicateConstants.NEAR_DUPLICATE_THRESHOLD):
+        if num_permutations % num_bands != 0:
+            raise ValueError(f"The number of permutations {num_permutations} must be a multiple of the number of "
+                             f"bands {num_bands}")
+
+        self.index_path: Path = Path(index_path)
+        self.num_permutations: int = num_permutations
+        self.num_bands: int = num_bands
+        self.shingle_words: int = shingle_words
+        self.threshold: float = threshold
+        rng: np.random.Generator = np.random.default_rng(DuplicateConstants.MINHASH_SEED)
+        # Multiply-shift hashing: odd 64-bit multipliers, keeping the high 32 bits of each product
+        self._multipliers: np.ndarray = rng.integers(0, 2 ** 63, num_permutations, dtype=np.uint64) * 2 + 1
+        self._increments: np.ndarray = rng.integers(0, 2 ** 63, num_permutations, dtype=np.uint64)
+        self._entries: Dict[str, DuplicateIndexEntry] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._dockeys_by_sha256: Dict[str, str] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [defaultdict(set) for _ in range(num_bands)]
+        self._aliases: Dict[str, str] = {}
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    def __len__(self) -> int:
+        """Return the number of papers in the index."""
+        return len(self._entries)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Returns the MinHash signature of a text.
+
+        Parameters
+        ----------
+        text : str
+            The text, e.g. the concatenated text chunks of a paper.
+
+        Returns
+        -------
+        np.ndarray
+            The minimum of each hash function over the text's distinct word shingles, as `num_permutations` `uint32`
+            values. The fraction of equal values in two signatures estimates the Jaccard similarity of the texts.
+        """
+        words: List[str] = re.findall(r'\w+', text.lower())
+        num_shingles: int = max(1, len(words) - self.shingle_words + 1)
+        shingles: Set[str] = {' '.join(words[i:i + self.shingle_words]) for i in range(num_shingles)}
+        hashes: np.ndarray = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+
+        signature: np.ndarray = np.full(self.num_permutations, np.iinfo(np.uint32).max, dtype=np.uint64)
+        block_size: int = DuplicateConstants.SHINGLE_BLOCK_SIZE
+        for block_start in range(0, len(hashes), block_size):
+            block: np.ndarray = hashes[block_start:block_start + block_size, None]
+            values: np.ndarray = (block * self._multipliers + self._increments) >> np.uint64(32)
+            np.minimum(signature, values.min(axis=0), out=signature)
+
+        return signature.astype(np.uint32)
+
+    def find(self, sha256: Optional[str], dockey: str, signature: Optional[np.ndarray] = None,
+             exclude_docname: Optional[str] = None) -> Optional[DuplicateMatch]:
+        """
+        Returns the embedded paper a PDF duplicates, if any.
+
+        Parameters
+        ----------
+        sha256 : str, optional
+            The SHA-256 hash of the PDF.
+        dockey : str
+            The MD5 hash of the PDF.
+        signature : np.ndarray, optional
+            The MinHash signature of the PDF's text. If not given, only exact duplicates are looked for.
+        exclude_docname : str, optional
+            A Zotero key whose papers are ignored, e.g. the previous version of the item being checked.
+
+        Returns
+        -------
+        Optional[DuplicateMatch]
+            The embedded paper with an identical PDF, or else the most similar near duplicate, if any.
+        """
+        with self._lock:
+            for match_dockey in (self._dockeys_by_sha256.get(sha256), dockey):
+                entry: Optional[DuplicateIndexEntry] = self._entries.get(match_dockey)
+                if entry is not None and entry.docname != exclude_docname:
+                    return DuplicateMatch(docname=entry.docname, dockey=entry.dockey, similarity=1.0, exact=True)
+
+            if signature is None:
+                return None
+
+            candidates: Set[str] = set()
+            for band, band_signature in enumerate(self._bands(signature)):
+                candidates |= self._buckets[band].get(band_signature, set())
+
+            best_match: Optional[DuplicateMatch] = None
+            for candidate in sorted(candidates):
+                entry = self._entries[candidate]
+                if entry.docname == exclude_docname:
+                    continue
+                similarity: float = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.threshold and (best_match is None or similarity > best_match.similarity):
+                    best_match = DuplicateMatch(docname=entry.docname, dockey=entry.dockey, similarity=similarity,
+                                                exact=False)
+
+            return best_match
+
+    def claim(self, docname: str, dockey: str, sha256: Optional[str], signature: np.ndarray,
+              skip_near_duplicates: bool = True) -> Optional[DuplicateMatch]:
+        """
+        Atomically looks for a duplicate of a paper and, unless the paper is to be skipped, adds it to the index.
+
+        Claiming a paper before it is embedded stops two copies of it in the same batch from both being embedded.
+
+        Parameters
+        ----------
+        docname : str
+            The Zotero key of the paper.
+        dockey : str
+            The MD5 hash of the paper's PDF.
+        sha256 : str, optional
+            The SHA-256 hash of the paper's PDF.
+        signature : np.ndarray
+            The MinHash signature of the paper's text.
+        skip_near_duplicates : bool
+            Whether a near duplicate is skipped like an exact duplicate, rather than added to the index and only
+            flagged.
+
+        Returns
+        -------
+        Optional[DuplicateMatch]
+            The duplicated paper, if any. The paper has only been added to the index if this is None, or a near
+            duplicate when `skip_near_duplicates` is False.
+        """
+        with self._lock:
+            match: Optional[DuplicateMatch] = self.find(sha256, dockey, signature, exclude_docname=docname)
+            if match is None or not (match.exact or skip_near_duplicates):
+                self._add(DuplicateIndexEntry(docname=docname, dockey=dockey, sha256=sha256,
+                                              signature=signature.tobytes().hex()))
+
+            return match
+
+    def release(self, docname: str, dockey: str):
+        """
+        Removes a claimed paper that was not embedded after all, e.g. because embedding it failed.
+
+        Parameters
+        ----------
+        docname : str
+            The Zotero key of the paper.
+        dockey : str
+            The MD5 hash of the paper's PDF. The entry is only removed if it was claimed by the same Zotero item.
+        """
+        with self._lock:
+            entry: Optional[DuplicateIndexEntry] = self._entries.get(dockey)
+            if entry is not None and entry.docname == docname:
+                self._remove(dockey)
+
+    def remove(self, dockeys: Iterable[str]):
+        """
+        Removes papers from the index, along with the Zotero items recorded as their duplicates.
+
+        Parameters
+        ----------
+        dockeys : Iterable[str]
+            The document keys of the papers.
+        """
+        with self._lock:
+            for dockey in dockeys:
+                if dockey in self._entries:
+                    self._remove(dockey)
+
+    def add_alias(self, docname: str, dockey: str):
+        """
+        Records a Zotero item that was skipped as a duplicate of an embedded paper, so that it is not downloaded and
+        checked again by the next run.
+
+        Parameters
+        ----------
+        docname : str
+            The Zotero key of the skipped item.
+        dockey : str
+            The document key of the embedded paper it duplicates.
+        """
+        with self._lock:
+            if dockey in self._entries:
+                self._aliases[docname] = dockey
+
+    def alias_of(self, docname: str) -> Optional[str]:
+        """
+        Returns the Zotero key of the embedded paper a skipped Zotero item duplicates.
+
+        Parameters
+        ----------
+        docname : str
+            The Zotero key of the item.
+
+        Returns
+        -------
+        Optional[str]
+            The Zotero key of the embedded paper, or None if the item has not been skipped as a duplicate.
+        """
+        with self._lock:
+            entry: Optional[DuplicateIndexEntry] = self._entries.get(self._aliases.get(docname))
+            return entry.docname if entry is not None else None
+
+    def sync(self, docs: 'paperqa.Docs') -> int:
+        """
+        Drops the papers no longer in a `Docs` object, and adds the ones missing from the index.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The embedded papers, e.g. a view over the embedding store.
+
+        Returns
+        -------
+        int
+            The number of papers added to the index, whose signatures were computed from their text chunks.
+        """
+        with self._lock:
+            self.remove([dockey for dockey in self._entries if dockey not in docs.docs])
+
+            missing_dockeys: Set[str] = {dockey for dockey in docs.docs if dockey not in self._entries}
+            if not missing_dockeys:
+                return 0
+
+            texts_by_dockey: Dict[str, List[str]] = defaultdict(list)
+            for text in docs.texts:
+                if text.doc.dockey in missing_dockeys:
+                    texts_by_dockey[text.doc.dockey].append(text.text)
+            for dockey in sorted(missing_dockeys):
+                signature: np.ndarray = self.signature(' '.join(texts_by_dockey[dockey]))
+                self._add(DuplicateIndexEntry(docname=docs.docs[dockey].docname, dockey=dockey,
+                                              signature=signature.tobytes().hex()))
+
+            return len(missing_dockeys)
+
+    def save(self):
+        """Atomically persists the index."""
+        with self._lock:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path: Path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'parameters': self._parameters(),
+                    'entries': [entry.model_dump() for entry in self._entries.values()],
+                    'aliases': {docname: dockey for docname, dockey in self._aliases.items() if dockey in self._entries}
+                }, file)
+            os.replace(temp_path, self.index_path)
+
+    def _parameters(self) -> dict:
+        """Returns the parameters the signatures depend on, which must match for a saved index to be reused."""
+        return {
+            'num_permutations': self.num_permutations,
+            'num_bands': self.num_bands,
+            'shingle_words': self.shingle_words,
+            'seed': DuplicateConstants.MINHASH_SEED
+        }
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        """Splits a signature into its LSH bands."""
+        return [band.tobytes() for band in np.split(signature, self.num_bands)]
+
+    def _add(self, entry: DuplicateIndexEntry):
+        """Adds an entry to the hash and LSH lookups."""
+        if entry.dockey in self._entries:
+            self._remove(entry.dockey)
+
+        signature: np.ndarray = np.frombuffer(bytes.fromhex(entry.signature), dtype=np.uint32)
+        self._entries[entry.dockey] = entry
+        self._signatures[entry.dockey] = signature
+        if entry.sha256 is not None:
+            self._dockeys_by_sha256[entry.sha256] = entry.dockey
+        for band, band_signature in enumerate(self._bands(signature)):
+            self._buckets[band][band_signature].add(entry.dockey)
+
+    def _remove(self, dockey: str):
+        """Removes an entry from the hash and LSH lookups. Aliases of it are dropped when they are next read."""
+        entry: DuplicateIndexEntry = self._entries.pop(dockey)
+        signature: np.ndarray = self._signatures.pop(dockey)
+        if entry.sha256 is not None and self._dockeys_by_sha256.get(entry.sha256) == dockey:
+            del self._dockeys_by_sha256[entry.sha256]
+        for band, band_signature in enumerate(self._bands(signature)):
+            bucket: Set[str] = self._buckets[band][band_signature]
+            bucket.discard(dockey)
+            if not bucket:
+                del self._buckets[band][band_signature]
+
+    def _load(self):
+        """Loads the persisted index, starting empty if it does not exist, cannot be read or used other parameters."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                state: dict = json.load(file)
+            if state['parameters'] != self._parameters():
+                return
+            entries: List[DuplicateIndexEntry] = [DuplicateIndexEntry(**entry) for entry in state['entries']]
+        except (FileNotFoundError, ValueError, TypeError, KeyError):
+            return
+
+        for entry in entries:
+            self._add(entry)
+        self._aliases = {docname: dockey for docname, dockey in state.get('aliases', {}).items()
+                         if dockey in self._entries}
@@ -0,0 +1,270 @@
+import os
+import sys
+import hashlib
+import paperqa
+from collections import defaultdict
+from pathlib import Path
+from pydantic import BaseModel, Field
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import DataConstants, ShardConstants
+from models.docs_checkpoint_store import DocsCheckpointStore
+from models.embedding_store import EmbeddingStore
+from models.page_hash_index import PageHashIndex
+from models.partition_index import PartitionIndex
+
+
+class EmbeddingShard(BaseModel):
+    """
+    One of `count` disjoint shards of a Zotero library, selected by a stable hash of each item's Zotero key.
+
+    Each shard is embedded independently, by its own process or machine, into its own embedding store in a shard
+    directory, and the shards are then combined into the main embedding store by an `EmbeddingShardMerger`.
+
+    Attributes
+    ----------
+    index : int
+        The index of the shard, from 0 to `count - 1`.
+    count : int
+        The total number of shards.
+
+    Methods
+    -------
+    parse(value: str) -> EmbeddingShard
+        Parses a shard written as `index/count`, e.g. `0/4`.
+    contains(zotero_key: str) -> bool
+        Returns whether a Zotero item belongs to the shard.
+    directory(processed_data_dir: Union[str, Path]) -> Path
+        Returns the directory of the shard's embedding store.
+
+    Notes
+    -----
+    The shard of an item only depends on its Zotero key, not on Python's randomised `hash()`, the page it is listed
+    on or the machine, so every process agrees on which items it owns without coordinating.
+    """
+    index: int = Field(ge=0)
+    count: int = Field(ge=1)
+
+    def model_post_init(self, __context):
+        if self.index >= self.count:
+            raise ValueError(f"Shard index {self.index} must be less than the shard count {self.count}")
+
+    @classmethod
+    def parse(cls, value: str) -> 'EmbeddingShard':
+        """
+        Parses a shard written as `index/count`.
+
+        Parameters
+        ----------
+        value : str
+            The shard, e.g. `0/4` for the first of four shards.
+
+        Returns
+        -------
+        EmbeddingShard
+            The shard.
+
+        Raises
+        ------
+        ValueError
+            If the value is not of the form `index/count` with `0 <= index < count`.
+        """
+        index, separator, count = value.partition('/')
+        if not separator or not index.isdigit() or not count.isdigit():
+            raise ValueError(f"{value} is not a shard of the form index/count, e.g. 0/4")
+
+        return cls(index=int(index), count=int(count))
+
+    def contains(self, zotero_key: str) -> bool:
+        """
+        Returns whether a Zotero item belongs to the shard.
+
+        Parameters
+        ----------
+        zotero_key : str
+            The key of the Zotero item.
+
+        Returns
+        -------
+        bool
+            True if the first eight bytes of the SHA-256 hash of the key, modulo the shard count, are the shard index.
+        """
+        digest: bytes = hashlib.sha256(zotero_key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % self.count == self.index
+
+    def directory(self, processed_data_dir: Union[str, Path]) -> Path:
+        """
+        Returns the directory of the shard's embedding store.
+
+        Parameters
+        ----------
+        processed_data_dir : Union[str, Path]
+            The directory of the main embedding store.
+
+        Returns
+        -------
+        Path
+            The shard directory, e.g. `shards/shard-0-of-4` within the processed data directory.
+        """
+        return Path(processed_data_dir) / ShardConstants.SHARDS_DIR_NAME / f"shard-{self.index}-of-{self.count}"
+
+
+class ShardMergeReport(BaseModel):
+    """
+    The outcome of merging shards into the main embedding store.
+
+    Attributes
+    ----------
+    shard_dirs : List[str]
+        The shard directories whose embedding stores were merged, in the order they were read.
+    missing_shard_dirs : List[str]
+        The shard directories without an embedding store for the main store's embedding model.
+    num_added : int
+        The number of papers added to the main store.
+    num_already_merged : int
+        The number of shard papers whose Zotero key was already in the main store, e.g. from a previous merge.
+    num_duplicate_keys : int
+        The number of shard papers skipped because another shard had a version of the same Zotero item.
+    num_duplicate_contents : int
+        The number of shard papers skipped because a paper with the same PDF content hash was already in the main
+        store or was added by the merge under another Zotero key.
+    """
+    shard_dirs: List[str] = Field(default_factory=list)
+    missing_shard_dirs: List[str] = Field(default_factory=list)
+    num_added: int = 0
+    num_already_merged: int = 0
+    num_duplicate_keys: int = 0
+    num_duplicate_contents: int = 0
+
+
+class EmbeddingShardMerger:
+    """
+    Combines the embedding stores of independently embedded shards into the main embedding store, without any
+    embedding API calls.
+
+    Attributes
+    ----------
+    embedding_store : EmbeddingStore
+        The main embedding store, into which the shards are merged.
+
+    Methods
+    -------
+    find_shard_dirs() -> List[Path]
+        Returns every shard directory under the main store's processed data directory.
+    merge(shard_dirs: Optional[Iterable[Union[str, Path]]] = None) -> ShardMergeReport
+        Merges the shards into the main store, and checkpoints it.
+
+    Notes
+    -----
+    Papers are deduplicated by Zotero key (a paper's `docname`) and by PDF content hash (its `dockey`, the MD5 hash of
+    its PDF), and the result does not depend on the order in which the shards are given:
+
+        - A paper whose Zotero key is already in the main store is never replaced, so merging the same shards twice
+          leaves the store unchanged, and a paper re-embedded by a later sync is not reverted by an old shard.
+        - If several shards embedded the same Zotero item with different PDFs (e.g. after the library was re-sharded),
+          the version with the smallest content hash is kept.
+        - If several Zotero items have the same PDF, only the one with the smallest Zotero key is kept.
+
+    The merged papers are added in Zotero key order, and the main store is compacted into a single snapshot and ANN
+    index. Their Zotero collections and tags, and their page hashes, are copied from the shards' partition and page
+    hash indexes. No other process may write to the main store during a merge; the shard stores are only read.
+    """
+    def __init__(self, embedding_store: EmbeddingStore):
+        self.embedding_store: EmbeddingStore = embedding_store
+
+    def find_shard_dirs(self) -> List[Path]:
+        """
+        Returns every shard directory under the main store's processed data directory.
+
+        Returns
+        -------
+        List[Path]
+            The shard directories, sorted by name.
+        """
+        shards_dir: Path = self.embedding_store.processed_data_dir / ShardConstants.SHARDS_DIR_NAME
+        if not shards_dir.is_dir():
+            return []
+
+        return sorted(path for path in shards_dir.iterdir() if path.is_dir())
+
+    def merge(self, shard_dirs: Optional[Iterable[Union[str, Path]]] = None) -> ShardMergeReport:
+        """
+        Merges the embedding stores of the shards into the main store, and checkpoints it.
+
+        Parameters
+        ----------
+        shard_dirs : Iterable[Union[str, Path]], optional
+            The shard directories to merge, e.g. copied from other machines. Defaults to every shard directory under
+            the main store's processed data directory.
+
+        Returns
+        -------
+        ShardMergeReport
+            The number of papers added and skipped.
+        """
+        report: ShardMergeReport = ShardMergeReport()
+        docs: paperqa.Docs = self.embedding_store.load()
+        if shard_dirs is None:
+            shard_dirs = self.find_shard_dirs()
+
+        candidates: Dict[str, List[dict]] = defaultdict(list)
+        shard_partition_indexes: Dict[str, PartitionIndex] = {}
+        shard_page_hash_indexes: Dict[str, PageHashIndex] = {}
+        for shard_dir in sorted(Path(path) for path in shard_dirs):
+            shard_pkl_file_path: str = EmbeddingStore(shard_dir, self.embedding_store.embedding_model).pkl_file_path
+            shard_docs: Optional[paperqa.Docs] = DocsCheckpointStore(shard_pkl_file_path).load()
+            if shard_docs is None:
+                report.missing_shard_dirs.append(str(shard_dir))
+                continue
+
+            report.shard_dirs.append(str(shard_dir))
+            partition_index: PartitionIndex = PartitionIndex(
+                f"{shard_pkl_file_path}{DataConstants.PARTITION_INDEX_FILE_SUFFIX}"
+            )
+            page_hash_index: PageHashIndex = PageHashIndex(
+                f"{shard_pkl_file_path}{DataConstants.PAGE_HASH_INDEX_FILE_SUFFIX}"
+            )
+            texts_by_dockey: Dict[str, List[paperqa.Text]] = defaultdict(list)
+            for text in shard_docs.texts:
+                texts_by_dockey[text.doc.dockey].append(text)
+            for dockey, doc in shard_docs.docs.items():
+                candidates[doc.docname].append({'op': 'add', 'doc': doc, 'texts': texts_by_dockey[dockey]})
+                shard_partition_indexes[dockey] = partition_index
+                shard_page_hash_indexes[dockey] = page_hash_index
+
+        embedded_docnames: Set[str] = {doc.docname for doc in docs.docs.values()}
+        merged_dockeys: Set[str] = set(docs.docs)
+        records: List[dict] = []
+        for docname in sorted(candidates):
+            versions: List[dict] = candidates[docname]
+            if docname in embedded_docnames:
+                report.num_already_merged += len(versions)
+                continue
+
+            report.num_duplicate_keys += len(versions) - 1
+            record: dict = min(versions, key=lambda version: version['doc'].dockey)
+            if record['doc'].dockey in merged_dockeys:
+                report.num_duplicate_contents += 1
+                continue
+
+            merged_dockeys.add(record['doc'].dockey)
+            records.append(record)
+
+        if records:
+            self.embedding_store.merge(records)
+            main_partition_index: PartitionIndex = PartitionIndex(
+                f"{self.embedding_store.pkl_file_path}{DataConstants.PARTITION_INDEX_FILE_SUFFIX}"
+            )
+            main_page_hash_index: PageHashIndex = PageHashIndex(
+                f"{self.embedding_store.pkl_file_path}{DataConstants.PAGE_HASH_INDEX_FILE_SUFFIX}"
+            )
+            for record in records:
+                main_partition_index.merge(shard_partition_indexes[record['doc'].dockey], [record['doc'].docname])
+                main_page_hash_index.merge(shard_page_hash_indexes[record['doc'].dockey], [record['doc'].dockey])
+            main_partition_index.save()
+            main_page_hash_index.save()
+        report.num_added = len(records)
+
+        return report
@@ -0,0 +1,416 @@
+import os
+import sys
+import hashlib
+import paperqa
+from paperqa.llms import LLMModel, NumpyVectorStore, embedding_model_factory, llm_model_factory
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import (AnnIndexConstants, DataConstants, LexicalIndexConstants, MappedStoreConstants,
+                              ModelsConstants)
+from models.ann_vector_store import AnnVectorStore
+from models.docs_checkpoint_store import DocsCheckpointStore
+from models.mapped_chunk_store import MappedChunkStore, MappedText
+
+
+class EmbeddingStore:
+    """
+    A store of embedded papers that is independent of the answering LLM, shared by the `paperqa.Docs` object of every
+    LLM.
+
+    The documents, text chunks and vectors are stored once per embedding model, in a single checkpointed `Docs`
+    snapshot. Each LLM-specific `Docs` object is a light view over the store: it shares the store's documents, text
+    chunks and vector indexes, and only has its own LLM and prompts. Switching to another answering LLM therefore
+    costs no embedding API calls and no extra disk space.
+
+    Within the store, vectors are also indexed by the SHA-256 hash of the text they embed, so that vectors are
+    effectively keyed by (embedding model, chunk hash) and a chunk whose text has already been embedded is never
+    embedded again.
+
+    Attributes
+    ----------
+    embedding_model : str
+        The name of the embedding model used for every vector in the store.
+    vector_dtype : str, optional
+        The data type of the memory-mapped embedding matrix written with each snapshot ('float32', 'float16' or
+        'int8'), or None to pickle every chunk's text and vector into the snapshot.
+    processed_data_dir : Path
+        The directory in which the store's snapshot and journal are kept.
+    pkl_file_path : str
+        The path to the store's `Docs` snapshot pickle file.
+    index_path : str
+        The path to the store's approximate-nearest-neighbour index file, next to the snapshot.
+    lexical_index_path : str
+        The path to the store's BM25 index of its text chunks, next to the snapshot.
+    checkpoint_store : DocsCheckpointStore
+        The checkpoint store used to persist the store's `Docs` object.
+    docs : paperqa.Docs, optional
+        The store's own `Docs` object, once loaded.
+    migrated_pkl_file_paths : List[str]
+        The legacy per-LLM pickle files that were merged into the store when it was first created.
+
+    Methods
+    -------
+    load() -> paperqa.Docs
+        Loads the store, creating it from any legacy per-LLM pickle files if it does not exist yet.
+    view(llm_model: str, prompts: Optional[paperqa.PromptCollection]) -> paperqa.Docs
+        Returns an LLM-specific `Docs` object sharing the store's documents, text chunks and vectors.
+    is_view(docs: paperqa.Docs) -> bool
+        Returns whether a `Docs` object is a view over the store.
+    lookup_embedding(text: str) -> Optional[List[float]]
+        Returns the vector of a piece of text, if it has already been embedded.
+    append(doc: paperqa.Doc, texts: List[paperqa.Text])
+        Records a document committed through a view, and checkpoints it.
+    remove(dockeys: Iterable[str]) -> int
+        Removes documents from the store (and so from every view), and checkpoints their removal.
+    has_changed() -> bool
+        Returns whether another process has checkpointed papers into the store since it was last read.
+    refresh() -> int
+        Applies any papers added to or removed from the store by another process since it was last read.
+    compact()
+        Writes a new snapshot of the store and its ANN index, and truncates its checkpoint journal.
+    chunk_hash(text: str) -> str
+        Returns the hash under which the vector of a piece of text is stored.
+
+    Notes
+    -----
+    Documents must only be added to a view with `paperqa.Docs.aadd_texts()` (as the `IngestionPipeline` does), which
+    mutates the shared containers in place.
+
+    The store's text chunks are searched with an `AnnVectorStore`, whose index is extended as papers are added and
+    saved next to the snapshot, rather than with a brute-force scan over every chunk. The BM25 index used for
+    hybrid search is saved next to it.
+
+    The text chunks of a loaded snapshot are `MappedText` objects backed by the snapshot's `MappedChunkStore`: their
+    vectors are searched straight from its memory-mapped matrix, and their text is only read when a chunk is
+    retrieved. Processes loading the same snapshot (e.g. the GUI and several query workers) share one copy of it in
+    the operating system's page cache.
+    """
+    def __init__(self, processed_data_dir: Union[str, Path] = DataConstants.PROCESSED_DATA_DIR,
+                 embedding_model: str = ModelsConstants.TEXT_EMBEDDING_ADA_002_MODEL,
+                 vector_dtype: Optional[str] = os.getenv(MappedStoreConstants.VECTOR_DTYPE_ENV_VAR,
+                                                         MappedStoreConstants.VECTOR_DTYPE)):
+        if vector_dtype is not None and vector_dtype not in MappedStoreConstants.VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector data type {vector_dtype}, expected one of "
+                             f"{', '.join(MappedStoreConstants.VECTOR_DTYPES)}")
+
+        self.embedding_model: str = embedding_model
+        self.vector_dtype: Optional[str] = vector_dtype
+        self.processed_data_dir: Path = Path(processed_data_dir)
+        self.pkl_file_path: str = str(
+            self.processed_data_dir / f"{DataConstants.EMBEDDING_STORE_FILE_PREFIX}"
+                                      f"{embedding_model.lower().replace(' ', '_').replace('-', '_')}.pkl"
+        )
+        self.index_path: str = f"{self.pkl_file_path}{AnnIndexConstants.INDEX_FILE_SUFFIX}"
+        self.lexical_index_path: str = f"{self.pkl_file_path}{LexicalIndexConstants.INDEX_FILE_SUFFIX}"
+        self.checkpoint_store: DocsCheckpointStore = DocsCheckpointStore(self.pkl_file_path,
+                                                                         vector_dtype=vector_dtype)
+        self.docs: Optional[paperqa.Docs] = None
+        self.migrated_pkl_file_paths: List[str] = []
+        self._embeddings_by_chunk_hash: Dict[str, List[float]] = {}
+
+    @property
+    def num_journal_records(self) -> int:
+        """Return the number of papers checkpointed since the last snapshot."""
+        return self.checkpoint_store.num_journal_records
+
+    def load(self) -> paperqa.Docs:
+        """
+        Loads the store, creating it if it does not exist yet.
+
+        Returns
+        -------
+        paperqa.Docs
+            The store's own `Docs` object.
+
+        Notes
+        -----
+        The store is only read from disk once. When it is first created, every legacy `paper_qa_<llm>.pkl` file
+        embedded with the same embedding model is merged into it without any embedding API calls, so papers embedded
+        under different LLMs before the store existed are kept. The legacy files are left in place, and can be
+        deleted once the store has been written.
+        """
+        if self.docs is not None:
+            return self.docs
+
+        docs: Optional[paperqa.Docs] = self.checkpoint_store.load()
+        if docs is None:
+            self.processed_data_dir.mkdir(parents=True, exist_ok=True)
+            docs = paperqa.Docs(
+                embedding=self.embedding_model,
+                texts_index=AnnVectorStore(embedding_model=embedding_model_factory(self.embedding_model)),
+                docs_index=AnnVectorStore(embedding_model=embedding_model_factory(self.embedding_model))
+            )
+            self.migrated_pkl_file_paths = self._migrate_legacy_docs(docs)
+            if self.migrated_pkl_file_paths:
+                self.checkpoint_store.compact(docs)
+
+        # Stores written before the ANN index existed are upgraded in place, keeping their vectors
+        for index_name in ('texts_index', 'docs_index'):
+            vector_store = getattr(docs, index_name)
+            if type(vector_store) is NumpyVectorStore:
+                setattr(docs, index_name, AnnVectorStore(
+                    embedding_model=vector_store.embedding_model,
+                    mmr_lambda=vector_store.mmr_lambda,
+                    texts=vector_store.texts
+                ))
+        if isinstance(docs.texts_index, AnnVectorStore):
+            docs.texts_index.load_index(self.index_path, self.lexical_index_path)
+
+        self.docs = docs
+        for doc in docs.docs.values():
+            self._remember_embedding(doc.citation, doc.embedding)
+        for text in docs.texts:
+            self._remember_text(text)
+
+        return docs
+
+    def has_changed(self) -> bool:
+        """
+        Returns whether another process has checkpointed papers into the store since it was last read.
+
+        Returns
+        -------
+        bool
+            True if the store has not been loaded yet, or its snapshot or journal has changed on disk.
+        """
+        return self.docs is None or self.checkpoint_store.has_changed()
+
+    def refresh(self) -> int:
+        """
+        Applies any papers added to or removed from the store by another process (e.g. a headless ingestion run)
+        since it was last read.
+
+        Returns
+        -------
+        int
+            The number of papers added or removed.
+
+        Notes
+        -----
+        Only the changed papers are read and applied to the store's `Docs` object, which every view shares, so views
+        already handed out see them without being re-created.
+        """
+        if self.docs is None:
+            return len(self.load().docs)
+
+        dockeys: Set[str] = set(self.docs.docs)
+        num_changed_docs: int = self.checkpoint_store.refresh(self.docs)
+        for text in self.docs.texts:
+            if text.doc.dockey not in dockeys:
+                self._remember_text(text)
+                self._remember_embedding(text.doc.citation, text.doc.embedding)
+
+        return num_changed_docs
+
+    def view(self, llm_model: str, prompts: Optional[paperqa.PromptCollection] = None) -> paperqa.Docs:
+        """
+        Returns an LLM-specific `Docs` object sharing the store's documents, text chunks and vectors.
+
+        Parameters
+        ----------
+        llm_model : str
+            The language model used by the view to generate citations, summaries and answers.
+        prompts : paperqa.PromptCollection, optional
+            The prompts used by the view. Defaults to the store's prompts.
+
+        Returns
+        -------
+        paperqa.Docs
+            The view.
+
+        Raises
+        ------
+        ValueError
+            If `llm_model` is not a valid LLM model.
+        """
+        docs: paperqa.Docs = self.load()
+        llm: LLMModel = llm_model_factory(llm_model)
+        view: paperqa.Docs = docs.model_copy(update={
+            'llm': llm_model,
+            'llm_model': llm,
+            'summary_llm': None,
+            'summary_llm_model': llm,
+            'prompts': prompts if prompts is not None else docs.prompts
+        })
+        view.set_client()
+
+        return view
+
+    def is_view(self, docs: paperqa.Docs) -> bool:
+        """
+        Returns whether a `Docs` object is a view over the store (or the store's own `Docs` object).
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The `Docs` object.
+
+        Returns
+        -------
+        bool
+            True if the `Docs` object shares the store's documents.
+        """
+        return self.docs is not None and docs.docs is self.docs.docs
+
+    def lookup_embedding(self, text: str) -> Optional[List[float]]:
+        """
+        Returns the vector of a piece of text, if the same text has already been embedded.
+
+        Parameters
+        ----------
+        text : str
+            The text of a chunk or citation.
+
+        Returns
+        -------
+        Optional[List[float]]
+            The vector, or None if the text has not been embedded with the store's embedding model.
+        """
+        chunk_hash: str = self.chunk_hash(text)
+        embedding: Optional[List[float]] = self._embeddings_by_chunk_hash.get(chunk_hash)
+        chunk_store: Optional[MappedChunkStore] = self.checkpoint_store.chunk_store
+        if embedding is None and chunk_store is not None:
+            embedding = chunk_store.lookup_embedding(chunk_hash)
+
+        return embedding
+
+    def append(self, doc: paperqa.Doc, texts: List[paperqa.Text]):
+        """
+        Records a document that has been committed through a view, and appends it to the checkpoint journal.
+
+        Parameters
+        ----------
+        doc : paperqa.Doc
+            The committed document.
+        texts : List[paperqa.Text]
+            The document's embedded text chunks.
+        """
+        self._remember_embedding(doc.citation, doc.embedding)
+        for text in texts:
+            self._remember_embedding(text.text, text.embedding)
+
+        self.checkpoint_store.append(self.load(), doc, texts)
+
+    def remove(self, dockeys: Iterable[str]) -> int:
+        """
+        Removes documents from the store, and so from every view, and appends their removal to the checkpoint
+        journal.
+
+        Parameters
+        ----------
+        dockeys : Iterable[str]
+            The document keys of the documents to remove. Keys not in the store are ignored.
+
+        Returns
+        -------
+        int
+            The number of removed documents.
+
+        Notes
+        -----
+        The vectors of the removed text chunks stay indexed by chunk hash, so re-adding identical text later makes no
+        embedding calls.
+        """
+        docs: paperqa.Docs = self.load()
+        removed_dockeys: List[str] = [dockey for dockey in dict.fromkeys(dockeys) if dockey in docs.docs]
+        DocsCheckpointStore.apply_records(docs, [{'op': 'delete', 'dockey': dockey} for dockey in removed_dockeys])
+        for dockey in removed_dockeys:
+            self.checkpoint_store.append_removal(docs, dockey)
+
+        return len(removed_dockeys)
+
+    def merge(self, records: List[dict]):
+        """
+        Adds papers embedded into another store, e.g. by an `EmbeddingShard`, without any embedding API calls, and
+        writes a new snapshot of the store and its ANN index.
+
+        Parameters
+        ----------
+        records : List[dict]
+            An 'add' record for each paper, as returned by `DocsCheckpointStore.missing_records()`. Papers whose
+            document key is already in the store are ignored.
+
+        Notes
+        -----
+        Merged papers are written to a single new snapshot rather than appended to the journal one by one, so merging
+        a large shard costs one write of the store.
+        """
+        docs: paperqa.Docs = self.load()
+        DocsCheckpointStore.apply_records(docs, records)
+        for record in records:
+            self._remember_embedding(record['doc'].citation, record['doc'].embedding)
+            for text in record['texts']:
+                self._remember_text(text)
+        self.compact()
+
+    def compact(self):
+        """
+        Writes a new snapshot of the store and its ANN and lexical indexes, and truncates its checkpoint journal.
+
+        Notes
+        -----
+        The ANN index then scores the snapshot's text chunks from its new chunk store, so the float32 vectors of the
+        papers embedded since the previous snapshot are freed.
+        """
+        docs: paperqa.Docs = self.load()
+        self.checkpoint_store.compact(docs)
+        if isinstance(docs.texts_index, AnnVectorStore):
+            if self.checkpoint_store.chunk_store is not None:
+                docs.texts_index.use_chunk_store(self.checkpoint_store.chunk_store)
+            docs.texts_index.save_index(self.index_path, self.lexical_index_path)
+
+    @staticmethod
+    def chunk_hash(text: str) -> str:
+        """
+        Returns the hash under which the vector of a piece of text is stored.
+
+        Parameters
+        ----------
+        text : str
+            The text of a chunk or citation.
+
+        Returns
+        -------
+        str
+            The hexadecimal SHA-256 hash of the text.
+        """
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _remember_embedding(self, text: str, embedding: Optional[List[float]]):
+        """Indexes the vector of a piece of text by its chunk hash."""
+        if embedding is not None:
+            self._embeddings_by_chunk_hash[self.chunk_hash(text)] = embedding
+
+    def _remember_text(self, text: paperqa.Text):
+        """Indexes the vector of a text chunk by its chunk hash, unless it is already indexed by its chunk store."""
+        if not isinstance(text, MappedText):
+            self._remember_embedding(text.text, text.embedding)
+
+    def _migrate_legacy_docs(self, docs: paperqa.Docs) -> List[str]:
+        """
+        Merges every legacy per-LLM `Docs` pickle file embedded with the store's embedding model into `docs`.
+
+        Returns
+        -------
+        List[str]
+            The paths of the legacy pickle files that were merged.
+        """
+        migrated_pkl_file_paths: List[str] = []
+        if not self.processed_data_dir.is_dir():
+            return migrated_pkl_file_paths
+
+        for pkl_file_path in sorted(self.processed_data_dir.glob(f"{DataConstants.LEGACY_DOCS_FILE_PREFIX}*.pkl")):
+            if pkl_file_path.name.startswith(DataConstants.EMBEDDING_STORE_FILE_PREFIX):
+                continue
+
+            legacy_docs: Optional[paperqa.Docs] = DocsCheckpointStore(str(pkl_file_path)).load()
+            if legacy_docs is None or legacy_docs.embedding != docs.embedding:
+                continue
+
+            DocsCheckpointStore.apply_records(docs, DocsCheckpointStore.missing_records(legacy_docs, docs))
+            migrated_pkl_file_paths.append(str(pkl_file_path))
+
+        return migrated_pkl_file_paths
@@ -0,0 +1,325 @@
+import os
+import sys
+import pickle
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from paperqa.llms import LLMModel
+from paperqa.prompts import default_system_prompt
+from paperqa.types import LLMResult
+from pathlib import Path
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import BatchQueryConstants, DataConstants
+
+
+class EvidenceCacheEntry(BaseModel):
+    """
+    A cached summary of a text chunk, written for a question.
+
+    Attributes
+    ----------
+    question_embedding : List[float]
+        The normalised embedding of the question the summary was written for.
+    result : LLMResult
+        The summary, as returned by the summary LLM.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    question_embedding: List[float]
+    result: LLMResult
+
+
+class EvidenceCacheStats(BaseModel):
+    """
+    Hit and miss statistics of an `EvidenceCache`.
+
+    Attributes
+    ----------
+    hits : int
+        Summaries returned from the cache.
+    shared : int
+        Summaries that were being written for a sufficiently similar question by a concurrent query, and were awaited
+        rather than requested again.
+    misses : int
+        Summaries requested from the summary LLM.
+    evictions : int
+        Summaries evicted because the cache was full.
+    """
+    hits: int = 0
+    shared: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the fraction of summaries that were not requested from the summary LLM."""
+        lookups: int = self.hits + self.shared + self.misses
+        return (self.hits + self.shared) / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        """Return a one-line human-readable summary of the statistics."""
+        return (f"{self.hits} hits, {self.shared} shared with concurrent queries, {self.misses} misses, "
+                f"{self.hit_rate:.0%} hit rate, {self.evictions} evictions")
+
+
+class EvidenceCache:
+    """
+    A persistent cache of evidence summaries, keyed by the text chunk they summarise and the embedding of the
+    question they were written for.
+
+    When many questions are answered, the same text chunks are often retrieved for similar questions. A summary is
+    reused if the same chunk has already been summarised, with the same prompts and summary LLM, for a question whose
+    embedding has a cosine similarity of at least `similarity_threshold` with the current one. If such a summary is
+    still being written by a concurrent query, it is awaited rather than requested again.
+
+    Attributes
+    ----------
+    cache_path : Path
+        The path to the pickle file in which the cache is persisted.
+    similarity_threshold : float
+        The minimum cosine similarity between two questions' embeddings for a summary written for one to be reused
+        for the other.
+    max_entries : int
+        The maximum number of cached summaries. The summaries of the least recently used chunk are evicted first.
+    stats : EvidenceCacheStats
+        The hit and miss statistics, persisted with the cache.
+
+    Methods
+    -------
+    get_or_summarise(chunk_key: str, question_embedding: Sequence[float],
+                     summarise: Callable[[], Awaitable[LLMResult]]) -> LLMResult
+        Returns the cached summary of a chunk for a question, or writes and caches it.
+    clear()
+        Discards every cached summary.
+    save()
+        Atomically persists the cache, including its statistics and LRU order.
+    chunk_key(llm_model: str, prompt: str, system_prompt: str, data: dict) -> str
+        Returns the key of a text chunk summarised with given prompts, excluding the question.
+
+    Notes
+    -----
+    A summary returned from the cache has no prompt or completion tokens, so the token counts of an answer only
+    include the LLM calls made for it. Unlike `AnswerCache`, the cache is not invalidated when papers are added,
+    as a chunk's key is derived from its text and citation.
+    """
+    def __init__(self, cache_path: Union[str, Path] = DataConstants.EVIDENCE_CACHE_PATH,
+                 similarity_threshold: float = BatchQueryConstants.EVIDENCE_SIMILARITY_THRESHOLD,
+                 max_entries: int = BatchQueryConstants.MAX_EVIDENCE_ENTRIES):
+        self.cache_path: Path = Path(cache_path)
+        self.similarity_threshold: float = similarity_threshold
+        self.max_entries: int = max_entries
+        self.stats: EvidenceCacheStats = EvidenceCacheStats()
+        self._entries: OrderedDict[str, List[EvidenceCacheEntry]] = OrderedDict()
+        self._num_entries: int = 0
+        self._in_flight: Dict[str, List[Tuple[np.ndarray, asyncio.Future]]] = {}
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    async def get_or_summarise(self, chunk_key: str, question_embedding: Sequence[float],
+                               summarise: Callable[[], Awaitable[LLMResult]]) -> LLMResult:
+        """
+        Returns the cached summary of a text chunk for a question, or writes and caches it.
+
+        Parameters
+        ----------
+        chunk_key : str
+            The key of the chunk, as returned by `chunk_key()`.
+        question_embedding : Sequence[float]
+            The normalised embedding of the question.
+        summarise : Callable[[], Awaitable[LLMResult]]
+            Writes the summary with the summary LLM, on a cache miss.
+
+        Returns
+        -------
+        LLMResult
+            The summary.
+        """
+        embedding: np.ndarray = np.asarray(question_embedding, dtype=np.float32)
+        with self._lock:
+            entries: List[EvidenceCacheEntry] = self._entries.get(chunk_key, [])
+            if entries:
+                similarities: np.ndarray = np.asarray(
+                    [entry.question_embedding for entry in entries], dtype=np.float32
+                ) @ embedding
+                best: int = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.stats.hits += 1
+                    self._entries.move_to_end(chunk_key)
+                    return self._reuse(entries[best].result)
+
+            for in_flight_embedding, in_flight_future in self._in_flight.get(chunk_key, []):
+                if float(in_flight_embedding @ embedding) >= self.similarity_threshold:
+                    self.stats.shared += 1
+                    future: Optional[asyncio.Future] = in_flight_future
+                    break
+            else:
+                future = None
+                self.stats.misses += 1
+                in_flight: Tuple[np.ndarray, asyncio.Future] = (
+                    embedding, asyncio.get_running_loop().create_future()
+                )
+                self._in_flight.setdefault(chunk_key, []).append(in_flight)
+
+        if future is not None:
+            return self._reuse(await asyncio.shield(future))
+
+        try:
+            result: LLMResult = await summarise()
+        except asyncio.CancelledError:
+            in_flight[1].cancel()
+            raise
+        except Exception as error:
+            in_flight[1].set_exception(error)
+            # The awaiting queries re-raise the exception, so it is not also reported as never retrieved
+            in_flight[1].exception()
+            raise
+        else:
+            in_flight[1].set_result(result)
+            self._add(chunk_key, embedding, result)
+        finally:
+            with self._lock:
+                self._in_flight[chunk_key].remove(in_flight)
+                if not self._in_flight[chunk_key]:
+                    del self._in_flight[chunk_key]
+
+        return result
+
+    def clear(self):
+        """Discards every cached summary."""
+        with self._lock:
+            self._entries.clear()
+            self._num_entries = 0
+            self.save()
+
+    def save(self):
+        """Atomically persists the cache, including its statistics and LRU order."""
+        with self._lock:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_temp_path: str = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(cache_temp_path, 'wb') as file:
+                pickle.dump({'entries': list(self._entries.items()), 'stats': self.stats}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_temp_path, self.cache_path)
+
+    @staticmethod
+    def chunk_key(llm_model: str, prompt: str, system_prompt: str, data: dict) -> str:
+        """
+        Returns the key of a text chunk summarised with given prompts, which does not depend on the question.
+
+        Parameters
+        ----------
+        llm_model : str
+            The summary LLM.
+        prompt : str
+            The summary prompt template.
+        system_prompt : str
+            The system prompt.
+        data : dict
+            The values formatted into the summary prompt, i.e. the question, the chunk's text and citation, and the
+            summary length. The question is ignored.
+
+        Returns
+        -------
+        str
+            The hexadecimal SHA-256 hash of everything but the question.
+        """
+        digest = hashlib.sha256()
+        values: List[str] = [llm_model, prompt, system_prompt] + [
+            f"{name}={data[name]}" for name in sorted(data) if name != 'question'
+        ]
+        for value in values:
+            digest.update(str(value).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def _add(self, chunk_key: str, question_embedding: np.ndarray, result: LLMResult):
+        """Caches a summary, evicting the summaries of the least recently used chunks if the cache is full."""
+        entry: EvidenceCacheEntry = EvidenceCacheEntry(
+            question_embedding=question_embedding.tolist(), result=result.model_copy(deep=True)
+        )
+        with self._lock:
+            self._entries.setdefault(chunk_key, []).append(entry)
+            self._entries.move_to_end(chunk_key)
+            self._num_entries += 1
+            while self._num_entries > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._num_entries -= len(evicted)
+                self.stats.evictions += len(evicted)
+
+    @staticmethod
+    def _reuse(result: LLMResult) -> LLMResult:
+        """Returns a copy of a cached summary, as a new LLM result without any tokens or latency."""
+        return LLMResult(model=result.model, prompt=result.prompt, text=result.text)
+
+    def _load(self):
+        """Loads the persisted cache, starting empty if it does not exist or cannot be read."""
+        try:
+            with open(self.cache_path, 'rb') as file:
+                state: Dict = pickle.load(file)
+            self._entries = OrderedDict(state['entries'])
+            self.stats = state['stats']
+        except (FileNotFoundError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+        self._num_entries = sum(len(entries) for entries in self._entries.values())
+
+
+class CachedSummaryLLMModel(LLMModel):
+    """
+    A summary LLM that reuses the evidence summaries in an `EvidenceCache` and shares a concurrency cap between
+    queries.
+
+    It stands in for a `paperqa.Docs` object's `summary_llm_model` while a batch of questions is answered. Summaries
+    of questions without a known embedding are written by the wrapped model without the cache.
+
+    Attributes
+    ----------
+    summary_llm_model : LLMModel
+        The wrapped summary LLM.
+    evidence_cache : EvidenceCache
+        The cache of evidence summaries.
+    question_embeddings : Dict[str, List[float]]
+        The normalised embedding of each question in the batch.
+    semaphore : asyncio.Semaphore
+        Limits the number of summaries written at once, across every question in the batch.
+
+    Methods
+    -------
+    make_chain(client: Any, prompt: str, skip_system: bool = False, system_prompt: str = default_system_prompt)
+        Returns a function that writes a summary, or reuses a cached one.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    summary_llm_model: LLMModel
+    evidence_cache: EvidenceCache
+    question_embeddings: Dict[str, List[float]]
+    semaphore: asyncio.Semaphore
+
+    def make_chain(self, client: Any, prompt: str, skip_system: bool = False,
+                   system_prompt: str = default_system_prompt):
+        chain = self.summary_llm_model.make_chain(client, prompt, skip_system=skip_system,
+                                                  system_prompt=system_prompt)
+
+        async def summarise(data: dict, callbacks: Optional[List[Callable]] = None) -> LLMResult:
+            async with self.semaphore:
+                return await chain(data, callbacks)
+
+        async def execute(data: dict, callbacks: Optional[List[Callable]] = None) -> LLMResult:
+            question_embedding: Optional[List[float]] = self.question_embeddings.get(data.get('question'))
+            if question_embedding is None:
+                return await summarise(data, callbacks)
+
+            chunk_key: str = EvidenceCache.chunk_key(
+                self.summary_llm_model.name, prompt, '' if skip_system else system_prompt, data
+            )
+            return await self.evidence_cache.get_or_summarise(
+                chunk_key, question_embedding, lambda: summarise(data, callbacks)
+            )
+
+        return execute
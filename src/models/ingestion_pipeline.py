@@ -0,0 +1,751 @@
+import os
+import sys
+import time
+import asyncio
+import contextvars
+import paperqa
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from paperqa.readers import chunk_pdf
+from paperqa.types import LLMResult, ParsedText
+from paperqa.utils import get_loop, maybe_is_text, md5sum
+from pathlib import Path
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import DuplicateConstants, PipelineConstants
+from models.duplicate_index import DuplicateIndex, DuplicateMatch
+from models.embedding_store import EmbeddingStore
+from models.page_hash_index import PageHashIndex
+from models.parsed_pdf_cache import ParsedPdf, ParsedPdfCache
+from models.rate_limiter import OpenAIRateLimiter
+from models.telemetry import Telemetry
+from models.zotero_paper import ZoteroPaper
+
+
+class PipelineWorkItem(BaseModel):
+    """
+    A single Zotero item as it moves through the stages of the ingestion pipeline.
+
+    Attributes
+    ----------
+    index : int
+        The position of the item in the batch. Results are committed into the `Docs` object in this order.
+    item : dict
+        The full item details from Zotero.
+    pdf : Path, optional
+        The path to the downloaded PDF for the item.
+    paper : ZoteroPaper, optional
+        The parsed paper.
+    parsed_text : ParsedText, optional
+        The per-page text of the PDF.
+    num_tokens : int
+        The number of tokens in the PDF text.
+    doc : paperqa.Doc, optional
+        The document to be added to the `Docs` object.
+    texts : List[paperqa.Text]
+        The text chunks of the document, embedded once the item has passed the embedding stage.
+    replaced_dockey : str, optional
+        The document key of the item's previously embedded version, which is removed from the `Docs` object when the
+        item is committed. Only set when re-syncing items that are already in the `Docs` object.
+    page_hashes : Dict[str, str]
+        The hash of each page's text, recorded in the `PageHashIndex` when the item is committed.
+    changed_pages : List[str], optional
+        The pages whose text differs from the previously embedded version, if only those were re-chunked.
+    num_reused_texts : int
+        The number of text chunks, and their embeddings, reused from the previously embedded version.
+    duplicate_of : DuplicateMatch, optional
+        The embedded paper the item duplicates, if any. Exact duplicates are skipped, and so are near duplicates
+        unless the pipeline only flags them.
+    skip_reason : str, optional
+        Why the item was skipped by the pipeline, if it was.
+    error : Exception, optional
+        The exception raised while processing the item, if any.
+    stage_timings : Dict[str, Tuple[float, float]]
+        The start and end time of each stage the item passed through.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int
+    item: dict
+    pdf: Optional[Path] = None
+    paper: Optional[ZoteroPaper] = None
+    parsed_text: Optional[ParsedText] = None
+    num_tokens: int = 0
+    doc: Optional[paperqa.Doc] = None
+    texts: List[paperqa.Text] = Field(default_factory=list)
+    replaced_dockey: Optional[str] = None
+    page_hashes: Dict[str, str] = Field(default_factory=dict)
+    changed_pages: Optional[List[str]] = None
+    num_reused_texts: int = 0
+    duplicate_of: Optional[DuplicateMatch] = None
+    skip_reason: Optional[str] = None
+    error: Optional[Exception] = None
+    stage_timings: Dict[str, Tuple[float, float]] = Field(default_factory=dict)
+
+    @property
+    def title(self) -> str:
+        """Return the title of the item."""
+        return self.item.get('data', {}).get('title', '')
+
+
+class PipelineMetrics:
+    """
+    Throughput metrics for each stage of the ingestion pipeline.
+
+    Attributes
+    ----------
+    stage_names : List[str]
+        The names of the stages, in pipeline order.
+
+    Methods
+    -------
+    record(work: PipelineWorkItem)
+        Records the timings of a committed work item.
+    stage_throughput(stage_name: str) -> Tuple[int, float, float]
+        Returns the number of papers, papers per minute and tokens per minute of a stage.
+    report() -> str
+        Returns a human-readable throughput report for every stage.
+
+    Notes
+    -----
+    A stage's throughput is measured over the wall-clock window between the first paper entering the stage and the
+    last paper leaving it, so concurrent stages are not penalised for time spent waiting on each other.
+    """
+    def __init__(self, stage_names: List[str]):
+        self.stage_names: List[str] = stage_names
+        self._num_papers: Dict[str, int] = {name: 0 for name in stage_names}
+        self._num_tokens: Dict[str, int] = {name: 0 for name in stage_names}
+        self._windows: Dict[str, Tuple[float, float]] = {}
+
+    def record(self, work: PipelineWorkItem):
+        """
+        Records the timings of a committed work item.
+
+        Parameters
+        ----------
+        work : PipelineWorkItem
+            The work item, once it has left the final stage.
+        """
+        for stage_name, (start, end) in work.stage_timings.items():
+            self._num_papers[stage_name] += 1
+            self._num_tokens[stage_name] += work.num_tokens
+            window_start, window_end = self._windows.get(stage_name, (start, end))
+            self._windows[stage_name] = (min(window_start, start), max(window_end, end))
+
+    def stage_throughput(self, stage_name: str) -> Tuple[int, float, float]:
+        """
+        Returns the throughput of a stage.
+
+        Parameters
+        ----------
+        stage_name : str
+            The name of the stage.
+
+        Returns
+        -------
+        Tuple[int, float, float]
+            The number of papers processed, papers per minute and tokens per minute.
+        """
+        num_papers: int = self._num_papers[stage_name]
+        if stage_name not in self._windows:
+            return num_papers, 0.0, 0.0
+
+        window_start, window_end = self._windows[stage_name]
+        elapsed_minutes: float = max(window_end - window_start, 1e-9) / 60
+
+        return num_papers, num_papers / elapsed_minutes, self._num_tokens[stage_name] / elapsed_minutes
+
+    def report(self) -> str:
+        """
+        Returns a human-readable throughput report for every stage.
+
+        Returns
+        -------
+        str
+            One line per stage with its paper count, papers per minute and tokens per minute.
+        """
+        lines: List[str] = []
+        for stage_name in self.stage_names:
+            num_papers, papers_per_minute, tokens_per_minute = self.stage_throughput(stage_name)
+            lines.append(f"{stage_name:>8}: {num_papers} papers, {papers_per_minute:.1f} papers/min, "
+                         f"{tokens_per_minute:.0f} tokens/min")
+
+        return "\n".join(lines)
+
+
+class IngestionPipeline:
+    """
+    A concurrent, staged download → parse → embed pipeline for adding Zotero papers to a `paperqa.Docs` object.
+
+    Each stage runs its own pool of workers, and the stages are connected by bounded queues. Downloads run on
+    threads, PDF parsing and chunking run on threads, and the citation and embedding API calls run as coroutines
+    on the event loop. Results are committed into the `Docs` object strictly in batch order, so a batch is
+    limited by its slowest stage rather than by the sum of every paper's latencies.
+
+    Attributes
+    ----------
+    zotero_paper_embedder : ZoteroPaperEmbedder
+        The embedder used to download PDFs, generate citation keys, and look up parsed PDFs and existing embeddings.
+    docs : paperqa.Docs
+        The document set that papers are committed into.
+    concurrency : Dict[str, int]
+        The number of workers for each of the download, parse and embed stages.
+    queue_size : int
+        The maximum number of work items waiting between two stages.
+    tokenizer_model : str
+        The language model used to count the tokens in each PDF.
+    resync_existing : bool
+        Whether items already in the `Docs` object are re-checked rather than skipped. A re-checked item whose PDF
+        has changed is re-embedded and replaces its previous version, and one that no longer has a PDF is removed.
+    skip_near_duplicates : bool
+        Whether papers whose text is a near duplicate of an embedded paper are skipped, rather than embedded and
+        flagged. Papers whose PDF is identical to an embedded paper's are always skipped.
+    metrics : PipelineMetrics
+        The throughput metrics of the most recent run.
+
+    Methods
+    -------
+    run(items: Iterable[dict], on_commit: Callable[[PipelineWorkItem], bool]) -> PipelineMetrics
+        Runs the pipeline over the given Zotero items until they are all committed or `on_commit` returns False.
+    arun(items: Iterable[dict], on_commit: Callable[[PipelineWorkItem], bool]) -> PipelineMetrics
+        Asynchronous version of `run()`.
+
+    Notes
+    -----
+    Papers are committed with `paperqa.Docs.aadd_texts()` once their chunks have been embedded, which replicates
+    `paperqa.Docs.aadd()` without parsing each PDF a second time. The number of items between the feeder and the
+    committer is capped, so the in-order commit buffer stays bounded when one paper is much slower than the rest.
+
+    Downloads and parses run on the pipeline's own thread pool. When the pipeline stops early, the workers are
+    cancelled and every download or parse already running on a thread is waited for, so no thread is left writing to
+    the PDF storage, the parsed PDF cache or the embedder's indexes once `run()` has returned.
+
+    Duplicates are looked up in the embedder's `DuplicateIndex` by the parse stage, before any API call is made for
+    them: by the hash of the PDF before it is parsed, and by the MinHash signature of its text once it is chunked.
+    Zotero items skipped as duplicates are recorded in the index, so later runs skip them without downloading them.
+
+    The hash of every page's text is recorded in the embedder's `PageHashIndex`. When a re-synced item's PDF has
+    changed, e.g. because it was replaced by a corrected version or annotated, only its pages whose text changed are
+    re-chunked and embedded. The chunks of its previous version that only span unchanged pages are kept, with their
+    embeddings, and so is its citation if its first chunk is unchanged.
+    """
+    STAGE_NAMES: List[str] = ['download', 'parse', 'embed', 'commit']
+
+    def __init__(
+            self,
+            zotero_paper_embedder,
+            docs: paperqa.Docs,
+            download_concurrency: int = PipelineConstants.DOWNLOAD_CONCURRENCY,
+            parse_concurrency: int = PipelineConstants.PARSE_CONCURRENCY,
+            embed_concurrency: int = PipelineConstants.EMBED_CONCURRENCY,
+            queue_size: int = PipelineConstants.QUEUE_SIZE,
+            tokenizer_model: str = PipelineConstants.TOKENIZER_MODEL,
+            resync_existing: bool = False,
+            skip_near_duplicates: bool = DuplicateConstants.SKIP_NEAR_DUPLICATES
+    ):
+        self.zotero_paper_embedder = zotero_paper_embedder
+        self.docs: paperqa.Docs = docs
+        self.concurrency: Dict[str, int] = {
+            'download': download_concurrency,
+            'parse': parse_concurrency,
+            'embed': embed_concurrency
+        }
+        self.queue_size: int = queue_size
+        self.tokenizer_model: str = tokenizer_model
+        self.resync_existing: bool = resync_existing
+        self.skip_near_duplicates: bool = skip_near_duplicates
+        self.metrics: PipelineMetrics = PipelineMetrics(self.STAGE_NAMES)
+        self._dockeys_by_docname: Dict[str, str] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread_futures: Set[Future] = set()
+
+    def run(self, items: Iterable[dict], on_commit: Callable[[PipelineWorkItem], bool]) -> PipelineMetrics:
+        """
+        Runs the pipeline over the given Zotero items.
+
+        Parameters
+        ----------
+        items : Iterable[dict]
+            The Zotero items to ingest. The iterable is consumed lazily on a worker thread.
+        on_commit : Callable[[PipelineWorkItem], bool]
+            Called with every work item in batch order once it has been committed, skipped or has failed. Returning
+            False stops the pipeline.
+
+        Returns
+        -------
+        PipelineMetrics
+            The throughput metrics of the run.
+        """
+        return get_loop().run_until_complete(self.arun(items, on_commit))
+
+    async def arun(self, items: Iterable[dict], on_commit: Callable[[PipelineWorkItem], bool]) -> PipelineMetrics:
+        """
+        Asynchronous version of `run()`.
+
+        Parameters
+        ----------
+        items : Iterable[dict]
+            The Zotero items to ingest. The iterable is consumed lazily on a worker thread.
+        on_commit : Callable[[PipelineWorkItem], bool]
+            Called with every work item in batch order once it has been committed, skipped or has failed. Returning
+            False stops the pipeline.
+
+        Returns
+        -------
+        PipelineMetrics
+            The throughput metrics of the run.
+
+        Raises
+        ------
+        Exception
+            Any exception raised while reading the Zotero items, or by `on_commit`.
+        """
+        self.metrics = PipelineMetrics(self.STAGE_NAMES)
+        self._dockeys_by_docname = {doc.docname: dockey for dockey, doc in self.docs.docs.items()}
+        duplicate_index: DuplicateIndex = self.zotero_paper_embedder.duplicate_index
+        with self.zotero_paper_embedder.telemetry.span('duplicates.sync') as span:
+            num_indexed: int = await asyncio.to_thread(duplicate_index.sync, self.docs)
+            span.set(num_indexed=num_indexed, num_papers=len(duplicate_index))
+        self.zotero_paper_embedder.page_hash_index.sync(self.docs)
+        download_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        parse_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        commit_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        in_flight: asyncio.Semaphore = asyncio.Semaphore(
+            self.queue_size * 4 + sum(self.concurrency.values())
+        )
+        feeder_errors: List[Exception] = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency['download'] + self.concurrency['parse'], thread_name_prefix='ingestion'
+        )
+        self._thread_futures = set()
+
+        workers: List[asyncio.Task] = [
+            asyncio.ensure_future(self._feed(iter(items), download_queue, in_flight, feeder_errors)),
+            asyncio.ensure_future(self._run_stage(
+                'download', self._download, download_queue, parse_queue, self.concurrency['parse']
+            )),
+            asyncio.ensure_future(self._run_stage(
+                'parse', self._parse, parse_queue, embed_queue, self.concurrency['embed']
+            )),
+            asyncio.ensure_future(self._run_stage(
+                'embed', self._embed, embed_queue, commit_queue, 1
+            )),
+        ]
+
+        try:
+            await self._commit(commit_queue, in_flight, on_commit)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Cancelling a worker does not stop the download or parse it was awaiting on a thread
+            await asyncio.to_thread(wait, list(self._thread_futures))
+            self._executor.shutdown(wait=False)
+
+        if feeder_errors:
+            raise feeder_errors[0]
+
+        return self.metrics
+
+    async def _feed(
+            self,
+            items: Iterator[dict],
+            download_queue: asyncio.Queue,
+            in_flight: asyncio.Semaphore,
+            feeder_errors: List[Exception]
+    ):
+        """
+        Reads Zotero items on a worker thread and feeds them into the download stage.
+
+        Items already present in the `Docs` object, or previously skipped as duplicates of an embedded paper, are marked
+        as skipped so that no PDF is downloaded for them, unless they are being re-synced.
+        """
+        duplicate_index: DuplicateIndex = self.zotero_paper_embedder.duplicate_index
+        index: int = 0
+        try:
+            while True:
+                item: Optional[dict] = await asyncio.to_thread(next, items, None)
+                if item is None:
+                    break
+
+                work: PipelineWorkItem = PipelineWorkItem(index=index, item=item)
+                if not self.resync_existing:
+                    duplicated_docname: Optional[str] = duplicate_index.alias_of(item['key'])
+                    if item['key'] in self.docs.docnames:
+                        work.skip_reason = 'it has already been processed'
+                    elif duplicated_docname is not None:
+                        work.skip_reason = f"it is a duplicate of already embedded paper {duplicated_docname}"
+
+                await in_flight.acquire()
+                await download_queue.put(work)
+                index += 1
+        except Exception as e:
+            feeder_errors.append(e)
+        finally:
+            for _ in range(self.concurrency['download']):
+                await download_queue.put(None)
+
+    async def _run_stage(
+            self,
+            stage_name: str,
+            handler: Callable,
+            in_queue: asyncio.Queue,
+            out_queue: asyncio.Queue,
+            num_downstream_workers: int
+    ):
+        """
+        Runs a pool of workers for a single stage, forwarding every work item to the next stage.
+
+        Work items that have already been skipped or have failed are forwarded untouched, so that the committer
+        still sees every item in batch order. Once every worker has received its shutdown sentinel, one sentinel is
+        sent for each downstream worker. Every handled work item is recorded as a telemetry span named after the stage.
+        """
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+
+        async def worker():
+            while True:
+                work: Optional[PipelineWorkItem] = await in_queue.get()
+                if work is None:
+                    return
+
+                if work.skip_reason is None and work.error is None:
+                    start: float = time.perf_counter()
+                    with telemetry.span(stage_name, zotero_key=work.item['key']) as span:
+                        try:
+                            await handler(work)
+                        except Exception as e:
+                            work.error = e
+                            span.set(error=repr(e))
+                        if work.skip_reason is not None:
+                            span.set(skip_reason=work.skip_reason)
+                    work.stage_timings[stage_name] = (start, time.perf_counter())
+
+                await out_queue.put(work)
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency[stage_name])])
+        for _ in range(num_downstream_workers):
+            await out_queue.put(None)
+
+    async def _run_in_thread(self, func: Callable, *args) -> Any:
+        """
+        Runs a function on the pipeline's thread pool, like `asyncio.to_thread()`, but keeps track of the call until
+        it has finished, even if the awaiting worker is cancelled, so that `arun()` can wait for it.
+        """
+        future: Future = self._executor.submit(contextvars.copy_context().run, func, *args)
+        self._thread_futures.add(future)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            if future.done():
+                self._thread_futures.discard(future)
+
+    async def _download(self, work: PipelineWorkItem):
+        """Downloads the PDF attachment of a work item on a worker thread."""
+        work.pdf = await self._run_in_thread(self.zotero_paper_embedder.download_pdf, work.item)
+        if work.pdf is None:
+            work.skip_reason = 'it has no associated PDF'
+            work.replaced_dockey = self._dockeys_by_docname.get(work.item['key'])
+
+    async def _parse(self, work: PipelineWorkItem):
+        """
+        Parses, token-counts and chunks the PDF of a work item on a worker thread.
+
+        The text chunks of the item's previously embedded version, if its page hashes are known, are read on the event
+        loop first, as the committer may be changing the `Docs` object's texts and compacting the chunk store.
+        """
+        previous_doc: Optional[paperqa.Doc] = None
+        previous_texts: List[paperqa.Text] = []
+        replaced_dockey: Optional[str] = self._dockeys_by_docname.get(work.item['key'])
+        if replaced_dockey is not None and self.zotero_paper_embedder.page_hash_index.get(replaced_dockey) is not None:
+            previous_doc = self.docs.docs.get(replaced_dockey)
+            previous_texts = [
+                paperqa.Text(text=text.text, name=text.name, doc=text.doc, embedding=text.embedding)
+                for text in self.docs.texts if text.doc.dockey == replaced_dockey
+            ]
+        await self._run_in_thread(self._parse_pdf, work, previous_doc, previous_texts)
+
+    def _parse_pdf(self, work: PipelineWorkItem, previous_doc: Optional[paperqa.Doc] = None,
+                   previous_texts: Optional[List[paperqa.Text]] = None):
+        """
+        Parses, token-counts and chunks the PDF of a work item.
+
+        The parsed text and token count are read from the embedder's `ParsedPdfCache`, so a PDF whose bytes have not
+        changed is never parsed again. A re-synced item whose PDF has not changed is skipped without being parsed
+        (unless its page hashes have not been recorded yet), and so is an item whose PDF is identical to an embedded
+        paper's. A re-synced item whose PDF has changed only has the pages whose text changed re-chunked, when the page
+        hashes of its previous version are known. Once chunked, an item whose text is a near duplicate of an embedded
+        paper is skipped or flagged, and any other item is claimed in the `DuplicateIndex`.
+
+        Raises
+        ------
+        ValueError
+            If the PDF does not contain any readable text.
+        """
+        dockey: str = md5sum(work.pdf)
+        replaced_dockey: Optional[str] = self._dockeys_by_docname.get(work.item['key'])
+        parsed_pdf_cache: ParsedPdfCache = self.zotero_paper_embedder.parsed_pdf_cache
+        page_hash_index: PageHashIndex = self.zotero_paper_embedder.page_hash_index
+        if replaced_dockey == dockey:
+            work.skip_reason = 'its PDF has not changed'
+            if page_hash_index.get(dockey) is None:
+                # Papers embedded before page hashes were recorded get them here, so their next change is incremental
+                page_hash_index.add(dockey, page_hash_index.page_hashes(parsed_pdf_cache.get(work.pdf).parsed_text))
+            return
+        work.replaced_dockey = replaced_dockey
+
+        duplicate_index: DuplicateIndex = self.zotero_paper_embedder.duplicate_index
+        sha256: str = parsed_pdf_cache.sha256(work.pdf)
+        work.duplicate_of = duplicate_index.find(sha256, dockey, exclude_docname=work.item['key'])
+        if work.duplicate_of is not None:
+            work.skip_reason = self._describe_duplicate(work.duplicate_of)
+            return
+
+        parsed_pdf: ParsedPdf = parsed_pdf_cache.get(work.pdf)
+        parsed_text: ParsedText = parsed_pdf.parsed_text
+
+        work.parsed_text = parsed_text
+        work.page_hashes = page_hash_index.page_hashes(parsed_text)
+        work.num_tokens = parsed_pdf_cache.count_tokens(work.pdf, self.tokenizer_model)
+        work.paper = ZoteroPaper(
+            key=self.zotero_paper_embedder._get_citation_key(work.item),
+            title=work.title,
+            pdf=work.pdf,
+            num_pages=parsed_pdf.num_pages,
+            details=work.item,
+            zotero_key=work.item['key'],
+        )
+
+        # The citation is generated by the embedding stage, and is shared by every chunk through `doc`
+        doc: paperqa.Doc = paperqa.Doc(docname=work.paper.zotero_key, citation='', dockey=dockey)
+        with self.zotero_paper_embedder.telemetry.span('parse.chunk') as span:
+            texts: Optional[List[paperqa.Text]] = None
+            previous_page_hashes: Optional[Dict[str, str]] = (
+                page_hash_index.get(replaced_dockey) if replaced_dockey is not None else None
+            )
+            if previous_page_hashes is not None and previous_texts:
+                texts = self._rechunk_changed_pages(work, doc, previous_page_hashes, previous_texts)
+            if texts is None:
+                texts = chunk_pdf(
+                    parsed_text, doc, chunk_chars=PipelineConstants.CHUNK_CHARS, overlap=PipelineConstants.CHUNK_OVERLAP
+                )
+            elif previous_doc is not None and texts and texts[0].text == previous_texts[0].text:
+                # The citation is generated from the first chunk, so it still applies
+                doc.citation = previous_doc.citation
+                doc.embedding = previous_doc.embedding
+            span.set(num_chunks=len(texts), num_reused_chunks=work.num_reused_texts)
+        if len(texts) == 0 or len(texts[0].text) < 10 or not maybe_is_text(texts[0].text):
+            raise ValueError(f"This does not look like a text document: {work.pdf}")
+
+        with self.zotero_paper_embedder.telemetry.span('parse.duplicates'):
+            work.duplicate_of = duplicate_index.claim(
+                work.item['key'], dockey, sha256, duplicate_index.signature(' '.join(text.text for text in texts)),
+                skip_near_duplicates=self.skip_near_duplicates
+            )
+        if work.duplicate_of is not None and (work.duplicate_of.exact or self.skip_near_duplicates):
+            work.skip_reason = self._describe_duplicate(work.duplicate_of)
+            return
+
+        work.doc = doc
+        work.texts = texts
+
+    def _rechunk_changed_pages(self, work: PipelineWorkItem, doc: paperqa.Doc, previous_page_hashes: Dict[str, str],
+                               previous_texts: List[paperqa.Text]) -> Optional[List[paperqa.Text]]:
+        """
+        Chunks a changed PDF by reusing the chunks of its previous version that only span unchanged pages, and
+        re-chunking every other page.
+
+        A previous chunk is reused, with its embedding, if none of the pages in its name changed and its text still
+        occurs in the text of those pages and the page before (which chunks can start in). The pages that changed, and
+        every page of a chunk that is not reused, are re-chunked in runs of consecutive pages.
+
+        Returns
+        -------
+        Optional[List[paperqa.Text]]
+            The reused and new chunks, in page order, or None if the page range of a previous chunk cannot be read
+            from its name, in which case the whole PDF must be re-chunked.
+        """
+        content: Dict[str, str] = work.parsed_text.content
+        pages: List[str] = list(content)
+        page_positions: Dict[str, int] = {page: position for position, page in enumerate(pages)}
+        changed_pages: Set[str] = {
+            page for page, page_hash in work.page_hashes.items() if previous_page_hashes.get(page) != page_hash
+        }
+        rechunked_pages: Set[str] = set(changed_pages)
+
+        chunks: List[Tuple[int, paperqa.Text]] = []
+        for text in previous_texts:
+            _, _, page_range = text.name.rpartition(' pages ')
+            first_page, _, last_page = page_range.partition('-')
+            if not first_page.isdigit() or not last_page.isdigit():
+                return None
+
+            chunk_pages: List[str] = [str(page) for page in range(int(first_page), int(last_page) + 1)]
+            if all(page in page_positions and page not in changed_pages for page in chunk_pages):
+                start: int = page_positions[chunk_pages[0]]
+                if text.text in ''.join(content[page] for page in pages[max(0, start - 1):start + len(chunk_pages)]):
+                    chunks.append((start, text.model_copy(update={'doc': doc})))
+                    continue
+            rechunked_pages.update(page for page in chunk_pages if page in page_positions)
+
+        work.num_reused_texts = len(chunks)
+        work.changed_pages = sorted(changed_pages, key=page_positions.__getitem__)
+        run: List[str] = []
+        for page in pages + [None]:
+            if page in rechunked_pages:
+                run.append(page)
+                continue
+            if run:
+                run_text: ParsedText = ParsedText(content={page: content[page] for page in run},
+                                                  metadata=work.parsed_text.metadata)
+                chunks.extend(
+                    (page_positions[run[0]], text) for text in chunk_pdf(
+                        run_text, doc, chunk_chars=PipelineConstants.CHUNK_CHARS,
+                        overlap=PipelineConstants.CHUNK_OVERLAP
+                    ) if text.text.strip()
+                )
+                run = []
+
+        return [text for _, text in sorted(chunks, key=lambda chunk: chunk[0])]
+
+    async def _embed(self, work: PipelineWorkItem):
+        """
+        Generates the citation of a work item and embeds its text chunks and citation.
+
+        Chunks and citations whose text has already been embedded are looked up in the embedder's `EmbeddingStore`
+        rather than embedded again. Chunks reused from the item's previous version already have their embedding, and
+        the citation is not generated again if it was reused as well.
+
+        Every API call goes through the embedder's `OpenAIRateLimiter` for the LLM or the embedding model, which
+        paces the calls to stay under the account's rate limits, and retries calls that are throttled anyway. The
+        number of tokens in each call is estimated from the token count of the PDF, pro rata to the characters sent.
+
+        Raises
+        ------
+        openai.RateLimitError
+            If the API rate limit is still exceeded once the rate limiter has exhausted its retries.
+        """
+        docs: paperqa.Docs = self.docs
+        telemetry: Telemetry = self.zotero_paper_embedder.telemetry
+        embedding_store: EmbeddingStore = self.zotero_paper_embedder.embedding_store
+        llm_rate_limiter: OpenAIRateLimiter = self.zotero_paper_embedder.llm_rate_limiter
+        embedding_rate_limiter: OpenAIRateLimiter = self.zotero_paper_embedder.embedding_rate_limiter
+        tokens_per_char: float = work.num_tokens / max(1, sum(len(text.text) for text in work.texts))
+
+        if not work.doc.citation:
+            cite_chain = docs.llm_model.make_chain(client=docs._client, prompt=docs.prompts.cite, skip_system=True)
+            with telemetry.span('embed.citation', model=docs.llm) as span:
+                citation_result: LLMResult = await llm_rate_limiter.call(
+                    lambda: cite_chain({'text': work.texts[0].text}, None),
+                    num_tokens=int(len(work.texts[0].text) * tokens_per_char) + PipelineConstants.CITATION_PROMPT_TOKENS
+                )
+                span.set(tokens_in=citation_result.prompt_count, tokens_out=citation_result.completion_count)
+            telemetry.increment('llm_tokens', citation_result.prompt_count, model=docs.llm, direction='in')
+            telemetry.increment('llm_tokens', citation_result.completion_count, model=docs.llm, direction='out')
+            citation: str = citation_result.text
+            if len(citation) < 3 or 'Unknown' in citation or 'insufficient' in citation:
+                citation = f"Unknown, {os.path.basename(work.pdf)}, {datetime.now().year}"
+            work.doc.citation = citation
+        citation = work.doc.citation
+
+        text_embeddings: List[Optional[List[float]]] = [
+            text.embedding if text.embedding is not None else embedding_store.lookup_embedding(text.text)
+            for text in work.texts
+        ]
+        unembedded_texts: List[str] = [
+            text.text for text, embedding in zip(work.texts, text_embeddings) if embedding is None
+        ]
+        telemetry.increment('cache_hits', len(work.texts) - work.num_reused_texts - len(unembedded_texts),
+                            cache='embedding')
+        telemetry.increment('reused_chunks', work.num_reused_texts)
+        telemetry.increment('cache_misses', len(unembedded_texts), cache='embedding')
+        if unembedded_texts:
+            num_tokens: int = int(sum(len(text) for text in unembedded_texts) * tokens_per_char)
+            with telemetry.span('embed.chunks', num_chunks=len(unembedded_texts), tokens_in=num_tokens):
+                new_embeddings: Iterator[List[float]] = iter(await embedding_rate_limiter.call(
+                    lambda: docs.texts_index.embedding_model.embed_documents(
+                        docs._embedding_client, texts=unembedded_texts
+                    ),
+                    num_tokens=num_tokens
+                ))
+            telemetry.increment('embedding_tokens', num_tokens, model=docs.texts_index.embedding_model.name)
+            text_embeddings = [
+                embedding if embedding is not None else next(new_embeddings) for embedding in text_embeddings
+            ]
+
+        if work.doc.embedding is None:
+            work.doc.embedding = embedding_store.lookup_embedding(citation)
+        if work.doc.embedding is None:
+            with telemetry.span('embed.citation_embedding'):
+                work.doc.embedding = (await embedding_rate_limiter.call(
+                    lambda: docs.docs_index.embedding_model.embed_documents(docs._embedding_client, texts=[citation]),
+                    num_tokens=int(len(citation) * tokens_per_char) + 1
+                ))[0]
+
+        for text, text_embedding in zip(work.texts, text_embeddings):
+            text.embedding = text_embedding
+
+    async def _commit(
+            self,
+            commit_queue: asyncio.Queue,
+            in_flight: asyncio.Semaphore,
+            on_commit: Callable[[PipelineWorkItem], bool]
+    ):
+        """
+        Commits embedded work items into the `Docs` object in batch order.
+
+        Work items arriving out of order are buffered until every earlier item has been committed. The previous
+        version of a re-synced item is removed from the embedder's `EmbeddingStore` and `DuplicateIndex` just before
+        the item is added, evicting its stale chunks and their vectors, and the page hashes of the version added are
+        recorded in the `PageHashIndex`. Items that claimed a place in the `DuplicateIndex` but were not committed
+        release it, and items skipped as duplicates are recorded as aliases of the paper they duplicate.
+        """
+        duplicate_index: DuplicateIndex = self.zotero_paper_embedder.duplicate_index
+        page_hash_index: PageHashIndex = self.zotero_paper_embedder.page_hash_index
+        pending: Dict[int, PipelineWorkItem] = {}
+        next_index: int = 0
+        while True:
+            work: Optional[PipelineWorkItem] = await commit_queue.get()
+            if work is None:
+                return
+
+            pending[work.index] = work
+            while next_index in pending:
+                work = pending.pop(next_index)
+                next_index += 1
+
+                if work.error is None and work.replaced_dockey is not None:
+                    self.zotero_paper_embedder.embedding_store.remove([work.replaced_dockey])
+                    duplicate_index.remove([work.replaced_dockey])
+                    page_hash_index.remove([work.replaced_dockey])
+
+                if work.skip_reason is None and work.error is None:
+                    start: float = time.perf_counter()
+                    with self.zotero_paper_embedder.telemetry.span('commit', zotero_key=work.item['key']):
+                        if not await self.docs.aadd_texts(work.texts, work.doc):
+                            work.skip_reason = 'its PDF has already been embedded'
+                        else:
+                            page_hash_index.add(work.doc.dockey, work.page_hashes)
+                    work.stage_timings['commit'] = (start, time.perf_counter())
+
+                if work.doc is not None and (work.skip_reason is not None or work.error is not None):
+                    duplicate_index.release(work.item['key'], work.doc.dockey)
+                elif work.duplicate_of is not None and work.skip_reason is not None:
+                    duplicate_index.add_alias(work.item['key'], work.duplicate_of.dockey)
+
+                self.metrics.record(work)
+                in_flight.release()
+                if not on_commit(work):
+                    return
+
+    @staticmethod
+    def _describe_duplicate(duplicate_of: DuplicateMatch) -> str:
+        """Returns why an item duplicating an embedded paper is skipped."""
+        if duplicate_of.exact:
+            return f"its PDF is identical to that of already embedded paper {duplicate_of.docname}"
+
+        return (f"it is a near duplicate of already embedded paper {duplicate_of.docname} (estimated text "
+                f"similarity {duplicate_of.similarity:.2f})")
@@ -0,0 +1,445 @@
+import os
+import re
+import sys
+import numpy as np
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import LexicalIndexConstants
+
+ELEMENT_SYMBOLS: frozenset = frozenset('''
+    H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb
+    Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au
+    Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts
+    Og
+'''.split())
+CAS_NUMBER_PATTERN: re.Pattern = re.compile(r'^(\d{2,7})-(\d{2})-(\d)$')
+SMILES_TOKEN_PATTERN: re.Pattern = re.compile(r'Cl|Br|[BCNOPSFI]|[bcnops]|\[[^\[\]]+\]|%\d{2}|\d|[-=#$:/\\().*~]')
+SMILES_PATTERN: re.Pattern = re.compile(rf'(?:{SMILES_TOKEN_PATTERN.pattern})+')
+SMILES_BRACKET_ATOM_PATTERN: re.Pattern = re.compile(
+    r'\[\d*(?P<symbol>[A-Z][a-z]?|[bcnops]|se|as|\*)(?:@@?)?(?:H\d?)?(?:[+-]+\d*)?(?::\d+)?\]'
+)
+FORMULA_PATTERN: re.Pattern = re.compile(r'(?:{}|\d+|[()\[\]/=#.+-])+'.format('|'.join(
+    sorted(ELEMENT_SYMBOLS | LexicalIndexConstants.FORMULA_GROUPS, key=len, reverse=True)
+)))
+SMILES_SYNTAX_CHARACTERS: frozenset = frozenset('()[]=#@/\\')
+PLAIN_WORD_PATTERN: re.Pattern = re.compile(r'[A-Za-z][a-z]{2,}')
+WORD_PATTERN: re.Pattern = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+DASHES: Dict[int, str] = {ord(dash): '-' for dash in '‐‑‒–—−'}
+WRAPPING_CHARACTERS: str = '"\'“”‘’,;:!?'
+
+
+def is_cas_number(token: str) -> bool:
+    """
+    Returns whether a token is a CAS Registry Number with a valid check digit, e.g. `50-78-2` (aspirin).
+
+    Parameters
+    ----------
+    token : str
+        The token.
+
+    Returns
+    -------
+    bool
+        True if the token has the form of a CAS number and its last digit is the checksum of the others.
+    """
+    match: Optional[re.Match] = CAS_NUMBER_PATTERN.match(token)
+    if match is None:
+        return False
+
+    digits: str = match.group(1) + match.group(2)
+    checksum: int = sum(position * int(digit) for position, digit in enumerate(reversed(digits), start=1))
+    return checksum % 10 == int(match.group(3))
+
+
+def is_smiles(token: str) -> bool:
+    """
+    Returns whether a token is a SMILES string, or a formula written like one such as `Pd(PPh3)4` or `Pd/C`.
+
+    Parameters
+    ----------
+    token : str
+        The token.
+
+    Returns
+    -------
+    bool
+        True if the token contains bond, branch, ring or bracket syntax, and is either a well-formed SMILES string
+        or a formula made only of element symbols and common group abbreviations (`Ph`, `OAc`, ...). Words joined by
+        SMILES syntax, such as `and/or`, `Suzuki/Heck` or `pH=7`, are not.
+    """
+    if (len(token) < LexicalIndexConstants.MIN_SMILES_LENGTH
+            or not any(character in SMILES_SYNTAX_CHARACTERS for character in token)
+            or token.count('(') != token.count(')') or token.count('[') != token.count(']')):
+        return False
+
+    parts: List[str] = [part for part in re.split(r'[^A-Za-z0-9]+', token) if part]
+    if parts and all(PLAIN_WORD_PATTERN.fullmatch(part) for part in parts):
+        return False
+
+    return _is_smiles_string(token) or FORMULA_PATTERN.fullmatch(token) is not None
+
+
+def _is_smiles_string(token: str) -> bool:
+    """
+    Returns whether a token is a well-formed SMILES string: it only contains organic subset atoms, bracket atoms of
+    real elements, bonds, branches and ring closures, every ring closure is opened and closed, and aromatic atoms are
+    in a ring.
+    """
+    if SMILES_PATTERN.fullmatch(token) is None:
+        return False
+
+    num_atoms: int = 0
+    is_aromatic: bool = False
+    ring_closures: Counter = Counter()
+    for smiles_token in SMILES_TOKEN_PATTERN.findall(token):
+        if smiles_token.startswith('['):
+            match: Optional[re.Match] = SMILES_BRACKET_ATOM_PATTERN.fullmatch(smiles_token)
+            if match is None:
+                return False
+            symbol: str = match.group('symbol')
+            if symbol[0].isupper() and symbol not in ELEMENT_SYMBOLS:
+                return False
+            num_atoms += 1
+            is_aromatic |= symbol.islower()
+        elif smiles_token[0].isalpha() or smiles_token == '*':
+            num_atoms += 1
+            is_aromatic |= smiles_token.islower()
+        elif smiles_token[0].isdigit() or smiles_token[0] == '%':
+            ring_closures[smiles_token] += 1
+
+    return (
+        num_atoms > 0
+        and all(count % 2 == 0 for count in ring_closures.values())
+        and (not is_aromatic or bool(ring_closures))
+    )
+
+
+def is_identifier(token: str) -> bool:
+    """
+    Returns whether a token, as returned by `tokenize()`, is an exact chemical identifier: a CAS number or a SMILES
+    string.
+
+    Parameters
+    ----------
+    token : str
+        The token.
+
+    Returns
+    -------
+    bool
+        True for CAS numbers and SMILES strings, False for words.
+    """
+    return is_cas_number(token) or is_smiles(token)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into search terms, keeping chemical identifiers intact.
+
+    Parameters
+    ----------
+    text : str
+        The text of a chunk or a query.
+
+    Returns
+    -------
+    List[str]
+        The terms, in order: each CAS number and SMILES string as it was written (SMILES are case-sensitive), and
+        every other word lower-cased, with hyphenated names such as `suzuki-miyaura` kept whole and also split into
+        their parts. Stop words are dropped.
+
+    Notes
+    -----
+    Text is split on whitespace before identifiers are recognised, so that the brackets, bonds and ring closures of
+    a SMILES string or the hyphens of a CAS number are not split like punctuation. Quotes, commas and other sentence
+    punctuation around a token are stripped first, as are a trailing full stop and enclosing or unbalanced brackets.
+    """
+    terms: List[str] = []
+    for raw_token in text.translate(DASHES).split():
+        token: str = _strip_brackets(raw_token.strip(WRAPPING_CHARACTERS).rstrip('.'))
+        token = token.strip(WRAPPING_CHARACTERS).rstrip('.')
+        if not token:
+            continue
+
+        if is_cas_number(token) or is_smiles(token):
+            terms.append(token)
+            continue
+
+        for word in WORD_PATTERN.findall(token.lower()):
+            if word in LexicalIndexConstants.STOP_WORDS:
+                continue
+            terms.append(word)
+            if '-' in word:
+                terms.extend(part for part in word.split('-') if part not in LexicalIndexConstants.STOP_WORDS)
+
+    return terms
+
+
+def _strip_brackets(token: str) -> str:
+    """
+    Strips the brackets around a token that are not matched within it, e.g. `(Pd(PPh3)4` -> `Pd(PPh3)4`, and a pair
+    of brackets enclosing the whole token, e.g. `(50-78-2)` -> `50-78-2`.
+    """
+    for opening, closing in ('()', '[]'):
+        while token.startswith(opening) and token.count(opening) > token.count(closing):
+            token = token[1:]
+        while token.endswith(closing) and token.count(closing) > token.count(opening):
+            token = token[:-1]
+        if token.startswith(opening) and token.endswith(closing) and _is_balanced(token[1:-1], opening, closing):
+            token = token[1:-1]
+
+    return token
+
+
+def _is_balanced(token: str, opening: str, closing: str) -> bool:
+    """Returns whether every closing bracket in a token closes an earlier opening bracket, and none are left open."""
+    depth: int = 0
+    for character in token:
+        depth += (character == opening) - (character == closing)
+        if depth < 0:
+            return False
+
+    return depth == 0
+
+
+class LexicalIndex:
+    """
+    An inverted index of text chunks, scored with Okapi BM25, in which chemical identifiers are single terms.
+
+    Rows are numbered in the order the chunks were added, so that they line up with the rows of the vector index of
+    the same chunks.
+
+    Attributes
+    ----------
+    k1 : float
+        The BM25 term frequency saturation parameter.
+    b : float
+        The BM25 document length normalisation parameter.
+
+    Methods
+    -------
+    add(texts: Iterable[str])
+        Indexes texts as the next rows.
+    remove_rows(keep: np.ndarray)
+        Removes rows, renumbering the rows that remain.
+    scores(terms: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]
+        Returns the rows containing any of the terms, and their BM25 scores.
+    rows_containing(terms: Iterable[str]) -> np.ndarray
+        Returns the rows containing any of the terms.
+    document_frequency(term: str) -> int
+        Returns the number of rows containing a term.
+    save(index_path: Union[str, Path], fingerprint: str)
+        Atomically saves the index.
+    load(index_path: Union[str, Path]) -> Optional[Tuple[LexicalIndex, str]]
+        Loads a saved index, and the fingerprint it was saved with.
+
+    Notes
+    -----
+    Each term's postings are two compact integer arrays, of rows and term frequencies, which are appended to as
+    chunks are added and scored with NumPy without being copied.
+    """
+    def __init__(self, k1: float = LexicalIndexConstants.BM25_K1, b: float = LexicalIndexConstants.BM25_B):
+        self.k1: float = k1
+        self.b: float = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._row_lengths: array = array('i')
+        self._total_length: int = 0
+
+    @property
+    def num_rows(self) -> int:
+        """Return the number of indexed rows."""
+        return len(self._row_lengths)
+
+    def add(self, texts: Iterable[str]):
+        """
+        Indexes texts as the next rows.
+
+        Parameters
+        ----------
+        texts : Iterable[str]
+            The texts of the chunks.
+        """
+        for text in texts:
+            row: int = len(self._row_lengths)
+            term_counts: Counter = Counter(tokenize(text))
+            for term, count in term_counts.items():
+                postings: Optional[Tuple[array, array]] = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array('i'), array('i'))
+                postings[0].append(row)
+                postings[1].append(count)
+            length: int = sum(term_counts.values())
+            self._row_lengths.append(length)
+            self._total_length += length
+
+    def remove_rows(self, keep: np.ndarray):
+        """
+        Removes rows, renumbering the rows that remain in order.
+
+        Parameters
+        ----------
+        keep : np.ndarray
+            A boolean mask with one entry per row, False for the rows to remove.
+        """
+        new_rows: np.ndarray = (np.cumsum(keep) - 1).astype(np.int32)
+        for term in list(self._postings):
+            rows, counts = self._arrays(term)
+            kept: np.ndarray = keep[rows]
+            if not kept.any():
+                del self._postings[term]
+            elif not kept.all():
+                self._postings[term] = (array('i', new_rows[rows[kept]].tobytes()),
+                                        array('i', counts[kept].tobytes()))
+            else:
+                self._postings[term] = (array('i', new_rows[rows].tobytes()), self._postings[term][1])
+
+        row_lengths: np.ndarray = np.frombuffer(self._row_lengths, dtype=np.int32)[keep]
+        self._row_lengths = array('i', row_lengths.tobytes())
+        self._total_length = int(row_lengths.sum())
+
+    def scores(self, terms: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows containing any of the terms, and their BM25 scores.
+
+        Parameters
+        ----------
+        terms : Iterable[str]
+            The query terms, as returned by `tokenize()`. Repeated terms count once.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The matching rows, in ascending order, and their scores.
+        """
+        matched_terms: List[str] = [term for term in dict.fromkeys(terms) if term in self._postings]
+        if not matched_terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        row_lengths: np.ndarray = np.frombuffer(self._row_lengths, dtype=np.int32)
+        average_length: float = max(self._total_length / max(self.num_rows, 1), 1.0)
+        totals: np.ndarray = np.zeros(self.num_rows, dtype=np.float32)
+        for term in matched_terms:
+            rows, counts = self._arrays(term)
+            idf: float = np.log1p((self.num_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            normalisation: np.ndarray = self.k1 * (1 - self.b + self.b * row_lengths[rows] / average_length)
+            totals[rows] += idf * counts * (self.k1 + 1) / (counts + normalisation)
+
+        matched_rows: np.ndarray = self.rows_containing(matched_terms)
+        return matched_rows, totals[matched_rows]
+
+    def rows_containing(self, terms: Iterable[str]) -> np.ndarray:
+        """
+        Returns the rows containing any of the terms.
+
+        Parameters
+        ----------
+        terms : Iterable[str]
+            The terms.
+
+        Returns
+        -------
+        np.ndarray
+            The rows, in ascending order.
+        """
+        postings: List[np.ndarray] = [self._arrays(term)[0] for term in set(terms) if term in self._postings]
+        if not postings:
+            return np.zeros(0, dtype=np.int32)
+
+        return np.unique(np.concatenate(postings))
+
+    def document_frequency(self, term: str) -> int:
+        """
+        Returns the number of rows containing a term.
+
+        Parameters
+        ----------
+        term : str
+            The term.
+
+        Returns
+        -------
+        int
+            The document frequency of the term.
+        """
+        postings: Optional[Tuple[array, array]] = self._postings.get(term)
+        return len(postings[0]) if postings is not None else 0
+
+    def save(self, index_path: Union[str, Path], fingerprint: str):
+        """
+        Atomically saves the index.
+
+        Parameters
+        ----------
+        index_path : Union[str, Path]
+            The path of the index file.
+        fingerprint : str
+            A hash identifying the indexed chunks, checked by the caller when the index is loaded.
+        """
+        terms: List[str] = list(self._postings)
+        lengths: np.ndarray = np.fromiter((len(self._postings[term][0]) for term in terms), dtype=np.int64,
+                                          count=len(terms))
+        index_temp_path: str = f"{index_path}.{os.getpid()}.tmp"
+        with open(index_temp_path, 'wb') as file:
+            np.savez(
+                file,
+                fingerprint=np.array(fingerprint),
+                parameters=np.array([self.k1, self.b, LexicalIndexConstants.TOKENIZER_VERSION]),
+                terms=np.frombuffer('\0'.join(terms).encode('utf-8'), dtype=np.uint8),
+                offsets=np.concatenate([[0], np.cumsum(lengths)]),
+                rows=np.concatenate([self._arrays(term)[0] for term in terms] or [np.zeros(0, dtype=np.int32)]),
+                counts=np.concatenate([self._arrays(term)[1] for term in terms] or [np.zeros(0, dtype=np.int32)]),
+                row_lengths=np.frombuffer(self._row_lengths, dtype=np.int32)
+            )
+        os.replace(index_temp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path: Union[str, Path]) -> Optional[Tuple['LexicalIndex', str]]:
+        """
+        Loads a saved index, and the fingerprint it was saved with.
+
+        Parameters
+        ----------
+        index_path : Union[str, Path]
+            The path of the index file.
+
+        Returns
+        -------
+        Optional[Tuple[LexicalIndex, str]]
+            The index and its fingerprint, or None if the file is missing, unreadable, or was saved with other BM25
+            parameters or another version of the tokenizer.
+        """
+        try:
+            with np.load(index_path) as saved:
+                k1, b, tokenizer_version = saved['parameters'].tolist()
+                if (k1, b, tokenizer_version) != (LexicalIndexConstants.BM25_K1, LexicalIndexConstants.BM25_B,
+                                                  LexicalIndexConstants.TOKENIZER_VERSION):
+                    return None
+                fingerprint: str = str(saved['fingerprint'])
+                terms_bytes: bytes = saved['terms'].tobytes()
+                offsets: np.ndarray = saved['offsets']
+                rows: np.ndarray = saved['rows'].astype(np.int32, copy=False)
+                counts: np.ndarray = saved['counts'].astype(np.int32, copy=False)
+                row_lengths: np.ndarray = saved['row_lengths'].astype(np.int32, copy=False)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        lexical_index: LexicalIndex = cls(k1, b)
+        terms: List[str] = terms_bytes.decode('utf-8').split('\0') if terms_bytes else []
+        for position, term in enumerate(terms):
+            start, end = int(offsets[position]), int(offsets[position + 1])
+            lexical_index._postings[term] = (array('i', rows[start:end].tobytes()),
+                                             array('i', counts[start:end].tobytes()))
+        lexical_index._row_lengths = array('i', row_lengths.tobytes())
+        lexical_index._total_length = int(row_lengths.sum())
+
+        return lexical_index, fingerprint
+
+    def _arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns views of a term's postings as NumPy arrays of rows and term frequencies."""
+        rows, counts = self._postings[term]
+        return np.frombuffer(rows, dtype=np.int32), np.frombuffer(counts, dtype=np.int32)
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Any, Callable, Optional, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import LibraryMetadataConstants
+
+
+class LibraryMetadata(BaseModel):
+    """
+    The size and version of a Zotero library, as last fetched from the Zotero API.
+
+    Attributes
+    ----------
+    library_id : Optional[str]
+        The ID of the Zotero library.
+    library_type : str
+        The type of the Zotero library, 'user' or 'group'.
+    num_items : Optional[int]
+        The number of top-level items in the library, or None if it has never been fetched.
+    library_version : Optional[int]
+        The latest version of the library, or None if it has never been fetched.
+    refreshed_at : Optional[float]
+        When the metadata was last fetched, as a Unix timestamp.
+
+    Methods
+    -------
+    age() -> float
+        Returns the number of seconds since the metadata was last fetched.
+    """
+    library_id: Optional[str] = None
+    library_type: str = 'user'
+    num_items: Optional[int] = None
+    library_version: Optional[int] = None
+    refreshed_at: Optional[float] = None
+
+    def age(self) -> float:
+        """
+        Returns the number of seconds since the metadata was last fetched.
+
+        Returns
+        -------
+        float
+            The age of the metadata, or infinity if it has never been fetched.
+        """
+        return time.time() - self.refreshed_at if self.refreshed_at is not None else float('inf')
+
+
+class LibraryMetadataCache:
+    """
+    A local cache of a Zotero library's item count and version, refreshed from the Zotero API in the background.
+
+    Reading the cache never touches the network, so the GUI can show the size of the library as soon as its window
+    opens (even offline), while a background thread fetches the current values and saves them for the next start.
+
+    Attributes
+    ----------
+    path : Path
+        The JSON file in which the metadata is cached.
+    library_id : Optional[str]
+        The ID of the Zotero library.
+    library_type : str
+        The type of the Zotero library, 'user' or 'group'.
+    api_key : Optional[str]
+        The Zotero API key, used if no Zotero client is given when refreshing.
+    endpoint : Optional[str]
+        The base URL of the Zotero web API, if not the default.
+    metadata : LibraryMetadata
+        The cached metadata.
+
+    Methods
+    -------
+    refresh(client: Optional[Any] = None) -> LibraryMetadata
+        Fetches the item count and version of the library, and saves them.
+    refresh_in_background(on_refresh: Optional[Callable[[LibraryMetadata], None]] = None,
+                          on_error: Optional[Callable[[Exception], None]] = None) -> threading.Thread
+        Refreshes the metadata on a daemon thread.
+    get(max_age_seconds: float, client: Optional[Any] = None) -> LibraryMetadata
+        Returns the metadata, refreshing it first if it is older than a given age.
+    update(**fields)
+        Updates and saves some of the metadata, e.g. the library version reached by a sync.
+
+    Notes
+    -----
+    `pyzotero` is only imported by the first refresh without a client, so creating the cache and reading it stays
+    cheap. Refreshes are serialised by a lock, so a background refresh and one made by the embedder never interleave
+    their writes.
+    """
+    def __init__(self, path: Union[str, Path], library_id: Optional[str], library_type: str = 'user',
+                 api_key: Optional[str] = None, endpoint: Optional[str] = None):
+        self.path: Path = Path(path)
+        self.library_id: Optional[str] = library_id
+        self.library_type: str = library_type
+        self.api_key: Optional[str] = api_key
+        self.endpoint: Optional[str] = endpoint
+        self.metadata: LibraryMetadata = self._load()
+        self._lock: threading.Lock = threading.Lock()
+
+    def refresh(self, client: Optional[Any] = None) -> LibraryMetadata:
+        """
+        Fetches the item count and version of the library from the Zotero API, and saves them.
+
+        Parameters
+        ----------
+        client : Any, optional
+            A `pyzotero.zotero.Zotero` client for the library, e.g. a `ZoteroPaperEmbedder`. By default, a new client
+            is created from the cache's library ID, type, API key and endpoint.
+
+        Returns
+        -------
+        LibraryMetadata
+            The refreshed metadata.
+
+        Raises
+        ------
+        Exception
+            Any error raised by the Zotero API, e.g. when offline. The cached metadata is then left unchanged.
+        """
+        if client is None:
+            from pyzotero import zotero
+            client = zotero.Zotero(self.library_id, self.library_type, self.api_key)
+            if self.endpoint is not None:
+                client.endpoint = self.endpoint
+
+        num_items: int = int(client.num_items())
+        library_version: int = int(client.last_modified_version())
+        self.update(num_items=num_items, library_version=library_version, refreshed_at=time.time())
+
+        return self.metadata
+
+    def refresh_in_background(self, on_refresh: Optional[Callable[[LibraryMetadata], None]] = None,
+                              on_error: Optional[Callable[[Exception], None]] = None) -> threading.Thread:
+        """
+        Refreshes the metadata on a daemon thread.
+
+        Parameters
+        ----------
+        on_refresh : Callable[[LibraryMetadata], None], optional
+            Called on the refresh thread with the refreshed metadata.
+        on_error : Callable[[Exception], None], optional
+            Called on the refresh thread if the refresh fails, e.g. when offline.
+
+        Returns
+        -------
+        threading.Thread
+            The started refresh thread.
+        """
+        def run():
+            try:
+                metadata: LibraryMetadata = self.refresh()
+            except Exception as error:
+                if on_error is not None:
+                    on_error(error)
+            else:
+                if on_refresh is not None:
+                    on_refresh(metadata)
+
+        thread: threading.Thread = threading.Thread(
+            target=run, name=LibraryMetadataConstants.REFRESH_THREAD_NAME, daemon=True
+        )
+        thread.start()
+        return thread
+
+    def get(self, max_age_seconds: float = LibraryMetadataConstants.MAX_AGE_SECONDS,
+            client: Optional[Any] = None) -> LibraryMetadata:
+        """
+        Returns the metadata, refreshing it first if it is older than a given age.
+
+        Parameters
+        ----------
+        max_age_seconds : float
+            The maximum age of cached metadata that is returned without a refresh.
+        client : Any, optional
+            The Zotero client used for the refresh, as for `refresh()`.
+
+        Returns
+        -------
+        LibraryMetadata
+            The metadata.
+
+        Raises
+        ------
+        Exception
+            Any error raised by the Zotero API, if the metadata is stale and has never been fetched. If it has been
+            fetched before, the stale metadata is returned instead.
+        """
+        if self.metadata.age() <= max_age_seconds:
+            return self.metadata
+
+        try:
+            return self.refresh(client)
+        except Exception:
+            if self.metadata.num_items is None:
+                raise
+            return self.metadata
+
+    def update(self, **fields):
+        """
+        Updates some of the metadata and atomically saves it.
+
+        Parameters
+        ----------
+        **fields
+            The `LibraryMetadata` fields to update, e.g. `library_version`.
+        """
+        with self._lock:
+            self.metadata = self.metadata.model_copy(update=fields)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path: Path = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.metadata.model_dump(), file)
+            os.replace(temp_path, self.path)
+
+    def _load(self) -> LibraryMetadata:
+        """Reads the cached metadata, or returns empty metadata if it is missing or belongs to another library."""
+        empty: LibraryMetadata = LibraryMetadata(library_id=self.library_id, library_type=self.library_type)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                metadata: LibraryMetadata = LibraryMetadata(**json.load(file))
+        except (FileNotFoundError, ValueError, TypeError):
+            return empty
+
+        if metadata.library_id != self.library_id or metadata.library_type != self.library_type:
+            return empty
+        return metadata
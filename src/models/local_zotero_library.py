@@ -0,0 +1,588 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Generator, Iterable, List, Optional, Set, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import LocalZoteroConstants
+
+
+class LocalZoteroLibrary:
+    """
+    A read-only source of Zotero items and PDF attachments, read directly from a local Zotero data directory rather
+    than through the Zotero web API.
+
+    Zotero keeps its library in a `zotero.sqlite` database and the files of its stored attachments in a `storage/`
+    directory, both of which are kept up to date by the Zotero desktop client's sync. Reading them instead of the web
+    API lists the whole library without any network round trips, and PDFs are read in place rather than downloaded.
+
+    Items are returned in the same form as the Zotero web API returns them, with `key`, `version`, `links` and `data`
+    fields, so they can be ingested, cited and deduplicated exactly like items listed through the API.
+
+    Attributes
+    ----------
+    data_dir : Path
+        The Zotero data directory, containing `zotero.sqlite` and `storage/`.
+    library_type : str
+        The type of the Zotero library, 'user' or 'group'.
+    library_id : Optional[str]
+        The ID of the group, for a group library. Unused for the user library, which is the only one in the database.
+    base_attachment_dir : Optional[Path]
+        The base directory of linked files stored with relative paths (Zotero's "Linked Attachment Base Directory"),
+        or None if those attachments should be ignored.
+
+    Methods
+    -------
+    iterate_pages(limit: int, start: int, q: Optional[str] = None, qmode: Optional[str] = None,
+                  since: Optional[int] = None, tag: Optional[str] = None, sort: Optional[str] = None,
+                  direction: Optional[str] = None,
+                  collection_name: Optional[str] = None) -> Generator[List[dict], None, None]
+        Lazily iterates over pages of top-level items matching a query.
+    items_by_key(keys: Iterable[str]) -> List[dict]
+        Returns the items with given keys, including items in the trash.
+    pdf_path(attachment_key: str) -> Optional[Path]
+        Returns the local path of a PDF attachment, if its file exists.
+    item_versions(since: int = 0) -> Dict[str, int]
+        Returns the version of every item, including attachments and notes, modified since a library version.
+    missing_keys(keys: Iterable[str]) -> Set[str]
+        Returns the keys of the given items that no longer exist in the library, e.g. after emptying the trash.
+    collection_names() -> Dict[str, str]
+        Returns the name of every collection in the library, by key.
+    num_items() -> int
+        Returns the number of top-level items in the library, outside the trash.
+    last_modified_version() -> int
+        Returns the library version the local database was last synced to.
+
+    Notes
+    -----
+    The database is only ever opened read-only, so it is safe to read while Zotero is running. As Zotero normally
+    holds an exclusive lock on its database while it is open, a locked database is copied to a temporary snapshot
+    (with its write-ahead log, if any), which is read instead and refreshed whenever the database changes. Every
+    query uses its own connection, so a library can be read from several threads at once.
+
+    Searches follow the web API's semantics where they apply: `q` matches titles and creators (or every field with
+    `qmode='everything'`), `tag` may combine tags with ` || `, items in the trash are excluded, and `since` selects
+    the items whose version is newer than a library version.
+    """
+    def __init__(self, data_dir: Union[str, Path], library_type: str = 'user', library_id: Optional[str] = None,
+                 base_attachment_dir: Optional[Union[str, Path]] = None):
+        self.data_dir: Path = Path(data_dir).expanduser()
+        self.library_type: str = library_type
+        self.library_id: Optional[str] = library_id
+        self.base_attachment_dir: Optional[Path] = (
+            Path(base_attachment_dir).expanduser() if base_attachment_dir is not None else None
+        )
+        self._database_path: Path = self.data_dir / LocalZoteroConstants.DATABASE_FILE_NAME
+        if not self._database_path.is_file():
+            raise FileNotFoundError(f"No Zotero database found at {self._database_path}")
+
+        self._lock: threading.Lock = threading.Lock()
+        self._pdf_paths: Dict[str, Optional[Path]] = {}
+        self._snapshot_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._snapshot_signature: Optional[Tuple[int, int]] = None
+        self._is_locked: bool = False
+        self._library_row_id: Optional[int] = None
+
+    def iterate_pages(
+            self,
+            limit: int,
+            start: int = 0,
+            q: Optional[str] = None,
+            qmode: Optional[str] = None,
+            since: Optional[int] = None,
+            tag: Optional[str] = None,
+            sort: Optional[str] = None,
+            direction: Optional[str] = None,
+            collection_name: Optional[str] = None
+    ) -> Generator[List[dict], None, None]:
+        """
+        Lazily iterates over pages of top-level items matching a query, outside the trash.
+
+        The parameters are the same as for `ZoteroPaperEmbedder.iterate()`.
+
+        Yields
+        ------
+        List[dict]
+            The items in the page, of up to `LocalZoteroConstants.PAGE_SIZE` items each, in the web API's format.
+
+        Raises
+        ------
+        ValueError
+            If the collection does not exist, or if the sort field is not supported.
+        """
+        with self._connect() as connection:
+            conditions, parameters = self._item_conditions(connection, q, qmode, since, tag, collection_name)
+            order_by: str = self._order_by(sort, direction)
+            item_ids: List[int] = [
+                row[0] for row in connection.execute(
+                    f"SELECT items.itemID FROM items WHERE {' AND '.join(conditions)} ORDER BY {order_by} "
+                    f"LIMIT ? OFFSET ?",
+                    parameters + [limit, start]
+                )
+            ]
+
+        for page_start in range(0, len(item_ids), LocalZoteroConstants.PAGE_SIZE):
+            with self._connect() as connection:
+                yield self._load_items(connection, item_ids[page_start:page_start + LocalZoteroConstants.PAGE_SIZE])
+
+    def items_by_key(self, keys: Iterable[str]) -> List[dict]:
+        """
+        Returns the items with given keys, including items in the trash, which are marked as `deleted`.
+
+        Parameters
+        ----------
+        keys : Iterable[str]
+            The Zotero keys of the items.
+
+        Returns
+        -------
+        List[dict]
+            The items that exist in the library, in the web API's format.
+        """
+        keys = list(keys)
+        items: List[dict] = []
+        with self._connect() as connection:
+            for batch_start in range(0, len(keys), LocalZoteroConstants.PAGE_SIZE):
+                batch_keys: List[str] = keys[batch_start:batch_start + LocalZoteroConstants.PAGE_SIZE]
+                item_ids: List[int] = [row[0] for row in connection.execute(
+                    f"SELECT itemID FROM items WHERE libraryID = ? AND key IN ({self._placeholders(batch_keys)})",
+                    [self._library_id(connection)] + batch_keys
+                )]
+                items.extend(self._load_items(connection, item_ids, include_children=True))
+
+        return items
+
+    def pdf_path(self, attachment_key: str) -> Optional[Path]:
+        """
+        Returns the local path of a PDF attachment, if its file exists.
+
+        Parameters
+        ----------
+        attachment_key : str
+            The Zotero key of the attachment, as linked from its parent item.
+
+        Returns
+        -------
+        Optional[Path]
+            The path to the PDF, or None if the attachment is not a stored or linked file, or its file has not been
+            synced to this computer.
+        """
+        with self._lock:
+            if attachment_key in self._pdf_paths:
+                return self._pdf_paths[attachment_key]
+
+        with self._connect() as connection:
+            row: Optional[sqlite3.Row] = connection.execute(
+                "SELECT itemAttachments.linkMode, itemAttachments.path FROM items JOIN itemAttachments "
+                "USING (itemID) WHERE items.libraryID = ? AND items.key = ?",
+                (self._library_id(connection), attachment_key)
+            ).fetchone()
+
+        pdf_path: Optional[Path] = (
+            self._resolve_path(attachment_key, row['linkMode'], row['path']) if row is not None else None
+        )
+        with self._lock:
+            self._pdf_paths[attachment_key] = pdf_path
+
+        return pdf_path
+
+    def item_versions(self, since: int = 0) -> Dict[str, int]:
+        """
+        Returns the version of every item, including attachments and notes, modified since a library version.
+
+        Parameters
+        ----------
+        since : int
+            The library version, e.g. of the last sync.
+
+        Returns
+        -------
+        Dict[str, int]
+            The version of each item whose version is newer than `since`, by key.
+        """
+        with self._connect() as connection:
+            return {
+                row['key']: row['version'] for row in connection.execute(
+                    "SELECT key, version FROM items WHERE libraryID = ? AND version > ?",
+                    (self._library_id(connection), int(since))
+                )
+            }
+
+    def missing_keys(self, keys: Iterable[str]) -> Set[str]:
+        """
+        Returns the keys of the given items that no longer exist in the library, e.g. after emptying the trash.
+
+        The local database keeps no record of purged items, so unlike the web API's deletion log, this checks the
+        given keys against the items that still exist.
+
+        Parameters
+        ----------
+        keys : Iterable[str]
+            The Zotero keys of the items.
+
+        Returns
+        -------
+        Set[str]
+            The keys that do not match any item.
+        """
+        missing_keys: Set[str] = set(keys)
+        with self._connect() as connection:
+            existing_keys: Set[str] = {
+                row[0] for row in connection.execute(
+                    "SELECT key FROM items WHERE libraryID = ?", (self._library_id(connection),)
+                )
+            }
+
+        return missing_keys - existing_keys
+
+    def collection_names(self) -> Dict[str, str]:
+        """
+        Returns the name of every collection in the library.
+
+        Returns
+        -------
+        Dict[str, str]
+            The name of each collection, by key.
+        """
+        with self._connect() as connection:
+            return {
+                row['key']: row['collectionName'] for row in connection.execute(
+                    "SELECT key, collectionName FROM collections WHERE libraryID = ?", (self._library_id(connection),)
+                )
+            }
+
+    def num_items(self) -> int:
+        """
+        Returns the number of top-level items in the library, outside the trash.
+
+        Returns
+        -------
+        int
+            The number of items.
+        """
+        with self._connect() as connection:
+            conditions, parameters = self._item_conditions(connection)
+            return connection.execute(
+                f"SELECT COUNT(*) FROM items WHERE {' AND '.join(conditions)}", parameters
+            ).fetchone()[0]
+
+    def last_modified_version(self) -> int:
+        """
+        Returns the library version the local database was last synced to.
+
+        Returns
+        -------
+        int
+            The library version, or 0 if the library has never been synced.
+        """
+        with self._connect() as connection:
+            row: Optional[sqlite3.Row] = connection.execute(
+                "SELECT version FROM libraries WHERE libraryID = ?", (self._library_id(connection),)
+            ).fetchone()
+
+        return int(row[0] or 0) if row is not None else 0
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        Opens a read-only connection to the database, or to a snapshot of it once Zotero has been found to lock it.
+
+        Yields
+        ------
+        sqlite3.Connection
+            The connection, which is closed on exit.
+        """
+        connection: Optional[sqlite3.Connection] = None
+        if not self._is_locked:
+            connection = sqlite3.connect(
+                f"{self._database_path.resolve().as_uri()}?mode=ro", uri=True,
+                timeout=LocalZoteroConstants.LOCK_TIMEOUT_SECONDS, check_same_thread=False
+            )
+            try:
+                connection.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            except sqlite3.OperationalError as error:
+                connection.close()
+                if 'locked' not in str(error):
+                    raise
+                # Zotero keeps the database locked while it is open, so the snapshot is read from now on
+                self._is_locked = True
+                connection = None
+        if connection is None:
+            connection = sqlite3.connect(
+                f"{self._snapshot().as_uri()}?mode=ro&immutable=1", uri=True, check_same_thread=False
+            )
+
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def _snapshot(self) -> Path:
+        """Returns a copy of the locked database, copying it again if the database has changed since."""
+        with self._lock:
+            stat: os.stat_result = self._database_path.stat()
+            wal_path: Path = self._database_path.with_name(f"{self._database_path.name}-wal")
+            wal_stat: Optional[os.stat_result] = wal_path.stat() if wal_path.exists() else None
+            signature: Tuple[int, int] = (
+                stat.st_mtime_ns + (wal_stat.st_mtime_ns if wal_stat is not None else 0),
+                stat.st_size + (wal_stat.st_size if wal_stat is not None else 0)
+            )
+            if self._snapshot_dir is None:
+                self._snapshot_dir = tempfile.TemporaryDirectory(prefix='zotero-snapshot-')
+            snapshot_path: Path = Path(self._snapshot_dir.name) / self._database_path.name
+            if signature != self._snapshot_signature:
+                shutil.copyfile(self._database_path, snapshot_path)
+                snapshot_wal_path: Path = snapshot_path.with_name(wal_path.name)
+                if wal_stat is not None:
+                    shutil.copyfile(wal_path, snapshot_wal_path)
+                else:
+                    snapshot_wal_path.unlink(missing_ok=True)
+                self._snapshot_signature = signature
+
+            return snapshot_path
+
+    def _library_id(self, connection: sqlite3.Connection) -> int:
+        """Returns the database ID of the library, the user library or a group's."""
+        if self._library_row_id is None:
+            if self.library_type == 'group':
+                row: Optional[sqlite3.Row] = connection.execute(
+                    "SELECT libraryID FROM groups WHERE groupID = ?", (int(self.library_id),)
+                ).fetchone()
+            else:
+                row = connection.execute("SELECT libraryID FROM libraries WHERE type = 'user'").fetchone()
+            if row is None:
+                raise ValueError(f"The Zotero database has no {self.library_type} library {self.library_id or ''}")
+            self._library_row_id = int(row[0])
+
+        return self._library_row_id
+
+    def _item_conditions(self, connection: sqlite3.Connection, q: Optional[str] = None, qmode: Optional[str] = None,
+                         since: Optional[int] = None, tag: Optional[str] = None,
+                         collection_name: Optional[str] = None) -> Tuple[List[str], list]:
+        """Returns the SQL conditions, and their parameters, selecting the top-level items matching a query."""
+        conditions: List[str] = [
+            "items.libraryID = ?",
+            "items.itemTypeID NOT IN (SELECT itemTypeID FROM itemTypes WHERE typeName IN "
+            "('attachment', 'note', 'annotation'))",
+            "items.itemID NOT IN (SELECT itemID FROM deletedItems)"
+        ]
+        parameters: list = [self._library_id(connection)]
+
+        if q is not None:
+            pattern: str = f"%{q}%"
+            if qmode == 'everything':
+                conditions.append(
+                    "items.itemID IN (SELECT itemID FROM itemData JOIN itemDataValues USING (valueID) "
+                    "WHERE value LIKE ?)"
+                )
+                parameters.append(pattern)
+            else:
+                conditions.append(
+                    "(items.itemID IN (SELECT itemID FROM itemData JOIN itemDataValues USING (valueID) "
+                    "JOIN fields USING (fieldID) WHERE fieldName = 'title' AND value LIKE ?) OR "
+                    "items.itemID IN (SELECT itemID FROM itemCreators JOIN creators USING (creatorID) "
+                    "WHERE firstName LIKE ? OR lastName LIKE ?))"
+                )
+                parameters.extend([pattern] * 3)
+        if since is not None:
+            conditions.append("items.version > ?")
+            parameters.append(int(since))
+        if tag is not None:
+            tag_names: List[str] = [name.strip() for name in tag.split('||')]
+            conditions.append(
+                f"items.itemID IN (SELECT itemID FROM itemTags JOIN tags USING (tagID) "
+                f"WHERE name IN ({self._placeholders(tag_names)}))"
+            )
+            parameters.extend(tag_names)
+        if collection_name is not None:
+            row: Optional[sqlite3.Row] = connection.execute(
+                "SELECT collectionID FROM collections WHERE libraryID = ? AND collectionName = ?",
+                (self._library_id(connection), collection_name)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"No collection named {collection_name} in the local Zotero library")
+            conditions.append("items.itemID IN (SELECT itemID FROM collectionItems WHERE collectionID = ?)")
+            parameters.append(row[0])
+
+        return conditions, parameters
+
+    @staticmethod
+    def _order_by(sort: Optional[str], direction: Optional[str]) -> str:
+        """Returns the SQL ordering of items for a web API sort field and direction."""
+        columns: Dict[str, str] = {
+            'dateAdded': "items.dateAdded",
+            'dateModified': "items.dateModified",
+            'title': "(SELECT value FROM itemData JOIN itemDataValues USING (valueID) JOIN fields USING (fieldID) "
+                     "WHERE itemData.itemID = items.itemID AND fieldName = 'title') COLLATE NOCASE"
+        }
+        sort = sort or 'dateModified'
+        if sort not in columns:
+            raise ValueError(f"Sorting a local Zotero library by {sort} is not supported")
+
+        order: str = 'ASC' if direction == 'asc' or (direction is None and sort == 'title') else 'DESC'
+        return f"{columns[sort]} {order}, items.itemID {order}"
+
+    def _load_items(self, connection: sqlite3.Connection, item_ids: List[int],
+                    include_children: bool = False) -> List[dict]:
+        """Loads items, in the order of their IDs, in the web API's format."""
+        if not item_ids:
+            return []
+
+        placeholders: str = self._placeholders(item_ids)
+        rows: Dict[int, sqlite3.Row] = {
+            row['itemID']: row for row in connection.execute(
+                f"SELECT items.itemID, items.key, items.version, items.dateAdded, items.dateModified, "
+                f"itemTypes.typeName, items.itemID IN (SELECT itemID FROM deletedItems) AS deleted, "
+                f"itemAttachments.parentItemID, itemAttachments.contentType, "
+                f"(SELECT parents.key FROM items AS parents WHERE parents.itemID = itemAttachments.parentItemID) "
+                f"AS parentKey "
+                f"FROM items JOIN itemTypes USING (itemTypeID) LEFT JOIN itemAttachments USING (itemID) "
+                f"WHERE items.itemID IN ({placeholders})",
+                item_ids
+            )
+        }
+        fields: Dict[int, Dict[str, str]] = {item_id: {} for item_id in rows}
+        for row in connection.execute(
+            f"SELECT itemID, fieldName, value FROM itemData JOIN fields USING (fieldID) "
+            f"JOIN itemDataValues USING (valueID) WHERE itemID IN ({placeholders})",
+            item_ids
+        ):
+            fields[row['itemID']][row['fieldName']] = row['value']
+        creators: Dict[int, List[dict]] = {item_id: [] for item_id in rows}
+        for row in connection.execute(
+            f"SELECT itemID, creatorType, firstName, lastName, fieldMode FROM itemCreators "
+            f"JOIN creators USING (creatorID) JOIN creatorTypes USING (creatorTypeID) "
+            f"WHERE itemID IN ({placeholders}) ORDER BY itemID, orderIndex",
+            item_ids
+        ):
+            creators[row['itemID']].append(
+                {'creatorType': row['creatorType'], 'name': row['lastName']} if row['fieldMode'] == 1 else
+                {'creatorType': row['creatorType'], 'firstName': row['firstName'], 'lastName': row['lastName']}
+            )
+        tags: Dict[int, List[dict]] = {item_id: [] for item_id in rows}
+        for row in connection.execute(
+            f"SELECT itemID, name, type FROM itemTags JOIN tags USING (tagID) WHERE itemID IN ({placeholders})",
+            item_ids
+        ):
+            tags[row['itemID']].append(
+                {'tag': row['name'], 'type': row['type']} if row['type'] else {'tag': row['name']}
+            )
+        collections: Dict[int, List[str]] = {item_id: [] for item_id in rows}
+        for row in connection.execute(
+            f"SELECT itemID, collections.key FROM collectionItems JOIN collections USING (collectionID) "
+            f"WHERE itemID IN ({placeholders})",
+            item_ids
+        ):
+            collections[row['itemID']].append(row['key'])
+        attachments: Dict[int, List[sqlite3.Row]] = {item_id: [] for item_id in rows}
+        for row in connection.execute(
+            f"SELECT itemAttachments.parentItemID, items.key, itemAttachments.linkMode, itemAttachments.path "
+            f"FROM itemAttachments JOIN items USING (itemID) "
+            f"WHERE itemAttachments.parentItemID IN ({placeholders}) AND itemAttachments.contentType = ? "
+            f"AND itemAttachments.itemID NOT IN (SELECT itemID FROM deletedItems) ORDER BY items.dateAdded",
+            item_ids + [LocalZoteroConstants.PDF_CONTENT_TYPE]
+        ):
+            attachments[row['parentItemID']].append(row)
+
+        items: List[dict] = []
+        for item_id in item_ids:
+            row: Optional[sqlite3.Row] = rows.get(item_id)
+            if row is None or (row['parentItemID'] is not None and not include_children):
+                continue
+            items.append(self._format_item(row, fields[item_id], creators[item_id], tags[item_id],
+                                           collections[item_id], attachments[item_id]))
+
+        return items
+
+    def _format_item(self, row: sqlite3.Row, fields: Dict[str, str], creators: List[dict], tags: List[dict],
+                     collections: List[str], attachments: List[sqlite3.Row]) -> dict:
+        """Formats an item as the web API would return it, linking to its first PDF attachment with a local file."""
+        data: dict = {
+            'key': row['key'],
+            'version': row['version'],
+            'itemType': row['typeName'],
+            **fields,
+            'creators': creators,
+            'tags': tags,
+            'collections': collections,
+            'relations': {},
+            'dateAdded': self._format_date(row['dateAdded']),
+            'dateModified': self._format_date(row['dateModified'])
+        }
+        if row['parentItemID'] is not None:
+            data['contentType'] = row['contentType']
+            data['parentItem'] = row['parentKey']
+        if row['deleted']:
+            data['deleted'] = 1
+
+        links: dict = {'alternate': {'href': self._item_uri(row['key']), 'type': 'text/html'}}
+        pdf_attachments: List[Tuple[str, Optional[Path]]] = []
+        for attachment in attachments:
+            pdf_path: Optional[Path] = self._resolve_path(
+                attachment['key'], attachment['linkMode'], attachment['path']
+            )
+            with self._lock:
+                self._pdf_paths[attachment['key']] = pdf_path
+            pdf_attachments.append((attachment['key'], pdf_path))
+        if pdf_attachments:
+            attachment_key: str = next(
+                (key for key, path in pdf_attachments if path is not None), pdf_attachments[0][0]
+            )
+            links['attachment'] = {
+                'href': self._item_uri(attachment_key),
+                'type': 'application/json',
+                'attachmentType': LocalZoteroConstants.PDF_CONTENT_TYPE
+            }
+
+        return {
+            'key': row['key'],
+            'version': row['version'],
+            'library': {'type': self.library_type, 'id': self.library_id},
+            'links': links,
+            'meta': {'numChildren': len(attachments)},
+            'data': data
+        }
+
+    def _resolve_path(self, attachment_key: str, link_mode: int, path: Optional[str]) -> Optional[Path]:
+        """Returns the path of an attachment's file, if it is a stored or linked file that exists on this computer."""
+        if not path:
+            return None
+
+        if link_mode in (LocalZoteroConstants.LINK_MODE_IMPORTED_FILE, LocalZoteroConstants.LINK_MODE_IMPORTED_URL):
+            if not path.startswith(LocalZoteroConstants.STORAGE_PATH_PREFIX):
+                return None
+            file_path: Path = (self.data_dir / LocalZoteroConstants.STORAGE_DIR_NAME / attachment_key /
+                               path[len(LocalZoteroConstants.STORAGE_PATH_PREFIX):])
+        elif link_mode == LocalZoteroConstants.LINK_MODE_LINKED_FILE:
+            if path.startswith(LocalZoteroConstants.ATTACHMENTS_PATH_PREFIX):
+                if self.base_attachment_dir is None:
+                    return None
+                file_path = self.base_attachment_dir / path[len(LocalZoteroConstants.ATTACHMENTS_PATH_PREFIX):]
+            else:
+                file_path = Path(path)
+        else:
+            return None
+
+        return file_path if file_path.is_file() else None
+
+    def _item_uri(self, key: str) -> str:
+        """Returns the `zotero://` URI that selects an item in the Zotero client."""
+        library: str = f"groups/{self.library_id}" if self.library_type == 'group' else 'library'
+        return f"zotero://select/{library}/items/{key}"
+
+    @staticmethod
+    def _format_date(value: Optional[str]) -> Optional[str]:
+        """Formats a UTC timestamp stored by Zotero, e.g. `2024-01-31 12:00:00`, as the web API does."""
+        return f"{value.replace(' ', 'T')}Z" if value else value
+
+    @staticmethod
+    def _placeholders(values: list) -> str:
+        """Returns the SQL placeholders for a list of values."""
+        return ', '.join('?' * len(values))
@@ -0,0 +1,564 @@
+import os
+import sys
+import json
+import uuid
+import pickle
+import copyreg
+import hashlib
+import numpy as np
+import paperqa
+from pathlib import Path
+from pydantic import PrivateAttr
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import MappedStoreConstants
+
+HASH_DTYPE: np.dtype = np.dtype('S32')
+
+
+class MappedText(paperqa.Text):
+    """
+    A text chunk whose text and embedding are read on demand from a `MappedChunkStore`, rather than held in memory.
+
+    Only the chunk's name and document are kept in the object. Its `text` and `embedding` are looked up in the chunk
+    store's offset-indexed text file and memory-mapped embedding matrix whenever they are accessed, so `paperqa` code
+    that reads them (e.g. to summarise a retrieved chunk) works unchanged.
+
+    Attributes
+    ----------
+    chunk_store : MappedChunkStore
+        The chunk store holding the chunk's text and embedding.
+    row : int
+        The row of the chunk in the chunk store.
+
+    Notes
+    -----
+    The embedding is the dequantized vector, so it differs from the original embedding by the quantization error of
+    the chunk store. Pickling a `MappedText` outside of a snapshot (e.g. within a cached answer) turns it back into a
+    plain `paperqa.Text`, so the pickle does not depend on the chunk store's files.
+    """
+    _chunk_store: Any = PrivateAttr(default=None)
+    _row: int = PrivateAttr(default=0)
+
+    @classmethod
+    def restore(cls, chunk_store: 'MappedChunkStore', row: int, name: str, doc: paperqa.Doc) -> 'MappedText':
+        """
+        Creates a text chunk backed by a row of a chunk store, without reading its text or embedding.
+
+        Parameters
+        ----------
+        chunk_store : MappedChunkStore
+            The chunk store.
+        row : int
+            The row of the chunk.
+        name : str
+            The name of the chunk.
+        doc : paperqa.Doc
+            The document of the chunk.
+
+        Returns
+        -------
+        MappedText
+            The text chunk.
+        """
+        text: MappedText = cls.__new__(cls)
+        object.__setattr__(text, '__dict__', {'name': name, 'doc': doc})
+        object.__setattr__(text, '__pydantic_fields_set__', {'text', 'name', 'doc', 'embedding'})
+        object.__setattr__(text, '__pydantic_extra__', None)
+        object.__setattr__(text, '__pydantic_private__', {'_chunk_store': chunk_store, '_row': row})
+        return text
+
+    @property
+    def chunk_store(self) -> 'MappedChunkStore':
+        """Return the chunk store holding the chunk's text and embedding."""
+        return self.__pydantic_private__['_chunk_store']
+
+    @property
+    def row(self) -> int:
+        """Return the row of the chunk in the chunk store."""
+        return self.__pydantic_private__['_row']
+
+    def __getattr__(self, name: str) -> Any:
+        if name == 'text':
+            return self.chunk_store.text(self.row)
+        if name == 'embedding':
+            return self.chunk_store.embedding(self.row)
+        return super().__getattr__(name)
+
+    def __reduce__(self):
+        # A plain `paperqa.Text` is created without validation, and its state set by pydantic's `__setstate__()`
+        return copyreg._reconstructor, (paperqa.Text, object, None), {
+            '__dict__': {'text': self.text, 'name': self.name, 'doc': self.doc, 'embedding': self.embedding},
+            '__pydantic_fields_set__': {'text', 'name', 'doc', 'embedding'},
+            '__pydantic_extra__': None,
+            '__pydantic_private__': None
+        }
+
+    def __reduce_ex__(self, protocol):
+        return self.__reduce__()
+
+
+class MappedChunkStore:
+    """
+    An immutable on-disk store of text chunks and their embeddings, memory-mapped when opened.
+
+    The embeddings are held as one contiguous matrix of unit-length vectors, quantized to float16 or int8 (with a
+    float32 scale per row), or kept as float32. The chunk texts are concatenated into a UTF-8 text file, indexed by an
+    array of byte offsets, and the SHA-256 hashes of the texts are kept sorted so that the embedding of a piece of
+    text can be looked up by binary search.
+
+    Opening a store maps its files rather than reading them, so only the pages touched by a query are read from disk,
+    and every process that opens the same store shares those pages through the OS page cache.
+
+    Attributes
+    ----------
+    base_path : Path
+        The path prefix of the store's files, e.g. `paper_qa_embeddings_<model>.pkl.chunks.<generation>`.
+    generation : str
+        The unique name of the store, written into the `Docs` snapshot that refers to it.
+    dtype : str
+        The data type of the embedding matrix: 'float32', 'float16' or 'int8'.
+    metadata : Dict[str, Any]
+        The number of rows and dimensions, the data type and the quantization accuracy of the store.
+
+    Methods
+    -------
+    write(base_path: Union[str, Path], texts: Sequence[paperqa.Text], dtype: str) -> MappedChunkStore
+        Writes a new store, returning it opened.
+    open(base_path: Union[str, Path]) -> MappedChunkStore
+        Memory-maps an existing store.
+    text(row: int) -> str
+        Returns the text of a chunk.
+    embedding(row: int) -> List[float]
+        Returns the dequantized embedding of a chunk.
+    vectors(rows: np.ndarray) -> np.ndarray
+        Returns the dequantized unit-length vectors of some chunks.
+    scores(query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray
+        Returns the cosine similarities of a unit-length query vector to some or all chunks.
+    lookup_embedding(chunk_hash: str) -> Optional[List[float]]
+        Returns the dequantized embedding of the chunk with a given text hash.
+    dump_snapshot(obj, file: BinaryIO, texts: Sequence[paperqa.Text])
+        Pickles a snapshot, replacing the given texts with references to their rows in the store.
+    load_snapshot(file: BinaryIO, directory: Union[str, Path]) -> Any
+        Unpickles a snapshot, opening the chunk stores its texts refer to.
+
+    Notes
+    -----
+    A store is written once and never modified. Each compaction of the embedding store writes a new store under a new
+    generation name, and the snapshot refers to its store by that name, so a process reading an older snapshot keeps
+    its own store mapped even after the files of that generation have been deleted.
+
+    The `metadata` records the minimum and mean cosine similarity between each original vector and its quantized
+    version, measured when the store is written, as a measure of the accuracy given up for the smaller matrix.
+    """
+    def __init__(self, base_path: Union[str, Path], metadata: Dict[str, Any], matrix: np.ndarray,
+                 scales: Optional[np.ndarray], norms: np.ndarray, offsets: np.ndarray, text_data: np.ndarray,
+                 hashes: np.ndarray, hash_rows: np.ndarray):
+        self.base_path: Path = Path(base_path)
+        self.generation: str = metadata['generation']
+        self.dtype: str = metadata['dtype']
+        self.metadata: Dict[str, Any] = metadata
+        self._matrix: np.ndarray = matrix
+        self._scales: Optional[np.ndarray] = scales
+        self._norms: np.ndarray = norms
+        self._offsets: np.ndarray = offsets
+        self._text_data: np.ndarray = text_data
+        self._hashes: np.ndarray = hashes
+        self._hash_rows: np.ndarray = hash_rows
+
+    def __len__(self) -> int:
+        return len(self._matrix)
+
+    @staticmethod
+    def file_path(base_path: Union[str, Path], part: str) -> Path:
+        """
+        Returns the path of one of a store's files.
+
+        Parameters
+        ----------
+        base_path : Union[str, Path]
+            The path prefix of the store's files.
+        part : str
+            The name of the file within the store, e.g. 'vectors.npy'.
+
+        Returns
+        -------
+        Path
+            The path of the file.
+        """
+        return Path(f"{base_path}.{part}")
+
+    @classmethod
+    def write(cls, base_path: Union[str, Path], texts: Sequence[paperqa.Text],
+              dtype: str = MappedStoreConstants.VECTOR_DTYPE) -> 'MappedChunkStore':
+        """
+        Writes a new store holding the given texts and their embeddings, in order.
+
+        Parameters
+        ----------
+        base_path : Union[str, Path]
+            The path prefix of the store's files. The store's generation is the final component of the prefix.
+        texts : Sequence[paperqa.Text]
+            The embedded text chunks. Their embeddings must all have the same number of dimensions.
+        dtype : str, optional
+            The data type of the embedding matrix: 'float32', 'float16' or 'int8'.
+
+        Returns
+        -------
+        MappedChunkStore
+            The new store, memory-mapped.
+
+        Raises
+        ------
+        ValueError
+            If `dtype` is not supported, or a text has no embedding.
+
+        Notes
+        -----
+        The embedding matrix is written in blocks straight into a memory-mapped file, so writing a store never holds
+        more than one block of float32 vectors in memory. Texts that are already backed by a chunk store are copied
+        from it without converting their vectors to Python lists.
+        """
+        if dtype not in MappedStoreConstants.VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector data type {dtype}, expected one of "
+                             f"{', '.join(MappedStoreConstants.VECTOR_DTYPES)}")
+
+        num_rows: int = len(texts)
+        dimensions: int = len(cls._text_vector(texts[0])[0]) if num_rows else 0
+        matrix: np.ndarray = np.lib.format.open_memmap(
+            cls.file_path(base_path, 'vectors.npy'), mode='w+', dtype=np.dtype(dtype), shape=(num_rows, dimensions)
+        )
+        scales: np.ndarray = np.ones(num_rows, dtype=np.float32)
+        norms: np.ndarray = np.empty(num_rows, dtype=np.float32)
+        offsets: np.ndarray = np.empty(num_rows + 1, dtype=np.int64)
+        hashes: np.ndarray = np.empty(num_rows, dtype=HASH_DTYPE)
+        min_cosine: float = 1.0
+        sum_cosine: float = 0.0
+
+        offsets[0] = 0
+        with open(cls.file_path(base_path, 'text.bin'), 'wb') as text_file:
+            for start in range(0, num_rows, MappedStoreConstants.SCORE_BLOCK_ROWS):
+                block_texts: Sequence[paperqa.Text] = texts[start:start + MappedStoreConstants.SCORE_BLOCK_ROWS]
+                block: np.ndarray = np.empty((len(block_texts), dimensions), dtype=np.float32)
+                for i, text in enumerate(block_texts):
+                    block[i], norms[start + i] = cls._text_vector(text)
+                    encoded_text: bytes = text.text.encode('utf-8')
+                    text_file.write(encoded_text)
+                    offsets[start + i + 1] = offsets[start + i] + len(encoded_text)
+                    hashes[start + i] = hashlib.sha256(encoded_text).digest()
+
+                quantized, block_scales = cls._quantize(block, dtype)
+                matrix[start:start + len(block)] = quantized
+                scales[start:start + len(block)] = block_scales
+                dequantized: np.ndarray = quantized.astype(np.float32) * block_scales[:, np.newaxis]
+                cosines: np.ndarray = np.einsum('ij,ij->i', block, dequantized) / np.maximum(
+                    np.linalg.norm(dequantized, axis=1), 1e-12
+                )
+                min_cosine = min(min_cosine, float(cosines.min()))
+                sum_cosine += float(cosines.sum())
+        matrix.flush()
+        del matrix
+
+        order: np.ndarray = np.argsort(hashes, kind='stable')
+        np.save(cls.file_path(base_path, 'scales.npy'), scales)
+        np.save(cls.file_path(base_path, 'norms.npy'), norms)
+        np.save(cls.file_path(base_path, 'offsets.npy'), offsets)
+        np.save(cls.file_path(base_path, 'hashes.npy'), hashes[order])
+        np.save(cls.file_path(base_path, 'hash_rows.npy'), order.astype(np.int64))
+
+        metadata: Dict[str, Any] = {
+            'generation': Path(base_path).name.rsplit('.', 1)[-1],
+            'dtype': dtype,
+            'rows': num_rows,
+            'dimensions': dimensions,
+            'min_cosine': round(min_cosine, 6),
+            'mean_cosine': round(sum_cosine / num_rows, 6) if num_rows else 1.0
+        }
+        with open(cls.file_path(base_path, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        return cls.open(base_path)
+
+    @classmethod
+    def open(cls, base_path: Union[str, Path]) -> 'MappedChunkStore':
+        """
+        Memory-maps an existing store.
+
+        Parameters
+        ----------
+        base_path : Union[str, Path]
+            The path prefix of the store's files.
+
+        Returns
+        -------
+        MappedChunkStore
+            The store.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the store does not exist.
+        """
+        with open(cls.file_path(base_path, 'meta.json'), 'r', encoding='utf-8') as file:
+            metadata: Dict[str, Any] = json.load(file)
+
+        def load(part: str) -> np.ndarray:
+            return np.load(cls.file_path(base_path, part), mmap_mode='r')
+
+        text_path: Path = cls.file_path(base_path, 'text.bin')
+        text_data: np.ndarray = (
+            np.memmap(text_path, dtype=np.uint8, mode='r') if os.path.getsize(text_path) else np.zeros(0, np.uint8)
+        )
+
+        return cls(base_path, metadata, load('vectors.npy'), load('scales.npy'), load('norms.npy'),
+                   load('offsets.npy'), text_data, load('hashes.npy'), load('hash_rows.npy'))
+
+    @staticmethod
+    def new_base_path(pkl_file_path: Union[str, Path]) -> Path:
+        """
+        Returns the path prefix of a new store for a snapshot, with a unique generation name.
+
+        Parameters
+        ----------
+        pkl_file_path : Union[str, Path]
+            The path of the snapshot.
+
+        Returns
+        -------
+        Path
+            The path prefix, e.g. `paper_qa_embeddings_<model>.pkl.chunks.<generation>`.
+        """
+        return Path(f"{pkl_file_path}{MappedStoreConstants.CHUNK_STORE_INFIX}{uuid.uuid4().hex[:16]}")
+
+    @staticmethod
+    def delete_generations(pkl_file_path: Union[str, Path], keep: Optional['MappedChunkStore'] = None):
+        """
+        Deletes the files of every store of a snapshot, except one.
+
+        Parameters
+        ----------
+        pkl_file_path : Union[str, Path]
+            The path of the snapshot.
+        keep : MappedChunkStore, optional
+            The store to keep, usually the one the current snapshot refers to.
+
+        Notes
+        -----
+        Processes that still have a deleted store mapped keep reading it, as the operating system only frees its
+        pages once they unmap it. Where the files cannot be deleted while mapped (on Windows), they are left for a
+        later compaction to delete.
+        """
+        pkl_file_path = Path(pkl_file_path)
+        prefix: str = f"{pkl_file_path.name}{MappedStoreConstants.CHUNK_STORE_INFIX}"
+        for path in pkl_file_path.parent.glob(f"{prefix}*"):
+            generation: str = path.name[len(prefix):].split('.', 1)[0]
+            if keep is not None and generation == keep.generation:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def text(self, row: int) -> str:
+        """
+        Returns the text of a chunk, read from the text file.
+
+        Parameters
+        ----------
+        row : int
+            The row of the chunk.
+
+        Returns
+        -------
+        str
+            The text.
+        """
+        return self._text_data[self._offsets[row]:self._offsets[row + 1]].tobytes().decode('utf-8')
+
+    def embedding(self, row: int) -> List[float]:
+        """
+        Returns the dequantized embedding of a chunk, with its original length.
+
+        Parameters
+        ----------
+        row : int
+            The row of the chunk.
+
+        Returns
+        -------
+        List[float]
+            The embedding.
+        """
+        return (self.vectors(np.array([row]))[0] * self._norms[row]).tolist()
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the dequantized unit-length vectors of some chunks.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The rows of the chunks.
+
+        Returns
+        -------
+        np.ndarray
+            A float32 matrix with one vector per row.
+        """
+        vectors: np.ndarray = self._matrix[rows].astype(np.float32)
+        if self.dtype == 'int8':
+            vectors *= self._scales[rows][:, np.newaxis]
+
+        return vectors
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the cosine similarities of a unit-length query vector to some or all chunks.
+
+        Parameters
+        ----------
+        query : np.ndarray
+            The float32 query vector, of unit length.
+        rows : np.ndarray, optional
+            The rows of the chunks to score. Defaults to every chunk.
+
+        Returns
+        -------
+        np.ndarray
+            The float32 cosine similarity of each chunk.
+
+        Notes
+        -----
+        The matrix is dequantized block by block, so scoring every chunk never holds more than one block of float32
+        vectors in memory.
+        """
+        num_rows: int = len(self) if rows is None else len(rows)
+        scores: np.ndarray = np.empty(num_rows, dtype=np.float32)
+        for start in range(0, num_rows, MappedStoreConstants.SCORE_BLOCK_ROWS):
+            end: int = min(start + MappedStoreConstants.SCORE_BLOCK_ROWS, num_rows)
+            block_rows: Union[slice, np.ndarray] = slice(start, end) if rows is None else rows[start:end]
+            block: np.ndarray = self._matrix[block_rows].astype(np.float32)
+            scores[start:end] = block @ query
+            if self.dtype == 'int8':
+                scores[start:end] *= self._scales[block_rows]
+
+        return scores
+
+    def lookup_embedding(self, chunk_hash: str) -> Optional[List[float]]:
+        """
+        Returns the dequantized embedding of the chunk with a given text hash, by binary search of the sorted hashes.
+
+        Parameters
+        ----------
+        chunk_hash : str
+            The hexadecimal SHA-256 hash of the chunk's text.
+
+        Returns
+        -------
+        Optional[List[float]]
+            The embedding, or None if no chunk in the store has that text.
+        """
+        digest: np.bytes_ = np.bytes_(bytes.fromhex(chunk_hash))
+        position: int = int(np.searchsorted(self._hashes, digest))
+        if position == len(self._hashes) or self._hashes[position] != digest:
+            return None
+
+        return self.embedding(int(self._hash_rows[position]))
+
+    def dump_snapshot(self, obj: Any, file: BinaryIO, texts: Sequence[paperqa.Text]):
+        """
+        Pickles a snapshot, replacing each of the given texts with a reference to its row in the store.
+
+        Parameters
+        ----------
+        obj : Any
+            The object to pickle, e.g. a dictionary holding a `paperqa.Docs` object.
+        file : BinaryIO
+            The file to write to.
+        texts : Sequence[paperqa.Text]
+            The texts the store was written from, in row order.
+        """
+        rows_by_id: Dict[int, int] = {id(text): row for row, text in enumerate(texts)}
+        _SnapshotPickler(file, self, rows_by_id).dump(obj)
+
+    @staticmethod
+    def load_snapshot(file: BinaryIO, directory: Union[str, Path]) -> Any:
+        """
+        Unpickles a snapshot, memory-mapping the chunk stores its texts refer to.
+
+        Parameters
+        ----------
+        file : BinaryIO
+            The file to read from.
+        directory : Union[str, Path]
+            The directory holding the chunk stores, next to the snapshot.
+
+        Returns
+        -------
+        Any
+            The unpickled object.
+        """
+        return _SnapshotUnpickler(file, Path(directory)).load()
+
+    @staticmethod
+    def _text_vector(text: paperqa.Text) -> Tuple[np.ndarray, float]:
+        """Returns the unit-length float32 vector of a text's embedding, and the embedding's original length."""
+        if isinstance(text, MappedText):
+            return text.chunk_store.vectors(np.array([text.row]))[0], float(text.chunk_store._norms[text.row])
+
+        if text.embedding is None:
+            raise ValueError(f"Text {text.name} has no embedding")
+
+        vector: np.ndarray = np.asarray(text.embedding, dtype=np.float32)
+        norm: float = float(np.linalg.norm(vector))
+        return (vector / norm if norm > 0 else vector), norm
+
+    @staticmethod
+    def _quantize(block: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Quantizes a block of unit-length vectors, returning the quantized block and the scale of each row."""
+        if dtype != 'int8':
+            return block.astype(np.dtype(dtype)), np.ones(len(block), dtype=np.float32)
+
+        scales: np.ndarray = (np.abs(block).max(axis=1) / 127).astype(np.float32)
+        scales[scales == 0] = 1.0
+        return np.clip(np.rint(block / scales[:, np.newaxis]), -127, 127).astype(np.int8), scales
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """Pickles texts stored in a chunk store as references to their rows, rather than with their text and vector."""
+    def __init__(self, file: BinaryIO, chunk_store: MappedChunkStore, rows_by_id: Dict[int, int]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.chunk_store: MappedChunkStore = chunk_store
+        self.rows_by_id: Dict[int, int] = rows_by_id
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[str, str]]:
+        if obj is self.chunk_store:
+            return 'chunk_store', self.chunk_store.base_path.name
+        return None
+
+    def reducer_override(self, obj: Any):
+        if isinstance(obj, paperqa.Text):
+            row: Optional[int] = self.rows_by_id.get(id(obj))
+            if row is not None:
+                return MappedText.restore, (self.chunk_store, row, obj.name, obj.doc)
+        return NotImplemented
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """Unpickles a snapshot, memory-mapping each chunk store its texts refer to once."""
+    def __init__(self, file: BinaryIO, directory: Path):
+        super().__init__(file)
+        self.directory: Path = directory
+        self.chunk_stores: Dict[str, MappedChunkStore] = {}
+
+    def persistent_load(self, pid: Tuple[str, str]) -> MappedChunkStore:
+        kind, name = pid
+        if kind != 'chunk_store':
+            raise pickle.UnpicklingError(f"Unsupported persistent ID {kind}")
+        if name not in self.chunk_stores:
+            self.chunk_stores[name] = MappedChunkStore.open(self.directory / name)
+        return self.chunk_stores[name]
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import PageHashConstants
+
+if TYPE_CHECKING:
+    import paperqa
+    from paperqa.types import ParsedText
+
+
+class PageHashIndex:
+    """
+    An index of the hash of every page's text in each embedded paper, used to re-embed only the pages of a paper that
+    changed when its PDF attachment is replaced or annotated.
+
+    Attributes
+    ----------
+    index_path : Path
+        The JSON file in which the index is persisted.
+
+    Methods
+    -------
+    page_hashes(parsed_text: ParsedText) -> Dict[str, str]
+        Returns the hash of the text of every page of a parsed PDF.
+    get(dockey: str) -> Optional[Dict[str, str]]
+        Returns the page hashes of an embedded paper, if they are known.
+    add(dockey: str, page_hashes: Dict[str, str])
+        Records the page hashes of an embedded paper.
+    remove(dockeys: Iterable[str])
+        Removes papers from the index.
+    merge(other: PageHashIndex, dockeys: Iterable[str])
+        Copies the page hashes of papers from another index.
+    sync(docs: paperqa.Docs)
+        Drops the papers no longer in a `Docs` object.
+    save()
+        Atomically persists the index.
+
+    Notes
+    -----
+    Papers are identified by their `dockey`, the MD5 hash of their PDF, so the hashes always describe the embedded
+    version of a paper. The hashes are truncated to `PageHashConstants.HASH_CHARS` hexadecimal characters to keep the
+    index small. Papers embedded before the index existed have no page hashes until they are next re-synced.
+    """
+    def __init__(self, index_path: Union[str, Path]):
+        self.index_path: Path = Path(index_path)
+        self._entries: Dict[str, Dict[str, str]] = {}
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    def __len__(self) -> int:
+        """Return the number of papers in the index."""
+        return len(self._entries)
+
+    @staticmethod
+    def page_hashes(parsed_text: 'ParsedText') -> Dict[str, str]:
+        """
+        Returns the hash of the text of every page of a parsed PDF.
+
+        Parameters
+        ----------
+        parsed_text : ParsedText
+            The per-page text of the PDF.
+
+        Returns
+        -------
+        Dict[str, str]
+            The SHA-256 hash of each page's text, truncated to `PageHashConstants.HASH_CHARS` characters, by page
+            number, in page order.
+        """
+        return {
+            page: hashlib.sha256(text.encode('utf-8')).hexdigest()[:PageHashConstants.HASH_CHARS]
+            for page, text in parsed_text.content.items()
+        }
+
+    def get(self, dockey: str) -> Optional[Dict[str, str]]:
+        """
+        Returns the page hashes of an embedded paper.
+
+        Parameters
+        ----------
+        dockey : str
+            The document key of the paper.
+
+        Returns
+        -------
+        Optional[Dict[str, str]]
+            The hash of each page's text, by page number, or None if they are not known.
+        """
+        with self._lock:
+            page_hashes: Optional[Dict[str, str]] = self._entries.get(dockey)
+            return dict(page_hashes) if page_hashes is not None else None
+
+    def add(self, dockey: str, page_hashes: Dict[str, str]):
+        """
+        Records the page hashes of an embedded paper.
+
+        Parameters
+        ----------
+        dockey : str
+            The document key of the paper.
+        page_hashes : Dict[str, str]
+            The hash of each page's text, by page number, as returned by `page_hashes()`.
+        """
+        with self._lock:
+            self._entries[dockey] = dict(page_hashes)
+
+    def remove(self, dockeys: Iterable[str]):
+        """
+        Removes papers from the index.
+
+        Parameters
+        ----------
+        dockeys : Iterable[str]
+            The document keys of the papers.
+        """
+        with self._lock:
+            for dockey in dockeys:
+                self._entries.pop(dockey, None)
+
+    def merge(self, other: 'PageHashIndex', dockeys: Iterable[str]):
+        """
+        Copies the page hashes of papers from another index, e.g. a shard's.
+
+        Parameters
+        ----------
+        other : PageHashIndex
+            The index to copy from.
+        dockeys : Iterable[str]
+            The document keys of the papers to copy. Papers missing from `other` are skipped.
+        """
+        with self._lock, other._lock:
+            for dockey in dockeys:
+                if dockey in other._entries:
+                    self._entries[dockey] = dict(other._entries[dockey])
+
+    def sync(self, docs: 'paperqa.Docs'):
+        """
+        Drops the papers no longer in a `Docs` object.
+
+        Parameters
+        ----------
+        docs : paperqa.Docs
+            The embedded papers, e.g. a view over the embedding store.
+        """
+        with self._lock:
+            self.remove([dockey for dockey in self._entries if dockey not in docs.docs])
+
+    def save(self):
+        """Atomically persists the index."""
+        with self._lock:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path: Path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'hash_chars': PageHashConstants.HASH_CHARS, 'entries': self._entries}, file)
+            os.replace(temp_path, self.index_path)
+
+    def _load(self):
+        """Loads the persisted index, starting empty if it does not exist, cannot be read or used other hashes."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                state: dict = json.load(file)
+            if state['hash_chars'] != PageHashConstants.HASH_CHARS:
+                return
+            entries: Dict[str, Dict[str, str]] = {
+                str(dockey): {str(page): str(page_hash) for page, page_hash in page_hashes.items()}
+                for dockey, page_hashes in state['entries'].items()
+            }
+        except (FileNotFoundError, ValueError, TypeError, KeyError, AttributeError):
+            return
+
+        self._entries = entries
@@ -0,0 +1,293 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from paperqa.readers import parse_pdf_to_pages
+from paperqa.types import ParsedText
+from pathlib import Path
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import DataConstants
+from models.telemetry import Telemetry, get_telemetry
+from utils import llm_utils
+
+
+class ParsedPdf(BaseModel):
+    """
+    The parsed contents of a PDF, as stored in the `ParsedPdfCache`.
+
+    Attributes
+    ----------
+    sha256 : str
+        The SHA-256 hash of the PDF's bytes.
+    parsed_text : ParsedText
+        The text of each page of the PDF, keyed by page number (as produced by `paperqa`'s PDF reader).
+    token_counts : Dict[str, int]
+        The number of tokens in the PDF text, keyed by `tiktoken` encoding name.
+    """
+    sha256: str
+    parsed_text: ParsedText
+    token_counts: Dict[str, int] = Field(default_factory=dict)
+
+    @property
+    def num_pages(self) -> int:
+        """Return the number of pages in the PDF."""
+        return len(self.parsed_text.content)
+
+    @property
+    def text(self) -> str:
+        """Return the text of every page of the PDF, concatenated."""
+        return ''.join(self.parsed_text.content.values())
+
+
+class ParsedPdfCache:
+    """
+    A disk-backed cache of parsed PDFs, keyed by the SHA-256 hash of each PDF's bytes.
+
+    Every PDF is parsed at most once, however many consumers need it. The per-page text, page count and token counts
+    are stored once per unique PDF, so re-runs, re-embeds under another LLM and dry-run cost estimates never re-parse a
+    PDF whose bytes have not changed.
+
+    Attributes
+    ----------
+    cache_dir : Path
+        The directory in which parsed PDFs are stored.
+    max_memory_entries : int
+        The number of most recently used parsed PDFs also kept in memory, so that the several consumers of a PDF
+        being ingested do not each read its cache entry from disk.
+
+    Methods
+    -------
+    get(pdf_path: Union[str, Path]) -> ParsedPdf
+        Returns the parsed PDF, parsing and caching it if required.
+    lookup(pdf_path: Union[str, Path]) -> Optional[ParsedPdf]
+        Returns the parsed PDF if it is already cached, without parsing it.
+    add(pdf_path: Union[str, Path], parsed_text: ParsedText, token_counts: Optional[Dict[str, int]]) -> ParsedPdf
+        Caches a PDF that has been parsed elsewhere.
+    get_parsed_text(pdf_path: Union[str, Path]) -> ParsedText
+        Returns the per-page text of the PDF.
+    count_pages(pdf_path: Union[str, Path]) -> int
+        Returns the number of pages in the PDF.
+    count_tokens(pdf_path: Union[str, Path], model: str) -> int
+        Returns the number of tokens in the PDF for a given language model.
+    sha256(pdf_path: Union[str, Path]) -> str
+        Returns the SHA-256 hash of the PDF's bytes.
+
+    Notes
+    -----
+    Cache entries are written to a temporary file and atomically moved into place, so concurrent writers and
+    interrupted writes never leave a corrupt entry behind. Hashes are memoised by path, size and modification time,
+    so a PDF is only read once per process to look it up.
+    """
+    def __init__(self, cache_dir: Union[str, Path] = DataConstants.PARSED_PDF_CACHE_DIR,
+                 max_memory_entries: int = DataConstants.PARSED_PDF_CACHE_MEMORY_ENTRIES):
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_memory_entries: int = max_memory_entries
+        self._sha256_by_stat: Dict[Tuple[str, int, int], str] = {}
+        self._memory_entries: OrderedDict[str, ParsedPdf] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, pdf_path: Union[str, Path]) -> ParsedPdf:
+        """
+        Returns the parsed PDF, parsing and caching it if it has not been seen before.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+
+        Returns
+        -------
+        ParsedPdf
+            The parsed PDF.
+        """
+        telemetry: Telemetry = get_telemetry()
+        sha256: str = self.sha256(pdf_path)
+        parsed_pdf: Optional[ParsedPdf] = self._read_entry(sha256)
+        if parsed_pdf is None:
+            telemetry.increment('cache_misses', cache='parsed_pdf')
+            with telemetry.span('parse.pdf', pdf=Path(pdf_path).name) as span:
+                parsed_pdf = ParsedPdf(sha256=sha256, parsed_text=parse_pdf_to_pages(Path(pdf_path)))
+                span.set(num_pages=parsed_pdf.num_pages)
+            self._write_entry(parsed_pdf)
+        else:
+            telemetry.increment('cache_hits', cache='parsed_pdf')
+
+        return parsed_pdf
+
+    def lookup(self, pdf_path: Union[str, Path]) -> Optional[ParsedPdf]:
+        """
+        Returns the parsed PDF if it is already cached, without parsing it.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+
+        Returns
+        -------
+        Optional[ParsedPdf]
+            The parsed PDF, or None if it has not been cached.
+        """
+        return self._read_entry(self.sha256(pdf_path))
+
+    def add(self, pdf_path: Union[str, Path], parsed_text: ParsedText,
+            token_counts: Optional[Dict[str, int]] = None) -> ParsedPdf:
+        """
+        Caches a PDF that has been parsed elsewhere, e.g. in a worker process.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+        parsed_text : ParsedText
+            The text of each page of the PDF, as produced by `paperqa.readers.parse_pdf_to_pages()`.
+        token_counts : Dict[str, int], optional
+            Any token counts already computed for the PDF, keyed by `tiktoken` encoding name.
+
+        Returns
+        -------
+        ParsedPdf
+            The cached parsed PDF.
+        """
+        parsed_pdf: ParsedPdf = ParsedPdf(
+            sha256=self.sha256(pdf_path), parsed_text=parsed_text, token_counts=dict(token_counts or {})
+        )
+        self._write_entry(parsed_pdf)
+
+        return parsed_pdf
+
+    def get_parsed_text(self, pdf_path: Union[str, Path]) -> ParsedText:
+        """
+        Returns the per-page text of the PDF, as expected by `paperqa.readers.chunk_pdf()`.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+
+        Returns
+        -------
+        ParsedText
+            The text of each page of the PDF.
+        """
+        return self.get(pdf_path).parsed_text
+
+    def count_pages(self, pdf_path: Union[str, Path]) -> int:
+        """
+        Returns the number of pages in the PDF.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+
+        Returns
+        -------
+        int
+            The number of pages in the PDF.
+        """
+        return self.get(pdf_path).num_pages
+
+    def count_tokens(self, pdf_path: Union[str, Path], model: str) -> int:
+        """
+        Returns the number of tokens in the PDF for a given language model.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+        model : str
+            The name of the language model to be used for tokenization.
+
+        Returns
+        -------
+        int
+            The total number of tokens in the PDF.
+
+        Notes
+        -----
+        Token counts are stored per `tiktoken` encoding rather than per model, so models sharing an encoding share
+        the count. A count for a new encoding is computed from the cached text, without re-parsing the PDF.
+        """
+        parsed_pdf: ParsedPdf = self.get(pdf_path)
+        encoding_name: str = llm_utils.get_encoding(model).name
+        if encoding_name not in parsed_pdf.token_counts:
+            with get_telemetry().span('parse.count_tokens', encoding=encoding_name):
+                parsed_pdf.token_counts[encoding_name] = llm_utils.calculate_tokens_from_text(parsed_pdf.text, model)
+            self._write_entry(parsed_pdf)
+
+        return parsed_pdf.token_counts[encoding_name]
+
+    def sha256(self, pdf_path: Union[str, Path]) -> str:
+        """
+        Returns the SHA-256 hash of the PDF's bytes.
+
+        Parameters
+        ----------
+        pdf_path : Union[str, Path]
+            The path to the PDF.
+
+        Returns
+        -------
+        str
+            The hexadecimal SHA-256 hash.
+        """
+        stat: os.stat_result = os.stat(pdf_path)
+        stat_key: Tuple[str, int, int] = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if stat_key in self._sha256_by_stat:
+                return self._sha256_by_stat[stat_key]
+
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        sha256: str = digest.hexdigest()
+
+        with self._lock:
+            self._sha256_by_stat[stat_key] = sha256
+
+        return sha256
+
+    def _entry_path(self, sha256: str) -> Path:
+        """Returns the path of the cache entry for a given SHA-256 hash."""
+        return self.cache_dir / sha256[:2] / f"{sha256}.json"
+
+    def _read_entry(self, sha256: str) -> Optional[ParsedPdf]:
+        """Reads a cache entry from memory or disk, returning None if it does not exist."""
+        with self._lock:
+            if sha256 in self._memory_entries:
+                self._memory_entries.move_to_end(sha256)
+                return self._memory_entries[sha256]
+
+        try:
+            with open(self._entry_path(sha256), 'r', encoding='utf-8') as file:
+                parsed_pdf: ParsedPdf = ParsedPdf.model_validate_json(file.read())
+        except FileNotFoundError:
+            return None
+
+        self._remember_entry(parsed_pdf)
+        return parsed_pdf
+
+    def _remember_entry(self, parsed_pdf: ParsedPdf):
+        """Keeps a cache entry in memory, evicting the least recently used entry if required."""
+        with self._lock:
+            self._memory_entries[parsed_pdf.sha256] = parsed_pdf
+            self._memory_entries.move_to_end(parsed_pdf.sha256)
+            while len(self._memory_entries) > self.max_memory_entries:
+                self._memory_entries.popitem(last=False)
+
+    def _write_entry(self, parsed_pdf: ParsedPdf):
+        """Atomically writes a cache entry to disk, and keeps it in memory."""
+        self._remember_entry(parsed_pdf)
+        entry_path: Path = self._entry_path(parsed_pdf.sha256)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_entry_path: Path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_entry_path, 'w', encoding='utf-8') as file:
+            file.write(parsed_pdf.model_dump_json())
+        os.replace(temp_entry_path, entry_path)
@@ -0,0 +1,392 @@
+import os
+import sys
+import json
+import threading
+from collections import Counter
+from pathlib import Path
+from pydantic import BaseModel, Field
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import PartitionConstants
+
+
+class PartitionScope(BaseModel):
+    """
+    The Zotero collections and tags a query is limited to.
+
+    A paper is in the scope if it is in any of the collections or has any of the tags.
+
+    Attributes
+    ----------
+    collections : List[str]
+        The names or keys of the collections.
+    tags : List[str]
+        The tags.
+
+    Methods
+    -------
+    parse(value: str) -> PartitionScope
+        Parses a comma-separated list of `collection:<name>` and `tag:<tag>` partitions.
+    is_empty() -> bool
+        Returns whether the scope is the whole library.
+    describe() -> str
+        Returns the scope in the form parsed by `parse()`, with its partitions sorted.
+    """
+    collections: List[str] = Field(default_factory=list)
+    tags: List[str] = Field(default_factory=list)
+
+    @classmethod
+    def parse(cls, value: str) -> 'PartitionScope':
+        """
+        Parses a comma-separated list of partitions.
+
+        Parameters
+        ----------
+        value : str
+            The partitions, e.g. `collection:Catalysis, tag:review`. An empty string is the whole library.
+
+        Returns
+        -------
+        PartitionScope
+            The scope.
+
+        Raises
+        ------
+        ValueError
+            If a partition does not start with `collection:` or `tag:`, or names nothing.
+        """
+        scope: PartitionScope = cls()
+        for partition in value.split(PartitionConstants.SEPARATOR):
+            partition = partition.strip()
+            if not partition:
+                continue
+
+            for prefix, names in ((PartitionConstants.COLLECTION_PREFIX, scope.collections),
+                                  (PartitionConstants.TAG_PREFIX, scope.tags)):
+                if partition.lower().startswith(prefix) and partition[len(prefix):].strip():
+                    names.append(partition[len(prefix):].strip())
+                    break
+            else:
+                raise ValueError(f"{partition} is not a partition of the form "
+                                 f"{PartitionConstants.COLLECTION_PREFIX}<name> or "
+                                 f"{PartitionConstants.TAG_PREFIX}<tag>")
+
+        return scope
+
+    def is_empty(self) -> bool:
+        """Return whether the scope is the whole library."""
+        return not self.collections and not self.tags
+
+    def describe(self) -> str:
+        """Return the scope in the form parsed by `parse()`, with its partitions sorted."""
+        return f"{PartitionConstants.SEPARATOR} ".join(
+            [f"{PartitionConstants.COLLECTION_PREFIX}{name}" for name in sorted(set(self.collections))]
+            + [f"{PartitionConstants.TAG_PREFIX}{tag}" for tag in sorted(set(self.tags))]
+        )
+
+
+class PaperPartitions(BaseModel):
+    """
+    The partitions of an embedded paper.
+
+    Attributes
+    ----------
+    collections : List[str]
+        The keys of the Zotero collections the paper is in.
+    tags : List[str]
+        The paper's Zotero tags.
+    """
+    collections: List[str] = Field(default_factory=list)
+    tags: List[str] = Field(default_factory=list)
+
+
+class PartitionIndex:
+    """
+    An index of the Zotero collections and tags of every embedded paper, used to limit queries to a subset of the
+    library.
+
+    The partitions of each paper are taken from its Zotero item details when it is ingested, and updated whenever the
+    item is re-synced, including when only its collections or tags changed. The names of the collections are kept
+    with the index, so queries can name collections as they appear in Zotero.
+
+    Attributes
+    ----------
+    index_path : Path
+        The JSON file in which the index is persisted.
+
+    Methods
+    -------
+    update(item: dict) -> bool
+        Records the partitions of an embedded paper from its Zotero item details.
+    remove(docnames: Iterable[str])
+        Removes papers from the index.
+    sync(docnames: Iterable[str])
+        Drops the papers that are no longer embedded.
+    merge(other: PartitionIndex, docnames: Iterable[str])
+        Copies the partitions of papers, and the names of their collections, from another index.
+    missing_docnames(docnames: Iterable[str]) -> List[str]
+        Returns the embedded papers whose partitions are not known.
+    unnamed_collections() -> Set[str]
+        Returns the keys of the collections whose names are not known.
+    set_collection_names(collection_names: Dict[str, str])
+        Records the names of collections, by key.
+    docnames(scope: PartitionScope) -> Set[str]
+        Returns the papers in a scope.
+    partitions() -> Dict[str, int]
+        Returns every partition and its number of papers.
+    refresh() -> bool
+        Reloads the index if another process has saved it since it was read.
+    save()
+        Atomically persists the index.
+
+    Notes
+    -----
+    Papers are identified by their Zotero key (their `docname`), so a paper keeps its partitions when its PDF is
+    re-embedded. Papers embedded before the index existed are filled in by the next ingestion run, which fetches
+    their item details in batches.
+    """
+    def __init__(self, index_path: Union[str, Path]):
+        self.index_path: Path = Path(index_path)
+        self._entries: Dict[str, PaperPartitions] = {}
+        self._collection_names: Dict[str, str] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock: threading.RLock = threading.RLock()
+        self._load()
+
+    def __len__(self) -> int:
+        """Return the number of papers in the index."""
+        return len(self._entries)
+
+    def update(self, item: dict) -> bool:
+        """
+        Records the partitions of an embedded paper from its Zotero item details.
+
+        Parameters
+        ----------
+        item : dict
+            The full item details from Zotero, e.g. `ZoteroPaper.details`.
+
+        Returns
+        -------
+        bool
+            True if the paper's partitions changed.
+        """
+        data: dict = item.get('data', {})
+        partitions: PaperPartitions = PaperPartitions(
+            collections=sorted(set(data.get('collections', []))),
+            tags=sorted({tag['tag'] for tag in data.get('tags', []) if tag.get('tag')})
+        )
+        with self._lock:
+            if self._entries.get(item['key']) == partitions:
+                return False
+            self._entries[item['key']] = partitions
+
+        return True
+
+    def remove(self, docnames: Iterable[str]):
+        """
+        Removes papers from the index.
+
+        Parameters
+        ----------
+        docnames : Iterable[str]
+            The Zotero keys of the papers.
+        """
+        with self._lock:
+            for docname in docnames:
+                self._entries.pop(docname, None)
+
+    def sync(self, docnames: Iterable[str]):
+        """
+        Drops the papers that are no longer embedded.
+
+        Parameters
+        ----------
+        docnames : Iterable[str]
+            The Zotero keys of every embedded paper.
+        """
+        embedded_docnames: Set[str] = set(docnames)
+        with self._lock:
+            self.remove([docname for docname in self._entries if docname not in embedded_docnames])
+
+    def merge(self, other: 'PartitionIndex', docnames: Iterable[str]):
+        """
+        Copies the partitions of papers, and the names of their collections, from another index, e.g. a shard's.
+
+        Parameters
+        ----------
+        other : PartitionIndex
+            The index to copy from.
+        docnames : Iterable[str]
+            The Zotero keys of the papers to copy. Papers missing from `other` are left to be filled in by the next
+            ingestion run.
+        """
+        with self._lock, other._lock:
+            for docname in docnames:
+                if docname in other._entries:
+                    self._entries[docname] = other._entries[docname]
+            self._collection_names.update(other._collection_names)
+
+    def missing_docnames(self, docnames: Iterable[str]) -> List[str]:
+        """
+        Returns the embedded papers whose partitions are not known, e.g. because they were embedded before the index
+        existed.
+
+        Parameters
+        ----------
+        docnames : Iterable[str]
+            The Zotero keys of every embedded paper.
+
+        Returns
+        -------
+        List[str]
+            The Zotero keys of the papers missing from the index, sorted.
+        """
+        with self._lock:
+            return sorted(docname for docname in set(docnames) if docname not in self._entries)
+
+    def unnamed_collections(self) -> Set[str]:
+        """
+        Returns the keys of the collections whose names are not known.
+
+        Returns
+        -------
+        Set[str]
+            The collection keys.
+        """
+        with self._lock:
+            return {
+                key for partitions in self._entries.values() for key in partitions.collections
+                if key not in self._collection_names
+            }
+
+    def set_collection_names(self, collection_names: Dict[str, str]):
+        """
+        Records the names of collections.
+
+        Parameters
+        ----------
+        collection_names : Dict[str, str]
+            The name of each collection, by key.
+        """
+        with self._lock:
+            self._collection_names.update(collection_names)
+
+    def docnames(self, scope: PartitionScope) -> Set[str]:
+        """
+        Returns the papers in a scope.
+
+        Parameters
+        ----------
+        scope : PartitionScope
+            The collections, by name or key, and tags.
+
+        Returns
+        -------
+        Set[str]
+            The Zotero keys of the papers in any of the scope's collections or with any of its tags.
+
+        Raises
+        ------
+        ValueError
+            If a collection or tag does not match any embedded paper.
+        """
+        with self._lock:
+            collection_keys: Set[str] = set()
+            for collection in scope.collections:
+                keys: Set[str] = {
+                    key for key, name in self._collection_names.items() if name == collection
+                } or ({collection} if any(collection in entry.collections for entry in self._entries.values())
+                      else set())
+                if not keys:
+                    raise ValueError(f"No embedded papers are in a collection named {collection}. Known partitions: "
+                                     f"{', '.join(self.partitions()) or 'none'}")
+                collection_keys |= keys
+
+            tags: Set[str] = set(scope.tags)
+            for tag in tags:
+                if not any(tag in entry.tags for entry in self._entries.values()):
+                    raise ValueError(f"No embedded papers have the tag {tag}. Known partitions: "
+                                     f"{', '.join(self.partitions()) or 'none'}")
+
+            return {
+                docname for docname, entry in self._entries.items()
+                if collection_keys.intersection(entry.collections) or tags.intersection(entry.tags)
+            }
+
+    def partitions(self) -> Dict[str, int]:
+        """
+        Returns every partition and its number of papers.
+
+        Returns
+        -------
+        Dict[str, int]
+            The number of papers in each partition, keyed by `collection:<name>` (or the collection's key if its name
+            is not known) and `tag:<tag>`, sorted by partition.
+        """
+        with self._lock:
+            counts: Counter = Counter()
+            for entry in self._entries.values():
+                counts.update(f"{PartitionConstants.COLLECTION_PREFIX}{self._collection_names.get(key, key)}"
+                              for key in entry.collections)
+                counts.update(f"{PartitionConstants.TAG_PREFIX}{tag}" for tag in entry.tags)
+
+            return dict(sorted(counts.items()))
+
+    def refresh(self) -> bool:
+        """
+        Reloads the index if another process, e.g. a headless ingestion run, has saved it since it was read.
+
+        Returns
+        -------
+        bool
+            True if the index was reloaded.
+        """
+        with self._lock:
+            if self._file_signature() == self._signature:
+                return False
+            self._entries = {}
+            self._collection_names = {}
+            self._load()
+
+        return True
+
+    def save(self):
+        """Atomically persists the index."""
+        with self._lock:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path: Path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'entries': {docname: entry.model_dump() for docname, entry in self._entries.items()},
+                    'collection_names': self._collection_names
+                }, file)
+            os.replace(temp_path, self.index_path)
+            self._signature = self._file_signature()
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        """Returns the modification time and size of the index file, or None if it does not exist."""
+        try:
+            stat: os.stat_result = self.index_path.stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """Loads the persisted index, starting empty if it does not exist or cannot be read."""
+        self._signature = self._file_signature()
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                state: dict = json.load(file)
+            entries: Dict[str, PaperPartitions] = {
+                docname: PaperPartitions(**entry) for docname, entry in state['entries'].items()
+            }
+            collection_names: Dict[str, str] = dict(state.get('collection_names', {}))
+        except (FileNotFoundError, ValueError, TypeError, KeyError, AttributeError):
+            return
+
+        self._entries = entries
+        self._collection_names = collection_names
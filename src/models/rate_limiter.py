@@ -0,0 +1,309 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+import openai
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import RateLimitConstants
+from models.telemetry import get_telemetry
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that refills continuously at a fixed rate.
+
+    Callers reserve capacity up front, and the bucket level may go negative. A caller that drives the level negative
+    must wait until the debt has been repaid by the refill, so concurrent callers are admitted in the order they
+    reserved capacity, and a single request larger than the bucket is still admitted rather than blocked forever.
+
+    Attributes
+    ----------
+    rate : float
+        The refill rate, in units per second.
+    capacity : float
+        The maximum level of the bucket, which bounds the size of a burst.
+
+    Methods
+    -------
+    reserve(amount: float, now: float) -> float
+        Reserves capacity, returning how many seconds the caller must wait before using it.
+    drain(now: float)
+        Empties the bucket, so that no further burst is admitted.
+    set_rate(rate: float, capacity: float, now: float)
+        Changes the refill rate and capacity of the bucket.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self._level: float = capacity
+        self._updated: float = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Reserves capacity from the bucket.
+
+        Parameters
+        ----------
+        amount : float
+            The capacity to reserve.
+        now : float
+            The current `time.monotonic()` time.
+
+        Returns
+        -------
+        float
+            The number of seconds until the reserved capacity has been refilled, or 0 if it is available now.
+        """
+        self._refill(now)
+        self._level -= amount
+
+        return max(0.0, -self._level / self.rate)
+
+    def drain(self, now: float):
+        """
+        Empties the bucket, keeping any outstanding debt.
+
+        Parameters
+        ----------
+        now : float
+            The current `time.monotonic()` time.
+        """
+        self._refill(now)
+        self._level = min(self._level, 0.0)
+
+    def set_rate(self, rate: float, capacity: float, now: float):
+        """
+        Changes the refill rate and capacity of the bucket.
+
+        Parameters
+        ----------
+        rate : float
+            The new refill rate, in units per second.
+        capacity : float
+            The new maximum level of the bucket.
+        now : float
+            The current `time.monotonic()` time.
+        """
+        self._refill(now)
+        self.rate = rate
+        self.capacity = capacity
+        self._level = min(self._level, capacity)
+
+    def _refill(self, now: float):
+        """Adds the capacity accrued since the bucket was last updated."""
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class OpenAIRateLimiter:
+    """
+    An adaptive client-side rate limiter for the OpenAI API, enforcing both a requests-per-minute (RPM) and a
+    tokens-per-minute (TPM) limit with a pair of token buckets.
+
+    The limiter targets a fraction of the account's limits, so sustained throughput sits just under the quota rather
+    than repeatedly hitting it. When a request is nevertheless throttled, every caller is paused for the duration
+    given by the response's `retry-after` header (or a jittered exponential backoff without one), and the target rate
+    is reduced multiplicatively. It then recovers additively with every successful request, back up to the target.
+
+    Attributes
+    ----------
+    name : str
+        The name of the limiter, used to label its telemetry, e.g. 'llm' or 'embedding'.
+    requests_per_minute : int
+        The account's requests-per-minute limit.
+    tokens_per_minute : int
+        The account's tokens-per-minute limit.
+    target_utilisation : float
+        The fraction of the limits that the limiter aims for.
+    max_retries : int
+        The number of times a throttled or transiently failed request is retried before its error is raised.
+    rate_scale : float
+        The fraction of the target rate currently allowed, reduced after each throttled request.
+    num_throttled : int
+        The number of requests throttled by the API.
+    num_retries : int
+        The number of requests retried.
+
+    Methods
+    -------
+    call(make_request: Callable[[], Awaitable[T]], num_tokens: int) -> T
+        Makes a rate-limited API request, retrying it if it is throttled or fails transiently.
+    acquire(num_tokens: int)
+        Waits until a request of a given number of tokens can be made without exceeding the limits.
+    report() -> str
+        Returns a one-line human-readable summary of the limiter's state.
+
+    Notes
+    -----
+    The limiter is thread-safe and does not use any `asyncio` synchronisation primitives, so a single limiter can be
+    shared by every pipeline run, whichever event loop it runs on.
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int,
+                 target_utilisation: float = RateLimitConstants.TARGET_UTILISATION,
+                 max_retries: int = RateLimitConstants.MAX_RETRIES, name: str = 'openai'):
+        self.name: str = name
+        self.requests_per_minute: int = requests_per_minute
+        self.tokens_per_minute: int = tokens_per_minute
+        self.target_utilisation: float = target_utilisation
+        self.max_retries: int = max_retries
+        self.rate_scale: float = 1.0
+        self.num_throttled: int = 0
+        self.num_retries: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._paused_until: float = 0.0
+        self._request_bucket: TokenBucket = TokenBucket(*self._bucket_rate(requests_per_minute))
+        self._token_bucket: TokenBucket = TokenBucket(*self._bucket_rate(tokens_per_minute))
+
+    async def call(self, make_request: Callable[[], Awaitable[T]], num_tokens: int) -> T:
+        """
+        Makes a rate-limited API request, retrying it if it is throttled or fails transiently.
+
+        Parameters
+        ----------
+        make_request : Callable[[], Awaitable[T]]
+            Creates the awaitable that makes the request. Called again for every retry.
+        num_tokens : int
+            The estimated number of tokens used by the request.
+
+        Returns
+        -------
+        T
+            The result of the request.
+
+        Raises
+        ------
+        openai.RateLimitError
+            If the request is still throttled after `max_retries` retries.
+        openai.APIConnectionError, openai.InternalServerError
+            If the request still fails transiently after `max_retries` retries.
+        openai.OpenAIError
+            Any other API error, which is not retried.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(num_tokens)
+            try:
+                result: T = await make_request()
+            except openai.RateLimitError as error:
+                if attempt == self.max_retries:
+                    raise
+                self._throttle(self._retry_after(error) or self._backoff(attempt), throttled=True)
+            except (openai.APIConnectionError, openai.InternalServerError) as error:
+                if attempt == self.max_retries:
+                    raise
+                self._throttle(self._retry_after(error) or self._backoff(attempt), throttled=False)
+            else:
+                self._recover()
+                return result
+
+    async def acquire(self, num_tokens: int):
+        """
+        Waits until a request of a given number of tokens can be made without exceeding the limits.
+
+        Parameters
+        ----------
+        num_tokens : int
+            The estimated number of tokens used by the request.
+        """
+        with self._lock:
+            now: float = time.monotonic()
+            delay: float = max(
+                self._paused_until - now,
+                self._request_bucket.reserve(1, now),
+                self._token_bucket.reserve(num_tokens, now)
+            )
+        if delay > 0:
+            get_telemetry().increment('openai_rate_limit_wait_seconds', delay, limiter=self.name)
+            await asyncio.sleep(delay)
+
+    def report(self) -> str:
+        """Return a one-line human-readable summary of the limiter's state."""
+        return (f"{self.num_throttled} throttled requests, {self.num_retries} retries, running at "
+                f"{self.rate_scale * self.target_utilisation:.0%} of {self.requests_per_minute} RPM / "
+                f"{self.tokens_per_minute} TPM")
+
+    def _throttle(self, delay: float, throttled: bool):
+        """Pauses every caller for `delay` seconds, reducing the target rate if the API throttled the request."""
+        with self._lock:
+            now: float = time.monotonic()
+            self.num_retries += 1
+            get_telemetry().increment('openai_retries', limiter=self.name,
+                                      reason='throttled' if throttled else 'transient')
+            already_paused: bool = now < self._paused_until
+            self._paused_until = max(self._paused_until, now + delay)
+            if not throttled:
+                return
+
+            # Requests in flight when the limit was hit are all throttled together, so the rate is only reduced once
+            # per pause
+            self.num_throttled += 1
+            if already_paused:
+                return
+
+            self.rate_scale = max(RateLimitConstants.MIN_RATE_SCALE,
+                                  self.rate_scale * RateLimitConstants.RATE_DECREASE_FACTOR)
+            self._request_bucket.set_rate(*self._bucket_rate(self.requests_per_minute), now)
+            self._token_bucket.set_rate(*self._bucket_rate(self.tokens_per_minute), now)
+            self._request_bucket.drain(now)
+            self._token_bucket.drain(now)
+
+    def _recover(self):
+        """Increases the allowed rate after a successful request, up to the target rate."""
+        if self.rate_scale >= 1.0:
+            return
+
+        with self._lock:
+            now: float = time.monotonic()
+            self.rate_scale = min(1.0, self.rate_scale + RateLimitConstants.RATE_RECOVERY_STEP)
+            self._request_bucket.set_rate(*self._bucket_rate(self.requests_per_minute), now)
+            self._token_bucket.set_rate(*self._bucket_rate(self.tokens_per_minute), now)
+
+    def _bucket_rate(self, limit_per_minute: int) -> Tuple[float, float]:
+        """Returns the refill rate per second and burst capacity of a bucket enforcing a per-minute limit."""
+        rate: float = limit_per_minute * self.target_utilisation * self.rate_scale / 60
+
+        return rate, rate * RateLimitConstants.BURST_SECONDS
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Returns a full-jitter exponential backoff delay for a given retry attempt."""
+        return random.uniform(
+            RateLimitConstants.MIN_BACKOFF_SECONDS,
+            min(RateLimitConstants.MAX_BACKOFF_SECONDS, RateLimitConstants.MIN_BACKOFF_SECONDS * 2 ** (attempt + 1))
+        )
+
+    @staticmethod
+    def _retry_after(error: openai.APIError) -> Optional[float]:
+        """
+        Returns the jittered delay requested by an error response's `retry-after-ms` or `retry-after` header, or None
+        if it has neither.
+        """
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+
+        retry_after: Optional[float] = None
+        try:
+            if 'retry-after-ms' in response.headers:
+                retry_after = float(response.headers['retry-after-ms']) / 1000
+            elif 'retry-after' in response.headers:
+                retry_after = float(response.headers['retry-after'])
+        except ValueError:
+            try:
+                retry_after = parsedate_to_datetime(response.headers['retry-after']).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+
+        if retry_after is None or retry_after < 0:
+            return None
+
+        return min(retry_after, RateLimitConstants.MAX_BACKOFF_SECONDS) * (
+            1 + random.uniform(0, RateLimitConstants.RETRY_AFTER_JITTER)
+        )
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Union
+
+
+class RetryQueueEntry(BaseModel):
+    """
+    A Zotero item queued to be re-attempted by the next embedding run.
+
+    Attributes
+    ----------
+    zotero_key : str
+        The Zotero key of the item.
+    title : str
+        The title of the item.
+    error : str
+        The error that stopped the item from being embedded on its last attempt.
+    attempts : int
+        The number of runs in which the item has failed.
+    queued_at : float
+        When the item was first queued, as a Unix timestamp.
+    """
+    zotero_key: str
+    title: str
+    error: str
+    attempts: int = 1
+    queued_at: float
+
+
+class RetryQueue:
+    """
+    A durable queue of Zotero items whose embedding failed with a recoverable API error, such as rate limiting.
+
+    Rather than being dropped from the batch, a throttled paper is added to the queue, which is persisted to a JSON
+    file after every change. Queued papers are re-attempted at the start of the next embedding run, and removed from
+    the queue once they have been embedded.
+
+    Attributes
+    ----------
+    queue_path : Path
+        The path to the JSON file in which the queue is persisted.
+
+    Methods
+    -------
+    add(zotero_key: str, title: str, error: Exception)
+        Queues an item, or records another failed attempt of an item already in the queue.
+    remove(zotero_key: str) -> bool
+        Removes an item from the queue.
+    keys() -> List[str]
+        Returns the Zotero keys of the queued items, in the order they were first queued.
+    save()
+        Atomically persists the queue.
+    """
+    def __init__(self, queue_path: Union[str, Path]):
+        self.queue_path: Path = Path(queue_path)
+        self._entries: Dict[str, RetryQueueEntry] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        """Return the number of queued items."""
+        return len(self._entries)
+
+    def __contains__(self, zotero_key: str) -> bool:
+        """Return whether an item is queued."""
+        return zotero_key in self._entries
+
+    def add(self, zotero_key: str, title: str, error: Exception):
+        """
+        Queues an item, or records another failed attempt of an item already in the queue.
+
+        Parameters
+        ----------
+        zotero_key : str
+            The Zotero key of the item.
+        title : str
+            The title of the item.
+        error : Exception
+            The error that stopped the item from being embedded.
+        """
+        with self._lock:
+            entry: Optional[RetryQueueEntry] = self._entries.get(zotero_key)
+            if entry is None:
+                self._entries[zotero_key] = RetryQueueEntry(
+                    zotero_key=zotero_key, title=title, error=repr(error), queued_at=time.time()
+                )
+            else:
+                entry.error = repr(error)
+                entry.attempts += 1
+            self.save()
+
+    def remove(self, zotero_key: str) -> bool:
+        """
+        Removes an item from the queue.
+
+        Parameters
+        ----------
+        zotero_key : str
+            The Zotero key of the item.
+
+        Returns
+        -------
+        bool
+            Whether the item was queued.
+        """
+        with self._lock:
+            if self._entries.pop(zotero_key, None) is None:
+                return False
+            self.save()
+
+        return True
+
+    def keys(self) -> List[str]:
+        """Return the Zotero keys of the queued items, in the order they were first queued."""
+        return list(self._entries)
+
+    def save(self):
+        """Atomically persists the queue."""
+        self.queue_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path: Path = self.queue_path.with_name(f"{self.queue_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump([entry.model_dump() for entry in self._entries.values()], file)
+        os.replace(temp_path, self.queue_path)
+
+    def _load(self):
+        """Loads the persisted queue, starting empty if it does not exist or cannot be read."""
+        try:
+            with open(self.queue_path, 'r', encoding='utf-8') as file:
+                entries: List[RetryQueueEntry] = [RetryQueueEntry(**entry) for entry in json.load(file)]
+        except (FileNotFoundError, ValueError, TypeError):
+            return
+
+        self._entries = {entry.zotero_key: entry for entry in entries}
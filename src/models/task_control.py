@@ -0,0 +1,95 @@
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+
+class TaskControl:
+    """
+    Lets a long-running task on a worker thread be paused, resumed and cancelled from another thread, e.g. the GUI.
+
+    The task checks the control between units of work, so pausing or cancelling takes effect once the work already in
+    flight has finished, and nothing is left half-done.
+
+    Attributes
+    ----------
+    is_cancelled : bool
+        Whether the task has been cancelled.
+    is_paused : bool
+        Whether the task is paused.
+
+    Methods
+    -------
+    cancel()
+        Cancels the task, also releasing it if it is paused.
+    pause()
+        Pauses the task before its next unit of work.
+    resume()
+        Resumes a paused task.
+    wait_if_paused() -> bool
+        Blocks while the task is paused, returning whether it may continue.
+    iterate(items: Iterable[T]) -> Iterator[T]
+        Yields items until the task is cancelled, blocking while it is paused.
+    """
+    def __init__(self):
+        self._cancelled: threading.Event = threading.Event()
+        self._running: threading.Event = threading.Event()
+        self._running.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        """Return whether the task has been cancelled."""
+        return self._cancelled.is_set()
+
+    @property
+    def is_paused(self) -> bool:
+        """Return whether the task is paused."""
+        return not self._running.is_set()
+
+    def cancel(self):
+        """Cancels the task, also releasing it if it is paused."""
+        self._cancelled.set()
+        self._running.set()
+
+    def pause(self):
+        """Pauses the task before its next unit of work."""
+        if not self.is_cancelled:
+            self._running.clear()
+
+    def resume(self):
+        """Resumes a paused task."""
+        self._running.set()
+
+    def wait_if_paused(self) -> bool:
+        """
+        Blocks while the task is paused.
+
+        Returns
+        -------
+        bool
+            False if the task has been cancelled, and True if it may continue.
+        """
+        self._running.wait()
+        return not self.is_cancelled
+
+    def iterate(self, items: Iterable[T]) -> Iterator[T]:
+        """
+        Yields items until the task is cancelled, blocking before each item while the task is paused.
+
+        Parameters
+        ----------
+        items : Iterable[T]
+            The items to yield.
+
+        Yields
+        ------
+        T
+            Each item, in order.
+        """
+        iterator: Iterator[T] = iter(items)
+        while self.wait_if_paused():
+            try:
+                item: T = next(iterator)
+            except StopIteration:
+                return
+            yield item
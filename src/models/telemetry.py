@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import atexit
+import itertools
+import threading
+import contextvars
+from pathlib import Path
+from typing import Any, Dict, Optional, TextIO, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import TelemetryConstants
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Span:
+    """
+    A timed operation, recorded when its `with` block exits.
+
+    Spans opened inside another span's `with` block (including in tasks and `asyncio.to_thread()` calls started
+    within it) are recorded as its children.
+
+    Attributes
+    ----------
+    name : str
+        The name of the operation, e.g. 'download' or 'query.answer'.
+    attributes : Dict[str, Any]
+        Details of the operation, written to the trace.
+    span_id : int
+        The ID of the span, unique within the process.
+    parent_id : int, optional
+        The ID of the enclosing span, if any.
+
+    Methods
+    -------
+    set(**attributes)
+        Adds attributes to the span.
+    """
+    def __init__(self, telemetry: 'Telemetry', name: str, attributes: Dict[str, Any]):
+        self.name: str = name
+        self.attributes: Dict[str, Any] = attributes
+        self.span_id: int = next(telemetry._span_ids)
+        self.parent_id: Optional[int] = None
+        self._telemetry: Telemetry = telemetry
+        self._start_time: float = 0.0
+        self._start: float = 0.0
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> 'Span':
+        parent: Optional[Span] = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self._token = _current_span.set(self)
+        self._start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration: float = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = repr(exc_value)
+        self._telemetry._record_span(self.name, self.span_id, self.parent_id, self._start_time, duration,
+                                     self.attributes)
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+
+class _NullSpan:
+    """The span returned while telemetry is disabled, which records nothing."""
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN: _NullSpan = _NullSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+class Telemetry:
+    """
+    Structured timing spans and counters for the embedder and query path, written as a JSONL trace and as a
+    Prometheus text-format metrics snapshot.
+
+    Every span is written to the trace as one JSON object per line as soon as it ends, with its start time, duration,
+    parent span and attributes, so a run can be profiled after the fact even if it crashes. Span durations are also
+    aggregated per span name into a Prometheus summary, alongside the counters (e.g. tokens, bytes downloaded, cache
+    hits and retries) and gauges.
+
+    Telemetry is disabled unless a telemetry directory is given, in which case `span()` returns a shared no-op span
+    and the counter methods return immediately, so instrumented code pays a single attribute check.
+
+    Attributes
+    ----------
+    telemetry_dir : Path, optional
+        The directory to which the trace and metrics snapshot are written, or None if telemetry is disabled.
+    enabled : bool
+        Whether telemetry is enabled.
+
+    Methods
+    -------
+    span(name: str, **attributes) -> Span
+        Returns a span timing the operation in its `with` block.
+    observe(name: str, duration: float, **attributes)
+        Records an operation that has just finished, timed elsewhere.
+    increment(name: str, value: float = 1, **labels)
+        Increments a counter.
+    set_gauge(name: str, value: float, **labels)
+        Sets a gauge.
+    prometheus_text() -> str
+        Returns the spans, counters and gauges in the Prometheus text exposition format.
+    write_metrics()
+        Atomically writes the Prometheus snapshot to the telemetry directory.
+    close()
+        Writes the metrics snapshot and closes the trace.
+    from_environment() -> Telemetry
+        Creates the telemetry configured by the `PAPER_QA_TELEMETRY_DIR` environment variable.
+
+    Notes
+    -----
+    Counters and span summaries accumulate over the life of the process. The metrics snapshot is rewritten after
+    every ingestion batch and query, and when the process exits.
+    """
+    def __init__(self, telemetry_dir: Optional[Union[str, Path]] = None):
+        self.telemetry_dir: Optional[Path] = Path(telemetry_dir) if telemetry_dir else None
+        self.enabled: bool = self.telemetry_dir is not None
+        self._lock: threading.Lock = threading.Lock()
+        self._span_ids: itertools.count = itertools.count(1)
+        self._span_stats: Dict[str, list] = {}
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._gauges: Dict[Tuple[str, LabelSet], float] = {}
+        self._trace_file: Optional[TextIO] = None
+        if self.enabled:
+            self.telemetry_dir.mkdir(parents=True, exist_ok=True)
+            self._trace_file = open(self.telemetry_dir / TelemetryConstants.TRACE_FILE_NAME, 'a', encoding='utf-8')
+            atexit.register(self.close)
+
+    @classmethod
+    def from_environment(cls) -> 'Telemetry':
+        """Return the telemetry configured by the `PAPER_QA_TELEMETRY_DIR` environment variable."""
+        return cls(os.getenv(TelemetryConstants.TELEMETRY_DIR_ENV_VAR))
+
+    def span(self, name: str, **attributes) -> Union[Span, _NullSpan]:
+        """
+        Returns a span timing the operation in its `with` block.
+
+        Parameters
+        ----------
+        name : str
+            The name of the operation.
+        **attributes
+            Details of the operation, written to the trace.
+
+        Returns
+        -------
+        Union[Span, _NullSpan]
+            The span, or a no-op span if telemetry is disabled.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+
+        return Span(self, name, attributes)
+
+    def observe(self, name: str, duration: float, **attributes):
+        """
+        Records an operation that has just finished, timed elsewhere, as a child of the current span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the operation.
+        duration : float
+            The duration of the operation, in seconds.
+        **attributes
+            Details of the operation, written to the trace.
+        """
+        if not self.enabled:
+            return
+
+        parent: Optional[Span] = _current_span.get()
+        self._record_span(name, next(self._span_ids), parent.span_id if parent is not None else None,
+                          time.time() - duration, duration, attributes)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Increments a counter.
+
+        Parameters
+        ----------
+        name : str
+            The name of the counter, without the metric prefix or `_total` suffix.
+        value : float
+            The amount to add.
+        **labels
+            The labels of the counter, e.g. `cache='parsed_pdf'`.
+        """
+        if not self.enabled:
+            return
+
+        key: Tuple[str, LabelSet] = (name, self._label_set(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        Sets a gauge.
+
+        Parameters
+        ----------
+        name : str
+            The name of the gauge, without the metric prefix.
+        value : float
+            The current value.
+        **labels
+            The labels of the gauge.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._gauges[(name, self._label_set(labels))] = value
+
+    def prometheus_text(self) -> str:
+        """
+        Returns the span summaries, counters and gauges in the Prometheus text exposition format.
+
+        Returns
+        -------
+        str
+            The metrics, one sample per line.
+        """
+        prefix: str = TelemetryConstants.METRIC_PREFIX
+        lines: list = []
+        with self._lock:
+            if self._span_stats:
+                lines += [f"# HELP {prefix}_span_seconds Time spent in each instrumented operation.",
+                          f"# TYPE {prefix}_span_seconds summary"]
+                for name, (count, total, _, _) in sorted(self._span_stats.items()):
+                    labels: str = self._format_labels((('span', name),))
+                    lines += [f"{prefix}_span_seconds_count{labels} {count}",
+                              f"{prefix}_span_seconds_sum{labels} {total:.6f}"]
+                lines += [f"# TYPE {prefix}_span_seconds_max gauge"]
+                lines += [f"{prefix}_span_seconds_max{self._format_labels((('span', name),))} {maximum:.6f}"
+                          for name, (_, _, maximum, _) in sorted(self._span_stats.items())]
+                lines += [f"# TYPE {prefix}_span_errors_total counter"]
+                lines += [f"{prefix}_span_errors_total{self._format_labels((('span', name),))} {errors}"
+                          for name, (_, _, _, errors) in sorted(self._span_stats.items())]
+
+            for metrics, metric_type, suffix in ((self._counters, 'counter', '_total'), (self._gauges, 'gauge', '')):
+                previous_name: Optional[str] = None
+                for (name, label_set), value in sorted(metrics.items()):
+                    if name != previous_name:
+                        lines.append(f"# TYPE {prefix}_{name}{suffix} {metric_type}")
+                        previous_name = name
+                    lines.append(f"{prefix}_{name}{suffix}{self._format_labels(label_set)} {value:g}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self):
+        """Atomically writes the Prometheus snapshot to the telemetry directory, if telemetry is enabled."""
+        if not self.enabled:
+            return
+
+        metrics_path: Path = self.telemetry_dir / TelemetryConstants.METRICS_FILE_NAME
+        temp_path: Path = metrics_path.with_name(f"{metrics_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_path, metrics_path)
+
+    def close(self):
+        """Writes the metrics snapshot and closes the trace."""
+        if self._trace_file is None:
+            return
+
+        self.write_metrics()
+        with self._lock:
+            self._trace_file.close()
+            self._trace_file = None
+
+    def _record_span(self, name: str, span_id: int, parent_id: Optional[int], start_time: float, duration: float,
+                     attributes: Dict[str, Any]):
+        """Aggregates a finished span into its summary and writes it to the trace."""
+        record: str = json.dumps({
+            'span': name,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'start': round(start_time, 6),
+            'duration': round(duration, 6),
+            **attributes
+        }, default=str)
+        with self._lock:
+            stats: list = self._span_stats.setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            stats[3] += 'error' in attributes
+            if self._trace_file is not None:
+                self._trace_file.write(record + '\n')
+                self._trace_file.flush()
+
+    @staticmethod
+    def _label_set(labels: Dict[str, Any]) -> LabelSet:
+        """Returns a hashable, sorted set of labels."""
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(label_set: LabelSet) -> str:
+        """Formats a set of labels for the Prometheus text format."""
+        if not label_set:
+            return ''
+
+        escaped: list = [
+            f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for name, value in label_set
+        ]
+        return '{' + ','.join(escaped) + '}'
+
+
+_telemetry: Optional[Telemetry] = None
+_telemetry_lock: threading.Lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """
+    Returns the process-wide telemetry, creating it from the `PAPER_QA_TELEMETRY_DIR` environment variable on first
+    use.
+
+    Returns
+    -------
+    Telemetry
+        The process-wide telemetry.
+    """
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry.from_environment()
+
+    return _telemetry
+
+
+def set_telemetry(telemetry: Telemetry) -> Telemetry:
+    """
+    Replaces the process-wide telemetry, e.g. to enable it from a command-line flag.
+
+    Parameters
+    ----------
+    telemetry : Telemetry
+        The new process-wide telemetry.
+
+    Returns
+    -------
+    Telemetry
+        The new process-wide telemetry.
+    """
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is not None and _telemetry is not telemetry:
+            _telemetry.close()
+        _telemetry = telemetry
+
+    return telemetry
@@ -1,19 +1,39 @@
 import os
 import sys
+import queue
 import paperqa
 import openai
-import pickle
-import time
-import PySimpleGUI as sg
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from itertools import chain
 from paperqa.contrib import ZoteroDB
-from paperqa import utils as paperqa_utils
-from pathlib import PosixPath, Path, WindowsPath
+from pathlib import Path
+from pyzotero.zotero import build_url
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from typing import Generator, Optional, List, cast, Union
+from typing import Callable, Dict, Generator, Iterable, Iterator, Optional, List, Set, Tuple, Union
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from config.constants import (
+    DataConstants, DuplicateConstants, LocalZoteroConstants, PipelineConstants, RateLimitConstants, ZoteroConstants
+)
 from models.zotero_paper import ZoteroPaper
+from models.duplicate_index import DuplicateIndex
+from models.embedding_shards import EmbeddingShard
+from models.embedding_store import EmbeddingStore
+from models.library_metadata import LibraryMetadataCache
+from models.local_zotero_library import LocalZoteroLibrary
+from models.mapped_chunk_store import MappedChunkStore
+from models.page_hash_index import PageHashIndex
+from models.parsed_pdf_cache import ParsedPdfCache
+from models.partition_index import PartitionIndex
+from models.rate_limiter import OpenAIRateLimiter
+from models.retry_queue import RetryQueue
+from models.task_control import TaskControl
+from models.telemetry import Telemetry, get_telemetry
+from models.zotero_sync_state import ZoteroSyncState
+from models.ingestion_pipeline import IngestionPipeline, PipelineMetrics, PipelineWorkItem
 from utils import llm_utils
 
 ZOTERO_LIBRARY_ID: str = os.getenv('ZOTERO_USER_ID')
@@ -31,24 +51,76 @@ class ZoteroPaperEmbedder(ZoteroDB):
 
     Attributes
     ----------
-    console_multiline : sg.Multiline
-        A PySimpleGUI Multiline element for logging output.
-    window : sg.Window
-        The PySimpleGUI window that contains the Multiline element.
+    endpoint : str
+        The base URL of the Zotero web API. Defaults to https://api.zotero.org.
+    log_queue : queue.Queue, optional
+        A queue to which log and error messages are posted as `('log', message)` and `('error', message)` tuples, for
+        a GUI to display from its own thread. If None, messages are printed to standard error.
+    telemetry : Telemetry
+        The process-wide timing spans and counters, enabled with the `PAPER_QA_TELEMETRY_DIR` environment variable.
+    embedding_store : EmbeddingStore
+        The store of embedded papers shared by the `Docs` object of every LLM.
+    parsed_pdf_cache : ParsedPdfCache
+        The content-addressed cache of parsed PDFs, shared by page counting, token counting and chunking.
+    prefetch_workers : int
+        The number of worker threads used by `iterate()` to download PDFs in parallel.
+    http_session : requests.Session
+        A keep-alive HTTP session with a connection pool, shared by all PDF downloads.
+    llm_rate_limiter : OpenAIRateLimiter
+        The rate limiter shared by every LLM call made while embedding papers. Its limits can be set with the
+        `OPENAI_LLM_RPM` and `OPENAI_LLM_TPM` environment variables.
+    embedding_rate_limiter : OpenAIRateLimiter
+        The rate limiter shared by every embedding API call. Its limits can be set with the `OPENAI_EMBEDDING_RPM` and
+        `OPENAI_EMBEDDING_TPM` environment variables.
+    retry_queue : RetryQueue
+        The durable queue of papers that failed with a recoverable API error, re-attempted by the next run.
+    library_metadata : LibraryMetadataCache
+        The locally cached item count and version of the Zotero library.
+    duplicate_index : DuplicateIndex
+        The PDF hashes and MinHash text signatures of the embedded papers, used to skip duplicates before they are
+        embedded.
+    partition_index : PartitionIndex
+        The Zotero collections and tags of the embedded papers, used to limit queries to some of them.
+    page_hash_index : PageHashIndex
+        The hash of every page's text in the embedded papers, used to re-embed only the changed pages of a paper whose
+        PDF attachment is replaced or annotated.
+    skip_near_duplicates : bool
+        Whether papers whose text is a near duplicate of an embedded paper, e.g. the preprint of a published paper, are
+        skipped rather than embedded and flagged.
+    stop_on_error : bool
+        Whether an ingestion run stops at the first paper that fails with a non-recoverable error, rather than recording
+        it as failed and carrying on with the other papers.
+    local_library : LocalZoteroLibrary, optional
+        The local Zotero data directory from which items and PDFs are read instead of the web API, if any.
 
     Methods
     -------
     console_output(message: str)
-        Logs a message to the Multiline element or prints it to the console.
-    load_paperqa_doc(pkl_file_path: str, llm_model: str) -> paperqa.Docs
-        Loads a paperqa.Docs object from a pickle file, or creates a new one if the file does not exist.
+        Posts a message to the log queue or prints it to the console.
+    error_output(message: str)
+        Posts an error to the log queue, or logs it to the console when running headless.
+    load_paperqa_doc(llm_model: str) -> paperqa.Docs
+        Loads a paperqa.Docs object for a given LLM as a view over the embedding store.
     chatgpt_4o_embedder(embedded_docs: paperqa.Docs, query_limit: int, query_start: int) -> paperqa.Docs
         Embeds papers from Zotero into the given `paperqa.Docs` object.
+    embed_library(embedded_docs: paperqa.Docs, collection_name: Optional[str] = None, tag: Optional[str] = None,
+                  limit: Optional[int] = None, on_progress=None) -> List[PipelineWorkItem]
+        Embeds every paper in the Zotero library, or in one of its collections or tags, that is not yet embedded.
+    sync_docs(embedded_docs: paperqa.Docs, on_progress=None) -> paperqa.Docs
+        Brings the embedding store up to date with the Zotero library, fetching only what changed since the last sync.
+    estimate_tokens(query_limit: int, query_start: int, model: str) -> Tuple[Dict[str, int], int]
+        Estimates the number of input tokens in a batch of papers without embedding them.
     iterate(limit: int = 25, start: int = 0, q: Optional[str] = None, qmode: Optional[str] = None,
             since: Optional[str] = None, tag: Optional[str] = None, sort: Optional[str] = None,
             direction: Optional[str] = None,
             collection_name: Optional[str] = None) -> Generator[ZoteroPaper, None, None]
         Lazily iterates over papers in a Zotero library and downloads PDFs as needed.
+    iterate_items(...) -> Generator[dict, None, None]
+        Lazily iterates over item metadata in a Zotero library without downloading any PDFs.
+    download_pdf(item: dict) -> Optional[Path]
+        Thread-safely downloads the PDF attachment of a Zotero item, if it is not stored locally.
+    collection_names() -> Dict[str, str]
+        Returns the name of every collection in the Zotero library, by key.
     _get_citation_key(item: dict) -> str
         Generates a citation key for a Zotero item based on its metadata.
 
@@ -56,16 +128,75 @@ class ZoteroPaperEmbedder(ZoteroDB):
     -----
     This class extends and overrides the `ZoteroDB` class implementation found in the `zotero.py` module of the
     `paperqa` package, available at https://github.com/Future-House/paper-qa/blob/main/paperqa/contrib/zotero.py.
+
+    With a `zotero_data_dir`, the library is read from the local Zotero database and the PDFs from its `storage/`
+    directory, so listing, embedding and syncing the library make no Zotero API calls, and no Zotero credentials are
+    needed. Papers whose PDF has not been synced to the local storage are skipped rather than downloaded.
     """
-    def __init__(self, library_id: Optional[str], library_type: str, api_key: Optional[str], console_multiline=None,
-                 window=None):
-        super().__init__(library_id=library_id, library_type=library_type, api_key=api_key)
-        self.console_multiline = console_multiline
-        self.window = window
+    def __init__(self, library_id: Optional[str], library_type: str, api_key: Optional[str],
+                 log_queue: Optional[queue.Queue] = None, storage: Optional[Union[str, Path]] = None,
+                 endpoint: Optional[str] = None,
+                 processed_data_dir: Union[str, Path] = DataConstants.PROCESSED_DATA_DIR,
+                 parsed_pdf_cache_dir: Union[str, Path] = DataConstants.PARSED_PDF_CACHE_DIR,
+                 library_metadata_path: Union[str, Path] = DataConstants.LIBRARY_METADATA_CACHE_PATH,
+                 zotero_data_dir: Optional[Union[str, Path]] = None):
+        if zotero_data_dir is not None:
+            # The web API is not used, so the library is identified as the Zotero client's local API does
+            library_id = library_id or os.getenv('ZOTERO_USER_ID', LocalZoteroConstants.LIBRARY_ID)
+            api_key = api_key or os.getenv('ZOTERO_API_KEY', '')
+        super().__init__(library_id=library_id, library_type=library_type, api_key=api_key, storage=storage)
+        if endpoint is not None:
+            self.endpoint = endpoint
+        self.log_queue: Optional[queue.Queue] = log_queue
+        self.telemetry: Telemetry = get_telemetry()
+        self.embedding_store: EmbeddingStore = EmbeddingStore(processed_data_dir)
+        self.parsed_pdf_cache: ParsedPdfCache = ParsedPdfCache(parsed_pdf_cache_dir)
+        self.prefetch_workers: int = ZoteroConstants.PREFETCH_WORKERS
+        self.http_session: requests.Session = requests.Session()
+        http_adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=ZoteroConstants.HTTP_POOL_SIZE,
+            pool_maxsize=ZoteroConstants.HTTP_POOL_SIZE
+        )
+        self.http_session.mount('https://', http_adapter)
+        self.http_session.mount('http://', http_adapter)
+        self.llm_rate_limiter: OpenAIRateLimiter = OpenAIRateLimiter(
+            name='llm',
+            requests_per_minute=int(os.getenv('OPENAI_LLM_RPM', RateLimitConstants.LLM_REQUESTS_PER_MINUTE)),
+            tokens_per_minute=int(os.getenv('OPENAI_LLM_TPM', RateLimitConstants.LLM_TOKENS_PER_MINUTE))
+        )
+        self.embedding_rate_limiter: OpenAIRateLimiter = OpenAIRateLimiter(
+            name='embedding',
+            requests_per_minute=int(
+                os.getenv('OPENAI_EMBEDDING_RPM', RateLimitConstants.EMBEDDING_REQUESTS_PER_MINUTE)
+            ),
+            tokens_per_minute=int(os.getenv('OPENAI_EMBEDDING_TPM', RateLimitConstants.EMBEDDING_TOKENS_PER_MINUTE))
+        )
+        self.retry_queue: RetryQueue = RetryQueue(
+            f"{self.embedding_store.pkl_file_path}{DataConstants.RETRY_QUEUE_FILE_SUFFIX}"
+        )
+        self.library_metadata: LibraryMetadataCache = LibraryMetadataCache(
+            library_metadata_path, library_id=self.library_id, library_type=library_type, api_key=api_key,
+            endpoint=self.endpoint
+        )
+        self.duplicate_index: DuplicateIndex = DuplicateIndex(
+            f"{self.embedding_store.pkl_file_path}{DataConstants.DUPLICATE_INDEX_FILE_SUFFIX}"
+        )
+        self.partition_index: PartitionIndex = PartitionIndex(
+            f"{self.embedding_store.pkl_file_path}{DataConstants.PARTITION_INDEX_FILE_SUFFIX}"
+        )
+        self.page_hash_index: PageHashIndex = PageHashIndex(
+            f"{self.embedding_store.pkl_file_path}{DataConstants.PAGE_HASH_INDEX_FILE_SUFFIX}"
+        )
+        self.skip_near_duplicates: bool = DuplicateConstants.SKIP_NEAR_DUPLICATES
+        self.stop_on_error: bool = True
+        self.local_library: Optional[LocalZoteroLibrary] = (
+            LocalZoteroLibrary(zotero_data_dir, library_type=library_type, library_id=self.library_id)
+            if zotero_data_dir is not None else None
+        )
 
     def console_output(self, message: str):
         """
-        Logs a message to the Multiline element or prints it to the console.
+        Posts a message to the log queue or prints it to the console.
 
         Parameters
         ----------
@@ -74,43 +205,62 @@ class ZoteroPaperEmbedder(ZoteroDB):
 
         Notes
         -----
-        If `console_multiline` is provided, the message is logged to the PySimpleGUI Multiline element.
-        Otherwise, it is printed to the console.
+        If `log_queue` is provided, the message is posted to it, to be displayed by the GUI thread in a batch with
+        any other pending messages. Embedding runs on a worker thread, which must never update the GUI directly.
+        Otherwise, it is printed to standard error, keeping standard output free for machine-readable output when
+        running headless.
         """
-        if self.console_output:
-            self.console_multiline.print(message)
-            self.window.refresh()
+        if self.log_queue is not None:
+            self.log_queue.put(('log', message))
         else:
-            print(message)
+            print(message, file=sys.stderr)
 
-    def load_paperqa_doc(self, pkl_file_path: str, llm_model: str) -> paperqa.Docs:
+    def error_output(self, message: str):
         """
-        Loads a paperqa.Docs object from a pickle file, or creates a new one if the file does not exist.
+        Posts an error to the log queue, for the GUI to report in a popup window, or logs it to the console when
+        running headless.
+
+        Parameters
+        ----------
+        message : str
+            The error message.
+        """
+        if self.log_queue is not None:
+            self.log_queue.put(('error', message))
+        else:
+            self.console_output(message)
+
+    def load_paperqa_doc(self, llm_model: str) -> paperqa.Docs:
+        """
+        Loads a paperqa.Docs object for a given LLM, as a view over the embedding store.
 
         Parameters
         ----------
-        pkl_file_path : str
-            The path to the pickle file containing the saved Docs object.
         llm_model : str
             The language model to be used for the Docs object.
 
         Returns
         -------
         paperqa.Docs
-            The loaded or newly created Docs object.
+            The loaded Docs object.
+
+        Raises
+        ------
+        ValueError
+            If `llm_model` is not a valid LLM model.
 
         Notes
         -----
-        The function first attempts to load a Docs object from the specified pickle file.
-        If the file does not exist, a new Docs object is created with the specified language model and prompts.
+        The documents, text chunks and vectors of every LLM's Docs object are shared through the `EmbeddingStore`,
+        which is loaded from its pickle file snapshot once, replaying any papers appended to its checkpoint journal
+        since the snapshot was written. If the store does not exist yet, it is created from any legacy
+        `paper_qa_<llm>.pkl` files, so switching LLM never requires re-embedding the library.
         The Docs object is configured to use a set of predefined prompts for answering questions, and its client is set up.
         """
-        processed_data_dir = os.path.dirname(pkl_file_path)
+        processed_data_dir: Path = self.embedding_store.processed_data_dir
         if not os.path.exists(processed_data_dir):
             os.makedirs(processed_data_dir)
-            process_data_dir_path = Path("data/processed")
-            process_data_dir_absolute_path = process_data_dir_path.resolve()
-            self.console_output(f"Directory {process_data_dir_absolute_path} created")
+            self.console_output(f"Directory {processed_data_dir.resolve()} created")
 
         prompts: str = (
             "Answer the question '{question}' "
@@ -125,21 +275,23 @@ class ZoteroPaperEmbedder(ZoteroDB):
         )
         prompt_collection: paperqa.PromptCollection = paperqa.PromptCollection(qa=prompts)
 
-        try:
-            with open(pkl_file_path, 'rb') as file:
-                docs: paperqa.Docs = pickle.load(file)
-                docs.llm = llm_model
-                docs.prompts = None
-                docs.prompts = prompt_collection
-                docs.set_client()
-            self.console_output("Loaded previously pickled `Docs` object state")
-        except FileNotFoundError:
-            docs: paperqa.Docs = paperqa.Docs(llm=llm_model, prompts=prompt_collection)
+        with self.telemetry.span('store.load', llm_model=llm_model) as span:
+            docs: paperqa.Docs = self.embedding_store.view(llm_model, prompt_collection)
+            span.set(num_papers=len(docs.docs), num_chunks=len(docs.texts))
+        for migrated_pkl_file_path in self.embedding_store.migrated_pkl_file_paths:
+            self.console_output(f"Migrated previously pickled `Docs` object state from {migrated_pkl_file_path}")
+        self.embedding_store.migrated_pkl_file_paths = []
+
+        if docs.docs:
+            self.console_output(f"Loaded {len(docs.docs)} previously embedded papers for {docs.llm}")
+        else:
             self.console_output("No previously pickled `Docs` object state found. Starting fresh")
 
         return docs
 
-    def embed_docs(self, embedded_docs: paperqa.Docs, query_limit: int, query_start: int) -> paperqa.Docs:
+    def embed_docs(self, embedded_docs: paperqa.Docs, query_limit: int, query_start: int,
+                   on_progress: Optional[Callable[[PipelineWorkItem, str], None]] = None,
+                   task_control: Optional[TaskControl] = None) -> paperqa.Docs:
         """
         Embeds papers from the Zotero database into vectors within a `paperqa.Docs` object.
 
@@ -151,65 +303,260 @@ class ZoteroPaperEmbedder(ZoteroDB):
             The number of papers to embed into the document set.
         query_start : int
             The starting position in the Zotero database to begin the embedding.
+        on_progress : Callable[[PipelineWorkItem, str], None], optional
+            Called with every work item once it has been processed, and its status, as for `embed_library()`.
+        task_control : TaskControl, optional
+            Lets the batch be paused or cancelled from another thread.
 
         Returns
         -------
         paperqa.Docs
             The updated document set with the newly embedded paper vectors.
 
+        Raises
+        ------
+        ValueError
+            If `embedded_docs` is not a view over the embedding store.
+
         Notes
         -----
         This method processes papers from the Zotero database, checking for duplicates and handling potential
-        errors such as API rate limits.
+        errors such as API rate limits. API calls are paced by the embedder's rate limiters to stay just under the
+        account's quota. A paper that is still throttled, or whose API calls keep failing transiently, is added to the
+        durable `retry_queue` rather than dropped, and the papers in the queue are re-attempted first by the next run.
+
+        Papers flow through a concurrent `IngestionPipeline`, so PDF downloads, parsing and embedding API calls for
+        different papers overlap, while papers are still committed into the `Docs` object in order. The throughput of
+        each stage is reported once the batch is complete.
+
+        After each paper only the new document, its text chunks and their embeddings are appended to the embedding
+        store's checkpoint journal, making them available to every LLM. The journal is compacted into a new snapshot
+        periodically and at the end of the batch.
         """
-        zotero: ZoteroDB = ZoteroDB(library_type='user')
-        library_size: int = zotero.num_items()
-        llm_model: str = embedded_docs.llm
-        pkl_file_path: str = (f"../data/processed/paper_qa_"
-                              f"{llm_model.lower().replace(' ', '_').replace('-', '_')}.pkl")
+        if not self.embedding_store.is_view(embedded_docs):
+            raise ValueError("`embedded_docs` must be loaded with `load_paperqa_doc()`")
+
+        # The library size only bounds the starting position, so a recently cached count saves an API call
+        library_size: int = self.library_metadata.get(client=self.local_library or self).num_items
 
         if query_start > library_size:
-            sg.popup_error(f"Starting position ({query_start}) cannot be larger than Zotero database size "
-                           f"({library_size})")
+            self.error_output(f"Starting position ({query_start}) cannot be larger than Zotero database size "
+                              f"({library_size})")
             return embedded_docs
 
-        papers: Generator = self.iterate(
+        items: Generator[dict, None, None] = self.iterate_items(
             limit=query_limit,
             start=query_start,
             sort='dateAdded',
             direction='desc'
         )
+        self._ingest(embedded_docs, items, query_limit, "Processing Papers", on_progress=on_progress,
+                     task_control=task_control)
 
-        for i, paper in enumerate(tqdm(papers, desc="Processing Papers", ncols=100, miniters=1, mininterval=0.5),
-                                  start=1):
-            zotero_key: str = paper.details["key"]
-            if zotero_key in embedded_docs.docnames:
-                self.console_output(f"\nSkipping already processed paper {i}: {paper.title}")
-                continue
+        return embedded_docs
 
-            self.console_output(f"\nProcessing paper {i}: {paper.title}")
+    def embed_library(self, embedded_docs: paperqa.Docs, collection_name: Optional[str] = None,
+                      tag: Optional[str] = None, limit: Optional[int] = None,
+                      on_progress: Optional[Callable[[PipelineWorkItem, str], None]] = None,
+                      task_control: Optional[TaskControl] = None,
+                      shard: Optional[EmbeddingShard] = None) -> List[PipelineWorkItem]:
+        """
+        Embeds every paper in the Zotero library, or in one of its collections or tags, that is not yet embedded.
 
-            paper_content: Union[PosixPath, WindowsPath] = paper.pdf
-            num_tokens: int = llm_utils.calculate_tokens_from_pdf(paper_content, 'gpt-4o-mini')
+        Parameters
+        ----------
+        embedded_docs : paperqa.Docs
+            A view over the embedding store, as returned by `load_paperqa_doc()`.
+        collection_name : str, optional
+            The name of the collection to embed. Cannot be combined with `tag`.
+        tag : str, optional
+            The tag of the papers to embed. Cannot be combined with `collection_name`.
+        limit : int, optional
+            The maximum number of papers to page through. By default, the whole library, collection or tag is embedded.
+        on_progress : Callable[[PipelineWorkItem, str], None], optional
+            Called with every work item once it has been processed, and its status: 'embedded', 'skipped', 'queued' for
+            papers added to the retry queue, or 'failed'.
+        task_control : TaskControl, optional
+            Lets the run be paused or cancelled from another thread.
+        shard : EmbeddingShard, optional
+            Only embed the papers in this shard of the library. The embedder should then have been created with the
+            shard's directory as its `processed_data_dir`, so the shard is embedded into its own store.
 
-            self.console_output(f"\nPaper contains {num_tokens} input tokens")
+        Returns
+        -------
+        List[PipelineWorkItem]
+            The work items of the papers that failed, including those added to the retry queue.
 
-            try:
-                embedded_docs.add(paper.pdf, docname=zotero_key)
-            except openai.RateLimitError as e:
-                sg.popup_error(f"\nRate limit exceeded: {e}. Waiting 60s before retrying...")
-                time.sleep(60)  # Wait for 60 seconds before retrying
-                continue
-            except openai.OpenAIError as e:
-                sg.popup_error(f"\nOpenAI API error: {e}")
-                break
-            except Exception as e:
-                sg.popup_error(f"\nUnexpected error: {e}")
-                break
+        Raises
+        ------
+        ValueError
+            If `embedded_docs` is not a view over the embedding store, or if both `collection_name` and `tag` are given.
 
-            with open(pkl_file_path, 'wb') as file:
-                pickle.dump(embedded_docs, file)
-            self.console_output(f"\nSaved checkpoint after processing paper {i}.")
+        Notes
+        -----
+        Zotero items are streamed page by page through the `IngestionPipeline`, oldest first, so there is no limit on
+        the number of papers in a run. As every paper is checkpointed once it has been embedded, an interrupted run
+        resumes where it left off: papers that were already embedded are skipped without their PDF being downloaded.
+
+        Items outside the `shard` are dropped as they are listed, before any PDF is downloaded, so each shard process
+        only pages through the library's item metadata and downloads its own PDFs.
+        """
+        if not self.embedding_store.is_view(embedded_docs):
+            raise ValueError("`embedded_docs` must be loaded with `load_paperqa_doc()`")
+
+        if collection_name is not None and tag is not None:
+            raise ValueError("Only one of `collection_name` and `tag` can be given")
+
+        if collection_name is not None:
+            items: Generator[dict, None, None] = self.iterate_items(
+                limit=limit if limit is not None else sys.maxsize,
+                collection_name=collection_name
+            )
+        else:
+            items = self.iterate_items(
+                limit=limit if limit is not None else sys.maxsize,
+                tag=tag,
+                sort='dateAdded',
+                direction='asc'
+            )
+        if shard is not None:
+            items = (item for item in items if shard.contains(item['key']))
+
+        return self._ingest(embedded_docs, items, limit, "Processing Papers", on_progress=on_progress,
+                            task_control=task_control)
+
+    def sync_docs(self, embedded_docs: paperqa.Docs,
+                  on_progress: Optional[Callable[[PipelineWorkItem, str], None]] = None,
+                  task_control: Optional[TaskControl] = None) -> paperqa.Docs:
+        """
+        Brings the embedding store up to date with the Zotero library, fetching only what changed since the last sync.
+
+        Parameters
+        ----------
+        embedded_docs : paperqa.Docs
+            A view over the embedding store, as returned by `load_paperqa_doc()`.
+        on_progress : Callable[[PipelineWorkItem, str], None], optional
+            Called with every work item once it has been processed, and its status, as for `embed_library()`.
+        task_control : TaskControl, optional
+            Lets the sync be paused or cancelled from another thread.
+
+        Returns
+        -------
+        paperqa.Docs
+            The updated document set.
+
+        Raises
+        ------
+        ValueError
+            If `embedded_docs` is not a view over the embedding store.
+
+        Notes
+        -----
+        The library version the store was last synced with is kept in a `ZoteroSyncState` file alongside the store.
+        If the library version has not changed, the sync makes a single API call. Otherwise, only the items modified
+        since that version are fetched, using the Zotero API's `since` parameter:
+
+            - Papers deleted from the library, or moved to the trash, are removed from the embedding store.
+            - Papers modified since the last sync are re-checked. Their PDF is downloaded again only if its attachment
+              changed, and re-embedded only if its MD5 hash differs from the embedded version, which it then replaces.
+              Papers whose PDF attachment was removed are removed from the embedding store.
+            - Papers added since the last sync are embedded.
+
+        The first sync of a library embeds every paper not yet in the store. The synced library version is only
+        advanced if every paper was processed, so papers that failed, or were not reached by a cancelled sync, are
+        retried by the next sync.
+        """
+        if not self.embedding_store.is_view(embedded_docs):
+            raise ValueError("`embedded_docs` must be loaded with `load_paperqa_doc()`")
+
+        sync_state_path: Path = Path(f"{self.embedding_store.pkl_file_path}{DataConstants.SYNC_STATE_FILE_SUFFIX}")
+        sync_state: ZoteroSyncState = ZoteroSyncState.load(sync_state_path, self.library_id)
+        since: int = sync_state.library_version
+        library_version: int = int((self.local_library or self).last_modified_version())
+        self.library_metadata.update(library_version=library_version)
+        if library_version == since and library_version > 0:
+            self.console_output(f"\nZotero library is up to date at version {library_version}.")
+            return embedded_docs
+
+        if since > 0:
+            if self.local_library is not None:
+                deleted_keys: Set[str] = self.local_library.missing_keys(
+                    doc.docname for doc in embedded_docs.docs.values()
+                )
+            else:
+                deleted_keys = set(self.deleted(since=since).get('items', []))
+            items, trashed_keys = self._fetch_modified_items(since)
+            deleted_keys |= trashed_keys
+            self.console_output(f"\nFound {len(items)} modified and {len(deleted_keys)} deleted Zotero items since "
+                                f"library version {since}.")
+        else:
+            deleted_keys = set()
+            items = self.iterate_items(limit=sys.maxsize, sort='dateAdded', direction='asc')
+            self.console_output("\nFirst sync of Zotero library: checking every paper.")
+
+        removed_dockeys: List[str] = [
+            dockey for dockey, doc in embedded_docs.docs.items() if doc.docname in deleted_keys
+        ]
+        num_removed_docs: int = self.embedding_store.remove(removed_dockeys)
+        if num_removed_docs:
+            self.console_output(f"\nRemoved {num_removed_docs} papers deleted from Zotero.")
+
+        failures: List[PipelineWorkItem] = self._ingest(
+            embedded_docs, items, len(items) if isinstance(items, list) else None, "Syncing Papers",
+            on_progress=on_progress, resync_existing=since > 0, excluded_keys=deleted_keys, task_control=task_control
+        )
+        if task_control is not None and task_control.is_cancelled:
+            self.console_output("\nSync cancelled. The remaining papers will be synced by the next sync.")
+        elif failures:
+            self.console_output(f"\nSync incomplete: {len(failures)} papers failed. They will be retried by the next "
+                                f"sync.")
+        else:
+            sync_state.library_version = library_version
+            sync_state.save(sync_state_path)
+            self.console_output(f"\nSynced Zotero library to version {library_version}.")
+
+        return embedded_docs
+
+    def estimate_tokens(self, query_limit: int, query_start: int,
+                        model: str = PipelineConstants.TOKENIZER_MODEL) -> Tuple[Dict[str, int], int]:
+        """
+        Estimates the number of input tokens in a batch of papers from the Zotero database, without embedding them.
+
+        Parameters
+        ----------
+        query_limit : int
+            The number of papers to estimate.
+        query_start : int
+            The starting position in the Zotero database to begin the estimate.
+        model : str, optional
+            The name of the language model to be used for tokenization.
+
+        Returns
+        -------
+        Tuple[Dict[str, int], int]
+            The number of tokens in each paper keyed by its Zotero key, and the total number of tokens.
+
+        Notes
+        -----
+        PDFs are downloaded on the prefetching thread pool, and then token-counted in parallel by
+        `llm_utils.calculate_tokens_from_pdfs()`. Every PDF is added to the `ParsedPdfCache`, so a later embedding run
+        does not need to parse it again.
+        """
+        items: List[dict] = list(self.iterate_items(
+            limit=query_limit,
+            start=query_start,
+            sort='dateAdded',
+            direction='desc'
+        ))
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as executor:
+            pdfs: List[Optional[Path]] = list(executor.map(self.download_pdf, items))
+
+        zotero_keys: Dict[str, str] = {str(pdf): item['key'] for item, pdf in zip(items, pdfs) if pdf is not None}
+        tokens_per_pdf, total_tokens = llm_utils.calculate_tokens_from_pdfs(
+            list(zotero_keys), model, parsed_pdf_cache=self.parsed_pdf_cache
+        )
+
+        return {zotero_keys[pdf]: num_tokens for pdf, num_tokens in tokens_per_pdf.items()}, total_tokens
 
     def iterate(
             self,
@@ -277,6 +624,547 @@ class ZoteroPaperEmbedder(ZoteroDB):
 
         Overriding was necessary as there was a bug within the original method logic that prevented embedding past the
         first 100 papers in the Zotero database.
+
+        PDFs are downloaded in parallel on a pool of `prefetch_workers` threads, and papers are yielded in the order
+        their downloads complete rather than in query order. The next page of item metadata is fetched in the
+        background while the current page is being consumed. Papers whose PDF has the same SHA-256 hash as a paper
+        already yielded are skipped.
+        """
+        pdf_hashes: Set[str] = set()
+        pages: Generator = self._prefetch_pages(self._iterate_pages(
+            limit=limit, start=start, q=q, qmode=qmode, since=since, tag=tag, sort=sort, direction=direction,
+            collection_name=collection_name
+        ))
+
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=self.prefetch_workers)
+        try:
+            for _items in pages:
+                self.logger.info("Downloading PDFs.")
+                futures: Dict[Future, dict] = {executor.submit(self._prefetch_paper, item): item for item in _items}
+
+                # Yield each paper as soon as its PDF is ready, rather than after the whole page has downloaded
+                for future in as_completed(futures):
+                    item: dict = futures[future]
+                    paper: Optional[ZoteroPaper] = future.result()
+                    if paper is None:
+                        self.console_output(f"\nSkipping paper '{item['data']['title']}' as it has no associated PDF.")
+                        continue
+
+                    pdf_hash: str = self.parsed_pdf_cache.sha256(paper.pdf)
+                    if pdf_hash in pdf_hashes:
+                        self.console_output(f"\nSkipping paper '{item['data']['title']}' as its PDF is identical to "
+                                            f"that of another paper.")
+                        continue
+                    pdf_hashes.add(pdf_hash)
+                    yield paper
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self.logger.info("Finished downloading papers. Now creating Docs object.")
+
+    def iterate_items(
+            self,
+            limit: int = 25,
+            start: int = 0,
+            q: Optional[str] = None,
+            qmode: Optional[str] = None,
+            since: Optional[str] = None,
+            tag: Optional[str] = None,
+            sort: Optional[str] = None,
+            direction: Optional[str] = None,
+            collection_name: Optional[str] = None,
+    ) -> Generator[dict, None, None]:
+        """
+        Given a search query, this will lazily iterate over the item metadata in a Zotero library without downloading
+        any PDFs.
+
+        This allows PDF downloads to be scheduled separately from paging through the library, e.g. by the
+        `IngestionPipeline`. The parameters are the same as for `iterate()`.
+
+        Yields
+        ------
+        dict
+            The full item details from Zotero for each item retrieved.
+        """
+        for _items in self._prefetch_pages(self._iterate_pages(
+            limit=limit, start=start, q=q, qmode=qmode, since=since, tag=tag, sort=sort, direction=direction,
+            collection_name=collection_name
+        )):
+            yield from _items
+
+    def download_pdf(self, item: dict) -> Optional[Path]:
+        """
+        Gets a filename for a given Zotero item's PDF attachment, downloading it if it is not stored locally.
+
+        Unlike `ZoteroDB.get_pdf()`, this method is safe to call from several threads at once, as it does not use the
+        request state shared by `pyzotero` API calls. Downloads share the keep-alive connections of `http_session`.
+
+        Parameters
+        ----------
+        item : dict
+            An item from `pyzotero`. Should have a `key` field, and also have an entry
+            `links->attachment->attachmentType == application/pdf`.
+
+        Returns
+        -------
+        Optional[Path]
+            The path to the local copy of the PDF, or None if the item has no PDF attachment.
+
+        Notes
+        -----
+        The PDF is written to a temporary file which is then moved into place, so an interrupted download never
+        leaves a truncated PDF in the local storage.
+
+        With a `local_library`, nothing is downloaded: the path of the PDF in the Zotero data directory is returned,
+        or None if its file has not been synced to this computer.
+        """
+        pdf_key: Optional[str] = self._extract_pdf_key(item)
+        if pdf_key is None:
+            return None
+
+        if self.local_library is not None:
+            local_pdf_path: Optional[Path] = self.local_library.pdf_path(pdf_key)
+            self.telemetry.increment('cache_hits' if local_pdf_path is not None else 'cache_misses',
+                                     cache='local_storage')
+            return local_pdf_path
+
+        pdf_path: Path = Path(self.storage) / f"{pdf_key}.pdf"
+        if pdf_path.exists():
+            self.telemetry.increment('cache_hits', cache='pdf_storage')
+            return pdf_path
+
+        self.telemetry.increment('cache_misses', cache='pdf_storage')
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+        self.logger.info(f"|  Downloading PDF for: {self._get_citation_key(item)}")
+        with self.telemetry.span('zotero.download_pdf', zotero_key=item['key']) as span:
+            response: requests.Response = self.http_session.get(
+                build_url(self.endpoint, f"/{self.library_type}/{self.library_id}/items/{pdf_key.upper()}/file"),
+                headers=self.default_headers()
+            )
+            response.raise_for_status()
+            span.set(bytes=len(response.content))
+        self.telemetry.increment('bytes_downloaded', len(response.content))
+
+        partial_pdf_path: Path = pdf_path.with_name(f"{pdf_path.name}.part")
+        with open(partial_pdf_path, 'wb') as file:
+            file.write(response.content)
+        os.replace(partial_pdf_path, pdf_path)
+
+        return pdf_path
+
+    def _ingest(self, embedded_docs: paperqa.Docs, items: Iterable[dict], num_items: Optional[int],
+                description: str, on_progress: Optional[Callable[[PipelineWorkItem, str], None]] = None,
+                resync_existing: bool = False, excluded_keys: Iterable[str] = (),
+                task_control: Optional[TaskControl] = None) -> List[PipelineWorkItem]:
+        """
+        Runs a batch of Zotero items, preceded by the papers in the retry queue, through the `IngestionPipeline`.
+
+        Parameters
+        ----------
+        embedded_docs : paperqa.Docs
+            A view over the embedding store.
+        items : Iterable[dict]
+            The Zotero items to ingest, consumed lazily.
+        num_items : int, optional
+            The number of items, if known, for the progress bar.
+        description : str
+            The description of the progress bar.
+        on_progress : Callable[[PipelineWorkItem, str], None], optional
+            Called with every work item once it has been processed, and its status.
+        resync_existing : bool
+            Whether items already in the `Docs` object are re-checked rather than skipped.
+        excluded_keys : Iterable[str]
+            The Zotero keys of items in the retry queue which should not be retried, e.g. because they were deleted.
+        task_control : TaskControl, optional
+            Lets the batch be paused or cancelled from another thread. A paused batch stops feeding new papers into the
+            pipeline, and a cancelled batch stops once the paper being committed has been checkpointed.
+
+        Returns
+        -------
+        List[PipelineWorkItem]
+            The work items of the papers that failed.
+
+        Notes
+        -----
+        The throughput of each stage and the state of the rate limiters are reported once the batch is complete, and
+        the checkpoint journal is compacted into a new snapshot. If telemetry is enabled, the metrics snapshot is then
+        rewritten.
+
+        The collections and tags of every paper committed or skipped are recorded in the `partition_index`, so moving
+        or re-tagging an embedded paper in Zotero updates its partitions without re-embedding it.
+        """
+        excluded_keys = set(excluded_keys)
+        retried_items: List[dict] = [
+            item for item in self._fetch_retry_queue_items() if item['key'] not in excluded_keys
+        ]
+        failures: List[PipelineWorkItem] = []
+        progress_bar: tqdm = tqdm(total=len(retried_items) + num_items if num_items is not None else None,
+                                  desc=description, ncols=100, miniters=1, mininterval=0.5)
+
+        items = self._unique_items(chain(retried_items, items))
+        if task_control is not None:
+            items = task_control.iterate(items)
+
+        pipeline: IngestionPipeline = IngestionPipeline(
+            self, embedded_docs, resync_existing=resync_existing, skip_near_duplicates=self.skip_near_duplicates
+        )
+        try:
+            with self.telemetry.span('ingest', description=description, resync_existing=resync_existing):
+                pipeline_metrics: PipelineMetrics = pipeline.run(
+                    items, self._make_commit_callback(progress_bar, failures, on_progress, task_control)
+                )
+        finally:
+            progress_bar.close()
+            self.duplicate_index.save()
+            self.page_hash_index.save()
+            self._update_partition_index(embedded_docs)
+
+        self.console_output(f"\nIngestion throughput:\n{pipeline_metrics.report()}")
+        self.console_output(f"\nLLM rate limiter: {self.llm_rate_limiter.report()}")
+        self.console_output(f"\nEmbedding rate limiter: {self.embedding_rate_limiter.report()}")
+        if len(self.retry_queue):
+            self.console_output(f"\n{len(self.retry_queue)} papers are queued to be retried by the next run.")
+        if task_control is not None and task_control.is_cancelled:
+            self.console_output("\nCancelled: the papers embedded so far have been saved.")
+
+        if self.embedding_store.num_journal_records > 0:
+            with self.telemetry.span('checkpoint.compact'):
+                self.embedding_store.compact()
+            self.console_output("\nCompacted checkpoint journal into `Docs` snapshot.")
+            chunk_store: Optional[MappedChunkStore] = self.embedding_store.checkpoint_store.chunk_store
+            if chunk_store is not None:
+                self.console_output(
+                    f"Wrote {chunk_store.metadata['rows']} chunk vectors as {chunk_store.dtype} (cosine similarity to "
+                    f"the original vectors: min {chunk_store.metadata['min_cosine']:.6f}, "
+                    f"mean {chunk_store.metadata['mean_cosine']:.6f})."
+                )
+                self.telemetry.set_gauge('chunk_store_min_cosine', chunk_store.metadata['min_cosine'],
+                                         dtype=chunk_store.dtype)
+
+        for rate_limiter in (self.llm_rate_limiter, self.embedding_rate_limiter):
+            self.telemetry.set_gauge('openai_rate_scale', rate_limiter.rate_scale, limiter=rate_limiter.name)
+        self.telemetry.set_gauge('retry_queue_papers', len(self.retry_queue))
+        self.telemetry.write_metrics()
+
+        return failures
+
+    def _make_commit_callback(
+            self,
+            progress_bar: tqdm,
+            failures: List[PipelineWorkItem],
+            on_progress: Optional[Callable[[PipelineWorkItem, str], None]] = None,
+            task_control: Optional[TaskControl] = None
+    ) -> Callable[[PipelineWorkItem], bool]:
+        """
+        Returns the `IngestionPipeline` commit callback, which logs each paper and appends it to the embedding store.
+
+        Parameters
+        ----------
+        progress_bar : tqdm
+            The progress bar advanced for every paper.
+        failures : List[PipelineWorkItem]
+            The list to which every work item that failed with an error is appended.
+        on_progress : Callable[[PipelineWorkItem, str], None], optional
+            Called with every work item and its status: 'embedded', 'skipped', 'queued' or 'failed'.
+        task_control : TaskControl, optional
+            Stops the pipeline once it has been cancelled.
+
+        Returns
+        -------
+        Callable[[PipelineWorkItem], bool]
+            The callback, which returns False to stop the pipeline on a non-recoverable error (unless `stop_on_error`
+            is False) or once cancelled.
+
+        Notes
+        -----
+        Papers that fail with a recoverable API error (rate limiting, connection errors or server errors) are added to
+        the `retry_queue`, and every other paper that is committed or skipped is removed from it. Papers skipped or
+        flagged as duplicates of an embedded paper are counted in the `duplicates` telemetry counter.
+        """
+        def commit_paper(work: PipelineWorkItem) -> bool:
+            i: int = work.index + 1
+            progress_bar.update(1)
+
+            if work.duplicate_of is not None and work.error is None:
+                self.telemetry.increment('duplicates', kind='exact' if work.duplicate_of.exact else 'near',
+                                         action='skipped' if work.skip_reason is not None else 'flagged')
+
+            if work.error is not None:
+                failures.append(work)
+            else:
+                self.retry_queue.remove(work.item['key'])
+                self.partition_index.update(work.item)
+                if work.replaced_dockey is not None:
+                    self.console_output(f"\nRemoved previous version of paper {i}: {work.title}")
+
+            if work.skip_reason is not None:
+                self.console_output(f"\nSkipping paper {i}: '{work.title}' as {work.skip_reason}.")
+                report_progress(work, 'skipped')
+                return True
+            if isinstance(work.error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+                self.retry_queue.add(work.item['key'], work.title, work.error)
+                self.console_output(f"\nQueued paper {i}: '{work.title}' to be retried, as its API calls kept "
+                                    f"failing: {work.error}")
+                report_progress(work, 'queued')
+                return True
+            if isinstance(work.error, openai.OpenAIError):
+                self.error_output(f"\nOpenAI API error: {work.error}")
+                report_progress(work, 'failed')
+                return not self.stop_on_error
+            if work.error is not None:
+                self.error_output(f"\nUnexpected error: {work.error}")
+                report_progress(work, 'failed')
+                return not self.stop_on_error
+
+            self.console_output(f"\nProcessed paper {i}: {work.title}")
+            self.console_output(f"\nPaper contains {work.num_tokens} input tokens")
+            if work.changed_pages is not None:
+                self.console_output(f"\nRe-embedded {len(work.texts) - work.num_reused_texts} of the {len(work.texts)} "
+                                    f"chunks of paper {i}, as {len(work.changed_pages)} of its "
+                                    f"{len(work.page_hashes)} pages changed.")
+            if work.duplicate_of is not None:
+                self.console_output(f"\nPaper {i} is a near duplicate of already embedded paper "
+                                    f"{work.duplicate_of.docname} (estimated text similarity "
+                                    f"{work.duplicate_of.similarity:.2f}), and was embedded anyway.")
+
+            with self.telemetry.span('checkpoint.append', zotero_key=work.item['key'], num_chunks=len(work.texts)):
+                self.embedding_store.append(work.doc, work.texts)
+            self.console_output(f"\nSaved checkpoint after processing paper {i}.")
+            report_progress(work, 'embedded')
+            return task_control is None or not task_control.is_cancelled
+
+        def report_progress(work: PipelineWorkItem, status: str):
+            self.telemetry.increment('papers', status=status)
+            if on_progress is not None:
+                on_progress(work, status)
+
+        return commit_paper
+
+    def collection_names(self) -> Dict[str, str]:
+        """
+        Returns the name of every collection in the Zotero library.
+
+        Returns
+        -------
+        Dict[str, str]
+            The name of each collection, by key.
+        """
+        if self.local_library is not None:
+            return self.local_library.collection_names()
+
+        return {collection['key']: collection['data']['name'] for collection in self.everything(self.collections())}
+
+    def _update_partition_index(self, embedded_docs: paperqa.Docs):
+        """
+        Drops the papers that are no longer embedded from the partition index, fills in the partitions of embedded
+        papers missing from it and the names of new collections, and saves it.
+
+        Parameters
+        ----------
+        embedded_docs : paperqa.Docs
+            A view over the embedding store.
+        """
+        docnames: List[str] = [doc.docname for doc in embedded_docs.docs.values()]
+        self.partition_index.sync(docnames)
+        try:
+            missing_docnames: List[str] = self.partition_index.missing_docnames(docnames)
+            if missing_docnames:
+                for item in self._fetch_items(missing_docnames):
+                    self.partition_index.update(item)
+                self.console_output(f"\nRecorded the collections and tags of {len(missing_docnames)} embedded papers.")
+            if self.partition_index.unnamed_collections():
+                self.partition_index.set_collection_names(self.collection_names())
+        except Exception as error:
+            self.console_output(f"\nCould not update the collections and tags of the embedded papers: {error}")
+        finally:
+            self.partition_index.save()
+
+    def _fetch_items(self, keys: List[str]) -> List[dict]:
+        """
+        Fetches Zotero items by key, in batches of up to `ZoteroConstants.MAX_ITEM_KEYS_PER_REQUEST` keys.
+
+        Parameters
+        ----------
+        keys : List[str]
+            The Zotero keys of the items.
+
+        Returns
+        -------
+        List[dict]
+            The items that still exist in the library.
+        """
+        if self.local_library is not None:
+            return self.local_library.items_by_key(keys)
+
+        items: List[dict] = []
+        batch_size: int = ZoteroConstants.MAX_ITEM_KEYS_PER_REQUEST
+        for batch_start in range(0, len(keys), batch_size):
+            batch_keys: List[str] = keys[batch_start:batch_start + batch_size]
+            items.extend(self.items(itemKey=','.join(batch_keys), limit=batch_size))
+
+        return items
+
+    def _fetch_retry_queue_items(self) -> List[dict]:
+        """
+        Fetches the items in the retry queue, dropping any that have since been deleted from the library.
+
+        Returns
+        -------
+        List[dict]
+            The queued items, in the order they were queued.
+        """
+        queued_keys: List[str] = self.retry_queue.keys()
+        if not queued_keys:
+            return []
+
+        items: Dict[str, dict] = {item['key']: item for item in self._fetch_items(queued_keys)}
+        for zotero_key in queued_keys:
+            if zotero_key not in items or items[zotero_key]['data'].get('deleted'):
+                self.retry_queue.remove(zotero_key)
+        self.console_output(f"\nRetrying {len(self.retry_queue)} papers queued by a previous run.")
+
+        return [items[zotero_key] for zotero_key in self.retry_queue.keys()]
+
+    @staticmethod
+    def _unique_items(items: Iterable[dict]) -> Generator[dict, None, None]:
+        """Yields the items with distinct Zotero keys, dropping any later duplicates."""
+        seen_keys: Set[str] = set()
+        for item in items:
+            if item['key'] not in seen_keys:
+                seen_keys.add(item['key'])
+                yield item
+
+    def _fetch_modified_items(self, since: int) -> Tuple[List[dict], Set[str]]:
+        """
+        Fetches the top-level items affected by any change to the Zotero library since a given library version.
+
+        Parameters
+        ----------
+        since : int
+            The library version of the last sync.
+
+        Returns
+        -------
+        Tuple[List[dict], Set[str]]
+            The modified top-level items that are not in the trash, and the keys of those that are.
+
+        Notes
+        -----
+        A modified child item (an attachment or note) marks its parent as modified. The local copy of a modified PDF
+        attachment is deleted, so that `download_pdf()` fetches the new version. Items are fetched in batches of up to
+        `ZoteroConstants.MAX_ITEM_KEYS_PER_REQUEST` keys.
+        """
+        modified_keys: List[str] = list(
+            self.local_library.item_versions(since=since) if self.local_library is not None
+            else self.item_versions(since=since)
+        )
+        top_level_items: Dict[str, dict] = {}
+        parent_keys: Set[str] = set()
+        for item in self._fetch_items(modified_keys):
+            parent_key: Optional[str] = item['data'].get('parentItem')
+            if parent_key is None:
+                top_level_items[item['key']] = item
+                continue
+
+            parent_keys.add(parent_key)
+            if item['data'].get('contentType') == 'application/pdf':
+                Path(self.storage, f"{item['key']}.pdf").unlink(missing_ok=True)
+
+        top_level_items.update({
+            item['key']: item for item in self._fetch_items(sorted(parent_keys - set(top_level_items)))
+        })
+        trashed_keys: Set[str] = {key for key, item in top_level_items.items() if item['data'].get('deleted')}
+
+        return [item for key, item in top_level_items.items() if key not in trashed_keys], trashed_keys
+
+    def _prefetch_paper(self, item: dict) -> Optional[ZoteroPaper]:
+        """
+        Downloads the PDF attachment of a Zotero item and counts its pages, on a prefetching worker thread.
+
+        The PDF is parsed into the `ParsedPdfCache` while counting its pages, so later token counting and chunking of
+        the same PDF read from the cache.
+
+        Parameters
+        ----------
+        item : dict
+            The full item details from Zotero.
+
+        Returns
+        -------
+        Optional[ZoteroPaper]
+            The paper, or None if the item has no PDF attachment.
+        """
+        pdf: Optional[Path] = self.download_pdf(item)
+        if pdf is None:
+            return None
+
+        return ZoteroPaper(
+            key=self._get_citation_key(item),
+            title=item["data"].get("title", ""),
+            pdf=pdf,
+            num_pages=self.parsed_pdf_cache.count_pages(pdf),
+            details=item,
+            zotero_key=item["key"],
+        )
+
+    @staticmethod
+    def _prefetch_pages(pages: Iterator[List[dict]]) -> Generator[List[dict], None, None]:
+        """
+        Fetches the next page of item metadata on a background thread while the current page is being consumed.
+
+        Parameters
+        ----------
+        pages : Iterator[List[dict]]
+            The pages of item metadata, e.g. from `_iterate_pages()`.
+
+        Yields
+        ------
+        List[dict]
+            The full item details from Zotero for each item in the page.
+
+        Notes
+        -----
+        Only one page is ever fetched at a time, so the request state shared by `pyzotero` API calls is never used
+        by two threads at once.
+        """
+        executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+        try:
+            next_page: Future = executor.submit(next, pages, None)
+            while True:
+                page: Optional[List[dict]] = next_page.result()
+                if page is None:
+                    return
+                next_page = executor.submit(next, pages, None)
+                yield page
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _iterate_pages(
+            self,
+            limit: int = 25,
+            start: int = 0,
+            q: Optional[str] = None,
+            qmode: Optional[str] = None,
+            since: Optional[str] = None,
+            tag: Optional[str] = None,
+            sort: Optional[str] = None,
+            direction: Optional[str] = None,
+            collection_name: Optional[str] = None,
+    ) -> Generator[List[dict], None, None]:
+        """
+        Lazily iterates over the pages of item metadata matching a search query, up to 100 items per page.
+
+        The parameters are the same as for `iterate()`.
+
+        Yields
+        ------
+        List[dict]
+            The full item details from Zotero for each item in the page.
+
+        Raises
+        ------
+        ValueError
+            If both a `collection_name` and a search query are given.
         """
         query_kwargs = {}
 
@@ -298,9 +1186,13 @@ class ZoteroPaperEmbedder(ZoteroDB):
                 "You cannot specify a `collection_name` and search query simultaneously!"
             )
 
-        max_limit = 100
-        items: List = []
-        pdfs: List[Path] = []
+        if self.local_library is not None:
+            yield from self.local_library.iterate_pages(
+                limit=limit, start=start, collection_name=collection_name, **query_kwargs
+            )
+            return
+
+        max_limit = ZoteroConstants.MAX_PAGE_SIZE
 
         collection_id = None
         if collection_name:
@@ -312,45 +1204,23 @@ class ZoteroPaperEmbedder(ZoteroDB):
             cur_limit = min(max_limit, num_remaining)
             self.logger.info(f"Downloading new batch of up to {cur_limit} papers.")
 
-            if collection_id:
-                _items = self._sliced_collection_items(
-                    collection_id, limit=cur_limit, start=start
-                )
-            else:
-                _items = self.top(**query_kwargs, limit=cur_limit, start=start)
+            with self.telemetry.span('zotero.page', start=start, limit=cur_limit) as span:
+                if collection_id:
+                    _items = self._sliced_collection_items(
+                        collection_id, limit=cur_limit, start=start
+                    )
+                else:
+                    _items = self.top(**query_kwargs, limit=cur_limit, start=start)
+                span.set(num_items=len(_items))
 
             if len(_items) == 0:
                 break
 
-            self.logger.info("Downloading PDFs.")
-            _pdfs = [self.get_pdf(item) for item in _items]
-
-            # Filter:
-            for item, pdf in zip(_items, _pdfs):
-                no_pdf = item is None or pdf is None
-                is_duplicate = pdf in pdfs
-
-                if no_pdf or is_duplicate:
-                    self.console_output(f"\nSkipping paper '{item['data']['title']}' as it has no associated PDF.")
-                    continue
-                pdf = cast(Path, pdf)
-                title = item["data"].get("title", "")
-                yield ZoteroPaper(
-                    key=self._get_citation_key(item),
-                    title=title,
-                    pdf=pdf,
-                    num_pages=paperqa_utils.count_pdf_pages(pdf),
-                    details=item,
-                    zotero_key=item["key"],
-                )
-                items.append(item)
-                pdfs.append(pdf)
+            yield _items
 
             start += cur_limit  # Increment start by the number of items processed
             num_remaining -= cur_limit  # Decrease remaining items to process
 
-        self.logger.info("Finished downloading papers. Now creating Docs object.")
-
     @staticmethod
     def _get_citation_key(item: dict) -> str:
         """
@@ -393,3 +1263,49 @@ class ZoteroPaperEmbedder(ZoteroDB):
         date = "".join([c for c in date if c.isalnum()])
 
         return f"{last_name}_{short_title}_{date}_{item['key']}".replace(" ", "")
+
+    @staticmethod
+    def _extract_pdf_key(item: dict) -> Optional[str]:
+        """
+        Extracts the key of the PDF attachment from a Zotero item.
+
+        Parameters
+        ----------
+        item : dict
+            The metadata of the Zotero item.
+
+        Returns
+        -------
+        Optional[str]
+            The Zotero key of the PDF attachment, or None if the item has no PDF attachment.
+
+        Notes
+        -----
+        This method uses the `_extract_pdf_key()` function implementation found in the `zotero.py` module of the
+        `paperqa` package, available at https://github.com/Future-House/paper-qa/blob/main/paperqa/contrib/zotero.py.
+
+        No changes have been made to the method logic.
+        """
+        if "links" not in item:
+            return None
+
+        if "attachment" not in item["links"]:
+            return None
+
+        attachments = item["links"]["attachment"]
+
+        if type(attachments) != dict:
+            # Find first attachment with attachmentType == application/pdf:
+            for attachment in attachments:
+                if attachment["attachmentType"] == "application/pdf":
+                    break
+        else:
+            attachment = attachments
+
+        if "attachmentType" not in attachment:
+            return None
+
+        if attachment["attachmentType"] != "application/pdf":
+            return None
+
+        return attachment["href"].split("/")[-1]
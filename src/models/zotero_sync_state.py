@@ -0,0 +1,78 @@
+import os
+import json
+import time
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Optional, Union
+
+
+class ZoteroSyncState(BaseModel):
+    """
+    The position of the embedding store in a Zotero library's version history, used for delta syncs.
+
+    Every change to a Zotero library increments its library version, and every item records the library version at
+    which it was last modified. Once the embedding store has been synced with the library at a given version, the next
+    sync only needs to fetch the items modified, and the keys of the items deleted, since that version.
+
+    Attributes
+    ----------
+    library_id : Optional[str]
+        The ID of the Zotero library that was synced.
+    library_version : int
+        The library version the embedding store was last fully synced with, or 0 if it has never been synced.
+    synced_at : Optional[float]
+        When the embedding store was last synced, as a Unix timestamp.
+
+    Methods
+    -------
+    load(path: Union[str, Path], library_id: Optional[str]) -> ZoteroSyncState
+        Loads the sync state of a library, or returns a fresh state if it has never been synced.
+    save(path: Union[str, Path])
+        Atomically saves the sync state to a JSON file.
+    """
+    library_id: Optional[str] = None
+    library_version: int = 0
+    synced_at: Optional[float] = None
+
+    @classmethod
+    def load(cls, path: Union[str, Path], library_id: Optional[str]) -> 'ZoteroSyncState':
+        """
+        Loads the sync state of a library from a JSON file.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the JSON file.
+        library_id : Optional[str]
+            The ID of the Zotero library being synced.
+
+        Returns
+        -------
+        ZoteroSyncState
+            The saved sync state, or a fresh state if the file does not exist, cannot be read, or belongs to a
+            different library.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                state: ZoteroSyncState = cls(**json.load(file))
+        except (FileNotFoundError, ValueError, TypeError):
+            return cls(library_id=library_id)
+
+        return state if state.library_id == library_id else cls(library_id=library_id)
+
+    def save(self, path: Union[str, Path]):
+        """
+        Atomically saves the sync state to a JSON file, recording the current time as the time of the sync.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The path to the JSON file.
+        """
+        self.synced_at = time.time()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path: Path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.model_dump(), file)
+        os.replace(temp_path, path)
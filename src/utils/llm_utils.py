@@ -1,9 +1,14 @@
+import os
 import tiktoken
 import PyPDF2
 import paperqa
 import pickle
-from pathlib import PosixPath
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from paperqa.readers import parse_pdf_to_pages
+from paperqa.types import ParsedText
+from pathlib import Path, PosixPath
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 
 def extract_text_from_pdf(pdf_path: PosixPath) -> str:
@@ -23,16 +28,32 @@ def extract_text_from_pdf(pdf_path: PosixPath) -> str:
     Notes
     -----
     This function uses the PyPDF2 library to read and extract text from each page of the PDF.
-    The extracted text is concatenated and returned as a single string.
+    The extracted text is joined once and returned as a single string, avoiding quadratic string concatenation on long
+    PDFs.
     """
     reader: PyPDF2.PdfReader = PyPDF2.PdfReader(pdf_path)
-    text: str = ''
-    for page in reader.pages:
-        text += page.extract_text()
-    return text
+    return ''.join(page.extract_text() for page in reader.pages)
 
 
-def calculate_tokens_from_pdf(pdf_path: PosixPath, model: str):
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Returns the `tiktoken` encoding for a language model, creating it only once per model and process.
+
+    Parameters
+    ----------
+    model : str
+        The name of the language model.
+
+    Returns
+    -------
+    tiktoken.Encoding
+        The encoding used by the language model.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+def calculate_tokens_from_pdf(pdf_path: PosixPath, model: str, parsed_pdf_cache=None) -> int:
     """
     Calculates the number of tokens in a PDF document based on a specific language model.
 
@@ -49,6 +70,9 @@ def calculate_tokens_from_pdf(pdf_path: PosixPath, model: str):
         The path to the PDF file.
     model : str
         The name of the language model to be used for tokenization.
+    parsed_pdf_cache : ParsedPdfCache, optional
+        A parsed PDF cache. If given, the token count is read from (and stored in) the cache rather than re-parsing
+        the PDF.
 
     Returns
     -------
@@ -60,7 +84,113 @@ def calculate_tokens_from_pdf(pdf_path: PosixPath, model: str):
     This function extracts text from the PDF and then encodes it using the specified language model's encoding.
     The token count is then returned as an integer.
     """
+    if parsed_pdf_cache is not None:
+        return parsed_pdf_cache.count_tokens(pdf_path, model)
+
     pdf_text: str = extract_text_from_pdf(pdf_path)
-    enc: tiktoken.Encoding = tiktoken.encoding_for_model(model)
-    tokens: List = enc.encode(pdf_text)
+    return calculate_tokens_from_text(pdf_text, model)
+
+
+def calculate_tokens_from_text(text: str, model: str) -> int:
+    """
+    Calculates the number of tokens in a piece of text based on a specific language model.
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+    model : str
+        The name of the language model to be used for tokenization.
+
+    Returns
+    -------
+    int
+        The total number of tokens in the text.
+    """
+    enc: tiktoken.Encoding = get_encoding(model)
+    tokens: List = enc.encode_ordinary(text)
     return len(tokens)
+
+
+def calculate_tokens_from_pdfs(
+        pdf_paths: Sequence[Union[str, Path]],
+        model: str,
+        max_workers: Optional[int] = None,
+        parsed_pdf_cache=None
+) -> Tuple[Dict[str, int], int]:
+    """
+    Calculates the number of tokens in many PDF documents at once, spreading the work across a process pool.
+
+    This gives a cost estimate for a whole library without embedding anything.
+
+    Parameters
+    ----------
+    pdf_paths : Sequence[Union[str, Path]]
+        The paths to the PDF files.
+    model : str
+        The name of the language model to be used for tokenization.
+    max_workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs.
+    parsed_pdf_cache : ParsedPdfCache, optional
+        A parsed PDF cache. Cached token counts are used directly, and every PDF parsed by the process pool is added
+        to the cache so that it is never parsed again.
+
+    Returns
+    -------
+    Tuple[Dict[str, int], int]
+        The number of tokens in each PDF keyed by its path, and the total number of tokens across all PDFs.
+
+    Notes
+    -----
+    PDFs that cannot be read are left out of the per-PDF token counts. Each worker process creates the model's
+    encoding once and reuses it for every PDF it is given.
+    """
+    tokens_per_pdf: Dict[str, int] = {}
+    uncached_pdf_paths: List[str] = []
+    for pdf_path in pdf_paths:
+        if parsed_pdf_cache is not None:
+            parsed_pdf = parsed_pdf_cache.lookup(pdf_path)
+            if parsed_pdf is not None:
+                tokens_per_pdf[str(pdf_path)] = parsed_pdf_cache.count_tokens(pdf_path, model)
+                continue
+        uncached_pdf_paths.append(str(pdf_path))
+
+    if uncached_pdf_paths:
+        max_workers = max_workers or os.cpu_count() or 1
+        chunksize: int = max(1, len(uncached_pdf_paths) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                _parse_and_count_tokens, uncached_pdf_paths, [model] * len(uncached_pdf_paths), chunksize=chunksize
+            )
+            for pdf_path, (parsed_text, num_tokens) in zip(uncached_pdf_paths, results):
+                if parsed_text is None:
+                    continue
+                if parsed_pdf_cache is not None:
+                    parsed_pdf_cache.add(pdf_path, parsed_text, {get_encoding(model).name: num_tokens})
+                tokens_per_pdf[pdf_path] = num_tokens
+
+    return tokens_per_pdf, sum(tokens_per_pdf.values())
+
+
+def _parse_and_count_tokens(pdf_path: str, model: str) -> Tuple[Optional[ParsedText], int]:
+    """
+    Parses a PDF and counts its tokens, in a `calculate_tokens_from_pdfs()` worker process.
+
+    Parameters
+    ----------
+    pdf_path : str
+        The path to the PDF file.
+    model : str
+        The name of the language model to be used for tokenization.
+
+    Returns
+    -------
+    Tuple[Optional[ParsedText], int]
+        The per-page text of the PDF and its number of tokens, or (None, 0) if the PDF cannot be read.
+    """
+    try:
+        parsed_text: ParsedText = parse_pdf_to_pages(Path(pdf_path))
+    except Exception:
+        return None, 0
+
+    return parsed_text, calculate_tokens_from_text(''.join(parsed_text.content.values()), model)